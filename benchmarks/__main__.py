@@ -0,0 +1,5 @@
+"""Run the benchmarks with 'python -m benchmarks'."""
+
+from .crushing import main
+
+main()
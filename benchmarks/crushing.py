@@ -0,0 +1,726 @@
+"""
+Benchmark the crushing hot path, and how fast the command starts.
+
+Run with 'python -m benchmarks' or 'tox -e bench'. Results are written as
+JSON and compared against a saved baseline, if there is one. Pass
+--save-baseline to make the current results the new baseline.
+"""
+
+from __future__ import annotations
+
+import argparse
+import datetime as dt
+import importlib.util
+import io
+import json
+import multiprocessing
+import pathlib
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from typing import TYPE_CHECKING, Any, NamedTuple
+
+import PIL
+from importlib_metadata import version
+from PIL import Image
+
+from pycrusher.batch import EXECUTOR_PROCESS, EXECUTORS, Job, Schedule, run_batch
+from pycrusher.core import (
+    OVERWRITE_ALWAYS,
+    Options,
+    change_color,
+    compress,
+    crush,
+    generate_quality_sequence,
+    run,
+)
+from pycrusher.preview import crush_preview
+from pycrusher.tiles import crush_tiled
+
+from .images import MODES, SIZES, encode_image, generate_image
+from .startup import measure_startup
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None  # type: ignore[assignment]
+
+RESULTS_DIRECTORY = pathlib.Path(__file__).parent.joinpath("results")
+OUTPUT_DEFAULT = RESULTS_DIRECTORY.joinpath("latest.json")
+BASELINE_DEFAULT = RESULTS_DIRECTORY.joinpath("baseline.json")
+REPEAT_DEFAULT = 3
+THRESHOLD_DEFAULT = 0.1
+MEMORY_THRESHOLD_DEFAULT = 0.1
+# (iterations, extra) combinations.
+SEQUENCES = ((10, 1), (50, 1), (10, 5))
+COLOR = 2.0
+COLOR_QUALITY = 50
+# Modes the numpy engine crushes, after conversion.
+NUMPY_MODES = ("L", "RGB")
+HAS_NUMPY = importlib.util.find_spec("numpy") is not None
+# Previews are crushed from JPEG inputs, as scrubbing parameters in a UI does.
+PREVIEW_WIDTH = 320
+PREVIEW_SEQUENCE = (50, 1)
+PREVIEW_QUALITY = 95
+PREVIEW_LATENCY_TARGET = 0.1
+# Batches crushed with each executor, to find which wins at which size.
+BATCH_MODE = "RGB"
+BATCH_SEQUENCE = (10, 1)
+BATCH_IMAGES = 16
+BATCH_WORKERS = 4
+# Tiles crushed in parallel, against 'crush' on the same work.
+TILE_SIZE = 512
+TILE_WORKERS = 4
+# Kinds timing a function crushing an image in memory.
+CRUSH_KINDS = ("compress", "crush", "crush_tiled", "preview", "crush_numpy")
+# Startup takes tens of milliseconds, so it is timed more often.
+STARTUP_REPEAT_MIN = 5
+# Metrics compared against the baseline, where higher is worse.
+COMPARED_METRICS = ("seconds", "peak_rss")
+
+
+class Case(NamedTuple):
+    """One thing to time, at one image mode and size."""
+
+    kind: str
+    mode: str
+    size: tuple[int, int]
+    iterations: int | None = None
+    extra: int | None = None
+
+    @property
+    def key(self) -> str:
+        """Name of this case in the results."""
+        width, height = self.size
+        key = f"{self.kind}/{self.mode}/{width}x{height}"
+        if self.iterations is not None:
+            key += f"/i{self.iterations}e{self.extra}"
+        return key
+
+
+class Regression(NamedTuple):
+    """A metric of a case that got worse than its baseline."""
+
+    key: str
+    metric: str
+    baseline: float
+    current: float
+
+    @property
+    def ratio(self) -> float:
+        """How many times worse the current value is."""
+        return self.current / self.baseline
+
+
+def plan_cases(
+    sizes: list[tuple[int, int]],
+    modes: list[str],
+) -> list[Case]:
+    """
+    List every case to time.
+
+    Args:
+        sizes (list[tuple[int, int]]): Image sizes.
+        modes (list[str]): Image modes, from images.MODES.
+
+    Returns:
+        Cases, one per function, size, mode and sequence. 'crush' and
+        'crush_numpy' time both engines on the same work, where numpy is
+        installed. 'preview' times a PREVIEW_WIDTH preview of a JPEG.
+        'batch_<executor>' times run_batch on BATCH_IMAGES copies of an
+        image, with BATCH_WORKERS workers of each executor. 'crush_tiled'
+        times crush_tiled with TILE_WORKERS workers.
+
+    """
+    cases: list[Case] = []
+    for size in sizes:
+        if BATCH_MODE in modes:
+            cases.extend(
+                Case(f"batch_{executor}", BATCH_MODE, size, *BATCH_SEQUENCE)
+                for executor in EXECUTORS
+            )
+        for mode in modes:
+            for iterations, extra in SEQUENCES:
+                cases.append(Case("compress", mode, size, iterations, extra))
+            cases.append(Case("change_color", mode, size))
+            for iterations, extra in SEQUENCES:
+                cases.append(Case("run", mode, size, iterations, extra))
+            for iterations, extra in SEQUENCES:
+                cases.append(Case("crush", mode, size, iterations, extra))
+                if HAS_NUMPY and MODES[mode] in NUMPY_MODES:
+                    cases.append(Case("crush_numpy", mode, size, iterations, extra))
+                cases.append(Case("crush_tiled", mode, size, iterations, extra))
+            cases.append(Case("preview", mode, size, *PREVIEW_SEQUENCE))
+    return cases
+
+
+def get_peak_rss() -> int | None:
+    """
+    Get the peak resident memory of this process.
+
+    Returns:
+        Peak resident memory in bytes, or None where it cannot be measured.
+
+    """
+    if resource is None:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kibibytes, macOS bytes.
+    return peak_rss if sys.platform == "darwin" else peak_rss * 1024
+
+
+def time_steps(data: bytes, qualities: list[int]) -> tuple[float, float]:
+    """
+    Split the time of a compression step between decoding and encoding.
+
+    Args:
+        data (bytes): Input image file.
+        qualities (list[int]): List of JPEG qualities.
+
+    Returns:
+        Mean decode and encode time per step, in milliseconds.
+
+    """
+    decode_time = encode_time = 0.0
+    img: Image.Image = Image.open(io.BytesIO(data))
+    img.load()
+    for quality in qualities:
+        buf = io.BytesIO()
+        start = time.perf_counter()
+        img.save(buf, format="JPEG", quality=quality)
+        encoded = time.perf_counter()
+        img = Image.open(buf)
+        img.load()
+        decoded = time.perf_counter()
+        encode_time += encoded - start
+        decode_time += decoded - encoded
+    return 1000 * decode_time / len(qualities), 1000 * encode_time / len(qualities)
+
+
+def get_crush_function(
+    kind: str, data: bytes, qualities: list[int]
+) -> Callable[[], Any]:
+    """
+    Build the function timed for a kind in CRUSH_KINDS.
+
+    Args:
+        kind (str): Kind of case.
+        data (bytes): Input image file.
+        qualities (list[int]): List of JPEG qualities.
+
+    Returns:
+        Function without arguments.
+
+    """
+    if kind == "compress":
+        return lambda: compress(io.BytesIO(data), qualities, progress=False)
+    if kind == "crush":
+        return lambda: crush(
+            io.BytesIO(data),
+            qualities,
+            options=Options(color=COLOR, preprocess=False),
+            progress=False,
+        )
+    if kind == "crush_tiled":
+        return lambda: crush_tiled(
+            io.BytesIO(data),
+            qualities,
+            options=Options(
+                color=COLOR,
+                preprocess=False,
+                tile_size=TILE_SIZE,
+                tile_workers=TILE_WORKERS,
+            ),
+            progress=False,
+        )
+    if kind == "preview":
+        with Image.open(io.BytesIO(data)) as img:
+            buf = io.BytesIO()
+            img.save(buf, format="JPEG", quality=PREVIEW_QUALITY)
+        jpeg = buf.getvalue()
+        return lambda: crush_preview(
+            io.BytesIO(jpeg),
+            qualities,
+            options=Options(preview=PREVIEW_WIDTH, color=COLOR, preprocess=False),
+            progress=False,
+        )
+
+    from pycrusher import dct  # noqa: PLC0415
+
+    return lambda: dct.crush(
+        io.BytesIO(data),
+        qualities,
+        options=Options(color=COLOR, preprocess=False),
+        progress=False,
+    )
+
+
+def get_function(case: Case, data: bytes, directory: pathlib.Path) -> Callable[[], Any]:
+    """
+    Build the function timed for case.
+
+    Args:
+        case (Case): What to time.
+        data (bytes): Input image file.
+        directory (pathlib.Path): Where run() reads and writes files.
+
+    Returns:
+        Function without arguments.
+
+    Raises:
+        ValueError: If case needs a sequence and has none.
+
+    """
+    if case.kind == "change_color":
+        return lambda: change_color(io.BytesIO(data), COLOR, COLOR_QUALITY)
+
+    iterations, extra = case.iterations, case.extra
+    if iterations is None or extra is None:
+        msg = f"{case.key} has no iterations or extra"
+        raise ValueError(msg)
+    if case.kind in CRUSH_KINDS:
+        qualities = extra * generate_quality_sequence(iterations, reverse=False)
+        return get_crush_function(case.kind, data, qualities)
+
+    if case.kind.startswith("batch_"):
+        jobs = []
+        for index in range(BATCH_IMAGES):
+            input_path = directory.joinpath(f"input{index}.tiff")
+            input_path.write_bytes(data)
+            jobs.append(Job(input_path, directory.joinpath(f"output{index}.jpg")))
+        return lambda: run_batch(
+            jobs,
+            options=Options(
+                iterations=iterations,
+                extra=extra,
+                color=COLOR,
+                reverse=False,
+                preprocess=False,
+                overwrite=OVERWRITE_ALWAYS,
+            ),
+            schedule=Schedule(
+                max_workers=BATCH_WORKERS, executor=case.kind.partition("_")[2]
+            ),
+            progress=False,
+        )
+
+    input_path = directory.joinpath("input.tiff")
+    input_path.write_bytes(data)
+    return lambda: run(
+        input_path=input_path,
+        output_path=directory.joinpath("output.jpg"),
+        options=Options(
+            iterations=iterations,
+            extra=extra,
+            color=COLOR,
+            reverse=False,
+            preprocess=False,
+            overwrite=OVERWRITE_ALWAYS,
+        ),
+        progress=False,
+    )
+
+
+def measure(case: Case, repeat: int) -> dict[str, Any]:
+    """
+    Time case, in a process of its own so its peak memory is its own.
+
+    Args:
+        case (Case): What to time.
+        repeat (int): Timed runs, after one warm-up run.
+
+    Returns:
+        Metrics of case.
+
+    """
+    img = generate_image(case.size, case.mode)
+    start = time.perf_counter()
+    img = img.convert(MODES[case.mode])
+    convert_seconds = time.perf_counter() - start
+    data = encode_image(img)
+    del img
+
+    metrics: dict[str, Any] = {}
+    with tempfile.TemporaryDirectory() as directory:
+        function = get_function(case, data, pathlib.Path(directory))
+        function()
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function()
+            timings.append(time.perf_counter() - start)
+
+    seconds = statistics.median(timings)
+    metrics["seconds"] = seconds
+    metrics["min_seconds"] = min(timings)
+    if case.kind.startswith("batch_"):
+        metrics["images_per_second"] = BATCH_IMAGES / seconds
+        # Worker processes have peaks of their own, so this one means nothing.
+        metrics["peak_rss"] = None
+    elif case.kind == "crush_tiled":
+        metrics["images_per_second"] = 1 / seconds
+        # Worker processes have peaks of their own, so this one means nothing.
+        metrics["peak_rss"] = None
+    else:
+        metrics["images_per_second"] = 1 / seconds
+        metrics["peak_rss"] = get_peak_rss()
+    if case.mode != MODES[case.mode]:
+        metrics["convert_seconds"] = convert_seconds
+    if case.kind == "compress" and case.iterations is not None:
+        qualities = generate_quality_sequence(case.iterations, reverse=False)
+        metrics["decode_ms"], metrics["encode_ms"] = time_steps(data, qualities)
+    return metrics
+
+
+def get_metadata() -> dict[str, str]:
+    """
+    Describe where the benchmarks ran.
+
+    Returns:
+        Versions, platform and date.
+
+    """
+    return {
+        "pycrusher": version("pycrusher"),
+        "pillow": PIL.__version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "date": dt.datetime.now(dt.timezone.utc).isoformat(),
+    }
+
+
+def run_benchmarks(cases: list[Case], repeat: int) -> dict[str, dict[str, Any]]:
+    """
+    Measure every case, each in a fresh worker process.
+
+    Args:
+        cases (list[Case]): Result of plan_cases.
+        repeat (int): Timed runs of each case.
+
+    Returns:
+        Metrics, keyed by case.
+
+    """
+    results = {}
+    with multiprocessing.Pool(1, maxtasksperchild=1) as pool:
+        for case in cases:
+            if case.kind in {f"batch_{EXECUTOR_PROCESS}", "crush_tiled"}:
+                # Pool workers are daemons, which cannot start processes.
+                metrics = measure(case, repeat)
+            else:
+                metrics = pool.apply(measure, (case, repeat))
+            results[case.key] = metrics
+            peak_rss = metrics["peak_rss"]
+            print(  # noqa: T201
+                f"{case.key:<36} {1000 * metrics['seconds']:>10.1f} ms"
+                f" {metrics['images_per_second']:>8.2f} img/s"
+                + (f" {peak_rss / 2**20:>8.1f} MiB" if peak_rss else "")
+            )
+    return results
+
+
+def compare_results(
+    baseline: dict[str, dict[str, Any]],
+    current: dict[str, dict[str, Any]],
+    *,
+    threshold: float,
+    memory_threshold: float,
+) -> list[Regression]:
+    """
+    Find cases that got slower or bigger than the baseline allows.
+
+    Args:
+        baseline (dict[str, dict[str, Any]]): Saved results.
+        current (dict[str, dict[str, Any]]): New results.
+        threshold (float): Tolerated relative slowdown, e.g. 0.1 for 10%.
+        memory_threshold (float): Tolerated relative growth of peak memory.
+
+    Returns:
+        Regressions, for cases present in both results.
+
+    """
+    thresholds = {"seconds": threshold, "peak_rss": memory_threshold}
+    regressions = []
+    for key in baseline.keys() & current.keys():
+        for metric in COMPARED_METRICS:
+            old = baseline[key].get(metric)
+            new = current[key].get(metric)
+            if not old or new is None:
+                continue
+            if new > old * (1 + thresholds[metric]):
+                regressions.append(Regression(key, metric, old, new))
+    return sorted(regressions)
+
+
+def get_speedups(
+    results: dict[str, dict[str, Any]], kind: str = "crush_numpy"
+) -> dict[str, float]:
+    """
+    Compare a kind of case with 'crush' on the same work.
+
+    Args:
+        results (dict[str, dict[str, Any]]): Metrics keyed by case key.
+        kind (str): Kind compared, such as 'crush_numpy' for the numpy engine
+            or 'crush_tiled' for tiles.
+
+    Returns:
+        'crush' time over the time of kind, keyed by 'crush' case key.
+
+    """
+    speedups = {}
+    for key, metrics in results.items():
+        case_kind, _, rest = key.partition("/")
+        other_metrics = results.get(f"{kind}/{rest}")
+        if case_kind == "crush" and other_metrics is not None:
+            speedups[key] = metrics["seconds"] / other_metrics["seconds"]
+    return speedups
+
+
+def get_fastest_executors(results: dict[str, dict[str, Any]]) -> dict[str, str]:
+    """
+    Find the executor crushing batches fastest, for each batch.
+
+    Args:
+        results (dict[str, dict[str, Any]]): Metrics keyed by case key.
+
+    Returns:
+        Fastest executor, keyed by the case key without its kind, such as
+        'RGB/256x256/i10e1'.
+
+    """
+    seconds: dict[str, dict[str, float]] = {}
+    for key, metrics in results.items():
+        kind, _, rest = key.partition("/")
+        if kind.startswith("batch_"):
+            executor = kind.partition("_")[2]
+            seconds.setdefault(rest, {})[executor] = metrics["seconds"]
+    return {
+        rest: min(executors, key=executors.__getitem__)
+        for rest, executors in seconds.items()
+    }
+
+
+def get_slow_previews(
+    results: dict[str, dict[str, Any]], target: float
+) -> dict[str, float]:
+    """
+    Find previews slower than the latency target.
+
+    Args:
+        results (dict[str, dict[str, Any]]): Metrics keyed by case key.
+        target (float): Latency target, in seconds.
+
+    Returns:
+        Seconds of every 'preview' case over target, keyed by case key.
+
+    """
+    return {
+        key: metrics["seconds"]
+        for key, metrics in results.items()
+        if key.startswith("preview/") and metrics["seconds"] > target
+    }
+
+
+def parse_size(value: str) -> tuple[int, int]:
+    """
+    Parse an image size, such as '1024x768'.
+
+    Args:
+        value (str): Size, as given to --sizes.
+
+    Returns:
+        Width and height.
+
+    Raises:
+        argparse.ArgumentTypeError: If value is not a size.
+
+    """
+    width, _, height = value.partition("x")
+    try:
+        return int(width), int(height)
+    except ValueError:
+        msg = f"invalid size: {value!r} (expected e.g. 1024x768)"
+        raise argparse.ArgumentTypeError(msg) from None
+
+
+def get_argparser() -> argparse.ArgumentParser:
+    """
+    Get the parser of 'python -m benchmarks'.
+
+    Returns:
+        Parser of the benchmark options.
+
+    """
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks",
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument(
+        "--sizes",
+        dest="sizes",
+        type=parse_size,
+        nargs="+",
+        help="Image sizes (default: %(default)s)",
+        default=list(SIZES),
+        metavar="WxH",
+    )
+    parser.add_argument(
+        "--modes",
+        dest="modes",
+        choices=list(MODES),
+        nargs="+",
+        help="Image modes (default: all)",
+        default=list(MODES),
+    )
+    parser.add_argument(
+        "--repeat",
+        dest="repeat",
+        type=int,
+        help="Timed runs of each case (default: %(default)s)",
+        default=REPEAT_DEFAULT,
+    )
+    parser.add_argument(
+        "--quick",
+        dest="quick",
+        action="store_true",
+        help="Only time the smallest size, once",
+    )
+    parser.add_argument(
+        "--output",
+        dest="output_path",
+        type=pathlib.Path,
+        help="Where to write results (default: %(default)s)",
+        default=OUTPUT_DEFAULT,
+    )
+    parser.add_argument(
+        "--baseline",
+        dest="baseline_path",
+        type=pathlib.Path,
+        help="Results to compare against, if they exist (default: %(default)s)",
+        default=BASELINE_DEFAULT,
+    )
+    parser.add_argument(
+        "--save-baseline",
+        dest="save_baseline",
+        action="store_true",
+        help="Also write results as the new baseline",
+    )
+    parser.add_argument(
+        "--threshold",
+        dest="threshold",
+        type=float,
+        help="Tolerated slowdown, as a fraction (default: %(default)s)",
+        default=THRESHOLD_DEFAULT,
+    )
+    parser.add_argument(
+        "--memory-threshold",
+        dest="memory_threshold",
+        type=float,
+        help="Tolerated peak memory growth, as a fraction (default: %(default)s)",
+        default=MEMORY_THRESHOLD_DEFAULT,
+    )
+    parser.add_argument(
+        "--preview-target",
+        dest="preview_target",
+        type=float,
+        help="Preview latency target, in seconds (default: %(default)s)",
+        default=PREVIEW_LATENCY_TARGET,
+    )
+    return parser
+
+
+def write_results(path: pathlib.Path, results: dict[str, dict[str, Any]]) -> None:
+    """
+    Write results as JSON, with where they were measured.
+
+    Args:
+        path (pathlib.Path): Where to write them.
+        results (dict[str, dict[str, Any]]): Metrics keyed by case key.
+
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    document = {"metadata": get_metadata(), "results": results}
+    path.write_text(
+        json.dumps(document, indent=2, sort_keys=True) + "\n", encoding="utf-8"
+    )
+
+
+def print_summary(results: dict[str, dict[str, Any]], preview_target: float) -> None:
+    """
+    Print how engines, tiles, executors and previews compare.
+
+    Args:
+        results (dict[str, dict[str, Any]]): Metrics keyed by case key.
+        preview_target (float): Preview latency target, in seconds.
+
+    """
+    for key, speedup in get_speedups(results).items():
+        print(f"numpy engine on {key}: {speedup:.2f}x Pillow's speed")  # noqa: T201
+    for key, speedup in get_speedups(results, "crush_tiled").items():
+        print(f"tiles on {key}: {speedup:.2f}x the speed of one image")  # noqa: T201
+
+    for rest, executor in get_fastest_executors(results).items():
+        print(f"fastest executor on batch/{rest}: {executor}")  # noqa: T201
+
+    for key, seconds in get_slow_previews(results, preview_target).items():
+        print(  # noqa: T201
+            f"SLOW PREVIEW {key}: {1000 * seconds:.1f} ms "
+            f"(target {1000 * preview_target:.0f} ms)"
+        )
+
+
+def main() -> None:
+    """Run the benchmarks, exiting with 1 on regressions."""
+    namespace = get_argparser().parse_args()
+    sizes = namespace.sizes
+    repeat = namespace.repeat
+    if namespace.quick:
+        sizes = [min(sizes)]
+        repeat = 1
+
+    results = run_benchmarks(plan_cases(sizes, namespace.modes), repeat)
+    startup = measure_startup(max(repeat, STARTUP_REPEAT_MIN))
+    for key, metrics in startup.items():
+        print(f"{key:<36} {1000 * metrics['seconds']:>10.1f} ms")  # noqa: T201
+    for name, seconds in startup["startup/import"]["slowest_imports"].items():
+        print(f"  import {name:<29} {1000 * seconds:>10.1f} ms")  # noqa: T201
+    results.update(startup)
+
+    write_results(namespace.output_path, results)
+    print(f"Results written to {namespace.output_path}")  # noqa: T201
+
+    print_summary(results, namespace.preview_target)
+
+    regressions = []
+    baseline_path = namespace.baseline_path
+    if baseline_path.is_file() and not namespace.save_baseline:
+        baseline = json.loads(baseline_path.read_text(encoding="utf-8"))
+        print(f"Comparing against {baseline_path} ({baseline['metadata']['date']})")  # noqa: T201
+        regressions = compare_results(
+            baseline["results"],
+            results,
+            threshold=namespace.threshold,
+            memory_threshold=namespace.memory_threshold,
+        )
+        for regression in regressions:
+            print(  # noqa: T201
+                f"REGRESSION {regression.key} {regression.metric}: "
+                f"{regression.baseline:.4g} -> {regression.current:.4g} "
+                f"({regression.ratio:.2f}x)"
+            )
+        if not regressions:
+            print("No regressions.")  # noqa: T201
+
+    if namespace.save_baseline:
+        write_results(baseline_path, results)
+        print(f"Baseline written to {baseline_path}")  # noqa: T201
+
+    if regressions:
+        sys.exit(1)
@@ -0,0 +1,58 @@
+"""Generate the images the benchmarks crush."""
+
+from __future__ import annotations
+
+import io
+
+from PIL import Image
+
+# Modes to benchmark, and the mode images are converted to before crushing.
+# RGBA cannot be written as JPEG, so it measures the conversion to RGB too.
+MODES = {"RGB": "RGB", "L": "L", "RGBA": "RGB", "CMYK": "CMYK"}
+SIZES = ((256, 256), (1024, 768), (2048, 1536))
+MANDELBROT_EXTENT = (-2.2, -1.2, 1.0, 1.2)
+MANDELBROT_QUALITY = 100
+
+
+def generate_image(size: tuple[int, int], mode: str) -> Image.Image:
+    """
+    Generate the same textured image on every run.
+
+    Bands are a horizontal gradient, a radial gradient and a Mandelbrot
+    set, so JPEG sees both smooth areas and sharp detail.
+
+    Args:
+        size (tuple[int, int]): Image width and height.
+        mode (str): One of MODES.
+
+    Returns:
+        Synthetic image.
+
+    """
+    horizontal = Image.linear_gradient("L").rotate(90).resize(size)
+    radial = Image.radial_gradient("L").resize(size)
+    mandelbrot = Image.effect_mandelbrot(size, MANDELBROT_EXTENT, MANDELBROT_QUALITY)
+    if mode == "L":
+        return mandelbrot
+    img = Image.merge("RGB", (horizontal, radial, mandelbrot))
+    if mode == "RGBA":
+        img.putalpha(Image.linear_gradient("L").resize(size))
+    elif mode == "CMYK":
+        img = img.convert("CMYK")
+    return img
+
+
+def encode_image(img: Image.Image) -> bytes:
+    """
+    Encode img losslessly, as an input file would be.
+
+    Args:
+        img (Image.Image): Synthetic image.
+
+    Returns:
+        TIFF file contents.
+
+    """
+    with io.BytesIO() as buf:
+        img.save(buf, format="TIFF")
+        return buf.getvalue()
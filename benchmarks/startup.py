@@ -0,0 +1,198 @@
+"""Measure how long the command takes to start and what it imports."""
+
+from __future__ import annotations
+
+import contextlib
+import os
+import pathlib
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import TYPE_CHECKING, Any
+
+from pycrusher.daemon import SOCKET_ENVIRONMENT_VARIABLE, is_listening, is_supported
+
+if TYPE_CHECKING:
+    from collections.abc import Generator
+
+# Imported by the pycrusher command before it parses anything.
+STARTUP_MODULE = "pycrusher.cli"
+# Modules reported as the slowest imports of STARTUP_MODULE.
+SLOWEST_IMPORTS = 5
+DAEMON_TIMEOUT = 30.0
+
+
+def parse_import_times(report: str, module: str) -> dict[str, int]:
+    """
+    Parse what 'python -X importtime' writes to stderr.
+
+    Modules are reported once imported, nested under the module importing
+    them, so the modules imported by module are the more deeply nested ones
+    reported right before it.
+
+    Args:
+        report (str): importtime report.
+        module (str): Module imported at the top level.
+
+    Returns:
+        Cumulative import time of module and of every module it imported,
+        in microseconds, keyed by module name.
+
+    """
+    lines = []
+    for line in report.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative_field, name_field = line[len("import time:") :].split("|")
+        if cumulative_field.strip().isdigit():
+            depth = (len(name_field) - len(name_field.lstrip()) - 1) // 2
+            lines.append((name_field.strip(), depth, int(cumulative_field)))
+
+    times: dict[str, int] = {}
+    for name, depth, cumulative in reversed(lines):
+        if times and depth == 0:
+            break
+        if times or (name == module and depth == 0):
+            times[name] = cumulative
+    return times
+
+
+def time_imports(module: str) -> dict[str, int]:
+    """
+    Import module in a fresh interpreter, timing every import.
+
+    Args:
+        module (str): Module to import.
+
+    Returns:
+        Result of parse_import_times.
+
+    """
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return parse_import_times(process.stderr, module)
+
+
+def time_command(
+    args: list[str], repeat: int, environ: dict[str, str] | None = None
+) -> list[float]:
+    """
+    Time 'python -m pycrusher' with args, from start to exit.
+
+    Args:
+        args (list[str]): Command line arguments.
+        repeat (int): Timed runs, after one warm-up run.
+        environ (dict[str, str] | None): Environment, if not this one.
+
+    Returns:
+        Seconds of every timed run.
+
+    """
+    command = [sys.executable, "-m", "pycrusher", *args]
+    timings = []
+    for index in range(repeat + 1):
+        start = time.perf_counter()
+        subprocess.run(command, env=environ, stdout=subprocess.DEVNULL, check=True)
+        if index:
+            timings.append(time.perf_counter() - start)
+    return timings
+
+
+@contextlib.contextmanager
+def running_daemon(socket_path: pathlib.Path) -> Generator[None, None, None]:
+    """
+    Run 'pycrusher daemon' on socket_path while inside the context.
+
+    Args:
+        socket_path (pathlib.Path): Where the daemon listens.
+
+    Yields:
+        Once the daemon listens.
+
+    Raises:
+        RuntimeError: If the daemon did not listen within DAEMON_TIMEOUT.
+
+    """
+    process = subprocess.Popen(
+        [sys.executable, "-m", "pycrusher", "daemon", "--socket", str(socket_path)],
+        stdout=subprocess.DEVNULL,
+    )
+    try:
+        deadline = time.monotonic() + DAEMON_TIMEOUT
+        while not is_listening(socket_path):
+            if process.poll() is not None or time.monotonic() > deadline:
+                msg = f"The daemon did not listen on {socket_path}"
+                raise RuntimeError(msg)
+            time.sleep(0.05)
+        yield
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def get_metrics(timings: list[float]) -> dict[str, Any]:
+    """
+    Summarize the timings of a command.
+
+    Args:
+        timings (list[float]): Result of time_command.
+
+    Returns:
+        Metrics, like those of a case.
+
+    """
+    return {
+        "seconds": statistics.median(timings),
+        "min_seconds": min(timings),
+        "peak_rss": None,
+    }
+
+
+def measure_startup(repeat: int) -> dict[str, dict[str, Any]]:
+    """
+    Time how long the pycrusher command takes to start.
+
+    Args:
+        repeat (int): Timed runs of each command.
+
+    Returns:
+        Metrics keyed like case keys: 'startup/import' for importing
+        STARTUP_MODULE, with its slowest imports, 'startup/help' for
+        'pycrusher --help' without a daemon, and 'startup/help_daemon'
+        for the same command forwarded to a daemon, where supported.
+
+    """
+    imports = time_imports(STARTUP_MODULE)
+    slowest = sorted(
+        (name for name in imports if name != STARTUP_MODULE),
+        key=imports.__getitem__,
+        reverse=True,
+    )
+    results = {
+        "startup/import": {
+            "seconds": imports[STARTUP_MODULE] / 1e6,
+            "peak_rss": None,
+            "slowest_imports": {
+                name: imports[name] / 1e6 for name in slowest[:SLOWEST_IMPORTS]
+            },
+        },
+    }
+
+    with tempfile.TemporaryDirectory() as directory:
+        socket_path = pathlib.Path(directory, "daemon.sock")
+        environ = dict(os.environ)
+        # Nothing listens there, unless started below.
+        environ[SOCKET_ENVIRONMENT_VARIABLE] = str(socket_path)
+        results["startup/help"] = get_metrics(time_command(["--help"], repeat, environ))
+        if is_supported():
+            with running_daemon(socket_path):
+                results["startup/help_daemon"] = get_metrics(
+                    time_command(["--help"], repeat, environ)
+                )
+    return results
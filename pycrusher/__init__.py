@@ -0,0 +1,25 @@
+"""Generate lossy JPEG compressions, for fun."""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+from .core import Options
+
+if TYPE_CHECKING:
+    # Loaded by __getattr__ at runtime.
+    from .api import Crusher, Frame  # noqa: TCH004
+
+__all__ = ["Crusher", "Frame", "Options"]
+
+# The API imports PIL, which the CLI defers until it crushes.
+LAZY_NAMES = ("Crusher", "Frame")
+
+
+def __getattr__(name: str) -> object:
+    if name in LAZY_NAMES:
+        from . import api  # noqa: PLC0415
+
+        return getattr(api, name)
+    msg = f"module {__name__!r} has no attribute {name!r}"
+    raise AttributeError(msg)
@@ -1,3 +1,5 @@
+"""Run pycrusher with 'python -m pycrusher'."""
+
 from .cli import main
 
 main()
@@ -0,0 +1,221 @@
+"""Crush images in memory, without touching the filesystem."""
+
+from __future__ import annotations
+
+import contextlib
+import io
+from typing import IO, TYPE_CHECKING, NamedTuple, Union
+
+from PIL import Image
+
+from .core import (
+    Options,
+    generate_quality_sequence,
+    get_modes,
+    iterate_compressions,
+    write_last_step,
+)
+from .preview import open_preview
+
+if TYPE_CHECKING:
+    from collections.abc import Generator
+
+    from .core import Step
+    from .hooks import Sink
+
+    ImageInput = Union[bytes, bytearray, memoryview, IO[bytes], Image.Image]
+
+
+class Frame(NamedTuple):
+    """JPEG of one step, as yielded by Crusher.frames."""
+
+    position: int
+    quality: int
+    data: bytes
+
+    def to_image(self) -> Image.Image:
+        """
+        Decode this frame's JPEG.
+
+        Returns:
+            Image, not yet loaded.
+
+        """
+        return Image.open(io.BytesIO(self.data))
+
+
+def open_image(image: ImageInput) -> Image.Image:
+    """
+    Open image, unless it already is one.
+
+    Args:
+        image (ImageInput): Encoded image, binary file object or image.
+
+    Returns:
+        Image, not yet loaded.
+
+    """
+    if isinstance(image, Image.Image):
+        return image
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        return Image.open(io.BytesIO(image))
+    return Image.open(image)
+
+
+class Crusher:
+    """
+    Crush images in memory, without touching the filesystem.
+
+    Options mean the same as in run(), and results are byte-identical to
+    it. Images are never modified, and Crusher never prompts. With preview,
+    images are first shrunk to at most that many pixels wide.
+    """
+
+    def __init__(self, options: Options | None = None) -> None:
+        """
+        Check and keep the parameters.
+
+        Args:
+            options (Options | None): Parameters of the crush, or None for the
+                defaults. Only iterations, extra, color, reverse, preprocess,
+                converge, fused_color and preview are used.
+
+        Raises:
+            TypeError: If iterations, extra or preview are below 1, color is
+                negative, or a way of crushing other than preview is given.
+
+        """
+        options = Options() if options is None else options
+        if options.iterations <= 0:
+            msg = f"Iterations must be greater or equal to 1: {options.iterations}"
+            raise TypeError(msg)
+        if options.extra <= 0:
+            msg = f"Extra must be greater or equal to 1: {options.extra}"
+            raise TypeError(msg)
+        if options.color < 0.0:
+            msg = f"Color enhancement must be greater or equal to 0.0: {options.color}"
+            raise TypeError(msg)
+        if options.preview is not None and options.preview <= 0:
+            msg = f"Preview width must be greater or equal to 1: {options.preview}"
+            raise TypeError(msg)
+        modes = [mode for mode in get_modes(options) if mode != "preview"]
+        if modes:
+            msg = f"Crusher cannot crush with {', '.join(modes)}."
+            raise TypeError(msg)
+
+        self.options = options
+
+    def open_input(self, image: ImageInput) -> Image.Image:
+        """
+        Open image, shrunk to a preview if one was asked for.
+
+        Args:
+            image (ImageInput): Encoded image, binary file object or image.
+
+        Returns:
+            Image to crush, which is image itself if it needs no changes.
+
+        """
+        img = open_image(image)
+        preview = self.options.preview
+        if preview is None:
+            return img
+        # Only decode at reduced size images opened here.
+        preview_img = open_preview(img, preview, draft=img is not image)
+        if img is not image and preview_img is not img:
+            img.close()
+        return preview_img
+
+    @property
+    def qualities(self) -> list[int]:
+        """JPEG quality of every step."""
+        options = self.options
+        return options.extra * generate_quality_sequence(
+            options.iterations, options.reverse
+        )
+
+    def iterate(self, img: Image.Image) -> Generator[Step, None, None]:
+        """
+        Compress img for every step, as crush() does.
+
+        Args:
+            img (Image.Image): Image to crush.
+
+        Returns:
+            Result of iterate_compressions.
+
+        """
+        qualities = self.qualities
+        return iterate_compressions(
+            img,
+            qualities,
+            color_index=0 if self.options.preprocess else len(qualities) - 1,
+            options=self.options,
+        )
+
+    def frames(self, image: ImageInput) -> Generator[Frame, None, None]:
+        """
+        Crush image lazily, one step at a time.
+
+        Each step is only computed once the previous frame was consumed, so
+        callers may stream frames or stop early, closing the generator to
+        release the image. With converge, skipped
+        steps yield nothing, and the last frame is still the result.
+
+        Args:
+            image (ImageInput): Encoded image, binary file object or image.
+
+        Yields:
+            JPEG of every step that was computed.
+
+        """
+        img = self.open_input(image)
+        try:
+            with contextlib.closing(self.iterate(img)) as steps:
+                for step in steps:
+                    with step.buffer.getbuffer() as view, view[: step.size] as data:
+                        jpeg = bytes(data)
+                    yield Frame(step.position, step.quality, jpeg)
+        finally:
+            if img is not image:
+                img.close()
+
+    def crush(self, image: ImageInput, *, sink: Sink | None = None) -> bytes:
+        """
+        Crush image.
+
+        Args:
+            image (ImageInput): Encoded image, binary file object or image.
+            sink (Sink | None): Receives the timing of every step, if given.
+
+        Returns:
+            Crushed JPEG.
+
+        """
+        img = self.open_input(image)
+        try:
+            with io.BytesIO() as image_buffer:
+                write_last_step(
+                    image_buffer,
+                    self.iterate(img),
+                    total=len(self.qualities),
+                    progress=False,
+                    sink=sink,
+                )
+                return image_buffer.getvalue()
+        finally:
+            if img is not image:
+                img.close()
+
+    def crush_image(self, image: ImageInput) -> Image.Image:
+        """
+        Crush image and decode the result.
+
+        Args:
+            image (ImageInput): Encoded image, binary file object or image.
+
+        Returns:
+            Crushed image.
+
+        """
+        return Image.open(io.BytesIO(self.crush(image)))
@@ -0,0 +1,566 @@
+"""Crush many images at once, in a pool of workers."""
+
+from __future__ import annotations
+
+import collections
+import functools
+import glob
+import os
+import pathlib
+import sys
+from typing import TYPE_CHECKING, NamedTuple
+
+from .core import (
+    ENGINE_NUMPY,
+    OVERWRITE_ALWAYS,
+    OVERWRITE_ASK,
+    Options,
+    generate_default_output_name,
+    get_compressions_directory,
+    keep_buffers,
+    reusing_buffers,
+    run,
+    should_write,
+)
+from .hooks import RecordingSink, replay
+from .sweep import Variant, get_output_name, run_sweep
+
+if TYPE_CHECKING:
+    from collections.abc import Callable, Iterable
+
+    from .hooks import Event, Sink
+    from .preflight import ImageHeader
+
+GLOB_CHARACTERS = frozenset("*?[")
+
+EXECUTOR_PROCESS = "process"
+EXECUTOR_THREAD = "thread"
+EXECUTOR_SERIAL = "serial"
+EXECUTORS = (EXECUTOR_PROCESS, EXECUTOR_THREAD, EXECUTOR_SERIAL)
+
+
+class Schedule(NamedTuple):
+    """How run_batch spreads jobs over workers."""
+
+    # Number of workers, or 0 for one per CPU.
+    max_workers: int = 0
+    # One of EXECUTORS. 'serial' crushes one image at a time in this process.
+    executor: str = EXECUTOR_PROCESS
+    # Most bytes the images crushed at once by workers may take, as estimated
+    # by preflight.estimate_memory, if given.
+    memory_budget: int | None = None
+    # Headers already read by preflight.preflight. Those of other inputs are
+    # read by run_batch, if needed for memory_budget.
+    headers: dict[pathlib.Path, ImageHeader] | None = None
+    # With the numpy engine, crush same-sized images together in stacks of at
+    # most this many, in this process, if given.
+    stack_size: int | None = None
+    # Most bytes of image data per stack, if given.
+    max_memory: int | None = None
+
+
+class Job(NamedTuple):
+    """An input to crush, and where to write it."""
+
+    input_path: pathlib.Path
+    output_path: pathlib.Path
+    # Parameters of this output, or None for those given to run_batch.
+    variant: Variant | None = None
+
+
+def is_glob(path: pathlib.Path) -> bool:
+    """
+    Check whether path is a glob pattern rather than a literal path.
+
+    Args:
+        path (pathlib.Path): Path given by the user.
+
+    Returns:
+        Whether path contains glob characters and does not exist as is.
+
+    """
+    return not path.exists() and not GLOB_CHARACTERS.isdisjoint(str(path))
+
+
+def is_image_file(path: pathlib.Path) -> bool:
+    """
+    Check whether path looks like an image Pillow can open.
+
+    Args:
+        path (pathlib.Path): File found inside a directory.
+
+    Returns:
+        Whether path is a file with a registered image extension.
+
+    """
+    from PIL import Image  # noqa: PLC0415
+
+    return path.is_file() and path.suffix.lower() in Image.registered_extensions()
+
+
+def expand_input_paths(input_paths: Iterable[pathlib.Path]) -> list[pathlib.Path]:
+    """
+    Expand directories and glob patterns into image files.
+
+    Directories expand to the image files directly inside them and globs are
+    matched with recursive '**' support. Any other path is kept as is, so
+    validation can report it. Duplicates are dropped, keeping the first one.
+
+    Args:
+        input_paths (Iterable[pathlib.Path]): Paths given by the user.
+
+    Returns:
+        Input files, in the order given.
+
+    """
+    expanded: list[pathlib.Path] = []
+    for input_path in input_paths:
+        if input_path.is_dir():
+            expanded.extend(sorted(filter(is_image_file, input_path.iterdir())))
+        elif is_glob(input_path):
+            pattern = str(input_path)
+            matches = map(pathlib.Path, glob.glob(pattern, recursive=True))  # noqa: PTH207
+            expanded.extend(sorted(filter(pathlib.Path.is_file, matches)))
+        else:
+            expanded.append(input_path)
+    return list(dict.fromkeys(expanded))
+
+
+def plan_jobs(
+    input_paths: list[pathlib.Path],
+    output_directory: pathlib.Path | None,
+    options: Options | None = None,
+) -> list[Job]:
+    """
+    Pair each input with its default output name.
+
+    Args:
+        input_paths (list[pathlib.Path]): Input files.
+        output_directory (pathlib.Path | None): Where outputs go, or None for
+            the 'compressions' directory.
+        options (Options | None): Parameters the outputs are named after, or
+            None for the defaults.
+
+    Returns:
+        One job per input.
+
+    """
+    options = Options() if options is None else options
+    if output_directory is None:
+        output_directory = get_compressions_directory()
+    return [
+        Job(
+            input_path,
+            output_directory.joinpath(
+                generate_default_output_name(input_path, options)
+            ),
+        )
+        for input_path in input_paths
+    ]
+
+
+def plan_sweep_jobs(
+    input_paths: list[pathlib.Path],
+    output_directory: pathlib.Path | None,
+    variants: list[Variant],
+) -> list[Job]:
+    """
+    Pair each input with the default output name of every variant.
+
+    Args:
+        input_paths (list[pathlib.Path]): Input files.
+        output_directory (pathlib.Path | None): Where outputs go, or None for
+            the 'compressions' directory.
+        variants (list[Variant]): Result of sweep.plan_variants.
+
+    Returns:
+        One job per input and variant.
+
+    """
+    if output_directory is None:
+        output_directory = get_compressions_directory()
+    return [
+        Job(
+            input_path,
+            output_directory.joinpath(get_output_name(input_path, variant)),
+            variant,
+        )
+        for input_path in input_paths
+        for variant in variants
+    ]
+
+
+def check_output_paths(jobs: Iterable[Job]) -> None:
+    """
+    Check that no two jobs would write the same output.
+
+    Args:
+        jobs (Iterable[Job]): Inputs and outputs.
+
+    Raises:
+        ValueError: If two jobs share an output.
+
+    """
+    seen: dict[pathlib.Path, pathlib.Path] = {}
+    for job in jobs:
+        if job.output_path in seen:
+            msg = (
+                f"Inputs {seen[job.output_path]} and {job.input_path} "
+                f"would both be written to {job.output_path}"
+            )
+            raise ValueError(msg)
+        seen[job.output_path] = job.input_path
+
+
+def check_input_paths(jobs: Iterable[Job]) -> None:
+    """
+    Check that every input is crushed by one job, or by one sweep.
+
+    Jobs with their own variant are grouped by input and crushed together,
+    and other jobs one per input, so an input cannot have another job
+    besides.
+
+    Args:
+        jobs (Iterable[Job]): Inputs and outputs.
+
+    Raises:
+        ValueError: If an input has a job without its own variant, and any
+            other job.
+
+    """
+    seen: dict[pathlib.Path, Job] = {}
+    for job in jobs:
+        other = seen.setdefault(job.input_path, job)
+        if other is not job and (other.variant is None or job.variant is None):
+            msg = (
+                f"Input {job.input_path} would be crushed twice, to "
+                f"{other.output_path} and {job.output_path}"
+            )
+            raise ValueError(msg)
+
+
+def run_batch(
+    jobs: list[Job],
+    *,
+    options: Options | None = None,
+    schedule: Schedule | None = None,
+    progress: bool = True,
+    sink: Sink | None = None,
+) -> dict[pathlib.Path, BaseException]:
+    """
+    Crush every job, fanning out over a process or thread pool.
+
+    Overwrite questions are asked up front, in this process, so workers never
+    block on input. With a single worker, jobs run in this process. Jobs with
+    their own variant are grouped by input, so each input is crushed once.
+    Jobs are checked first by check_output_paths and check_input_paths.
+
+    With a memory budget, workers only start an image while the estimated
+    peak memory of the images being crushed, with it, fits in the budget.
+    Images start in order, so a large image waits for room instead of being
+    passed by smaller ones. An image over budget on its own still runs, alone.
+
+    Pillow releases the GIL while encoding and decoding JPEGs, so threads
+    crush in parallel too, without starting processes or pickling jobs and
+    their events. Each thread reuses its step buffers from one image to the
+    next. Workers never touch sink or progress bars: their events are
+    recorded, and replayed here as each job completes.
+
+    Args:
+        jobs (list[Job]): Inputs and outputs.
+        options (Options | None): Parameters of jobs without their own
+            variant, or None for the defaults. With tile_size, images are
+            crushed one at a time, each with tile_workers. The overwrite
+            policy and cache apply to every job, and an animation takes the
+            only image.
+        schedule (Schedule | None): How to spread jobs over workers, or None
+            for one process per CPU.
+        progress (bool): Show progress bars.
+        sink (Sink | None): Receives the timings of every job, if given.
+
+    Returns:
+        Exceptions raised by failed jobs, keyed by input path.
+
+    """
+    options = Options() if options is None else options
+    schedule = Schedule() if schedule is None else schedule
+    check_output_paths(jobs)
+    check_input_paths(jobs)
+
+    if options.engine == ENGINE_NUMPY and schedule.stack_size is not None:
+        from .stack import run_stacked  # noqa: PLC0415
+
+        return run_stacked(
+            jobs, options=options, schedule=schedule, progress=progress, sink=sink
+        )
+
+    if options.overwrite == OVERWRITE_ASK:
+        jobs = [job for job in jobs if should_write(job.output_path, OVERWRITE_ASK)]
+        options = options._replace(overwrite=OVERWRITE_ALWAYS)
+
+    for output_directory in {job.output_path.parent for job in jobs}:
+        output_directory.mkdir(parents=True, exist_ok=True)
+
+    tasks: dict[pathlib.Path, Callable[..., object]] = {
+        job.input_path: functools.partial(
+            run,
+            input_path=job.input_path,
+            output_path=job.output_path,
+            options=options,
+        )
+        for job in jobs
+        if job.variant is None
+    }
+    sweeps = group_sweeps(jobs, options.overwrite)
+    for input_path, outputs in sweeps.items():
+        tasks[input_path] = functools.partial(
+            run_sweep,
+            input_path=input_path,
+            outputs=outputs,
+            cache=options.cache,
+        )
+
+    max_workers = 1
+    if options.tile_size is None and schedule.executor != EXECUTOR_SERIAL:
+        max_workers = min(
+            schedule.max_workers or os.cpu_count() or 1, max(len(tasks), 1)
+        )
+    if max_workers == 1:
+        return run_serially(tasks, progress=progress, sink=sink)
+
+    failures: dict[pathlib.Path, BaseException] = {}
+    estimates: dict[pathlib.Path, int] = {}
+    if schedule.memory_budget is not None:
+        headers = dict(schedule.headers or {})
+        from .preflight import preflight  # noqa: PLC0415
+
+        read, failures = preflight(set(tasks).difference(headers))
+        headers.update(read)
+        for input_path in failures:
+            del tasks[input_path]
+        estimates = estimate_tasks(tasks, sweeps, headers, options=options)
+
+    failures.update(
+        run_in_pool(
+            tasks,
+            schedule=schedule._replace(max_workers=max_workers),
+            estimates=estimates,
+            progress=progress,
+            sink=sink,
+        )
+    )
+    return failures
+
+
+def group_sweeps(
+    jobs: Iterable[Job], overwrite: str
+) -> dict[pathlib.Path, dict[pathlib.Path, Variant]]:
+    """
+    Group the outputs of jobs with their own variant by input.
+
+    Args:
+        jobs (Iterable[Job]): Inputs and outputs.
+        overwrite (str): What to do if an output exists.
+
+    Returns:
+        Variant of each output to write, keyed by input.
+
+    """
+    sweeps: dict[pathlib.Path, dict[pathlib.Path, Variant]] = {}
+    for job in jobs:
+        if job.variant is not None and should_write(job.output_path, overwrite):
+            sweeps.setdefault(job.input_path, {})[job.output_path] = job.variant
+    return sweeps
+
+
+def run_serially(
+    tasks: dict[pathlib.Path, Callable[..., object]],
+    *,
+    progress: bool,
+    sink: Sink | None,
+) -> dict[pathlib.Path, BaseException]:
+    """
+    Run tasks one after another in this process.
+
+    Args:
+        tasks (dict[pathlib.Path, Callable[..., object]]): Jobs built by
+            run_batch, keyed by input.
+        progress (bool): Show progress bars, per step for a single task, or
+            else per task.
+        sink (Sink | None): Receives the timings of every task, if given.
+
+    Returns:
+        Exceptions raised by failed tasks, keyed by input path.
+
+    """
+    import tqdm  # noqa: PLC0415
+
+    single_task = len(tasks) <= 1
+    failures: dict[pathlib.Path, BaseException] = {}
+    with reusing_buffers():
+        for input_path, task in tqdm.tqdm(
+            tasks.items(), unit="image", disable=single_task or not progress
+        ):
+            error = run_caught(task, progress=progress and single_task, sink=sink)
+            if error is not None:
+                failures[input_path] = error
+    return failures
+
+
+def run_caught(task: Callable[..., object], **kwargs: object) -> Exception | None:
+    """
+    Run task, catching what it raises.
+
+    Args:
+        task (Callable[..., object]): Job built by run_batch.
+        kwargs (object): Keyword arguments of task.
+
+    Returns:
+        Exception raised by task, or None if it succeeded.
+
+    """
+    try:
+        task(**kwargs)
+    except Exception as exc:  # noqa: BLE001
+        return exc
+    return None
+
+
+def estimate_tasks(
+    tasks: Iterable[pathlib.Path],
+    sweeps: dict[pathlib.Path, dict[pathlib.Path, Variant]],
+    headers: dict[pathlib.Path, ImageHeader],
+    *,
+    options: Options,
+) -> dict[pathlib.Path, int]:
+    """
+    Estimate the peak memory of each task.
+
+    Args:
+        tasks (Iterable[pathlib.Path]): Inputs of the tasks.
+        sweeps (dict[pathlib.Path, dict[pathlib.Path, Variant]]): Result of
+            group_sweeps.
+        headers (dict[pathlib.Path, ImageHeader]): Header of every input.
+        options (Options): Parameters of inputs that are not swept. Only
+            engine, preview and strip_memory are used.
+
+    Returns:
+        Bytes, keyed by input path.
+
+    """
+    from .preflight import estimate_memory  # noqa: PLC0415
+
+    estimates = {}
+    for input_path in tasks:
+        estimate = estimate_memory(
+            headers[input_path],
+            engine=options.engine,
+            preview=options.preview,
+            strip_memory=options.strip_memory,
+        )
+        # A sweep keeps a decoded image at every branch of its steps.
+        estimates[input_path] = estimate * len(sweeps.get(input_path, [None]))
+    return estimates
+
+
+def run_in_pool(
+    tasks: dict[pathlib.Path, Callable[..., object]],
+    *,
+    schedule: Schedule,
+    estimates: dict[pathlib.Path, int],
+    progress: bool,
+    sink: Sink | None,
+) -> dict[pathlib.Path, BaseException]:
+    """
+    Run tasks in a pool of workers, within the memory budget.
+
+    Args:
+        tasks (dict[pathlib.Path, Callable[..., object]]): Jobs built by
+            run_batch, keyed by input.
+        schedule (Schedule): Only executor, EXECUTOR_THREAD or else
+            processes, max_workers, the number of workers, and memory_budget
+            are used.
+        estimates (dict[pathlib.Path, int]): Result of estimate_tasks, if
+            memory_budget is given.
+        progress (bool): Show a progress bar.
+        sink (Sink | None): Receives the replayed timings of every task, if
+            given.
+
+    Returns:
+        Exceptions raised by failed tasks, keyed by input path.
+
+    """
+    import concurrent.futures  # noqa: PLC0415
+
+    import tqdm  # noqa: PLC0415
+
+    max_workers, memory_budget = schedule.max_workers, schedule.memory_budget
+    pool: concurrent.futures.Executor
+    if schedule.executor == EXECUTOR_THREAD:
+        pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers, initializer=keep_buffers
+        )
+    else:
+        pool = concurrent.futures.ProcessPoolExecutor(max_workers)
+    failures: dict[pathlib.Path, BaseException] = {}
+    waiting = collections.deque(tasks.items())
+    futures: dict[concurrent.futures.Future[list[Event]], pathlib.Path] = {}
+    used = 0
+    with pool, tqdm.tqdm(
+        total=len(tasks), unit="image", disable=not progress
+    ) as progress_bar:
+        while waiting or futures:
+            while waiting and (
+                memory_budget is None
+                or not futures
+                or used + estimates[waiting[0][0]] <= memory_budget
+            ):
+                input_path, task = waiting.popleft()
+                used += estimates.get(input_path, 0)
+                future = pool.submit(run_recorded, task, record=sink is not None)
+                futures[future] = input_path
+            done, _ = concurrent.futures.wait(
+                futures, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                input_path = futures.pop(future)
+                used -= estimates.get(input_path, 0)
+                error = future.exception()
+                if error is not None:
+                    failures[input_path] = error
+                elif sink is not None:
+                    replay(future.result(), sink)
+                progress_bar.update()
+    return failures
+
+
+def run_recorded(task: Callable[..., object], *, record: bool) -> list[Event]:
+    """
+    Run task in a worker, without a progress bar.
+
+    Args:
+        task (Callable[..., object]): Job built by run_batch.
+        record (bool): Record the events of task.
+
+    Returns:
+        Recorded events, to be replayed by run_batch.
+
+    """
+    if not record:
+        task(progress=False)
+        return []
+    recorder = RecordingSink()
+    task(progress=False, sink=recorder)
+    return recorder.events
+
+
+def report_failures(failures: dict[pathlib.Path, BaseException]) -> None:
+    """
+    Print failed jobs to stderr.
+
+    Args:
+        failures (dict[pathlib.Path, BaseException]): Result of run_batch.
+
+    """
+    for input_path, exc in failures.items():
+        print(f"Failed to crush {input_path}: {exc}", file=sys.stderr)  # noqa: T201
@@ -0,0 +1,298 @@
+"""Cache crushed images by their input and parameters."""
+
+from __future__ import annotations
+
+import contextlib
+import hashlib
+import json
+import os
+import pathlib
+import shutil
+import time
+from typing import TYPE_CHECKING, NamedTuple
+
+from .core import open_atomically
+
+if TYPE_CHECKING:
+    import sqlite3
+    from collections.abc import Generator
+
+CACHE_SIZE_DEFAULT = 2**30
+
+INDEX_NAME = "index.sqlite3"
+OBJECTS_NAME = "objects"
+CHUNK_SIZE = 2**20
+SQLITE_TIMEOUT = 60.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO counters VALUES ('hits', 0), ('misses', 0);
+"""
+
+
+class CacheStats(NamedTuple):
+    """Size of a cache, in entries and bytes, and how often it was hit."""
+
+    entries: int
+    size: int
+    max_size: int
+    hits: int
+    misses: int
+
+
+def get_cache_directory() -> pathlib.Path:
+    """
+    Get the default cache directory, from the environment at call time.
+
+    Returns:
+        'pycrusher' in $XDG_CACHE_HOME, or else in ~/.cache.
+
+    """
+    return pathlib.Path(
+        os.environ.get("XDG_CACHE_HOME", pathlib.Path.home().joinpath(".cache"))
+    ).joinpath("pycrusher")
+
+
+def get_version_stamp() -> str:
+    """
+    Get the versions that can change a crushed image.
+
+    Returns:
+        pycrusher and Pillow versions.
+
+    """
+    import PIL  # noqa: PLC0415
+    from importlib_metadata import version  # noqa: PLC0415
+
+    return f"pycrusher {version('pycrusher')} pillow {PIL.__version__}"
+
+
+class Cache:
+    """
+    Crushed images on disk, keyed by their input and parameters.
+
+    Entries are files written atomically, and their index lives in a SQLite
+    database, so several processes can share a cache directory. Once the
+    cache grows over max_size bytes, least recently used entries are evicted.
+    """
+
+    def __init__(
+        self,
+        directory: pathlib.Path | None = None,
+        max_size: int = CACHE_SIZE_DEFAULT,
+    ) -> None:
+        """
+        Use a cache directory, creating it once it is first written to.
+
+        Args:
+            directory (pathlib.Path | None): Where entries are stored, or None
+                for the directory of get_cache_directory.
+            max_size (int): Bytes the cache may take before evicting entries.
+
+        """
+        # Resolved here rather than on import, so a daemon serving callers
+        # with other environments uses the cache of each caller.
+        self.directory = directory or get_cache_directory()
+        self.max_size = max_size
+
+    @contextlib.contextmanager
+    def connect(self) -> Generator[sqlite3.Connection, None, None]:
+        """
+        Open the index, creating the cache directory if needed.
+
+        Yields:
+            Connection in autocommit mode. Use 'BEGIN IMMEDIATE' to write.
+
+        """
+        import sqlite3  # noqa: PLC0415
+
+        self.directory.joinpath(OBJECTS_NAME).mkdir(parents=True, exist_ok=True)
+        connection = sqlite3.connect(
+            self.directory.joinpath(INDEX_NAME),
+            timeout=SQLITE_TIMEOUT,
+            isolation_level=None,
+        )
+        try:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(SCHEMA)
+            yield connection
+        finally:
+            connection.close()
+
+    def get_object_path(self, key: str) -> pathlib.Path:
+        """
+        Get where the entry for key is stored.
+
+        Args:
+            key (str): Result of make_key.
+
+        Returns:
+            Entry path.
+
+        """
+        return self.directory.joinpath(OBJECTS_NAME, key[:2], key[2:])
+
+    @staticmethod
+    def make_key(input_path: pathlib.Path, **parameters: object) -> str:
+        """
+        Hash input_path contents, parameters and versions into a key.
+
+        Args:
+            input_path (pathlib.Path): Image to crush.
+            parameters (object): Parameters that change the crushed image.
+
+        Returns:
+            Hexadecimal key.
+
+        """
+        digest = hashlib.sha256()
+        digest.update(get_version_stamp().encode())
+        digest.update(json.dumps(parameters, sort_keys=True).encode())
+        with input_path.open("rb") as input_file:
+            for chunk in iter(lambda: input_file.read(CHUNK_SIZE), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def fetch(self, key: str, output_path: pathlib.Path) -> bool:
+        """
+        Copy the entry for key to output_path, if there is one.
+
+        Args:
+            key (str): Result of make_key.
+            output_path (pathlib.Path): Where to write the crushed image.
+
+        Returns:
+            Whether key was found.
+
+        """
+        try:
+            object_file = self.get_object_path(key).open("rb")
+        except FileNotFoundError:
+            object_file = None
+        if object_file is not None:
+            with object_file, open_atomically(output_path) as output_file:
+                shutil.copyfileobj(object_file, output_file)
+
+        # Counted once copied, so an entry evicted by another process since
+        # its lookup is a miss, and leaves no row behind.
+        found = object_file is not None
+        with self.connect() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            if found:
+                connection.execute(
+                    "UPDATE entries SET last_access = ? WHERE key = ?",
+                    (time.time(), key),
+                )
+            else:
+                connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+            connection.execute(
+                "UPDATE counters SET value = value + 1 WHERE name = ?",
+                ("hits" if found else "misses",),
+            )
+            connection.execute("COMMIT")
+        return found
+
+    def store(self, key: str, output_path: pathlib.Path) -> None:
+        """
+        Copy output_path into the cache as the entry for key.
+
+        Args:
+            key (str): Result of make_key.
+            output_path (pathlib.Path): Crushed image.
+
+        """
+        object_path = self.get_object_path(key)
+        object_path.parent.mkdir(parents=True, exist_ok=True)
+        copy_atomically(output_path, object_path)
+
+        with self.connect() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?)",
+                (key, object_path.stat().st_size, time.time()),
+            )
+            connection.execute("COMMIT")
+
+        self.prune()
+
+    def prune(self, max_size: int | None = None) -> int:
+        """
+        Evict least recently used entries until the cache fits max_size.
+
+        Args:
+            max_size (int | None): Size limit in bytes, or None for the
+                cache's own.
+
+        Returns:
+            Number of evicted entries.
+
+        """
+        if max_size is None:
+            max_size = self.max_size
+
+        with self.connect() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            (size,) = connection.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM entries"
+            ).fetchone()
+            evicted = []
+            entries = connection.execute(
+                "SELECT key, size FROM entries ORDER BY last_access"
+            )
+            for key, entry_size in entries:
+                if size <= max_size:
+                    break
+                evicted.append(key)
+                size -= entry_size
+            connection.executemany(
+                "DELETE FROM entries WHERE key = ?", [(key,) for key in evicted]
+            )
+            connection.execute("COMMIT")
+
+        for key in evicted:
+            with contextlib.suppress(FileNotFoundError):
+                self.get_object_path(key).unlink()
+        return len(evicted)
+
+    def stats(self) -> CacheStats:
+        """
+        Count entries, bytes, hits and misses.
+
+        Returns:
+            Cache statistics.
+
+        """
+        with self.connect() as connection:
+            entries, size = connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+            ).fetchone()
+            counters = dict(connection.execute("SELECT name, value FROM counters"))
+        return CacheStats(
+            entries=entries,
+            size=size,
+            max_size=self.max_size,
+            hits=counters["hits"],
+            misses=counters["misses"],
+        )
+
+
+def copy_atomically(source: pathlib.Path, destination: pathlib.Path) -> None:
+    """
+    Copy source to destination, so that readers never see a partial file.
+
+    Args:
+        source (pathlib.Path): File to copy.
+        destination (pathlib.Path): File to create or replace.
+
+    """
+    with source.open("rb") as source_file, open_atomically(destination) as file:
+        shutil.copyfileobj(source_file, file)
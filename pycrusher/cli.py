@@ -1,35 +1,628 @@
+"""Parse the command line and run the crushes it asks for."""
+
 from __future__ import annotations
 
 import argparse
+import contextlib
+import functools
+import importlib.util
+import os
 import pathlib
 import sys
+from typing import TYPE_CHECKING, Any, NoReturn, cast
+
+from .animate import FRAME_DURATION_DEFAULT, Animation
+from .batch import (
+    EXECUTOR_PROCESS,
+    EXECUTOR_SERIAL,
+    EXECUTOR_THREAD,
+    EXECUTORS,
+    Job,
+    Schedule,
+    check_input_paths,
+    check_output_paths,
+    expand_input_paths,
+    plan_jobs,
+    plan_sweep_jobs,
+    report_failures,
+    run_batch,
+)
+from .cache import CACHE_SIZE_DEFAULT, Cache
+from .core import (
+    COLOR_DEFAULT,
+    ENGINE_NUMPY,
+    ENGINE_PILLOW,
+    ENGINES,
+    EXTRA_DEFAULT,
+    ITERATIONS_DEFAULT,
+    OVERWRITE_ALWAYS,
+    OVERWRITE_ASK,
+    OVERWRITE_POLICIES,
+    Options,
+    keep_buffers,
+    load_options,
+    should_write,
+)
+from .hooks import (
+    JSONLinesSink,
+    MultiSink,
+    ProfileSink,
+    Sink,
+    SummarySink,
+    TargetSink,
+)
+from .resume import RESUME_INTERVAL_DEFAULT
+from .sweep import Variant, plan_variants
+from .targets import METRIC_BYTES, METRIC_PSNR, METRIC_SSIM, Target
 
-from importlib_metadata import version
+if TYPE_CHECKING:
+    import concurrent.futures
+    from collections.abc import Callable
 
-from .core import run
+    from .jobqueue import JobQueue
 
-ITERATIONS_DEFAULT = 50
-EXTRA_DEFAULT = 1
-COLOR_DEFAULT = 1.0
 OUTPUT_DEFAULT = None
+JOBS_DEFAULT = 1
+MEMORY_BUDGET_DEFAULT = None
+OVERWRITE_DEFAULT = OVERWRITE_ASK
+TILE_SIZE_DEFAULT = None
+STRIP_MEMORY_DEFAULT = None
+MAX_MEMORY_DEFAULT = None
+CACHE_DIR_DEFAULT = None
+SWEEP_DEFAULT = None
+CHECKPOINTS_DEFAULT = None
+LOG_STEPS_DEFAULT = None
+ENGINE_DEFAULT = ENGINE_PILLOW
+STACK_SIZE_DEFAULT = None
+PREVIEW_DEFAULT = None
+QUEUE_ACTIONS = ("add", "work", "status")
+TARGET_DEFAULT = None
+ANIMATE_DEFAULT = None
+EXECUTOR_DEFAULT = EXECUTOR_PROCESS
+ANIMATE_EVERY_DEFAULT = 1
+ANIMATE_WIDTH_DEFAULT = None
+
+MEMORY_UNITS = {"": 1, "K": 2**10, "M": 2**20, "G": 2**30, "T": 2**40}
+SWEEP_PARAMETERS = {"iterations": int, "extra": int, "color": float}
 
 PROGRAM = "pycrusher"
 
 
+class VersionAction(argparse.Action):
+    """Print the version like action='version', looking it up only then."""
+
+    def __init__(
+        self,
+        option_strings: list[str],
+        dest: str = argparse.SUPPRESS,
+        default: str = argparse.SUPPRESS,
+        help: str | None = None,  # noqa: A002
+    ) -> None:
+        """
+        Take no values, and store nothing.
+
+        Args:
+            option_strings (list[str]): Option names, such as '--version'.
+            dest (str): Unused attribute of the namespace.
+            default (str): Unused default.
+            help (str | None): Help of the option.
+
+        """
+        super().__init__(option_strings, dest=dest, default=default, nargs=0, help=help)
+
+    def __call__(
+        self,
+        parser: argparse.ArgumentParser,
+        namespace: argparse.Namespace,
+        values: object,
+        option_string: str | None = None,
+    ) -> NoReturn:
+        """Print the version of this package and exit."""
+        del namespace, values, option_string
+        from importlib_metadata import version  # noqa: PLC0415
+
+        print(f"{parser.prog} {version(PROGRAM)}")  # noqa: T201
+        parser.exit()
+
+
+class ColorAction(argparse.Action):
+    """Stores a single color, and sweeps several like --sweep color=... does."""
+
+    def __call__(
+        self,
+        parser: argparse.ArgumentParser,
+        namespace: argparse.Namespace,
+        values: object,
+        option_string: str | None = None,
+    ) -> None:
+        """Store the colors parsed by parse_colors."""
+        del parser, option_string
+        colors = cast("list[float]", values)
+        if len(colors) == 1:
+            namespace.color = colors[0]
+        else:
+            namespace.sweep = [*(namespace.sweep or []), ("color", colors)]
+
+
+def parse_colors(value: str) -> list[float]:
+    """
+    Parse --color, one factor or several to sweep.
+
+    Args:
+        value (str): Argument, such as '2' or '0.5,1,2'.
+
+    Returns:
+        Color enhancement factors.
+
+    Raises:
+        argparse.ArgumentTypeError: If value is not a list of numbers.
+
+    """
+    try:
+        return [float(item) for item in value.split(",")]
+    except ValueError:
+        msg = f"invalid colors: {value!r} (expected e.g. 2 or 0.5,1,2)"
+        raise argparse.ArgumentTypeError(msg) from None
+
+
+def parse_memory(value: str) -> int:
+    """
+    Parse a size in bytes, with an optional K, M, G or T suffix.
+
+    Args:
+        value (str): Argument, such as '512M'.
+
+    Returns:
+        Size in bytes.
+
+    Raises:
+        argparse.ArgumentTypeError: If value is not a size.
+
+    """
+    number, unit = value[:-1], value[-1:].upper()
+    if unit not in MEMORY_UNITS:
+        number, unit = value, ""
+    try:
+        return int(float(number) * MEMORY_UNITS[unit])
+    except ValueError:
+        msg = f"invalid memory size: {value!r}"
+        raise argparse.ArgumentTypeError(msg) from None
+
+
+def parse_sweep(value: str) -> tuple[str, list[float]]:
+    """
+    Parse --sweep, as a parameter and its values.
+
+    Args:
+        value (str): Argument, such as 'extra=1..10' or 'color=0.5,2'.
+
+    Returns:
+        Name of the parameter, and its values in order.
+
+    Raises:
+        argparse.ArgumentTypeError: If value names no sweepable parameter, or
+            gives no values.
+
+    """
+    name, _, values = value.partition("=")
+    convert = SWEEP_PARAMETERS.get(name)
+    swept = None if convert is None else parse_sweep_values(values, convert)
+    if not swept:
+        msg = f"invalid sweep: {value!r} (expected e.g. extra=1..10 or color=0.5,2)"
+        raise argparse.ArgumentTypeError(msg)
+    return name, swept
+
+
+def parse_sweep_values(
+    values: str, convert: Callable[[str], float]
+) -> list[float] | None:
+    """
+    Parse the values of a parameter in --sweep.
+
+    Args:
+        values (str): Values, such as '1..10' or '0.5,2'.
+        convert (Callable[[str], float]): Type of the parameter. Ranges are
+            only allowed for int.
+
+    Returns:
+        Values in order, or None if one is not of that type.
+
+    """
+    try:
+        if convert is int and ".." in values:
+            start, _, stop = values.partition("..")
+            return list(range(int(start), int(stop) + 1))
+        return [convert(item) for item in values.split(",")]
+    except ValueError:
+        return None
+
+
+def add_cache_arguments(parser: argparse.ArgumentParser) -> None:
+    """
+    Add the options of the cache to parser.
+
+    Args:
+        parser (argparse.ArgumentParser): Parser of a command using the cache.
+
+    """
+    parser.add_argument(
+        "--cache-dir",
+        dest="cache_dir",
+        type=pathlib.Path,
+        help=(
+            "Cache directory, implies --cache "
+            "(default: $XDG_CACHE_HOME/pycrusher, or ~/.cache/pycrusher)"
+        ),
+        default=CACHE_DIR_DEFAULT,
+    )
+
+    parser.add_argument(
+        "--cache-size",
+        dest="cache_size",
+        type=parse_memory,
+        help="Evict least recently used results past SIZE bytes (default: 1G)",
+        default=CACHE_SIZE_DEFAULT,
+        metavar="SIZE",
+    )
+
+
+def get_cache_argparser() -> argparse.ArgumentParser:
+    """
+    Get the parser of the cache command.
+
+    Returns:
+        Parser of 'pycrusher cache'.
+
+    """
+    parser = argparse.ArgumentParser(prog=f"{PROGRAM} cache")
+    parser.add_argument(
+        "action",
+        choices=["stats", "prune"],
+        help="Show cache statistics, or evict entries down to --cache-size",
+    )
+    add_cache_arguments(parser)
+    return parser
+
+
+def get_serve_argparser() -> argparse.ArgumentParser:
+    """
+    Get the parser of the serve command.
+
+    Returns:
+        Parser of 'pycrusher serve'.
+
+    """
+    from .server import (  # noqa: PLC0415
+        HOST_DEFAULT,
+        MAX_BODY_SIZE_DEFAULT,
+        MAX_STEPS_DEFAULT,
+        PORT_DEFAULT,
+        QUEUE_SIZE_DEFAULT,
+        READ_TIMEOUT_DEFAULT,
+        TIMEOUT_DEFAULT,
+    )
+
+    parser = argparse.ArgumentParser(
+        prog=f"{PROGRAM} serve",
+        description=(
+            "Crush images POSTed to /crush, with options as query parameters "
+            "(e.g. /crush?iterations=20&reverse). GET /metrics reports queue "
+            "depth and latencies."
+        ),
+    )
+    parser.add_argument(
+        "--host",
+        dest="host",
+        help=f"Address to listen on (default: {HOST_DEFAULT})",
+        default=HOST_DEFAULT,
+    )
+    parser.add_argument(
+        "--port",
+        dest="port",
+        type=int,
+        help=f"Port to listen on (default: {PORT_DEFAULT})",
+        default=PORT_DEFAULT,
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        dest="jobs",
+        type=int,
+        help="Number of worker processes (default: 0, one per CPU)",
+        default=0,
+    )
+    parser.add_argument(
+        "--queue-size",
+        dest="queue_size",
+        type=int,
+        help=(
+            "Requests that may wait for a worker before others get 429 "
+            f"(default: {QUEUE_SIZE_DEFAULT})"
+        ),
+        default=QUEUE_SIZE_DEFAULT,
+    )
+    parser.add_argument(
+        "--timeout",
+        dest="timeout",
+        type=float,
+        help=f"Seconds before a request gets 503 (default: {TIMEOUT_DEFAULT})",
+        default=TIMEOUT_DEFAULT,
+    )
+    parser.add_argument(
+        "--read-timeout",
+        dest="read_timeout",
+        type=float,
+        help=(
+            "Seconds a client may take to send the request head or body, "
+            f"before getting 408 (default: {READ_TIMEOUT_DEFAULT})"
+        ),
+        default=READ_TIMEOUT_DEFAULT,
+    )
+    parser.add_argument(
+        "--max-body-size",
+        dest="max_body_size",
+        type=parse_memory,
+        help="Largest accepted upload, in bytes (default: 64M)",
+        default=MAX_BODY_SIZE_DEFAULT,
+        metavar="SIZE",
+    )
+    parser.add_argument(
+        "--max-steps",
+        dest="max_steps",
+        type=int,
+        help=(
+            "Most steps, iterations times extra, a request may ask for "
+            f"(default: {MAX_STEPS_DEFAULT})"
+        ),
+        default=MAX_STEPS_DEFAULT,
+    )
+    return parser
+
+
+def add_queue_argument(parser: argparse.ArgumentParser) -> None:
+    """
+    Add the option of the queue path to parser.
+
+    Args:
+        parser (argparse.ArgumentParser): Parser of a queue command.
+
+    """
+    from .jobqueue import QUEUE_PATH_DEFAULT  # noqa: PLC0415
+
+    parser.add_argument(
+        "--queue",
+        dest="queue_path",
+        type=pathlib.Path,
+        help=f"Queue database (default: {QUEUE_PATH_DEFAULT})",
+        default=QUEUE_PATH_DEFAULT,
+        metavar="PATH",
+    )
+
+
+def get_queue_argparser() -> argparse.ArgumentParser:
+    """
+    Get the parser choosing a queue command.
+
+    Returns:
+        Parser of 'pycrusher queue'.
+
+    """
+    parser = argparse.ArgumentParser(
+        prog=f"{PROGRAM} queue",
+        description=(
+            "Crush images through a SQLite job queue shared by any number of "
+            "workers. Run '%(prog)s ACTION -h' for the options of each action."
+        ),
+    )
+    parser.add_argument(
+        "action",
+        choices=QUEUE_ACTIONS,
+        help=(
+            "Enqueue images with crushing options, crush queued images, or "
+            "show queue statistics"
+        ),
+    )
+    return parser
+
+
+def get_queue_add_argparser() -> argparse.ArgumentParser:
+    """
+    Get the parser of the queue add command.
+
+    Returns:
+        Parser of 'pycrusher queue add'.
+
+    """
+    parser = get_argparser()
+    parser.prog = f"{PROGRAM} queue add"
+    add_queue_argument(parser)
+    return parser
+
+
+def get_watch_argparser() -> argparse.ArgumentParser:
+    """
+    Get the parser of the watch command.
+
+    Returns:
+        Parser of 'pycrusher watch'.
+
+    """
+    from .watch import (  # noqa: PLC0415
+        INTERVAL_DEFAULT,
+        MANIFEST_PATH_DEFAULT,
+        SETTLE_DEFAULT,
+    )
+
+    parser = get_argparser()
+    parser.prog = f"{PROGRAM} watch"
+    parser.description = (
+        "Crush new and changed images in directories as they appear, "
+        "recording crushed files in a manifest so restarts skip them. "
+        "Outputs the manifest does not know of are kept, unless "
+        "'--overwrite always'."
+    )
+    parser.add_argument(
+        "--manifest",
+        dest="manifest_path",
+        type=pathlib.Path,
+        help=f"Manifest database (default: {MANIFEST_PATH_DEFAULT})",
+        default=MANIFEST_PATH_DEFAULT,
+        metavar="PATH",
+    )
+    parser.add_argument(
+        "--settle",
+        dest="settle",
+        type=float,
+        help=(
+            "Seconds a file must stay unchanged before it is crushed "
+            f"(default: {SETTLE_DEFAULT:g})"
+        ),
+        default=SETTLE_DEFAULT,
+        metavar="SECONDS",
+    )
+    parser.add_argument(
+        "--interval",
+        dest="interval",
+        type=float,
+        help=f"Seconds between scans when polling (default: {INTERVAL_DEFAULT:g})",
+        default=INTERVAL_DEFAULT,
+        metavar="SECONDS",
+    )
+    parser.add_argument(
+        "--poll",
+        dest="poll",
+        action="store_true",
+        help=(
+            "Scan every --interval seconds even where inotify is available "
+            "(e.g. on network filesystems)"
+        ),
+    )
+    parser.add_argument(
+        "--once",
+        dest="once",
+        action="store_true",
+        help="Crush what changed since the last run, then exit",
+    )
+    return parser
+
+
+def get_queue_work_argparser() -> argparse.ArgumentParser:
+    """
+    Get the parser of the queue work command.
+
+    Returns:
+        Parser of 'pycrusher queue work'.
+
+    """
+    from .jobqueue import (  # noqa: PLC0415
+        BACKOFF_DEFAULT,
+        LEASE_DEFAULT,
+        MAX_ATTEMPTS_DEFAULT,
+    )
+
+    parser = argparse.ArgumentParser(prog=f"{PROGRAM} queue work")
+    add_queue_argument(parser)
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        dest="jobs",
+        type=int,
+        help="Number of worker processes (0: one per CPU, default: 1)",
+        default=JOBS_DEFAULT,
+    )
+    parser.add_argument(
+        "--lease",
+        dest="lease",
+        type=float,
+        help=(
+            "Seconds before the job of a dead worker is retried "
+            f"(default: {LEASE_DEFAULT:g})"
+        ),
+        default=LEASE_DEFAULT,
+        metavar="SECONDS",
+    )
+    parser.add_argument(
+        "--max-attempts",
+        dest="max_attempts",
+        type=int,
+        help=f"Attempts before a job fails for good (default: {MAX_ATTEMPTS_DEFAULT})",
+        default=MAX_ATTEMPTS_DEFAULT,
+        metavar="N",
+    )
+    parser.add_argument(
+        "--backoff",
+        dest="backoff",
+        type=float,
+        help=(
+            "Seconds before the first retry of a failed job, doubling after "
+            f"each attempt (default: {BACKOFF_DEFAULT:g})"
+        ),
+        default=BACKOFF_DEFAULT,
+        metavar="SECONDS",
+    )
+    add_cache_arguments(parser)
+    parser.add_argument(
+        "--cache",
+        dest="cache",
+        action="store_true",
+        help="Reuse results of previous runs with the same input and parameters",
+    )
+    return parser
+
+
+def get_queue_status_argparser() -> argparse.ArgumentParser:
+    """
+    Get the parser of the queue status command.
+
+    Returns:
+        Parser of 'pycrusher queue status'.
+
+    """
+    parser = argparse.ArgumentParser(prog=f"{PROGRAM} queue status")
+    add_queue_argument(parser)
+    return parser
+
+
+def get_cache(namespace: argparse.Namespace) -> Cache | None:
+    """
+    Open the cache the arguments ask for.
+
+    Args:
+        namespace (argparse.Namespace): Parsed arguments.
+
+    Returns:
+        Cache, or None if not asked for.
+
+    """
+    if not getattr(namespace, "cache", True) and namespace.cache_dir is None:
+        return None
+    return Cache(
+        directory=namespace.cache_dir,
+        max_size=namespace.cache_size,
+    )
+
+
 def get_argparser() -> argparse.ArgumentParser:
+    """
+    Get the parser of crushing, the default command.
+
+    Returns:
+        Parser of 'pycrusher'.
+
+    """
     parser = argparse.ArgumentParser(prog=PROGRAM)
     parser.add_argument(
-        "input_path",
+        "input_paths",
         type=pathlib.Path,
-        help="Input image filename",
+        nargs="+",
+        help="Input image filenames, directories or glob patterns",
         metavar="INPUT_PATH",
     )
 
     parser.add_argument(
         "-v",
         "--version",
-        action="version",
-        version=f"%(prog)s {version(PROGRAM)}",
+        action=VersionAction,
         help="show %(prog)s version",
     )
 
@@ -61,9 +654,14 @@ def get_argparser() -> argparse.ArgumentParser:
         "-c",
         "--color",
         dest="color",
-        type=float,
-        help="Color enhancement",
+        type=parse_colors,
+        action=ColorAction,
+        help=(
+            "Color enhancement, or several separated by commas to write one "
+            "output per color, crushing the steps before color once (e.g. 0.5,1,2)"
+        ),
         default=COLOR_DEFAULT,
+        metavar="COLORS",
     )
 
     parser.add_argument(
@@ -71,7 +669,7 @@ def get_argparser() -> argparse.ArgumentParser:
         "--output",
         dest="output_path",
         type=pathlib.Path,
-        help="Output image filename",
+        help="Output image filename, or output directory for multiple inputs",
         default=OUTPUT_DEFAULT,
     )
 
@@ -83,55 +681,1657 @@ def get_argparser() -> argparse.ArgumentParser:
         help="Adds color enhancement BEFORE compression",
     )
 
-    return parser
+    parser.add_argument(
+        "--converge",
+        dest="converge",
+        action="store_true",
+        help="Skip iterations once the compressed image stops changing",
+    )
 
+    parser.add_argument(
+        "--fused-color",
+        dest="fused_color",
+        action="store_true",
+        help=(
+            "Enhance color on the YCbCr planes of the previous step, instead "
+            "of in RGB (faster, output differs slightly, no effect with -p)"
+        ),
+    )
 
-def validate_input_path(namespace: argparse.Namespace) -> None:
-    if not namespace.input_path.exists():
-        msg = f"Input path does not exist: {namespace.input_path}"
-        raise TypeError(msg)
+    parser.add_argument(
+        "--preview",
+        dest="preview",
+        type=int,
+        help=(
+            "Crush a quick preview at most WIDTH pixels wide, decoding JPEG "
+            "inputs at reduced size"
+        ),
+        default=PREVIEW_DEFAULT,
+        metavar="WIDTH",
+    )
 
-    if not namespace.input_path.is_file():
-        msg = "Input path should be a file."
-        raise TypeError(msg)
+    parser.add_argument(
+        "--target-psnr",
+        dest="target_psnr",
+        type=float,
+        help="Stop at the first step whose PSNR against the input is DB or lower",
+        default=TARGET_DEFAULT,
+        metavar="DB",
+    )
+    parser.add_argument(
+        "--target-ssim",
+        dest="target_ssim",
+        type=float,
+        help=(
+            "Stop at the first step whose SSIM against the input is VALUE or "
+            "lower (requires numpy)"
+        ),
+        default=TARGET_DEFAULT,
+        metavar="VALUE",
+    )
+    parser.add_argument(
+        "--target-bytes",
+        dest="target_bytes",
+        type=parse_memory,
+        help="Stop at the first step encoding to SIZE bytes or fewer (e.g. 20K)",
+        default=TARGET_DEFAULT,
+        metavar="SIZE",
+    )
 
+    parser.add_argument(
+        "--resume",
+        dest="resume",
+        action="store_true",
+        help=(
+            "Save progress next to each output, and continue from it if a "
+            "previous run was interrupted"
+        ),
+    )
+    parser.add_argument(
+        "--resume-interval",
+        dest="resume_interval",
+        type=float,
+        help="Seconds between saves of progress with --resume (0: every step)",
+        default=RESUME_INTERVAL_DEFAULT,
+        metavar="SECONDS",
+    )
 
-def validate_iterations(namespace: argparse.Namespace) -> None:
-    if namespace.iterations <= 0:
-        msg = f"Iterations must be greater or equal to 1: {namespace.iterations}"
-        raise TypeError(msg)
+    parser.add_argument(
+        "--animate",
+        dest="animate",
+        type=pathlib.Path,
+        help=(
+            "Stream the steps of a single image into an animated .gif or "
+            ".webp, or else into numbered frames in directory PATH"
+        ),
+        default=ANIMATE_DEFAULT,
+        metavar="PATH",
+    )
+    parser.add_argument(
+        "--animate-every",
+        dest="animate_every",
+        type=int,
+        help="Keep one step out of every N as a frame (first and last are kept)",
+        default=ANIMATE_EVERY_DEFAULT,
+        metavar="N",
+    )
+    parser.add_argument(
+        "--animate-width",
+        dest="animate_width",
+        type=int,
+        help="Shrink frames to at most WIDTH pixels wide",
+        default=ANIMATE_WIDTH_DEFAULT,
+        metavar="WIDTH",
+    )
+    parser.add_argument(
+        "--frame-duration",
+        dest="frame_duration",
+        type=int,
+        help="Milliseconds per frame of .gif and .webp animations",
+        default=FRAME_DURATION_DEFAULT,
+        metavar="MS",
+    )
 
+    parser.add_argument(
+        "--tile-size",
+        dest="tile_size",
+        type=int,
+        help="Crush tiles of this many pixels in parallel, using --jobs processes",
+        default=TILE_SIZE_DEFAULT,
+        metavar="PIXELS",
+    )
 
-def validate_extra(namespace: argparse.Namespace) -> None:
-    if namespace.extra <= 0:
-        msg = f"Extra must be greater or equal to 1: {namespace.extra}"
-        raise TypeError(msg)
+    parser.add_argument(
+        "--strip-memory",
+        dest="strip_memory",
+        type=parse_memory,
+        help=(
+            "Crush in strips, keeping image data within SIZE bytes (e.g. 512M). "
+            "Images are still decoded whole, so SIZE must hold the decoded image"
+        ),
+        default=STRIP_MEMORY_DEFAULT,
+        metavar="SIZE",
+    )
 
+    parser.add_argument(
+        "--max-memory",
+        dest="max_memory",
+        type=parse_memory,
+        help="With --stack-size, keep the image data of each stack within SIZE bytes",
+        default=MAX_MEMORY_DEFAULT,
+        metavar="SIZE",
+    )
 
-def validate_color(namespace: argparse.Namespace) -> None:
-    if namespace.color < 0.0:
-        msg = f"Color enhancement must be greater or equal to 0.0: {namespace.color}"
-        raise TypeError(msg)
+    parser.add_argument(
+        "--engine",
+        dest="engine",
+        choices=ENGINES,
+        help=(
+            "How to crush: 'pillow' encodes every step, 'numpy' simulates them "
+            "in the DCT domain and encodes only the result"
+        ),
+        default=ENGINE_DEFAULT,
+    )
 
+    parser.add_argument(
+        "--stack-size",
+        dest="stack_size",
+        type=int,
+        help=(
+            "With the numpy engine, crush up to N images of the same size "
+            "and mode together, as one array"
+        ),
+        default=STACK_SIZE_DEFAULT,
+        metavar="N",
+    )
 
-def main() -> None:
-    parser = get_argparser()
+    parser.add_argument(
+        "--sweep",
+        dest="sweep",
+        type=parse_sweep,
+        action="append",
+        help=(
+            "Write one output per value of iterations, extra or color, "
+            "crushing shared steps once (e.g. extra=1..10, color=0.5,2)"
+        ),
+        default=SWEEP_DEFAULT,
+        metavar="PARAM=VALUES",
+    )
+
+    parser.add_argument(
+        "--checkpoints",
+        dest="checkpoints",
+        type=int,
+        help="Also write the image every N steps",
+        default=CHECKPOINTS_DEFAULT,
+        metavar="N",
+    )
 
-    namespace = parser.parse_args(sys.argv[1:])
+    add_cache_arguments(parser)
+    parser.add_argument(
+        "--cache",
+        dest="cache",
+        action="store_true",
+        help="Reuse results of previous runs with the same input and parameters",
+    )
 
-    validate_input_path(namespace)
-    validate_iterations(namespace)
-    validate_extra(namespace)
-    validate_color(namespace)
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        dest="jobs",
+        type=int,
+        help="Number of workers for multiple inputs (0: one per CPU)",
+        default=JOBS_DEFAULT,
+    )
+    parser.add_argument(
+        "--executor",
+        dest="executor",
+        choices=EXECUTORS,
+        help=(
+            "Run workers as processes, as threads (no process startup, best "
+            "for small images), or one image at a time in this process"
+        ),
+        default=EXECUTOR_DEFAULT,
+    )
+    parser.add_argument(
+        "--memory-budget",
+        dest="memory_budget",
+        type=parse_memory,
+        help=(
+            "Start an image only while the estimated peak memory of the "
+            "images crushed at once fits in SIZE bytes (e.g. 8G)"
+        ),
+        default=MEMORY_BUDGET_DEFAULT,
+        metavar="SIZE",
+    )
+
+    parser.add_argument(
+        "--overwrite",
+        dest="overwrite",
+        choices=OVERWRITE_POLICIES,
+        help="What to do when an output file already exists",
+        default=OVERWRITE_DEFAULT,
+    )
+
+    parser.add_argument(
+        "-q",
+        "--quiet",
+        dest="quiet",
+        action="store_true",
+        help="Hide progress bars",
+    )
 
-    run(
-        input_path=namespace.input_path,
-        output_path=namespace.output_path,
-        iterations=namespace.iterations,
-        extra=namespace.extra,
-        color=namespace.color,
-        reverse=namespace.reverse,
-        preprocess=namespace.preprocess,
+    parser.add_argument(
+        "--profile",
+        dest="profile",
+        action="store_true",
+        help="Print the time spent in each stage, and step time percentiles",
     )
 
-    print("Done!")  # noqa: T201
+    parser.add_argument(
+        "--report",
+        dest="report",
+        action="store_true",
+        help=(
+            "Print the PSNR, SSIM and per-channel errors of every output "
+            "against its input (requires numpy)"
+        ),
+    )
+
+    parser.add_argument(
+        "--log-steps",
+        dest="log_steps",
+        type=pathlib.Path,
+        help="Write the timing of every step as JSON lines to PATH ('-': stdout)",
+        default=LOG_STEPS_DEFAULT,
+        metavar="PATH",
+    )
+
+    return parser
+
+
+def check_not_combined(option: str, conflicts: dict[str, bool]) -> None:
+    """
+    Check that option is given without any of the options it conflicts with.
+
+    Args:
+        option (str): Name of the option, capitalized.
+        conflicts (dict[str, bool]): Whether each conflicting option is given,
+            by its name.
+
+    Raises:
+        TypeError: If any of them is given.
+
+    """
+    if any(conflicts.values()):
+        *others, last = conflicts
+        listed = f"{', '.join(others)} or {last}" if others else last
+        msg = f"{option} cannot be combined with {listed}."
+        raise TypeError(msg)
+
+
+def validate_input_paths(namespace: argparse.Namespace) -> None:
+    """
+    Check that there are inputs, and that they are existing files.
+
+    Args:
+        namespace (argparse.Namespace): Parsed arguments.
+
+    Raises:
+        TypeError: If there are no inputs, or one is not a file.
+
+    """
+    if not namespace.input_paths:
+        msg = "No input images found."
+        raise TypeError(msg)
+
+    for input_path in namespace.input_paths:
+        if not input_path.exists():
+            msg = f"Input path does not exist: {input_path}"
+            raise TypeError(msg)
+
+        if not input_path.is_file():
+            msg = "Input path should be a file."
+            raise TypeError(msg)
+
+
+def validate_iterations(namespace: argparse.Namespace) -> None:
+    """
+    Check that iterations are positive.
+
+    Args:
+        namespace (argparse.Namespace): Parsed arguments.
+
+    Raises:
+        TypeError: If they are not.
+
+    """
+    if namespace.iterations <= 0:
+        msg = f"Iterations must be greater or equal to 1: {namespace.iterations}"
+        raise TypeError(msg)
+
+
+def validate_extra(namespace: argparse.Namespace) -> None:
+    """
+    Check that extra is positive.
+
+    Args:
+        namespace (argparse.Namespace): Parsed arguments.
+
+    Raises:
+        TypeError: If it is not.
+
+    """
+    if namespace.extra <= 0:
+        msg = f"Extra must be greater or equal to 1: {namespace.extra}"
+        raise TypeError(msg)
+
+
+def validate_color(namespace: argparse.Namespace) -> None:
+    """
+    Check that color is not negative.
+
+    Args:
+        namespace (argparse.Namespace): Parsed arguments.
+
+    Raises:
+        TypeError: If it is.
+
+    """
+    if namespace.color < 0.0:
+        msg = f"Color enhancement must be greater or equal to 0.0: {namespace.color}"
+        raise TypeError(msg)
+
+
+def validate_jobs(namespace: argparse.Namespace) -> None:
+    """
+    Check that jobs are not negative.
+
+    Args:
+        namespace (argparse.Namespace): Parsed arguments.
+
+    Raises:
+        TypeError: If they are.
+
+    """
+    if namespace.jobs < 0:
+        msg = f"Jobs must be greater or equal to 0: {namespace.jobs}"
+        raise TypeError(msg)
+
+
+def validate_tile_size(namespace: argparse.Namespace) -> None:
+    """
+    Check tile size, if given.
+
+    Args:
+        namespace (argparse.Namespace): Parsed arguments.
+
+    Raises:
+        TypeError: If it is not positive, or given with converge.
+
+    """
+    if namespace.tile_size is None:
+        return
+
+    if namespace.tile_size <= 0:
+        msg = f"Tile size must be greater or equal to 1: {namespace.tile_size}"
+        raise TypeError(msg)
+
+    if namespace.converge:
+        msg = "Tile size cannot be combined with converge."
+        raise TypeError(msg)
+
+
+def validate_strip_memory(namespace: argparse.Namespace) -> None:
+    """
+    Check strip memory, if given.
+
+    Args:
+        namespace (argparse.Namespace): Parsed arguments.
+
+    Raises:
+        TypeError: If it is not positive, or given with what it cannot be.
+
+    """
+    if namespace.strip_memory is None:
+        return
+
+    if namespace.strip_memory <= 0:
+        msg = f"Strip memory must be greater or equal to 1: {namespace.strip_memory}"
+        raise TypeError(msg)
+
+    if namespace.converge or namespace.tile_size is not None:
+        msg = "Strip memory cannot be combined with converge or tile size."
+        raise TypeError(msg)
+
+
+def validate_max_memory(namespace: argparse.Namespace) -> None:
+    """
+    Check max memory, if given.
+
+    Args:
+        namespace (argparse.Namespace): Parsed arguments.
+
+    Raises:
+        TypeError: If it is not positive, or given without stack size.
+
+    """
+    if namespace.max_memory is None:
+        return
+
+    if namespace.max_memory <= 0:
+        msg = f"Max memory must be greater or equal to 1: {namespace.max_memory}"
+        raise TypeError(msg)
+
+    if namespace.stack_size is None:
+        msg = "Max memory only bounds stacks: use strip memory to crush in strips."
+        raise TypeError(msg)
+
+
+def validate_memory_budget(namespace: argparse.Namespace) -> None:
+    """
+    Check memory budget, if given.
+
+    Args:
+        namespace (argparse.Namespace): Parsed arguments.
+
+    Raises:
+        TypeError: If it is not positive, or given with stack size.
+
+    """
+    if namespace.memory_budget is None:
+        return
+
+    if namespace.memory_budget <= 0:
+        msg = f"Memory budget must be greater or equal to 1: {namespace.memory_budget}"
+        raise TypeError(msg)
+
+    if namespace.stack_size is not None:
+        msg = "Memory budget cannot be combined with stack size: use max memory."
+        raise TypeError(msg)
+
+
+def validate_report(namespace: argparse.Namespace) -> None:
+    """
+    Check that numpy is installed, if a report is asked for.
+
+    Args:
+        namespace (argparse.Namespace): Parsed arguments.
+
+    Raises:
+        TypeError: If it is not.
+
+    """
+    if namespace.report and importlib.util.find_spec("numpy") is None:
+        msg = "Report requires numpy: pip install 'pycrusher[numpy]'"
+        raise TypeError(msg)
+
+
+def validate_sweep(namespace: argparse.Namespace) -> None:
+    """
+    Check sweep and checkpoints, if given.
+
+    Args:
+        namespace (argparse.Namespace): Parsed arguments.
+
+    Raises:
+        TypeError: If checkpoints are not positive, a parameter is swept twice
+            or to invalid values, or they are given with what they cannot be.
+
+    """
+    if namespace.sweep is None and namespace.checkpoints is None:
+        return
+
+    if namespace.checkpoints is not None and namespace.checkpoints <= 0:
+        msg = f"Checkpoints must be greater or equal to 1: {namespace.checkpoints}"
+        raise TypeError(msg)
+
+    check_not_combined(
+        "Sweep",
+        {
+            "converge": namespace.converge,
+            "tile size": namespace.tile_size is not None,
+            "strip memory": namespace.strip_memory is not None,
+        },
+    )
+
+    names = [name for name, _ in namespace.sweep or []]
+    for name in names:
+        if names.count(name) > 1:
+            msg = f"Sweep sets {name} more than once."
+            raise TypeError(msg)
+
+    validators = {
+        "iterations": validate_iterations,
+        "extra": validate_extra,
+        "color": validate_color,
+    }
+    for name, values in namespace.sweep or []:
+        for value in values:
+            validators[name](argparse.Namespace(**{name: value}))
+
+
+def validate_engine(namespace: argparse.Namespace) -> None:
+    """
+    Check that the numpy engine can run, if chosen.
+
+    Args:
+        namespace (argparse.Namespace): Parsed arguments.
+
+    Raises:
+        TypeError: If numpy is not installed, or the engine is given with what
+            it cannot be.
+
+    """
+    if namespace.engine != ENGINE_NUMPY:
+        return
+
+    if importlib.util.find_spec("numpy") is None:
+        msg = "The numpy engine requires numpy: pip install 'pycrusher[numpy]'"
+        raise TypeError(msg)
+
+    check_not_combined(
+        "The numpy engine",
+        {
+            "converge": namespace.converge,
+            "tile size": namespace.tile_size is not None,
+            "strip memory": namespace.strip_memory is not None,
+            "sweep": namespace.sweep is not None,
+            "checkpoints": namespace.checkpoints is not None,
+        },
+    )
+
+
+def validate_stack_size(namespace: argparse.Namespace) -> None:
+    """
+    Check stack size, if given.
+
+    Args:
+        namespace (argparse.Namespace): Parsed arguments.
+
+    Raises:
+        TypeError: If it is not positive, or given without the numpy engine.
+
+    """
+    if namespace.stack_size is None:
+        return
+
+    if namespace.stack_size <= 0:
+        msg = f"Stack size must be greater or equal to 1: {namespace.stack_size}"
+        raise TypeError(msg)
+
+    if namespace.engine != ENGINE_NUMPY:
+        msg = "Stack size requires the numpy engine."
+        raise TypeError(msg)
+
+
+def validate_fused_color(namespace: argparse.Namespace) -> None:
+    """
+    Check fused color, if given, raising TypeError if it cannot be.
+
+    Args:
+        namespace (argparse.Namespace): Parsed arguments.
+
+    """
+    if not namespace.fused_color:
+        return
+
+    check_not_combined(
+        "Fused color",
+        {
+            "tile size": namespace.tile_size is not None,
+            "strip memory": namespace.strip_memory is not None,
+            "sweep": namespace.sweep is not None,
+            "checkpoints": namespace.checkpoints is not None,
+            "the numpy engine": namespace.engine != ENGINE_PILLOW,
+        },
+    )
+
+
+def validate_preview(namespace: argparse.Namespace) -> None:
+    """
+    Check preview width, if given.
+
+    Args:
+        namespace (argparse.Namespace): Parsed arguments.
+
+    Raises:
+        TypeError: If it is not positive, or given with what it cannot be.
+
+    """
+    if namespace.preview is None:
+        return
+
+    if namespace.preview <= 0:
+        msg = f"Preview width must be greater or equal to 1: {namespace.preview}"
+        raise TypeError(msg)
+
+    check_not_combined(
+        "Preview",
+        {
+            "tile size": namespace.tile_size is not None,
+            "strip memory": namespace.strip_memory is not None,
+            "sweep": namespace.sweep is not None,
+            "checkpoints": namespace.checkpoints is not None,
+            "the numpy engine": namespace.engine != ENGINE_PILLOW,
+        },
+    )
+
+
+def get_target(namespace: argparse.Namespace) -> Target | None:
+    """
+    Get the target the arguments give.
+
+    Args:
+        namespace (argparse.Namespace): Parsed arguments.
+
+    Returns:
+        Target, or None if none is given.
+
+    """
+    targets = [
+        Target(metric, value)
+        for metric, value in (
+            (METRIC_PSNR, namespace.target_psnr),
+            (METRIC_SSIM, namespace.target_ssim),
+            (METRIC_BYTES, namespace.target_bytes),
+        )
+        if value is not None
+    ]
+    return targets[0] if targets else None
+
+
+def validate_target(namespace: argparse.Namespace) -> None:
+    """
+    Check targets, if given.
+
+    Args:
+        namespace (argparse.Namespace): Parsed arguments.
+
+    Raises:
+        TypeError: If several are given, target bytes are not positive, target
+            SSIM lacks numpy, or a target is given with what it cannot be.
+
+    """
+    targets = [
+        value
+        for value in (
+            namespace.target_psnr,
+            namespace.target_ssim,
+            namespace.target_bytes,
+        )
+        if value is not None
+    ]
+    if not targets:
+        return
+
+    if len(targets) > 1:
+        msg = "Only one of target PSNR, target SSIM and target bytes can be given."
+        raise TypeError(msg)
+
+    if namespace.target_bytes is not None and namespace.target_bytes <= 0:
+        msg = f"Target bytes must be greater or equal to 1: {namespace.target_bytes}"
+        raise TypeError(msg)
+
+    if namespace.target_ssim is not None and importlib.util.find_spec("numpy") is None:
+        msg = "Target SSIM requires numpy: pip install 'pycrusher[numpy]'"
+        raise TypeError(msg)
+
+    if namespace.color != COLOR_DEFAULT and not namespace.preprocess:
+        msg = "Targets can only enhance color with preprocess."
+        raise TypeError(msg)
+
+    check_not_combined(
+        "Targets",
+        {
+            "converge": namespace.converge,
+            "fused color": namespace.fused_color,
+            "preview": namespace.preview is not None,
+            "tile size": namespace.tile_size is not None,
+            "strip memory": namespace.strip_memory is not None,
+            "sweep": namespace.sweep is not None,
+            "checkpoints": namespace.checkpoints is not None,
+            "the numpy engine": namespace.engine != ENGINE_PILLOW,
+        },
+    )
+
+
+def validate_resume(namespace: argparse.Namespace) -> None:
+    """
+    Check resume interval, and resume if asked for.
+
+    Args:
+        namespace (argparse.Namespace): Parsed arguments.
+
+    Raises:
+        TypeError: If the interval is negative, or resume is given with what
+            it cannot be.
+
+    """
+    if namespace.resume_interval < 0:
+        msg = (
+            "Resume interval must be greater or equal to 0: "
+            f"{namespace.resume_interval}"
+        )
+        raise TypeError(msg)
+
+    if not namespace.resume:
+        return
+
+    check_not_combined(
+        "Resume",
+        {
+            "preview": namespace.preview is not None,
+            "targets": get_target(namespace) is not None,
+            "tile size": namespace.tile_size is not None,
+            "strip memory": namespace.strip_memory is not None,
+            "sweep": namespace.sweep is not None,
+            "checkpoints": namespace.checkpoints is not None,
+            "the numpy engine": namespace.engine != ENGINE_PILLOW,
+        },
+    )
+
+
+def get_animation(namespace: argparse.Namespace) -> Animation | None:
+    """
+    Get the animation the arguments ask for.
+
+    Args:
+        namespace (argparse.Namespace): Parsed arguments.
+
+    Returns:
+        Animation, or None if not asked for.
+
+    """
+    if namespace.animate is None:
+        return None
+    return Animation(
+        namespace.animate,
+        every=namespace.animate_every,
+        width=namespace.animate_width,
+        duration=namespace.frame_duration,
+    )
+
+
+def validate_animate(
+    namespace: argparse.Namespace, input_paths: list[pathlib.Path]
+) -> None:
+    """
+    Check the options of animations, and the animation if asked for.
+
+    Args:
+        namespace (argparse.Namespace): Parsed arguments.
+        input_paths (list[pathlib.Path]): Expanded inputs.
+
+    Raises:
+        TypeError: If an option is not positive, there is not exactly one
+            input, WebP is unsupported, or the animation is given with what it
+            cannot be.
+
+    """
+    if namespace.animate_every <= 0:
+        msg = f"Animate every must be greater or equal to 1: {namespace.animate_every}"
+        raise TypeError(msg)
+
+    if namespace.animate_width is not None and namespace.animate_width <= 0:
+        msg = f"Animate width must be greater or equal to 1: {namespace.animate_width}"
+        raise TypeError(msg)
+
+    if namespace.frame_duration <= 0:
+        msg = (
+            f"Frame duration must be greater or equal to 1: {namespace.frame_duration}"
+        )
+        raise TypeError(msg)
+
+    if namespace.animate is None:
+        return
+
+    if len(input_paths) != 1:
+        msg = f"Animate requires a single input, got {len(input_paths)}"
+        raise TypeError(msg)
+
+    if namespace.animate.suffix.lower() == ".webp":
+        from PIL import features  # noqa: PLC0415
+
+        if not features.check("webp"):  # type: ignore[no-untyped-call]
+            msg = "Animate to .webp requires Pillow with WebP support."
+            raise TypeError(msg)
+
+    check_not_combined(
+        "Animate",
+        {
+            "converge": namespace.converge,
+            "preview": namespace.preview is not None,
+            "targets": get_target(namespace) is not None,
+            "resume": namespace.resume,
+            "tile size": namespace.tile_size is not None,
+            "strip memory": namespace.strip_memory is not None,
+            "sweep": namespace.sweep is not None,
+            "checkpoints": namespace.checkpoints is not None,
+            "the numpy engine": namespace.engine != ENGINE_PILLOW,
+        },
+    )
+
+
+def validate_cache_size(namespace: argparse.Namespace) -> None:
+    """
+    Check that cache size is not negative.
+
+    Args:
+        namespace (argparse.Namespace): Parsed arguments.
+
+    Raises:
+        TypeError: If it is.
+
+    """
+    if namespace.cache_size < 0:
+        msg = f"Cache size must be greater or equal to 0: {namespace.cache_size}"
+        raise TypeError(msg)
+
+
+def validate_output_paths(jobs: list[Job]) -> None:
+    """
+    Check that no two jobs write the same output, or crush the same input.
+
+    Args:
+        jobs (list[Job]): Planned jobs.
+
+    Raises:
+        TypeError: If two do.
+
+    """
+    try:
+        check_output_paths(jobs)
+        check_input_paths(jobs)
+    except ValueError as exc:
+        raise TypeError(str(exc)) from exc
+
+
+def get_jobs(
+    namespace: argparse.Namespace, input_paths: list[pathlib.Path]
+) -> list[Job]:
+    """
+    Plan the jobs the arguments ask for.
+
+    Args:
+        namespace (argparse.Namespace): Parsed arguments.
+        input_paths (list[pathlib.Path]): Expanded inputs.
+
+    Returns:
+        Inputs and outputs, with their own parameters when sweeping.
+
+    """
+    if namespace.sweep is not None or namespace.checkpoints is not None:
+        # Every variant gets its default name, so '-o' is always a directory.
+        base = Variant(
+            iterations=namespace.iterations,
+            extra=namespace.extra,
+            color=namespace.color,
+            reverse=namespace.reverse,
+            preprocess=namespace.preprocess,
+        )
+        variants = plan_variants(base, namespace.sweep or [], namespace.checkpoints)
+        return plan_sweep_jobs(input_paths, namespace.output_path, variants)
+
+    # A single input file keeps '-o' as the output filename;
+    # otherwise, '-o' is the directory every output goes to.
+    single_file = (
+        len(namespace.input_paths) == 1
+        and len(input_paths) == 1
+        and namespace.input_paths[0] == input_paths[0]
+    )
+    output_path = namespace.output_path
+    if single_file and output_path is not None and not output_path.is_dir():
+        return [Job(input_paths[0], output_path)]
+
+    return plan_jobs(input_paths, output_path, get_options(namespace))
+
+
+def validate_crush(
+    namespace: argparse.Namespace, input_paths: list[pathlib.Path]
+) -> None:
+    """
+    Check every argument of crushing, raising TypeError if one is invalid.
+
+    Args:
+        namespace (argparse.Namespace): Parsed arguments.
+        input_paths (list[pathlib.Path]): Expanded inputs.
+
+    """
+    validate_input_paths(argparse.Namespace(input_paths=input_paths))
+    validate_crush_options(namespace)
+    validate_memory_budget(namespace)
+    validate_sweep(namespace)
+    validate_stack_size(namespace)
+    validate_animate(namespace, input_paths)
+    validate_report(namespace)
+
+
+def validate_crush_options(namespace: argparse.Namespace) -> None:
+    """
+    Check the arguments of how each image is crushed, shared by every command.
+
+    Args:
+        namespace (argparse.Namespace): Parsed arguments.
+
+    """
+    validate_iterations(namespace)
+    validate_extra(namespace)
+    validate_color(namespace)
+    validate_jobs(namespace)
+    validate_tile_size(namespace)
+    validate_strip_memory(namespace)
+    validate_max_memory(namespace)
+    validate_engine(namespace)
+    validate_fused_color(namespace)
+    validate_preview(namespace)
+    validate_target(namespace)
+    validate_resume(namespace)
+    validate_cache_size(namespace)
+
+
+def cache_main(args: list[str]) -> None:
+    """
+    Show cache statistics, after pruning the cache if asked to.
+
+    Args:
+        args (list[str]): Command line arguments, after the command name.
+
+    """
+    parser = get_cache_argparser()
+
+    namespace = parser.parse_args(args)
+
+    validate_cache_size(namespace)
+
+    cache = Cache(directory=namespace.cache_dir, max_size=namespace.cache_size)
+
+    if namespace.action == "prune":
+        evicted = cache.prune()
+        print(f"Evicted {evicted} entries.")  # noqa: T201
+
+    stats = cache.stats()
+    lookups = stats.hits + stats.misses
+    hit_rate = stats.hits / lookups if lookups else 0.0
+    print(f"Directory: {cache.directory}")  # noqa: T201
+    print(f"Entries: {stats.entries}")  # noqa: T201
+    print(f"Size: {stats.size} / {stats.max_size} bytes")  # noqa: T201
+    print(f"Hits: {stats.hits}, misses: {stats.misses} ({hit_rate:.1%})")  # noqa: T201
+
+
+def validate_serve(namespace: argparse.Namespace) -> None:
+    """
+    Check the arguments of the serve command.
+
+    Args:
+        namespace (argparse.Namespace): Parsed arguments.
+
+    Raises:
+        TypeError: If an argument is invalid.
+
+    """
+    validate_jobs(namespace)
+
+    if namespace.queue_size < 0:
+        msg = f"Queue size must be greater or equal to 0: {namespace.queue_size}"
+        raise TypeError(msg)
+
+    if namespace.timeout <= 0:
+        msg = f"Timeout must be greater than 0: {namespace.timeout}"
+        raise TypeError(msg)
+
+    if namespace.read_timeout <= 0:
+        msg = f"Read timeout must be greater than 0: {namespace.read_timeout}"
+        raise TypeError(msg)
+
+    if namespace.max_steps <= 0:
+        msg = f"Max steps must be greater than 0: {namespace.max_steps}"
+        raise TypeError(msg)
+
+
+def serve_main(args: list[str]) -> None:
+    """
+    Serve crushes over HTTP until interrupted.
+
+    Args:
+        args (list[str]): Command line arguments, after the command name.
+
+    """
+    from .server import Limits, serve  # noqa: PLC0415
+
+    parser = get_serve_argparser()
+
+    namespace = parser.parse_args(args)
+
+    validate_serve(namespace)
+
+    serve(
+        host=namespace.host,
+        port=namespace.port,
+        max_workers=namespace.jobs or None,
+        limits=Limits(
+            queue_size=namespace.queue_size,
+            timeout=namespace.timeout,
+            read_timeout=namespace.read_timeout,
+            max_body_size=namespace.max_body_size,
+            max_steps=namespace.max_steps,
+        ),
+    )
+
+
+def validate_queue_add(namespace: argparse.Namespace) -> None:
+    """
+    Check that the arguments can be queued.
+
+    Args:
+        namespace (argparse.Namespace): Parsed arguments.
+
+    Raises:
+        TypeError: If they ask for what a worker cannot run.
+
+    """
+    if (
+        namespace.sweep is not None
+        or namespace.checkpoints is not None
+        or namespace.stack_size is not None
+        or namespace.animate is not None
+    ):
+        msg = "Sweep, checkpoints, stack size and animations cannot be queued."
+        raise TypeError(msg)
+
+
+def validate_queue_work(namespace: argparse.Namespace) -> None:
+    """
+    Check the arguments of the queue work command.
+
+    Args:
+        namespace (argparse.Namespace): Parsed arguments.
+
+    Raises:
+        TypeError: If an argument is invalid.
+
+    """
+    validate_jobs(namespace)
+    validate_cache_size(namespace)
+
+    if namespace.lease <= 0:
+        msg = f"Lease must be greater than 0: {namespace.lease}"
+        raise TypeError(msg)
+
+    if namespace.max_attempts <= 0:
+        msg = f"Max attempts must be greater or equal to 1: {namespace.max_attempts}"
+        raise TypeError(msg)
+
+    if namespace.backoff < 0:
+        msg = f"Backoff must be greater or equal to 0: {namespace.backoff}"
+        raise TypeError(msg)
+
+
+def validate_watch(namespace: argparse.Namespace) -> None:
+    """
+    Check the arguments of the watch command.
+
+    Args:
+        namespace (argparse.Namespace): Parsed arguments.
+
+    Raises:
+        TypeError: If an argument is invalid, or asks for what a watcher
+            cannot run.
+
+    """
+    for directory in namespace.input_paths:
+        if not directory.is_dir():
+            msg = f"Watched path should be a directory: {directory}"
+            raise TypeError(msg)
+
+    output_path = namespace.output_path
+    if output_path is not None and output_path.resolve() in {
+        directory.resolve() for directory in namespace.input_paths
+    }:
+        msg = f"Outputs cannot go to a watched directory: {output_path}"
+        raise TypeError(msg)
+
+    if (
+        namespace.sweep is not None
+        or namespace.checkpoints is not None
+        or namespace.stack_size is not None
+        or namespace.animate is not None
+    ):
+        msg = "Sweep, checkpoints, stack size and animations cannot be watched."
+        raise TypeError(msg)
+
+    if namespace.settle < 0:
+        msg = f"Settle must be greater or equal to 0: {namespace.settle}"
+        raise TypeError(msg)
+
+    if namespace.interval <= 0:
+        msg = f"Interval must be greater than 0: {namespace.interval}"
+        raise TypeError(msg)
+
+
+def get_run_parameters(namespace: argparse.Namespace) -> dict[str, Any]:
+    """
+    Get the fields of core.Options the arguments give, as JSON.
+
+    Args:
+        namespace (argparse.Namespace): Parsed arguments.
+
+    Returns:
+        Parameters, with targets as lists.
+
+    """
+    target = get_target(namespace)
+    return {
+        "iterations": namespace.iterations,
+        "extra": namespace.extra,
+        "color": namespace.color,
+        "reverse": namespace.reverse,
+        "preprocess": namespace.preprocess,
+        "converge": namespace.converge,
+        "fused_color": namespace.fused_color,
+        "preview": namespace.preview,
+        "target": None if target is None else list(target),
+        "resume_interval": namespace.resume_interval if namespace.resume else None,
+        "tile_size": namespace.tile_size,
+        "tile_workers": namespace.jobs or None,
+        "strip_memory": namespace.strip_memory,
+        "engine": namespace.engine,
+    }
+
+
+def get_options(namespace: argparse.Namespace) -> Options:
+    """
+    Get the options of core.run the arguments give.
+
+    Args:
+        namespace (argparse.Namespace): Parsed arguments.
+
+    Returns:
+        Options, without an overwrite policy, animation or cache, which only
+        some commands take.
+
+    """
+    return load_options(get_run_parameters(namespace))
+
+
+def queue_add_main(args: list[str]) -> None:
+    """
+    Add the jobs the arguments ask for to the queue.
+
+    Args:
+        args (list[str]): Command line arguments, after the command name.
+
+    """
+    from .jobqueue import JobQueue  # noqa: PLC0415
+
+    parser = get_queue_add_argparser()
+
+    namespace = parser.parse_args(args)
+
+    input_paths = expand_input_paths(namespace.input_paths)
+
+    validate_crush(namespace, input_paths)
+    validate_queue_add(namespace)
+
+    jobs = get_jobs(namespace, input_paths)
+    validate_output_paths(jobs)
+
+    # Workers may run elsewhere, and never ask before overwriting.
+    jobs = [
+        Job(job.input_path.resolve(), job.output_path.resolve())
+        for job in jobs
+        if should_write(job.output_path, namespace.overwrite)
+    ]
+    for output_directory in {job.output_path.parent for job in jobs}:
+        output_directory.mkdir(parents=True, exist_ok=True)
+
+    added = JobQueue(namespace.queue_path).add(jobs, get_run_parameters(namespace))
+    print(f"Queued {added} jobs ({len(jobs) - added} already queued).")  # noqa: T201
+
+
+def watch_main(args: list[str]) -> None:
+    """
+    Watch directories, crushing images as they change.
+
+    Args:
+        args (list[str]): Command line arguments, after the command name.
+
+    """
+    from .watch import (  # noqa: PLC0415
+        Inotify,
+        Manifest,
+        Settings,
+        Watcher,
+        is_inotify_supported,
+    )
+
+    parser = get_watch_argparser()
+
+    namespace = parser.parse_args(args)
+
+    validate_watch(namespace)
+    validate_crush_options(namespace)
+
+    directories = [directory.resolve() for directory in namespace.input_paths]
+    max_workers = namespace.jobs or os.cpu_count() or 1
+    if namespace.tile_size is not None or namespace.executor == EXECUTOR_SERIAL:
+        max_workers = 1
+
+    with contextlib.ExitStack() as stack:
+        executor: concurrent.futures.Executor | None = None
+        if max_workers > 1:
+            import concurrent.futures  # noqa: PLC0415
+
+            if namespace.executor == EXECUTOR_THREAD:
+                executor = stack.enter_context(
+                    concurrent.futures.ThreadPoolExecutor(
+                        max_workers, initializer=keep_buffers
+                    )
+                )
+            else:
+                executor = stack.enter_context(
+                    concurrent.futures.ProcessPoolExecutor(max_workers)
+                )
+
+        inotify = None
+        if not namespace.poll and not namespace.once and is_inotify_supported():
+            try:
+                inotify = Inotify(directories)
+            except OSError as exc:
+                print(  # noqa: T201
+                    f"Polling, as inotify is unavailable: {exc}", file=sys.stderr
+                )
+            else:
+                stack.callback(inotify.close)
+
+        watcher = Watcher(
+            directories,
+            Manifest(namespace.manifest_path),
+            parameters=get_run_parameters(namespace),
+            settings=Settings(
+                output_directory=namespace.output_path,
+                overwrite=namespace.overwrite == OVERWRITE_ALWAYS,
+                settle=namespace.settle,
+                max_workers=max_workers,
+                cache=get_cache(namespace),
+            ),
+            executor=executor,
+        )
+        if not namespace.once:
+            how = "inotify" if inotify else f"polling every {namespace.interval:g} s"
+            names = ", ".join(map(str, directories))
+            print(f"Watching {names} ({how})")  # noqa: T201
+            sys.stdout.flush()
+        with contextlib.suppress(KeyboardInterrupt):
+            watcher.run(
+                interval=namespace.interval, inotify=inotify, once=namespace.once
+            )
+
+    print(f"Crushed {watcher.crushed} images.")  # noqa: T201
+    if namespace.once and watcher.failures:
+        sys.exit(1)
+
+
+def queue_work_main(args: list[str]) -> None:
+    """
+    Run queued jobs until none are left.
+
+    Args:
+        args (list[str]): Command line arguments, after the command name.
+
+    """
+    from .jobqueue import JobQueue, Retries, work  # noqa: PLC0415
+
+    parser = get_queue_work_argparser()
+
+    namespace = parser.parse_args(args)
+
+    validate_queue_work(namespace)
+
+    task = functools.partial(
+        work,
+        JobQueue(namespace.queue_path),
+        lease=namespace.lease,
+        retries=Retries(namespace.max_attempts, namespace.backoff),
+        cache=get_cache(namespace),
+    )
+    max_workers = namespace.jobs or os.cpu_count() or 1
+    if max_workers == 1:
+        completed = task()
+    else:
+        import concurrent.futures  # noqa: PLC0415
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers) as executor:
+            futures = [executor.submit(task) for _ in range(max_workers)]
+            completed = sum(future.result() for future in futures)
+    print(f"Completed {completed} jobs.")  # noqa: T201
+
+    queue = JobQueue(namespace.queue_path)
+    report_queue(queue)
+    if queue.stats().failed:
+        sys.exit(1)
+
+
+def queue_status_main(args: list[str]) -> None:
+    """
+    Show how many jobs are in each state.
+
+    Args:
+        args (list[str]): Command line arguments, after the command name.
+
+    """
+    from .jobqueue import JobQueue  # noqa: PLC0415
+
+    parser = get_queue_status_argparser()
+
+    namespace = parser.parse_args(args)
+
+    report_queue(JobQueue(namespace.queue_path))
+
+
+def report_queue(queue: JobQueue) -> None:
+    """
+    Print the state of queue, and the jobs that failed.
+
+    Args:
+        queue (JobQueue): Queue to report.
+
+    """
+    stats = queue.stats()
+    print(  # noqa: T201
+        f"Pending: {stats.pending}, leased: {stats.leased}, "
+        f"done: {stats.done}, failed: {stats.failed}"
+    )
+    if stats.seconds_p50 is not None and stats.seconds_p95 is not None:
+        print(  # noqa: T201
+            f"Job time: p50 {stats.seconds_p50:.2f} s, p95 {stats.seconds_p95:.2f} s"
+        )
+    for input_path, error in queue.failures():
+        print(f"Failed to crush {input_path}: {error}", file=sys.stderr)  # noqa: T201
+
+
+QUEUE_COMMANDS = {
+    "add": queue_add_main,
+    "work": queue_work_main,
+    "status": queue_status_main,
+}
+
+
+def queue_main(args: list[str]) -> None:
+    """
+    Run the queue command the first argument names.
+
+    Args:
+        args (list[str]): Command line arguments, after the command name.
+
+    """
+    parser = get_queue_argparser()
+
+    namespace = parser.parse_args(args[:1])
+
+    QUEUE_COMMANDS[namespace.action](args[1:])
+
+
+def get_daemon_argparser() -> argparse.ArgumentParser:
+    """
+    Get the parser of the daemon command.
+
+    Returns:
+        Parser of 'pycrusher daemon'.
+
+    """
+    from .daemon import SOCKET_ENVIRONMENT_VARIABLE, get_socket_path  # noqa: PLC0415
+
+    parser = argparse.ArgumentParser(
+        prog=f"{PROGRAM} daemon",
+        description=(
+            f"Keep {PROGRAM} imported, and run the commands of this user in it, "
+            "so they start without importing anything."
+        ),
+    )
+    parser.add_argument(
+        "--socket",
+        dest="socket_path",
+        type=pathlib.Path,
+        help=(
+            f"Where to listen, also read from ${SOCKET_ENVIRONMENT_VARIABLE} "
+            "by commands (default: %(default)s)"
+        ),
+        default=get_socket_path(),
+        metavar="PATH",
+    )
+    return parser
+
+
+def warm_up() -> None:
+    """Import what commands import when they run, once for every command."""
+    from importlib_metadata import version  # noqa: PLC0415
+    from PIL import Image, ImageEnhance  # noqa: F401, PLC0415
+
+    from . import (  # noqa: F401, PLC0415
+        animate,
+        jobqueue,
+        preview,
+        resume,
+        targets,
+        tiles,
+    )
+
+    Image.init()
+    version(PROGRAM)
+    if importlib.util.find_spec("numpy") is not None:
+        from . import dct, stack  # noqa: F401, PLC0415
+    get_argparser()
+
+
+def daemon_main(args: list[str]) -> None:
+    """
+    Run a daemon until interrupted.
+
+    Args:
+        args (list[str]): Command line arguments, after the command name.
+
+    Raises:
+        TypeError: If this platform cannot run a daemon.
+
+    """
+    from .daemon import is_supported, serve_daemon  # noqa: PLC0415
+
+    parser = get_daemon_argparser()
+
+    namespace = parser.parse_args(args)
+
+    if not is_supported():
+        msg = "The daemon needs Unix sockets and fork."
+        raise TypeError(msg)
+
+    warm_up()
+
+    print(f"Listening on {namespace.socket_path}")  # noqa: T201
+    sys.stdout.flush()
+    serve_daemon(namespace.socket_path, main)
+
+
+COMMANDS = {
+    "cache": cache_main,
+    "serve": serve_main,
+    "queue": queue_main,
+    "daemon": daemon_main,
+    "watch": watch_main,
+}
+
+
+def report_profile(summary: SummarySink, profile: ProfileSink) -> None:
+    """
+    Print the summary and stage profile of a batch.
+
+    Args:
+        summary (SummarySink): Totals of every step.
+        profile (ProfileSink): Time taken by every stage.
+
+    """
+    stats = summary.summary()
+    print(  # noqa: T201
+        f"Crushed {stats['images']} images: {stats['steps']} steps "
+        f"({stats['skipped']} skipped), {stats['total_bytes']} bytes encoded",
+        file=sys.stderr,
+    )
+    if stats["steps"]:
+        print(  # noqa: T201
+            f"Step time: p50 {stats['step_p50'] * 1000:.2f} ms, "
+            f"p95 {stats['step_p95'] * 1000:.2f} ms",
+            file=sys.stderr,
+        )
+    print(profile.report(), file=sys.stderr)  # noqa: T201
+
+
+def report_targets(targets: TargetSink) -> None:
+    """
+    Print how each crush towards a target went.
+
+    Args:
+        targets (TargetSink): Results of every input.
+
+    """
+    for name, result in targets.results.items():
+        target = result.target
+        outcome = "reached" if result.reached else "not reached"
+        print(  # noqa: T201
+            f"{name}: {target.metric} {target.value:g} {outcome}, "
+            f"{result.value:g} at step {result.steps} of {result.total} "
+            f"(quality {result.quality})"
+        )
+
+
+def report_quality(
+    jobs: list[Job], failures: dict[pathlib.Path, BaseException]
+) -> None:
+    """
+    Print how much each output differs from its input.
+
+    Args:
+        jobs (list[Job]): Crushed jobs.
+        failures (dict[pathlib.Path, BaseException]): Inputs that failed,
+            which are skipped.
+
+    """
+    from PIL import Image  # noqa: PLC0415
+
+    from .metrics import compare  # noqa: PLC0415
+
+    for job in jobs:
+        if job.input_path in failures or not job.output_path.exists():
+            continue
+        with Image.open(job.input_path) as reference, Image.open(
+            job.output_path
+        ) as img:
+            report = compare(reference, img)
+        print(  # noqa: T201
+            f"{job.output_path}: PSNR {report.psnr:.2f} dB, SSIM {report.ssim:.4f}"
+        )
+        for channel in report.channels:
+            print(  # noqa: T201
+                f"  {channel.channel}: mean {channel.mean_absolute:.2f}, "
+                f"RMS {channel.root_mean_square:.2f}, max {channel.max_absolute}"
+            )
+
+
+def forward_to_daemon(args: list[str]) -> None:
+    """
+    Exit with the status of args run in a daemon, if one was asked for.
+
+    Args:
+        args (list[str]): Command line arguments of this process.
+
+    """
+    from .daemon import forward_command  # noqa: PLC0415
+
+    status = forward_command(args)
+    if status is not None:
+        sys.exit(status)
+
+
+def main(args: list[str] | None = None) -> None:
+    """
+    Run the command line.
+
+    Args:
+        args (list[str] | None): Command line arguments, or None for those of
+            this process, which are sent to a daemon if one was asked for.
+
+    """
+    if args is None:
+        args = sys.argv[1:]
+        forward_to_daemon(args)
+    if args and args[0] in COMMANDS:
+        COMMANDS[args[0]](args[1:])
+        return
+
+    parser = get_argparser()
+
+    namespace = parser.parse_args(args)
+
+    input_paths = expand_input_paths(namespace.input_paths)
+
+    validate_crush(namespace, input_paths)
+
+    jobs = get_jobs(namespace, input_paths)
+    validate_output_paths(jobs)
+
+    from .preflight import preflight  # noqa: PLC0415
+
+    # Unreadable inputs are reported before anything is crushed.
+    headers, rejected = preflight(input_paths)
+    report_failures(rejected)
+    jobs = [job for job in jobs if job.input_path not in rejected]
+
+    sinks: list[Sink] = []
+    summary = SummarySink()
+    profile = ProfileSink()
+    if namespace.profile:
+        sinks.extend((summary, profile))
+    target = get_target(namespace)
+    targets = TargetSink()
+    if target is not None:
+        sinks.append(targets)
+
+    with contextlib.ExitStack() as stack:
+        if namespace.log_steps is not None:
+            if str(namespace.log_steps) == "-":
+                stream = sys.stdout
+                # Keep stdout for JSON lines, and print the rest to stderr.
+                stack.enter_context(contextlib.redirect_stdout(sys.stderr))
+            else:
+                stream = stack.enter_context(namespace.log_steps.open("w"))
+            sinks.append(JSONLinesSink(stream))
+
+        failures = run_batch(
+            jobs,
+            options=get_options(namespace)._replace(
+                overwrite=namespace.overwrite,
+                animation=get_animation(namespace),
+                cache=get_cache(namespace),
+            ),
+            schedule=Schedule(
+                max_workers=namespace.jobs,
+                executor=namespace.executor,
+                memory_budget=namespace.memory_budget,
+                headers=headers,
+                stack_size=namespace.stack_size,
+                max_memory=namespace.max_memory,
+            ),
+            progress=not namespace.quiet,
+            sink=MultiSink(sinks) if sinks else None,
+        )
+
+        if namespace.profile:
+            report_profile(summary, profile)
+        report_targets(targets)
+        if namespace.report:
+            report_quality(jobs, failures)
+
+        report_failures(failures)
+        if failures or rejected:
+            sys.exit(1)
+
+        print("Done!")  # noqa: T201
@@ -1,53 +1,651 @@
+"""Compress images as JPEG over and over, lowering the quality each time."""
+
 from __future__ import annotations
 
+import contextlib
+import hashlib
 import io
+import os
 import pathlib
+import secrets
+import threading
+import time
+from typing import TYPE_CHECKING, Any, BinaryIO, NamedTuple
 
-import tqdm
-from PIL import Image, ImageEnhance
+from .hooks import Sink, get_timing, make_sink
 
-CWD_COMPRESSIONS_DIRECTORY = pathlib.Path.cwd().joinpath("compressions")
+if TYPE_CHECKING:
+    from collections.abc import Generator, Iterable
 
+    from PIL import Image
 
-def generate_default_output_name(
-    input_path: pathlib.Path,
-    *,
-    iterations: int,
-    extra: int,
-    color: float,
-    reverse: bool,
-    preprocess: bool,
-) -> str:
+    from .animate import Animation
+    from .cache import Cache
+    from .targets import Target, TargetResult
+
+COMPRESSIONS_DIRECTORY_NAME = "compressions"
+
+ITERATIONS_DEFAULT = 50
+EXTRA_DEFAULT = 1
+COLOR_DEFAULT = 1.0
+
+OVERWRITE_ASK = "ask"
+OVERWRITE_ALWAYS = "always"
+OVERWRITE_NEVER = "never"
+OVERWRITE_POLICIES = (OVERWRITE_ASK, OVERWRITE_ALWAYS, OVERWRITE_NEVER)
+
+ENGINE_PILLOW = "pillow"
+ENGINE_NUMPY = "numpy"
+ENGINES = (ENGINE_PILLOW, ENGINE_NUMPY)
+
+# Step buffers of finished crushes, in threads that keep them.
+REUSED_BUFFERS = threading.local()
+
+
+def get_compressions_directory() -> pathlib.Path:
+    """
+    Get where outputs go by default.
+
+    Returns:
+        The 'compressions' directory in the current working directory, as it
+        is now: a daemon changes directory for every call it runs.
+
+    """
+    return pathlib.Path.cwd().joinpath(COMPRESSIONS_DIRECTORY_NAME)
+
+
+class Options(NamedTuple):
+    """
+    Parameters of a crush, with their defaults.
+
+    Names are those of the JSON parameters kept by job queues and watch
+    manifests, so they load with load_options.
+    """
+
+    # How many times to iterate compression.
+    iterations: int = ITERATIONS_DEFAULT
+    # How much to enforce compression: the qualities are repeated this often.
+    extra: int = EXTRA_DEFAULT
+    # Color enhancement factor.
+    color: float = COLOR_DEFAULT
+    # Go up in quality instead of down.
+    reverse: bool = False
+    # Enhance color at the first step instead of the last.
+    preprocess: bool = False
+    # Skip steps once the JPEG stream repeats itself.
+    converge: bool = False
+    # Enhance color in YCbCr with enhance_color, unless preprocess. Only whole
+    # images crushed with the pillow engine use it.
+    fused_color: bool = False
+    # One of ENGINES. The numpy engine simulates every step but the last in
+    # the DCT domain, and ignores converge and tiles.
+    engine: str = ENGINE_PILLOW
+    # Crush a preview at most this many pixels wide, if given, with the pillow
+    # engine and without tiles or strips.
+    preview: int | None = None
+    # Stop at the first step reaching target, if given, with the pillow engine
+    # and without tiles or strips.
+    target: Target | None = None
+    # Save progress next to the output every this many seconds, and resume
+    # from progress saved there by an interrupted run, if given, with the
+    # pillow engine and without tiles or strips.
+    resume_interval: float | None = None
+    # Stream sampled steps into an animation or numbered frames, if given,
+    # with the pillow engine and without tiles or strips.
+    animation: Animation | None = None
+    # Crush tiles of this side in parallel, if given.
+    tile_size: int | None = None
+    # Number of processes crushing tiles, or None for one per CPU.
+    tile_workers: int | None = None
+    # Crush in strips, keeping image data within this many bytes, if given.
+    # The decoded image is kept whole, so it must fit.
+    strip_memory: int | None = None
+    # What to do if an output exists, one of OVERWRITE_POLICIES.
+    overwrite: str = OVERWRITE_ASK
+    # Reuse and store results in this cache, if given.
+    cache: Cache | None = None
+
+
+def load_options(parameters: dict[str, Any]) -> Options:
+    """
+    Load options from JSON parameters.
+
+    Args:
+        parameters (dict[str, Any]): Fields of Options, with targets as lists.
+
+    Returns:
+        Options, with a Target if one is given.
+
+    """
+    if parameters.get("target") is not None:
+        from .targets import Target  # noqa: PLC0415
+
+        parameters = {**parameters, "target": Target(*parameters["target"])}
+    return Options(**parameters)
+
+
+def get_modes(options: Options) -> list[str]:
+    """
+    Get the ways of crushing options ask for, besides crushing the whole image.
+
+    Args:
+        options (Options): Parameters of the crush.
+
+    Returns:
+        Names of the options asking for each, in the order run checks them.
+
+    """
+    return [
+        name
+        for name, given in (
+            ("strip_memory", options.strip_memory is not None),
+            ("preview", options.preview is not None),
+            ("target", options.target is not None),
+            ("the numpy engine", options.engine == ENGINE_NUMPY),
+            ("resume_interval", options.resume_interval is not None),
+            ("animation", options.animation is not None),
+            ("tile_size", options.tile_size is not None),
+        )
+        if given
+    ]
+
+
+def generate_default_output_name(input_path: pathlib.Path, options: Options) -> str:
     """
     Generate default output name based on pycrusher parameters.
 
     Args:
         input_path (pathlib.Path): Input given by parse_args.
-        iterations (int): How many times to iterate compression.
-        extra (int): How much to enforce compression.
-        color (float): Color saturation.
-        reverse (bool): Reverse qualities.
-        preprocess (bool): Preprocess color.
+        options (Options): Parameters of the crush. Those changing the result
+            besides the engine and fused color are named.
 
     Returns:
         Default output name based on pycrusher parameters.
 
     """
-    output_suffixes = [f"i{iterations}", f"e{extra}"]
-    if reverse:
+    output_suffixes = [f"i{options.iterations}", f"e{options.extra}"]
+    if options.reverse:
         output_suffixes.append("rev")
-    if preprocess:
+    if options.preprocess:
         output_suffixes.append("pre")
-    if color != 1.0:
-        output_suffixes.append(f"c{color}")
+    if options.color != 1.0:
+        output_suffixes.append(f"c{options.color}")
+    if options.preview is not None:
+        output_suffixes.append(f"w{options.preview}")
+    if options.target is not None:
+        output_suffixes.append(f"{options.target.metric}{options.target.value:g}")
 
     joined_suffixes = "_".join(output_suffixes)
     return f"{input_path.stem}_{joined_suffixes}.jpg"
 
 
+class Step(NamedTuple):
+    """One compression of a crush, and how long it took."""
+
+    position: int
+    quality: int
+    buffer: io.BytesIO
+    size: int
+    decode_seconds: float = 0.0
+    color_seconds: float = 0.0
+    encode_seconds: float = 0.0
+
+
+def smallest_period(qualities: list[int]) -> int:
+    """
+    Find the smallest p such that qualities[i] == qualities[i + p] for all i.
+
+    Args:
+        qualities (list[int]): List of JPEG qualities.
+
+    Returns:
+        Smallest period of qualities, or its length if it has none.
+
+    """
+    # Knuth-Morris-Pratt failure function: the longest proper prefix
+    # that is also a suffix gives the smallest period.
+    border = [0] * len(qualities)
+    for i in range(1, len(qualities)):
+        k = border[i - 1]
+        while k and qualities[i] != qualities[k]:
+            k = border[k - 1]
+        if qualities[i] == qualities[k]:
+            k += 1
+        border[i] = k
+    return len(qualities) - (border[-1] if border else 0)
+
+
+def keep_buffers() -> None:
+    """
+    Make crushes in this thread reuse the step buffers of finished ones.
+
+    Buffers are never truncated, so a thread crushing one image after
+    another stops growing new ones. Crushes running side by side, as sweeps
+    do, each take buffers of their own. Steps of a finished crush must not be
+    read once the next one starts.
+    """
+    REUSED_BUFFERS.pool = []
+
+
+def drop_buffers() -> None:
+    """Free the buffers kept by keep_buffers, and stop keeping them."""
+    vars(REUSED_BUFFERS).pop("pool", None)
+
+
+@contextlib.contextmanager
+def reusing_buffers() -> Generator[None, None, None]:
+    """
+    Keep step buffers in this thread while the context is active.
+
+    Yields:
+        Nothing.
+
+    """
+    keep_buffers()
+    try:
+        yield
+    finally:
+        drop_buffers()
+
+
+class Compressor:
+    """
+    Compress an image as JPEG, then each JPEG it gives in turn.
+
+    Encoded images ping-pong between two buffers that are never truncated,
+    so they keep their allocation across steps, and across crushes in threads
+    that keep_buffers. After the first step, each JPEG is decoded straight
+    into the same image object.
+    """
+
+    def __init__(
+        self,
+        image_buffer: io.BytesIO | Image.Image,
+        opened: contextlib.ExitStack,
+        *,
+        start: int = 0,
+    ) -> None:
+        """
+        Open the image to compress.
+
+        Args:
+            image_buffer (io.BytesIO | Image.Image): Buffer containing image
+                file, or an image.
+            opened (contextlib.ExitStack): Gives the buffers back and closes
+                the images once closed.
+            start (int): Position of the first step. After 0, image_buffer
+                must be the buffer of the JPEG of the step before, which is
+                decoded as if this had compressed it.
+
+        """
+        self.buffers = borrow_buffers(opened)
+        self.input_img = self.img = open_input(image_buffer, opened)
+        self.decoder_args: tuple[str, ...] | None = None
+        self.current: io.BytesIO | None = None
+        if start and isinstance(image_buffer, io.BytesIO):
+            self.current = image_buffer
+        self.size = self.current.seek(0, io.SEEK_END) if self.current else 0
+        opened.callback(self.close)
+
+    def close(self) -> None:
+        """Close the image decoded last, unless it is the input."""
+        if self.img is not self.input_img:
+            self.img.close()
+
+    def compress(
+        self,
+        position: int,
+        quality: int,
+        *,
+        color: float = 1.0,
+        fused_color: bool = False,
+    ) -> Step:
+        """
+        Decode the last JPEG, enhance its color and encode it again.
+
+        Args:
+            position (int): Position of the step.
+            quality (int): JPEG quality.
+            color (float): Color enhancement factor.
+            fused_color (bool): Enhance color with enhance_color, on the
+                previous JPEG decoded straight to YCbCr, instead of
+                ImageEnhance.Color. Color enhanced at the first step still
+                uses ImageEnhance.Color, since the input would need
+                converting anyway.
+
+        Returns:
+            The step, with the time spent decoding, enhancing color and
+            encoding. Its buffer is reused two steps later.
+
+        """
+        # PIL is imported by what crushes, so the CLI starts without it.
+        from PIL import ImageEnhance  # noqa: PLC0415
+
+        enhanced = color != 1.0
+        fused = enhanced and fused_color and self.current is not None
+        started = time.perf_counter()
+        if self.current is None:
+            self.img.load()
+        elif fused:
+            # Skip converting to RGB and back: the encoder takes YCbCr.
+            ycbcr_img = open_jpeg(self.current, self.size)
+            ycbcr_img.draft("YCbCr", ycbcr_img.size)
+            ycbcr_img.load()
+        else:
+            self.img, self.decoder_args = decode_into(
+                self.img, self.current, self.size, self.decoder_args
+            )
+        decoded = time.perf_counter()
+
+        encoded_img = self.img
+        if fused:
+            with ycbcr_img:
+                encoded_img = enhance_color(ycbcr_img, color)
+        elif enhanced:
+            encoded_img = ImageEnhance.Color(self.img).enhance(color)
+        colored = time.perf_counter()
+
+        buffers = self.buffers
+        self.current = buffers[1] if self.current is buffers[0] else buffers[0]
+        self.current.seek(0)
+        try:
+            encoded_img.save(
+                self.current,
+                format="JPEG",
+                quality=quality,
+            )
+        finally:
+            if encoded_img is not self.img:
+                encoded_img.close()
+        self.size = self.current.tell()
+        encoded = time.perf_counter()
+
+        return Step(
+            position,
+            quality,
+            self.current,
+            self.size,
+            decoded - started,
+            colored - decoded,
+            encoded - colored,
+        )
+
+
+def iterate_compressions(
+    image_buffer: io.BytesIO | Image.Image,
+    qualities: list[int],
+    *,
+    color_index: int | None = None,
+    options: Options | None = None,
+    start: int = 0,
+) -> Generator[Step, None, None]:
+    """
+    Save image repeatedly as JPEG for each quality in qualities.
+
+    With converge, every JPEG is hashed. Once the same JPEG shows up again
+    at the same position of the quality cycle, every following step would
+    repeat, so whole cycles are skipped without changing the result.
+
+    Args:
+        image_buffer (io.BytesIO | Image.Image): Buffer containing image file,
+            or an image.
+        qualities (list[int]): List of JPEG qualities.
+        color_index (int | None): Step at which color is enhanced, if any.
+        options (Options | None): Parameters of the crush, or None for the
+            defaults. Only color, converge and fused_color are used.
+        start (int): Position of the first step to compute. After 0,
+            image_buffer must be the buffer of the JPEG of the step before,
+            which is decoded as if this had computed it.
+
+    Yields:
+        Each step that was computed, as Compressor.compress returns it.
+
+    """
+    options = Options() if options is None else options
+    period = smallest_period(qualities)
+    seen: dict[tuple[int, bytes], int] = {}
+
+    with contextlib.ExitStack() as opened:
+        compressor = Compressor(image_buffer, opened, start=start)
+        index = start
+        while index < len(qualities):
+            step = compressor.compress(
+                index,
+                qualities[index],
+                color=options.color if index == color_index else 1.0,
+                fused_color=options.fused_color,
+            )
+            yield step
+
+            if options.converge:
+                index = skip_cycles(
+                    seen,
+                    step,
+                    period=period,
+                    color_index=color_index,
+                    total=len(qualities),
+                )
+
+            index += 1
+
+
+def borrow_buffers(opened: contextlib.ExitStack) -> tuple[io.BytesIO, io.BytesIO]:
+    """
+    Take two buffers from the pool of this thread, if it keeps buffers.
+
+    Args:
+        opened (contextlib.ExitStack): Gives the buffers back to the pool once
+            closed.
+
+    Returns:
+        Two buffers, new if the pool is empty.
+
+    """
+    pool: list[tuple[io.BytesIO, io.BytesIO]] | None = getattr(
+        REUSED_BUFFERS, "pool", None
+    )
+    buffers = pool.pop() if pool else (io.BytesIO(), io.BytesIO())
+    if pool is not None:
+        opened.callback(pool.append, buffers)
+    return buffers
+
+
+def open_input(
+    image_buffer: io.BytesIO | Image.Image, opened: contextlib.ExitStack
+) -> Image.Image:
+    """
+    Open the input of iterate_compressions.
+
+    Args:
+        image_buffer (io.BytesIO | Image.Image): Buffer containing image file,
+            or an image.
+        opened (contextlib.ExitStack): Closes the image once done, if this
+            opened it. Left as a with block would, which keeps image_buffer
+            open.
+
+    Returns:
+        Image, not loaded yet if opened from image_buffer.
+
+    """
+    from PIL import Image  # noqa: PLC0415
+
+    if isinstance(image_buffer, Image.Image):
+        return image_buffer
+    return opened.enter_context(Image.open(image_buffer))
+
+
+def open_jpeg(buffer: io.BytesIO, size: int) -> Image.Image:
+    """
+    Open the JPEG in the first size bytes of buffer.
+
+    Args:
+        buffer (io.BytesIO): Buffer written by iterate_compressions.
+        size (int): Size of the JPEG in buffer.
+
+    Returns:
+        Image, not loaded yet.
+
+    """
+    from PIL import Image  # noqa: PLC0415
+
+    with buffer.getbuffer() as view, view[:size] as data:
+        return Image.open(io.BytesIO(data))
+
+
+def decode_into(
+    img: Image.Image,
+    buffer: io.BytesIO,
+    size: int,
+    decoder_args: tuple[str, ...] | None,
+) -> tuple[Image.Image, tuple[str, ...]]:
+    """
+    Decode the JPEG in the first size bytes of buffer.
+
+    Args:
+        img (Image.Image): Image decoded at the previous step.
+        buffer (io.BytesIO): Buffer written by iterate_compressions.
+        size (int): Size of the JPEG in buffer.
+        decoder_args (tuple[str, ...] | None): Returned by the previous call,
+            or None at the first.
+
+    Returns:
+        Decoded image, which is img after the first call, and the arguments
+        of its decoder.
+
+    """
+    if decoder_args is None:
+        # Parse the header of our own JPEG once...
+        jpeg_img = open_jpeg(buffer, size)
+        decoder_args = tuple(jpeg_img.tile[0][3])  # type: ignore[attr-defined]
+        jpeg_img.load()
+        return jpeg_img, decoder_args
+    # ...then decode every later JPEG into the same image memory.
+    with buffer.getbuffer() as view, view[:size] as data:
+        img.frombytes(data, "jpeg", *decoder_args)  # type: ignore[arg-type]
+    return img, decoder_args
+
+
+def skip_cycles(
+    seen: dict[tuple[int, bytes], int],
+    step: Step,
+    *,
+    period: int,
+    color_index: int | None,
+    total: int,
+) -> int:
+    """
+    Record the JPEG of a step, and skip the cycles of steps it would repeat.
+
+    Args:
+        seen (dict[tuple[int, bytes], int]): First position of each JPEG, by
+            position in the quality cycle and hash. Updated.
+        step (Step): Step just computed.
+        period (int): Length of the quality cycle.
+        color_index (int | None): Step at which color is enhanced, if any,
+            which is never skipped.
+        total (int): Number of qualities.
+
+    Returns:
+        Position of the last skipped step, or that of step if none is.
+
+    """
+    index = step.position
+    with step.buffer.getbuffer() as view, view[: step.size] as data:
+        digest = hashlib.blake2b(data, digest_size=16).digest()
+    first_index = seen.setdefault((index % period, digest), index)
+    if first_index == index:
+        return index
+    # Steps past color enhancement are not repeats of those before it.
+    stop = color_index if color_index is not None and color_index > index else total
+    cycle = index - first_index
+    return index + (stop - 1 - index) // cycle * cycle
+
+
+def write_last_step(
+    image_buffer: io.BytesIO,
+    steps: Iterable[Step],
+    *,
+    total: int,
+    progress: bool = True,
+    sink: Sink | None = None,
+) -> int:
+    """
+    Exhaust steps and copy the last JPEG into image_buffer.
+
+    Args:
+        image_buffer (io.BytesIO): Buffer receiving the last JPEG.
+        steps (Iterable[Step]): Result of iterate_compressions.
+        total (int): Number of qualities given to iterate_compressions.
+        progress (bool): Show a progress bar.
+        sink (Sink | None): Receives the timing of every step, if given.
+
+    Returns:
+        Number of skipped steps.
+
+    """
+    computed = 0
+    last_step = None
+    sink = make_sink(sink, progress=progress)
+    if sink is None:
+        for step in steps:
+            computed += 1
+            last_step = step
+    else:
+        sink.start(total)
+        for last_step in steps:
+            computed += 1
+            sink.step(get_timing(last_step))
+        sink.finish(total - computed)
+
+    if last_step is not None:
+        image_buffer.seek(0)
+        image_buffer.truncate()
+        with last_step.buffer.getbuffer() as view, view[: last_step.size] as data:
+            image_buffer.write(data)
+
+    return total - computed
+
+
+def crush(
+    image_buffer: io.BytesIO,
+    qualities: list[int],
+    *,
+    options: Options | None = None,
+    progress: bool = True,
+    sink: Sink | None = None,
+) -> int:
+    """
+    Compress image for each quality in qualities, enhancing its color once.
+
+    Args:
+        image_buffer (io.BytesIO): Buffer containing image file.
+        qualities (list[int]): List of JPEG qualities.
+        options (Options | None): Parameters of the crush, or None for the
+            defaults. Only color, preprocess, converge and fused_color are
+            used.
+        progress (bool): Show a progress bar.
+        sink (Sink | None): Receives the timing of every step, if given.
+
+    Returns:
+        Number of skipped steps.
+
+    """
+    options = Options() if options is None else options
+    color_index = 0 if options.preprocess else len(qualities) - 1
+    steps = iterate_compressions(
+        image_buffer, qualities, color_index=color_index, options=options
+    )
+    return write_last_step(
+        image_buffer, steps, total=len(qualities), progress=progress, sink=sink
+    )
+
+
 def compress(
     image_buffer: io.BytesIO,
     qualities: list[int],
+    *,
+    progress: bool = True,
+    sink: Sink | None = None,
 ) -> None:
     """
     Save file repeatedly as JPEG for each quality in qualities.
@@ -55,20 +653,45 @@ def compress(
     Args:
         image_buffer (io.BytesIO): Buffer containing image file.
         qualities (list[int]): List of JPEG qualities.
+        progress (bool): Show a progress bar.
+        sink (Sink | None): Receives the timing of every step, if given.
 
     """
-    for quality in tqdm.tqdm(qualities):
-        with Image.open(image_buffer) as img:
-            img.load()
+    steps = iterate_compressions(image_buffer, qualities)
+    write_last_step(
+        image_buffer, steps, total=len(qualities), progress=progress, sink=sink
+    )
 
-            image_buffer.seek(0)
-            image_buffer.truncate()
 
-            img.save(
-                image_buffer,
-                format="JPEG",
-                quality=quality,
-            )
+def enhance_color(img: Image.Image, color: float) -> Image.Image:
+    """
+    Enhance color by scaling chroma around neutral gray, in YCbCr.
+
+    ImageEnhance.Color blends img with its grayscale copy in RGB, which keeps
+    luma and scales chroma, so both only differ in rounding and in how they
+    clip saturated colors. Grayscale images are returned as they are.
+
+    Args:
+        img (Image.Image): RGB, YCbCr or grayscale image. Other modes go
+            through ImageEnhance.Color.
+        color (float): Color enhancement factor.
+
+    Returns:
+        YCbCr image, ready for the JPEG encoder.
+
+    """
+    if img.mode == "L":
+        return img
+    if img.mode not in {"RGB", "YCbCr"}:
+        from PIL import ImageEnhance  # noqa: PLC0415
+
+        return ImageEnhance.Color(img).enhance(color)
+    if img.mode == "RGB":
+        img = img.convert("YCbCr")
+    chroma = [
+        min(max(round(128 + color * (value - 128)), 0), 255) for value in range(256)
+    ]
+    return img.point([*range(256), *chroma, *chroma])
 
 
 def change_color(
@@ -85,18 +708,10 @@ def change_color(
         quality (int): JPEG quality
 
     """
-    with Image.open(image_buffer) as img:
-        converter = ImageEnhance.Color(img)
-        enhanced_img = converter.enhance(color)
-
-        image_buffer.seek(0)
-        image_buffer.truncate()
-
-        enhanced_img.save(
-            image_buffer,
-            format="JPEG",
-            quality=quality,
-        )
+    steps = iterate_compressions(
+        image_buffer, [quality], color_index=0, options=Options(color=color)
+    )
+    write_last_step(image_buffer, steps, total=1, progress=False)
 
 
 def generate_quality_sequence(
@@ -149,44 +764,293 @@ def confirm(title: str, question: str) -> bool:
             return True
 
 
+def should_write(output_path: pathlib.Path, overwrite: str) -> bool:
+    """
+    Decide whether output_path may be written under an overwrite policy.
+
+    Args:
+        output_path (pathlib.Path): Path about to be written.
+        overwrite (str): One of OVERWRITE_POLICIES.
+
+    Returns:
+        Whether output_path may be written.
+
+    """
+    if not output_path.exists() or overwrite == OVERWRITE_ALWAYS:
+        return True
+    if overwrite == OVERWRITE_NEVER:
+        return False
+    return confirm(
+        title=f"File already exists: {output_path}",
+        question="Do you want to overwrite it?",
+    )
+
+
+@contextlib.contextmanager
+def open_atomically(path: pathlib.Path) -> Generator[BinaryIO, None, None]:
+    """
+    Open a file that replaces path once closed, so path is never partial.
+
+    The file is written next to path, under a hidden temporary name, and is
+    removed instead if the block raises.
+
+    Args:
+        path (pathlib.Path): File to create or replace.
+
+    Yields:
+        File to write the new contents to.
+
+    """
+    temporary_path = path.with_name(f".{path.name}.{secrets.token_hex(4)}.tmp")
+    with temporary_path.open("xb") as file:
+        try:
+            yield file
+            file.flush()
+            os.fsync(file.fileno())
+        except BaseException:
+            file.close()
+            temporary_path.unlink()
+            raise
+    os.replace(temporary_path, path)  # noqa: PTH105
+
+
+def write_atomically(path: pathlib.Path, data: bytes | memoryview) -> None:
+    """
+    Write data to path, so path is always either the old or the new file.
+
+    Args:
+        path (pathlib.Path): File to create or replace.
+        data (bytes | memoryview): New contents.
+
+    """
+    with open_atomically(path) as file:
+        file.write(data)
+
+
 def run(
     *,
     input_path: pathlib.Path,
-    iterations: int,
-    extra: int,
-    color: float,
-    reverse: bool,
-    preprocess: bool,
-    output_path: pathlib.Path | None,
-) -> None:
+    output_path: pathlib.Path | None = None,
+    options: Options | None = None,
+    progress: bool = True,
+    sink: Sink | None = None,
+) -> pathlib.Path | None:
+    """
+    Crush input_path and write the result.
+
+    Only one of strip_memory, preview, target, the numpy engine,
+    resume_interval, animation and tile_size can be given: each crushes
+    in its own way. With a target, where crushing stopped goes to sink,
+    unless the output was cached. With an animation, outputs are crushed
+    again, not cached.
+
+    Args:
+        input_path (pathlib.Path): Image to crush.
+        output_path (pathlib.Path | None): Output file, or None for default.
+        options (Options | None): Parameters of the crush, or None for the
+            defaults.
+        progress (bool): Show a progress bar.
+        sink (Sink | None): Receives the timing of every step and of reading,
+            writing and caching, if given. Tiled and strip crushing report
+            only their total time, as stage 'tiles' or 'strips'.
+
+    Returns:
+        Path written, or None if an existing output was kept.
+
+    Raises:
+        TypeError: If more than one of the above is given.
+
+    """
+    options = Options() if options is None else options
+    modes = get_modes(options)
+    if len(modes) > 1:
+        msg = f"Only one of {', '.join(modes)} can be given."
+        raise TypeError(msg)
+
     if output_path is None:
-        default_output_name = generate_default_output_name(
-            input_path,
-            iterations=iterations,
-            extra=extra,
-            color=color,
-            reverse=reverse,
-            preprocess=preprocess,
-        )
-        output_path = CWD_COMPRESSIONS_DIRECTORY.joinpath(default_output_name)
-        CWD_COMPRESSIONS_DIRECTORY.mkdir(exist_ok=True)
+        default_output_name = generate_default_output_name(input_path, options)
+        compressions_directory = get_compressions_directory()
+        output_path = compressions_directory.joinpath(default_output_name)
+        compressions_directory.mkdir(exist_ok=True)
+
+    if not should_write(output_path, options.overwrite):
+        return None
+
+    # Stages are few, so they are always timed. Steps keep their fast path
+    # because crush still gets sink as given.
+    stages = Sink() if sink is None else sink
+
+    # A cached output has no steps left to animate.
+    cache = options.cache if options.animation is None else None
+
+    if cache is not None:
+        started = time.perf_counter()
+        key = cache.make_key(input_path, **get_keyed_options(options))
+        hit = cache.fetch(key, output_path)
+        stages.stage("cache", time.perf_counter() - started)
+        if hit:
+            return output_path
+
+    crush_path(input_path, output_path, options=options, progress=progress, sink=stages)
+
+    if cache is not None:
+        started = time.perf_counter()
+        cache.store(key, output_path)
+        stages.stage("cache", time.perf_counter() - started)
+
+    return output_path
+
+
+def get_keyed_options(options: Options) -> dict[str, object]:
+    """
+    Get the options of run that change its result.
+
+    Options besides the five always keyed are left out at their default,
+    so entries cached before they existed stay valid.
+
+    Args:
+        options (Options): Parameters of the crush.
+
+    Returns:
+        Keyword arguments of Cache.make_key, as JSON.
+
+    """
+    keyed: dict[str, object] = {
+        "iterations": options.iterations,
+        "extra": options.extra,
+        "color": options.color,
+        "reverse": options.reverse,
+        "preprocess": options.preprocess,
+    }
+    if options.engine != ENGINE_PILLOW:
+        keyed["engine"] = options.engine
+    if options.fused_color:
+        keyed["fused_color"] = True
+    if options.preview is not None:
+        keyed["preview"] = options.preview
+    if options.target is not None:
+        keyed["target"] = list(options.target)
+    return keyed
+
 
-    if output_path.exists():
-        should_overwrite = confirm(
-            title=f"File already exists: {output_path}",
-            question="Do you want to overwrite it?",
+def crush_path(
+    input_path: pathlib.Path,
+    output_path: pathlib.Path,
+    *,
+    options: Options,
+    progress: bool,
+    sink: Sink,
+) -> None:
+    """
+    Crush input_path into output_path, the way run was asked to.
+
+    Args:
+        input_path (pathlib.Path): Image to crush.
+        output_path (pathlib.Path): Output file.
+        options (Options): Parameters of the crush.
+        progress (bool): Show a progress bar.
+        sink (Sink): Receives the timing of every step and of every stage, and
+            where a target stopped.
+
+    """
+    qualities = options.extra * generate_quality_sequence(
+        options.iterations, options.reverse
+    )
+    started = time.perf_counter()
+
+    if options.strip_memory is not None:
+        from .streaming import crush_file  # noqa: PLC0415
+
+        crush_file(
+            input_path, output_path, qualities, options=options, progress=progress
         )
-        if not should_overwrite:
-            return
+        sink.stage("strips", time.perf_counter() - started)
+        return
 
-    qualities = extra * generate_quality_sequence(iterations, reverse)
+    data = input_path.read_bytes()
+    sink.stage("read", time.perf_counter() - started)
+    state_path: pathlib.Path | None = None
+    with io.BytesIO(data) as image_buffer:
+        started = time.perf_counter()
+        if options.resume_interval is not None:
+            from .resume import crush_resumable, get_state_path  # noqa: PLC0415
 
-    with io.BytesIO(input_path.read_bytes()) as image_buffer:
-        if preprocess:
-            change_color(image_buffer, color, quality=qualities[0])
-            compress(image_buffer, qualities[1:])
+            state_path = get_state_path(output_path)
+            crush_resumable(
+                image_buffer,
+                qualities,
+                state_path,
+                options=options,
+                sink=make_sink(sink, progress=progress),
+            )
         else:
-            compress(image_buffer, qualities[:-1])
-            change_color(image_buffer, color, quality=qualities[-1])
+            result = crush_in_mode(
+                image_buffer, qualities, options=options, progress=progress, sink=sink
+            )
+            if result is not None:
+                sink.target(str(input_path), result)
+        if options.tile_size is not None:
+            sink.stage("tiles", time.perf_counter() - started)
+
+        started = time.perf_counter()
+        write_atomically(output_path, image_buffer.getvalue())
+        if state_path is not None and state_path.exists():
+            state_path.unlink()
+        sink.stage("write", time.perf_counter() - started)
+
+
+def crush_in_mode(
+    image_buffer: io.BytesIO,
+    qualities: list[int],
+    *,
+    options: Options,
+    progress: bool,
+    sink: Sink | None,
+) -> TargetResult | None:
+    """
+    Crush the image in image_buffer in place, the way options ask.
+
+    Saving progress to resume is left to crush_path, which knows where.
+
+    Args:
+        image_buffer (io.BytesIO): Buffer containing image file.
+        qualities (list[int]): List of JPEG qualities.
+        options (Options): Parameters of the crush.
+        progress (bool): Show a progress bar.
+        sink (Sink | None): Receives the timing of every step, if given.
+
+    Returns:
+        Where crushing stopped, with a target, or None.
+
+    """
+    if options.preview is not None:
+        from .preview import crush_preview  # noqa: PLC0415
+
+        crush_preview(
+            image_buffer, qualities, options=options, progress=progress, sink=sink
+        )
+    elif options.target is not None:
+        from .targets import crush_to_target  # noqa: PLC0415
+
+        return crush_to_target(
+            image_buffer, qualities, options=options, progress=progress, sink=sink
+        )
+    elif options.engine == ENGINE_NUMPY:
+        from .dct import crush as crush_dct  # noqa: PLC0415
+
+        crush_dct(
+            image_buffer, qualities, options=options, progress=progress, sink=sink
+        )
+    elif options.animation is not None:
+        from .animate import crush_animated  # noqa: PLC0415
+
+        crush_animated(
+            image_buffer, qualities, options=options, progress=progress, sink=sink
+        )
+    elif options.tile_size is None:
+        crush(image_buffer, qualities, options=options, progress=progress, sink=sink)
+    else:
+        from .tiles import crush_tiled  # noqa: PLC0415
 
-        output_path.write_bytes(image_buffer.getvalue())
+        crush_tiled(image_buffer, qualities, options=options, progress=progress)
+    return None
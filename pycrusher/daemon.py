@@ -0,0 +1,429 @@
+"""Keep an interpreter with everything imported, to start crushes quickly."""
+
+from __future__ import annotations
+
+import array
+import contextlib
+import itertools
+import json
+import os
+import pathlib
+import select
+import signal
+import socket
+import struct
+import sys
+from typing import TYPE_CHECKING, Any, NoReturn
+
+if TYPE_CHECKING:
+    from collections.abc import Callable, Iterable, Mapping
+
+SOCKET_ENVIRONMENT_VARIABLE = "PYCRUSHER_DAEMON_SOCKET"
+SOCKET_NAME = "pycrusher-{uid}.sock"
+# Requests are a length, with the caller's standard streams attached, then
+# JSON. Replies are the exit status.
+LENGTH = struct.Struct("!I")
+STATUS = struct.Struct("!i")
+STANDARD_FDS = (0, 1, 2)
+BACKLOG = 16
+INTERRUPTED_STATUS = 128 + signal.SIGINT
+# Signals that stop the daemon, once calls in progress were handed over.
+STOP_SIGNALS = (signal.SIGINT, signal.SIGTERM)
+# Commands that run for long, and own their process.
+NOT_FORWARDED = ("daemon", "serve", "watch")
+
+
+def is_supported() -> bool:
+    """
+    Check whether this platform can run and reach a daemon.
+
+    Returns:
+        Whether Unix sockets, passing file descriptors and fork are available.
+
+    """
+    return all(
+        itertools.starmap(
+            hasattr, ((socket, "AF_UNIX"), (socket, "SCM_RIGHTS"), (os, "fork"))
+        )
+    )
+
+
+def get_socket_path() -> pathlib.Path:
+    """
+    Get where the daemon of this user listens.
+
+    Returns:
+        $PYCRUSHER_DAEMON_SOCKET if set, or else a socket named after the
+        user ID in $XDG_RUNTIME_DIR, or the temporary directory.
+
+    """
+    path = os.environ.get(SOCKET_ENVIRONMENT_VARIABLE)
+    if path:
+        return pathlib.Path(path)
+    directory = os.environ.get("XDG_RUNTIME_DIR")
+    if not directory:
+        import tempfile  # noqa: PLC0415
+
+        directory = tempfile.gettempdir()
+    return pathlib.Path(directory, SOCKET_NAME.format(uid=os.getuid()))
+
+
+def send_fds(connection: socket.socket, data: bytes, fds: tuple[int, ...]) -> None:
+    """
+    Send data, attaching duplicates of fds.
+
+    Args:
+        connection (socket.socket): Unix socket.
+        data (bytes): At least one byte to carry fds.
+        fds (tuple[int, ...]): File descriptors.
+
+    """
+    ancillary = (socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array("i", fds))
+    connection.sendmsg([data], [ancillary])
+
+
+def receive_fds(
+    connection: socket.socket, size: int, max_fds: int
+) -> tuple[bytes, list[int]]:
+    """
+    Receive size bytes, and the file descriptors sent with them.
+
+    Args:
+        connection (socket.socket): Unix socket.
+        size (int): Bytes to receive.
+        max_fds (int): Most file descriptors expected.
+
+    Returns:
+        Data and received file descriptors.
+
+    """
+    fds = array.array("i")
+    data, ancillary, _, _ = connection.recvmsg(
+        size, socket.CMSG_LEN(max_fds * fds.itemsize)
+    )
+    for level, kind, payload in ancillary:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(payload[: len(payload) - len(payload) % fds.itemsize])
+    return data + receive_exactly(connection, size - len(data)), list(fds)
+
+
+def receive_exactly(connection: socket.socket, size: int) -> bytes:
+    """
+    Receive size bytes, unless the connection closes first.
+
+    Args:
+        connection (socket.socket): Connected socket.
+        size (int): Bytes to receive.
+
+    Returns:
+        Received bytes, fewer than size if the connection closed.
+
+    """
+    chunks = []
+    while size:
+        chunk = connection.recv(size)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def forward(args: list[str], socket_path: pathlib.Path | None = None) -> int | None:
+    """
+    Run args in the daemon listening on socket_path, if any.
+
+    The daemon gets the standard streams, working directory and environment
+    of this process, so the call behaves as if it ran here. Interrupting this
+    process interrupts the call.
+
+    Args:
+        args (list[str]): Command line arguments, without the program name.
+        socket_path (pathlib.Path | None): Daemon socket, or None for
+            get_socket_path().
+
+    Returns:
+        Exit status of the call, or None if no daemon of this user listens
+        there, in which case nothing ran.
+
+    """
+    if not is_supported():
+        return None
+    if socket_path is None:
+        socket_path = get_socket_path()
+    try:
+        # Never hand our streams to a socket someone else created.
+        owned = socket_path.stat().st_uid == os.getuid()
+    except OSError:
+        owned = False
+    if not owned:
+        return None
+
+    with socket.socket(socket.AF_UNIX) as connection:
+        try:
+            connection.connect(str(socket_path))
+        except OSError:
+            # Left behind by a daemon that was killed.
+            return None
+        request = json.dumps({
+            "args": args,
+            "cwd": str(pathlib.Path.cwd()),
+            "environ": dict(os.environ),
+        }).encode()
+        send_fds(connection, LENGTH.pack(len(request)), STANDARD_FDS)
+        connection.sendall(request)
+        try:
+            reply = receive_exactly(connection, STATUS.size)
+        except KeyboardInterrupt:
+            # Closing the connection interrupts the call in the daemon.
+            return INTERRUPTED_STATUS
+    if len(reply) < STATUS.size:
+        return 1
+    (status,) = STATUS.unpack(reply)
+    return int(status)
+
+
+def is_listening(socket_path: pathlib.Path) -> bool:
+    """
+    Check whether something listens on socket_path.
+
+    Args:
+        socket_path (pathlib.Path): Daemon socket.
+
+    Returns:
+        Whether connecting succeeds.
+
+    """
+    with socket.socket(socket.AF_UNIX) as connection:
+        try:
+            connection.connect(str(socket_path))
+        except OSError:
+            return False
+    return True
+
+
+def serve_daemon(
+    socket_path: pathlib.Path, handle: Callable[[list[str]], object]
+) -> None:
+    """
+    Run forwarded calls until interrupted or terminated.
+
+    Calls in progress carry on once this returns.
+
+    Each call runs in a child forked from this process, so it starts with
+    every module this process imported, and whatever it changes, such as its
+    working directory, goes away with it.
+
+    Args:
+        socket_path (pathlib.Path): Where to listen.
+        handle (Callable[[list[str]], object]): Runs command line arguments,
+            and may exit with SystemExit.
+
+    Raises:
+        RuntimeError: If another daemon listens on socket_path.
+
+    """
+    if is_listening(socket_path):
+        msg = f"A daemon already listens on {socket_path}"
+        raise RuntimeError(msg)
+    if socket_path.exists() or socket_path.is_symlink():
+        socket_path.unlink()
+
+    stopping = []
+
+    def stop(signum: int, frame: object) -> None:
+        del frame
+        # Raising here could be swallowed: handlers may run in the hooks
+        # os.fork calls, which report exceptions instead of raising them.
+        stopping.append(signum)
+
+    handlers = {signum: signal.signal(signum, stop) for signum in STOP_SIGNALS}
+    # Wakes select up when a signal comes, so the loop sees stopping.
+    wakeup, wakeup_writer = socket.socketpair()
+    wakeup_writer.settimeout(0)
+    previous_wakeup_fd = signal.set_wakeup_fd(wakeup_writer.fileno())
+    server = socket.socket(socket.AF_UNIX)
+    umask = os.umask(0o177)
+    try:
+        server.bind(str(socket_path))
+    finally:
+        os.umask(umask)
+    try:
+        server.listen(BACKLOG)
+        while not stopping:
+            readable, _, _ = select.select([server, wakeup], [], [])
+            if wakeup in readable:
+                wakeup.recv(BACKLOG)
+            if stopping or server not in readable:
+                continue
+            connection, _ = server.accept()
+            with connection:
+                if os.fork() == 0:
+                    run_child(
+                        connection,
+                        handle,
+                        handlers,
+                        previous_wakeup_fd,
+                        (server, wakeup, wakeup_writer),
+                    )
+            reap_children()
+    finally:
+        restore(handlers, previous_wakeup_fd, (server, wakeup, wakeup_writer))
+        if socket_path.exists():
+            socket_path.unlink()
+
+
+def restore(
+    handlers: Mapping[signal.Signals, Any],
+    wakeup_fd: int,
+    sockets: Iterable[socket.socket],
+) -> None:
+    """
+    Undo what serve_daemon set up, in the daemon or in a child.
+
+    Args:
+        handlers (Mapping[signal.Signals, Any]): Signal handlers to restore,
+            by signal.
+        wakeup_fd (int): Wakeup file descriptor to restore.
+        sockets (Iterable[socket.socket]): Sockets of the daemon, to close.
+
+    """
+    signal.set_wakeup_fd(wakeup_fd)
+    for signum, handler in handlers.items():
+        signal.signal(signum, handler)
+    for sock in sockets:
+        sock.close()
+
+
+def run_child(
+    connection: socket.socket,
+    handle: Callable[[list[str]], object],
+    handlers: Mapping[signal.Signals, Any],
+    wakeup_fd: int,
+    sockets: Iterable[socket.socket],
+) -> NoReturn:
+    """
+    Run a forwarded call in a child forked by serve_daemon, then exit.
+
+    Args:
+        connection (socket.socket): Connection of the caller.
+        handle (Callable[[list[str]], object]): Runs command line arguments.
+        handlers (Mapping[signal.Signals, Any]): Signal handlers serve_daemon
+            replaced.
+        wakeup_fd (int): Wakeup file descriptor serve_daemon replaced.
+        sockets (Iterable[socket.socket]): Sockets of the daemon.
+
+    """
+    status = 1
+    try:
+        restore(handlers, wakeup_fd, sockets)
+        status = run_forwarded(connection, handle)
+    finally:
+        os._exit(status)
+
+
+def reap_children() -> None:
+    """Collect children that finished their calls, without waiting."""
+    while True:
+        try:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            return
+        if pid == 0:
+            return
+
+
+def run_forwarded(
+    connection: socket.socket, handle: Callable[[list[str]], object]
+) -> int:
+    """
+    Run the call sent by forward, in a forked child.
+
+    Args:
+        connection (socket.socket): Connection of the caller.
+        handle (Callable[[list[str]], object]): Runs command line arguments.
+
+    Returns:
+        Exit status, also sent to the caller.
+
+    """
+    header, fds = receive_fds(connection, LENGTH.size, len(STANDARD_FDS))
+    (length,) = LENGTH.unpack(header)
+    request = json.loads(receive_exactly(connection, length))
+    for fd, standard_fd in zip(fds, STANDARD_FDS):
+        os.dup2(fd, standard_fd)
+        os.close(fd)
+    reopen_standard_streams()
+    os.chdir(request["cwd"])
+    os.environ.clear()
+    os.environ.update(request["environ"])
+
+    import threading  # noqa: PLC0415
+    import traceback  # noqa: PLC0415
+
+    done = threading.Event()
+    main_thread = threading.get_ident()
+
+    def interrupt_on_hangup() -> None:
+        # The caller only closes the connection early when interrupted.
+        if not connection.recv(1) and not done.is_set():
+            signal.pthread_kill(main_thread, signal.SIGINT)
+
+    threading.Thread(target=interrupt_on_hangup, daemon=True).start()
+
+    status = 0
+    try:
+        handle(request["args"])
+    except SystemExit as exc:
+        if exc.code is None or isinstance(exc.code, int):
+            status = exc.code or 0
+        else:
+            print(exc.code, file=sys.stderr)  # noqa: T201
+            status = 1
+    except KeyboardInterrupt:
+        status = INTERRUPTED_STATUS
+    except BaseException:  # noqa: BLE001
+        traceback.print_exc()
+        status = 1
+    finally:
+        done.set()
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        sys.stdout.flush()
+        sys.stderr.flush()
+    # The caller may be gone, if it was interrupted.
+    with contextlib.suppress(OSError):
+        connection.sendall(STATUS.pack(status))
+    return status
+
+
+def reopen_standard_streams() -> None:
+    """Rebuild sys.stdin, sys.stdout and sys.stderr over the received streams."""
+    import locale  # noqa: PLC0415
+
+    # What open defaults to, given explicitly.
+    encoding = locale.getpreferredencoding(do_setlocale=False)
+    sys.stdin = open(0, encoding=encoding, closefd=False)  # noqa: SIM115
+    sys.stdout = open(  # noqa: SIM115
+        1, "w", buffering=1 if os.isatty(1) else -1, encoding=encoding, closefd=False
+    )
+    sys.stderr = open(2, "w", buffering=1, encoding=encoding, closefd=False)  # noqa: SIM115
+
+
+def forward_command(args: list[str]) -> int | None:
+    """
+    Run args in a daemon, if this process was asked to.
+
+    Forwarding is opt-in: only with $PYCRUSHER_DAEMON_SOCKET set are
+    commands sent to the daemon listening there.
+
+    Args:
+        args (list[str]): Command line arguments, without the program name.
+
+    Returns:
+        Result of forward, or None if args are not forwarded.
+
+    """
+    path = os.environ.get(SOCKET_ENVIRONMENT_VARIABLE)
+    if not path or (args and args[0] in NOT_FORWARDED):
+        return None
+    return forward(args, pathlib.Path(path))
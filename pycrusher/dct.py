@@ -0,0 +1,479 @@
+"""Crush images by quantizing their DCT coefficients with numpy."""
+
+from __future__ import annotations
+
+import time
+from typing import TYPE_CHECKING
+
+import numpy as np
+from PIL import Image
+
+from .core import Options
+from .hooks import StepTiming, make_sink
+
+if TYPE_CHECKING:
+    import io
+
+    import numpy.typing as npt
+
+    from .hooks import Sink
+
+    Plane = npt.NDArray[np.float32]
+
+BLOCK = 8
+MODES = ("L", "RGB")
+
+# Annex K tables, as libjpeg scales them with jpeg_set_quality.
+LUMINANCE_TABLE = np.array(
+    [
+        [16, 11, 10, 16, 24, 40, 51, 61],
+        [12, 12, 14, 19, 26, 58, 60, 55],
+        [14, 13, 16, 24, 40, 57, 69, 56],
+        [14, 17, 22, 29, 51, 87, 80, 62],
+        [18, 22, 37, 56, 68, 109, 103, 77],
+        [24, 35, 55, 64, 81, 104, 113, 92],
+        [49, 64, 78, 87, 103, 121, 120, 101],
+        [72, 92, 95, 98, 112, 100, 103, 99],
+    ],
+    dtype=np.float32,
+)
+CHROMINANCE_TABLE = np.array(
+    [
+        [17, 18, 24, 47, 99, 99, 99, 99],
+        [18, 21, 26, 66, 99, 99, 99, 99],
+        [24, 26, 56, 99, 99, 99, 99, 99],
+        [47, 66, 99, 99, 99, 99, 99, 99],
+        [99, 99, 99, 99, 99, 99, 99, 99],
+        [99, 99, 99, 99, 99, 99, 99, 99],
+        [99, 99, 99, 99, 99, 99, 99, 99],
+        [99, 99, 99, 99, 99, 99, 99, 99],
+    ],
+    dtype=np.float32,
+)
+
+# Orthonormal DCT-II matrix. Applied to rows and columns, it is the JPEG
+# forward DCT.
+DCT_MATRIX = np.array(
+    [
+        [
+            np.sqrt((1 if u == 0 else 2) / BLOCK)
+            * np.cos((2 * x + 1) * u * np.pi / (2 * BLOCK))
+            for x in range(BLOCK)
+        ]
+        for u in range(BLOCK)
+    ],
+    dtype=np.float32,
+)
+
+# JFIF RGB to YCbCr conversion, as libjpeg does it. Pillow's own conversion
+# truncates, so it is half a level off on average.
+YCBCR_MATRIX = np.array(
+    [
+        [0.299, 0.587, 0.114],
+        [-0.168735892, -0.331264108, 0.5],
+        [0.5, -0.418687589, -0.081312411],
+    ],
+    dtype=np.float32,
+)
+YCBCR_OFFSET = np.array([0, 128, 128], dtype=np.float32)
+
+# Decoding upsamples chroma with libjpeg's triangle filter, and encoding
+# averages it back over 2x2 pixels. Together, they blur chroma with this
+# separable kernel.
+CHROMA_ROUND_TRIP_KERNEL = (0.125, 0.75, 0.125)
+
+
+def scale_table(table: Plane, quality: int) -> Plane:
+    """
+    Scale a quantization table for quality, as libjpeg does for baseline JPEG.
+
+    Args:
+        table (Plane): LUMINANCE_TABLE or CHROMINANCE_TABLE.
+        quality (int): JPEG quality.
+
+    Returns:
+        Scaled table.
+
+    """
+    quality = min(max(quality, 1), 100)
+    scale = 5000 // quality if quality < 50 else 200 - 2 * quality  # noqa: PLR2004
+    return np.clip((table * scale + 50) // 100, 1, 255)
+
+
+def to_blocks(plane: Plane) -> Plane:
+    """
+    Split plane into 8x8 blocks, padding its edges as libjpeg does.
+
+    Args:
+        plane (Plane): Samples, height by width, after any stacking axes.
+
+    Returns:
+        Blocks, shaped (..., rows, columns, 8, 8).
+
+    """
+    *stack, height, width = plane.shape
+    padding = [(0, 0)] * len(stack) + [(0, -height % BLOCK), (0, -width % BLOCK)]
+    padded = np.pad(plane, padding, mode="edge")
+    rows, columns = padded.shape[-2] // BLOCK, padded.shape[-1] // BLOCK
+    return np.ascontiguousarray(
+        padded.reshape(*stack, rows, BLOCK, columns, BLOCK).swapaxes(-3, -2)
+    )
+
+
+def from_blocks(blocks: Plane, shape: tuple[int, ...]) -> Plane:
+    """
+    Join blocks made by to_blocks, dropping their padding.
+
+    Args:
+        blocks (Plane): Blocks, shaped (..., rows, columns, 8, 8).
+        shape (tuple[int, ...]): Height and width of the original plane.
+
+    Returns:
+        Samples, height by width, after any stacking axes.
+
+    """
+    *stack, rows, columns = blocks.shape[:-2]
+    padded = blocks.swapaxes(-3, -2).reshape(*stack, rows * BLOCK, columns * BLOCK)
+    return padded[..., : shape[-2], : shape[-1]]
+
+
+def repad(blocks: Plane, shape: tuple[int, ...]) -> None:
+    """
+    Pad the edge blocks again from the samples they keep, in place.
+
+    libjpeg pads every encoding from the decoded image, so padding never
+    carries over from one step to the next.
+
+    Args:
+        blocks (Plane): Blocks, shaped (..., rows, columns, 8, 8).
+        shape (tuple[int, ...]): Height and width of the original plane.
+
+    """
+    height, width = shape[-2] % BLOCK, shape[-1] % BLOCK
+    if width:
+        blocks[..., -1, :, width:] = blocks[..., -1, :, width - 1 : width]
+    if height:
+        blocks[..., -1, :, height:, :] = blocks[..., -1, :, height - 1 : height, :]
+
+
+def get_quantizers(table: Plane) -> tuple[Plane, Plane, Plane]:
+    """
+    Fold the DCT and a quantization table into two matrices.
+
+    A flattened block times the Kronecker product of the DCT matrix with
+    itself gives its flattened coefficients, so dividing by the table is
+    one more column scaling of the same matrix.
+
+    Args:
+        table (Plane): Scaled quantization table.
+
+    Returns:
+        Matrix from samples to quantized coefficients, the offset to subtract
+        from its result to level shift the samples, and the matrix from
+        quantized coefficients back to level-shifted samples.
+
+    """
+    dct = np.kron(DCT_MATRIX, DCT_MATRIX)
+    forward = dct.T / table.reshape(1, -1)
+    inverse = table.reshape(-1, 1) * dct
+    return forward, 128 * forward.sum(axis=0), inverse
+
+
+def quantize(blocks: Plane, table: Plane, shape: tuple[int, ...]) -> Plane:
+    """
+    Run one JPEG round trip on every block, without entropy coding.
+
+    Args:
+        blocks (Plane): Blocks, shaped (..., rows, columns, 8, 8).
+        table (Plane): Scaled quantization table.
+        shape (tuple[int, ...]): Height and width of the original plane.
+
+    Returns:
+        Decoded blocks, rounded and clamped like libjpeg's.
+
+    """
+    forward, offset, inverse = get_quantizers(table)
+    coefficients = blocks.reshape(-1, BLOCK * BLOCK) @ forward
+    coefficients -= offset
+    np.rint(coefficients, out=coefficients)
+    samples = coefficients @ inverse
+    samples += 128
+    np.rint(samples, out=samples)
+    np.clip(samples, 0, 255, out=samples)
+    decoded = samples.reshape(blocks.shape).astype(np.float32, copy=False)
+    repad(decoded, shape)
+    return decoded
+
+
+def to_ycbcr(rgb: Plane) -> list[Plane]:
+    """
+    Convert RGB samples to YCbCr planes.
+
+    Args:
+        rgb (Plane): RGB samples, with channels last.
+
+    Returns:
+        Y, Cb and Cr samples, rounded.
+
+    """
+    ycbcr = np.rint(rgb @ YCBCR_MATRIX.T + YCBCR_OFFSET)
+    return [np.ascontiguousarray(ycbcr[..., channel]) for channel in range(3)]
+
+
+def downsample(plane: Plane) -> Plane:
+    """
+    Average plane over 2x2 pixels, as libjpeg does for 4:2:0 chroma.
+
+    Args:
+        plane (Plane): Samples, height by width, after any stacking axes.
+
+    Returns:
+        Samples, half the height and width, rounded up.
+
+    """
+    *stack, height, width = plane.shape
+    padding = [(0, 0)] * len(stack) + [(0, height % 2), (0, width % 2)]
+    padded = np.pad(plane, padding, mode="edge")
+    pairs = padded.reshape(*stack, padded.shape[-2] // 2, 2, padded.shape[-1] // 2, 2)
+    averages: Plane = pairs.mean(axis=(-3, -1))
+    return np.rint(averages)
+
+
+def blur_chroma(plane: Plane) -> Plane:
+    """
+    Blur chroma as decoding and encoding it again would.
+
+    Args:
+        plane (Plane): Subsampled chroma samples, after any stacking axes.
+
+    Returns:
+        Blurred samples, rounded.
+
+    """
+    left, center, right = CHROMA_ROUND_TRIP_KERNEL
+    padding = [(0, 0)] * (plane.ndim - 2) + [(1, 1), (1, 1)]
+    padded = np.pad(plane, padding, mode="edge")
+    rows = (
+        left * padded[..., :-2, :]
+        + center * padded[..., 1:-1, :]
+        + right * padded[..., 2:, :]
+    )
+    blurred: Plane = (
+        left * rows[..., :-2] + center * rows[..., 1:-1] + right * rows[..., 2:]
+    )
+    return np.rint(blurred)
+
+
+def enhance_color(chroma: list[Plane], color: float) -> list[Plane]:
+    """
+    Enhance color like ImageEnhance.Color, which keeps luma and scales chroma.
+
+    Args:
+        chroma (list[Plane]): Cb and Cr samples.
+        color (float): Color enhancement factor.
+
+    Returns:
+        Enhanced samples.
+
+    """
+    return [np.clip(np.round(128 + color * (plane - 128)), 0, 255) for plane in chroma]
+
+
+def to_image(luma: Plane, chroma: list[Plane]) -> Image.Image:
+    """
+    Build an image from simulated planes, for the final encoding.
+
+    Chroma is repeated over 2x2 pixels, which libjpeg averages back exactly.
+
+    Args:
+        luma (Plane): Y samples.
+        chroma (list[Plane]): Cb and Cr samples, or no planes for grayscale.
+
+    Returns:
+        L or YCbCr image.
+
+    """
+    bands = [Image.fromarray(luma.astype(np.uint8), "L")]
+    for plane in chroma:
+        upsampled = plane.repeat(2, axis=0).repeat(2, axis=1)[
+            : luma.shape[0], : luma.shape[1]
+        ]
+        bands.append(Image.fromarray(upsampled.astype(np.uint8), "L"))
+    if not chroma:
+        return bands[0]
+    return Image.merge("YCbCr", bands)
+
+
+def load_planes(img: Image.Image) -> tuple[Plane, list[Plane]]:
+    """
+    Convert img to the planes a JPEG encoder sees.
+
+    Args:
+        img (Image.Image): Grayscale or RGB image.
+
+    Returns:
+        Y samples, and subsampled Cb and Cr samples unless img is grayscale.
+
+    Raises:
+        OSError: If img is neither grayscale nor RGB.
+
+    """
+    if img.mode not in MODES:
+        msg = f"cannot crush mode {img.mode} with the numpy engine"
+        raise OSError(msg)
+    if img.mode == "L":
+        return np.asarray(img, dtype=np.float32), []
+    luma, *chroma = to_ycbcr(np.asarray(img, dtype=np.float32))
+    return luma, [downsample(plane) for plane in chroma]
+
+
+def prepare_step(
+    chroma: list[Plane],
+    position: int,
+    *,
+    color: float,
+    color_index: int,
+) -> list[Plane]:
+    """
+    Change chroma as it would be before the step at position is encoded.
+
+    Args:
+        chroma (list[Plane]): Cb and Cr samples.
+        position (int): Step index.
+        color (float): Color enhancement factor.
+        color_index (int): Step at which color is enhanced.
+
+    Returns:
+        Chroma samples to encode.
+
+    """
+    if position > 0:
+        chroma = [blur_chroma(plane) for plane in chroma]
+    if position == color_index and color != 1.0:
+        chroma = enhance_color(chroma, color)
+    return chroma
+
+
+def simulate(
+    planes: tuple[Plane, list[Plane]],
+    qualities: list[int],
+    *,
+    color: float,
+    color_index: int,
+    sink: Sink | None = None,
+) -> tuple[Plane, list[Plane]]:
+    """
+    Run every step but the last in the DCT domain.
+
+    Planes may be stacked along leading axes, in which case every image in
+    the stack goes through each step at once.
+
+    Args:
+        planes (tuple[Plane, list[Plane]]): Y samples, and subsampled Cb and
+            Cr samples, if any.
+        qualities (list[int]): List of JPEG qualities, including the last.
+        color (float): Color enhancement factor.
+        color_index (int): Step at which color is enhanced.
+        sink (Sink | None): Receives the timing of every simulated step.
+
+    Returns:
+        Y and chroma samples after the second to last step.
+
+    """
+    luma, chroma = planes
+    shape = luma.shape
+    # Luma stays in blocks, but chroma is blurred as a plane.
+    blocks = to_blocks(luma)
+    for position, quality in enumerate(qualities[:-1]):
+        started = time.perf_counter()
+        chroma = prepare_step(chroma, position, color=color, color_index=color_index)
+        colored = time.perf_counter()
+
+        blocks = quantize(blocks, scale_table(LUMINANCE_TABLE, quality), shape)
+        table = scale_table(CHROMINANCE_TABLE, quality)
+        chroma = [
+            from_blocks(quantize(to_blocks(plane), table, plane.shape), plane.shape)
+            for plane in chroma
+        ]
+        encoded = time.perf_counter()
+
+        if sink is not None:
+            sink.step(
+                StepTiming(
+                    position, quality, 0, 0.0, colored - started, encoded - colored
+                )
+            )
+    return from_blocks(blocks, shape), chroma
+
+
+def crush(
+    image_buffer: io.BytesIO,
+    qualities: list[int],
+    *,
+    options: Options | None = None,
+    progress: bool = True,
+    sink: Sink | None = None,
+) -> int:
+    """
+    Simulate core.crush in the DCT domain, entropy coding only the last step.
+
+    The image is converted to YCbCr and 4:2:0 chroma once. Every step but
+    the last quantizes and dequantizes all 8x8 blocks at once, with the
+    libjpeg tables for its quality. The last step is a real JPEG encoding.
+    Images that are neither grayscale nor RGB are rejected by load_planes.
+
+    Args:
+        image_buffer (io.BytesIO): Buffer containing image file.
+        qualities (list[int]): List of JPEG qualities.
+        options (Options | None): Parameters of the crush, or None for the
+            defaults. Only color and preprocess are used.
+        progress (bool): Show a progress bar.
+        sink (Sink | None): Receives the timing of every step, if given.
+            Simulated steps report no size, and decoding the input is
+            reported as stage 'decode'.
+
+    Returns:
+        Number of skipped steps, which is always 0.
+
+    """
+    if not qualities:
+        return 0
+    options = Options() if options is None else options
+    color = options.color
+    color_index = 0 if options.preprocess else len(qualities) - 1
+    sink = make_sink(sink, progress=progress)
+    if sink is not None:
+        sink.start(len(qualities))
+
+    started = time.perf_counter()
+    with Image.open(image_buffer) as img:
+        planes = load_planes(img)
+    if sink is not None:
+        sink.stage("decode", time.perf_counter() - started)
+
+    luma, chroma = simulate(
+        planes, qualities, color=color, color_index=color_index, sink=sink
+    )
+
+    position, quality = len(qualities) - 1, qualities[-1]
+    started = time.perf_counter()
+    chroma = prepare_step(chroma, position, color=color, color_index=color_index)
+    colored = time.perf_counter()
+    image_buffer.seek(0)
+    image_buffer.truncate()
+    to_image(luma, chroma).save(image_buffer, format="JPEG", quality=quality)
+    encoded = time.perf_counter()
+
+    if sink is not None:
+        sink.step(
+            StepTiming(
+                position,
+                quality,
+                image_buffer.tell(),
+                0.0,
+                colored - started,
+                encoded - colored,
+            )
+        )
+        sink.finish(0)
+    return 0
@@ -0,0 +1,407 @@
+"""Report how long each step of a crush takes."""
+
+from __future__ import annotations
+
+import collections
+import json
+from typing import IO, TYPE_CHECKING, Any, NamedTuple, NoReturn
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+
+    import tqdm
+
+    from .core import Step
+    from .targets import TargetResult
+
+    Event = tuple[str, tuple[Any, ...]]
+
+
+class StepTiming(NamedTuple):
+    """What a step took, without its buffer."""
+
+    position: int
+    quality: int
+    size: int
+    decode_seconds: float
+    color_seconds: float
+    encode_seconds: float
+
+    @property
+    def seconds(self) -> float:
+        """Time taken by the whole step."""
+        return self.decode_seconds + self.color_seconds + self.encode_seconds
+
+
+def get_timing(step: Step) -> StepTiming:
+    """
+    Strip the buffer from step, keeping what sinks need.
+
+    Args:
+        step (Step): Yielded by iterate_compressions.
+
+    Returns:
+        Step timings.
+
+    """
+    return StepTiming(
+        step.position,
+        step.quality,
+        step.size,
+        step.decode_seconds,
+        step.color_seconds,
+        step.encode_seconds,
+    )
+
+
+def percentile(values: Iterable[float], fraction: float) -> float | None:
+    """
+    Get the nearest-rank percentile of values.
+
+    Args:
+        values (Iterable[float]): Samples.
+        fraction (float): Percentile, between 0 and 1.
+
+    Returns:
+        Percentile, or None without samples.
+
+    """
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    rank = max(round(fraction * len(ordered)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+class Sink:
+    """
+    Receives what happens while an image is crushed.
+
+    Each crush calls start, then step for every computed step, then finish.
+    Work around the crushing loop, such as reading and writing files, is
+    reported through stage, and where a target stopped crushing through
+    target. This base class ignores everything, so it is
+    also the no-op sink.
+    """
+
+    def start(self, total: int) -> None:
+        """
+        Start crushing an image.
+
+        Args:
+            total (int): Number of steps, including those that may be skipped.
+
+        """
+
+    def step(self, timing: StepTiming) -> None:
+        """
+        Finish a step.
+
+        Args:
+            timing (StepTiming): What the step took.
+
+        """
+
+    def stage(self, name: str, seconds: float) -> None:
+        """
+        Finish work outside the crushing loop.
+
+        Args:
+            name (str): Stage name, such as 'read' or 'write'.
+            seconds (float): Time taken.
+
+        """
+
+    def finish(self, skipped: int) -> None:
+        """
+        Finish crushing an image.
+
+        Args:
+            skipped (int): Steps that were not computed.
+
+        """
+
+    def target(self, name: str, result: TargetResult) -> None:
+        """
+        Stop crushing an image at a target.
+
+        Args:
+            name (str): Input image.
+            result (TargetResult): Where crushing stopped.
+
+        """
+
+
+class MultiSink(Sink):
+    """Forwards everything to several sinks."""
+
+    def __init__(self, sinks: Iterable[Sink]) -> None:
+        """
+        Forward to sinks, in order.
+
+        Args:
+            sinks (Iterable[Sink]): Sinks receiving every event.
+
+        """
+        self.sinks = list(sinks)
+
+    def start(self, total: int) -> None:
+        """Forward start to every sink."""
+        for sink in self.sinks:
+            sink.start(total)
+
+    def step(self, timing: StepTiming) -> None:
+        """Forward step to every sink."""
+        for sink in self.sinks:
+            sink.step(timing)
+
+    def stage(self, name: str, seconds: float) -> None:
+        """Forward stage to every sink."""
+        for sink in self.sinks:
+            sink.stage(name, seconds)
+
+    def finish(self, skipped: int) -> None:
+        """Forward finish to every sink."""
+        for sink in self.sinks:
+            sink.finish(skipped)
+
+    def target(self, name: str, result: TargetResult) -> None:
+        """Forward target to every sink."""
+        for sink in self.sinks:
+            sink.target(name, result)
+
+
+class TqdmSink(Sink):
+    """Shows a progress bar for each image."""
+
+    def __init__(self) -> None:
+        """Show nothing until an image starts."""
+        self.progress_bar: tqdm.tqdm[NoReturn] | None = None
+
+    def start(self, total: int) -> None:
+        """Open a progress bar of total steps."""
+        import tqdm  # noqa: PLC0415
+
+        self.progress_bar = tqdm.tqdm(total=total)
+
+    def step(self, timing: StepTiming) -> None:
+        """Move the progress bar past the step, and any skipped before it."""
+        if self.progress_bar is not None:
+            self.progress_bar.update(timing.position + 1 - self.progress_bar.n)
+
+    def finish(self, skipped: int) -> None:
+        """Close the progress bar, showing how many steps were skipped."""
+        if self.progress_bar is None:
+            return
+        if skipped:
+            self.progress_bar.set_postfix(skipped=skipped)
+        self.progress_bar.close()
+        self.progress_bar = None
+
+
+class JSONLinesSink(Sink):
+    """Writes one JSON object per event to a text stream."""
+
+    def __init__(self, stream: IO[str]) -> None:
+        """
+        Write to stream.
+
+        Args:
+            stream (IO[str]): Text stream, flushed after every image.
+
+        """
+        self.stream = stream
+
+    def write(self, event: str, **fields: object) -> None:
+        """
+        Write one event.
+
+        Args:
+            event (str): Event name.
+            fields (object): Event fields, which must be JSON serializable.
+
+        """
+        self.stream.write(json.dumps({"event": event, **fields}) + "\n")
+
+    def start(self, total: int) -> None:
+        """Write a start event."""
+        self.write("start", total=total)
+
+    def step(self, timing: StepTiming) -> None:
+        """Write a step event, with every field of timing."""
+        self.write("step", **timing._asdict())
+
+    def stage(self, name: str, seconds: float) -> None:
+        """Write a stage event."""
+        self.write("stage", name=name, seconds=seconds)
+
+    def finish(self, skipped: int) -> None:
+        """Write a finish event and flush the stream."""
+        self.write("finish", skipped=skipped)
+        self.stream.flush()
+
+    def target(self, name: str, result: TargetResult) -> None:
+        """Write a target event and flush the stream."""
+        self.write(
+            "target",
+            name=name,
+            metric=result.target.metric,
+            target=result.target.value,
+            value=result.value,
+            reached=result.reached,
+            steps=result.steps,
+            total=result.total,
+            quality=result.quality,
+        )
+        self.stream.flush()
+
+
+class SummarySink(Sink):
+    """Aggregates step times and output sizes over every image."""
+
+    def __init__(self) -> None:
+        """Start without images."""
+        self.images = 0
+        self.skipped = 0
+        self.total_bytes = 0
+        self.step_seconds: list[float] = []
+
+    def start(self, total: int) -> None:
+        """Count the image."""
+        del total
+        self.images += 1
+
+    def step(self, timing: StepTiming) -> None:
+        """Keep the time and size of the step."""
+        self.step_seconds.append(timing.seconds)
+        self.total_bytes += timing.size
+
+    def finish(self, skipped: int) -> None:
+        """Count the skipped steps."""
+        self.skipped += skipped
+
+    def summary(self) -> dict[str, Any]:
+        """
+        Summarize every image so far.
+
+        Returns:
+            Image, step and skipped counts, bytes encoded, and p50 and p95
+            step time in seconds.
+
+        """
+        return {
+            "images": self.images,
+            "steps": len(self.step_seconds),
+            "skipped": self.skipped,
+            "total_bytes": self.total_bytes,
+            "step_p50": percentile(self.step_seconds, 0.5),
+            "step_p95": percentile(self.step_seconds, 0.95),
+        }
+
+
+class ProfileSink(Sink):
+    """Adds up the time spent in each stage."""
+
+    def __init__(self) -> None:
+        """Start without time in any stage."""
+        self.stages: collections.defaultdict[str, float] = collections.defaultdict(
+            float
+        )
+
+    def step(self, timing: StepTiming) -> None:
+        """Add the step to the decode, color and encode stages."""
+        self.stages["decode"] += timing.decode_seconds
+        self.stages["color"] += timing.color_seconds
+        self.stages["encode"] += timing.encode_seconds
+
+    def stage(self, name: str, seconds: float) -> None:
+        """Add seconds to the stage."""
+        self.stages[name] += seconds
+
+    def report(self) -> str:
+        """
+        Format the time spent in each stage.
+
+        Returns:
+            Table of stages, with seconds and share of the total.
+
+        """
+        total = sum(self.stages.values()) or 1.0
+        lines = [f"{'stage':<10} {'seconds':>10} {'%':>6}"]
+        stages = sorted(self.stages.items(), key=lambda item: -item[1])
+        for name, seconds in stages:
+            lines.append(f"{name:<10} {seconds:>10.4f} {100 * seconds / total:>6.1f}")
+        return "\n".join(lines)
+
+
+class TargetSink(Sink):
+    """Keeps where targets stopped crushing each image."""
+
+    def __init__(self) -> None:
+        """Start without results."""
+        self.results: dict[str, TargetResult] = {}
+
+    def target(self, name: str, result: TargetResult) -> None:
+        """Keep result, by input image."""
+        self.results[name] = result
+
+
+class RecordingSink(Sink):
+    """Keeps every event, to replay them into another sink later."""
+
+    def __init__(self) -> None:
+        """Start without events."""
+        self.events: list[Event] = []
+
+    def start(self, total: int) -> None:
+        """Record a start event."""
+        self.events.append(("start", (total,)))
+
+    def step(self, timing: StepTiming) -> None:
+        """Record a step event."""
+        self.events.append(("step", (timing,)))
+
+    def stage(self, name: str, seconds: float) -> None:
+        """Record a stage event."""
+        self.events.append(("stage", (name, seconds)))
+
+    def finish(self, skipped: int) -> None:
+        """Record a finish event."""
+        self.events.append(("finish", (skipped,)))
+
+    def target(self, name: str, result: TargetResult) -> None:
+        """Record a target event."""
+        self.events.append(("target", (name, result)))
+
+
+def replay(events: Iterable[Event], sink: Sink) -> None:
+    """
+    Send recorded events to sink, in order.
+
+    Args:
+        events (Iterable[Event]): RecordingSink.events, possibly from
+            another process.
+        sink (Sink): Where events go.
+
+    """
+    for name, arguments in events:
+        getattr(sink, name)(*arguments)
+
+
+def make_sink(sink: Sink | None, *, progress: bool) -> Sink | None:
+    """
+    Combine the progress bar with sink.
+
+    Args:
+        sink (Sink | None): Other sink, if any.
+        progress (bool): Show a progress bar.
+
+    Returns:
+        Sink receiving everything, or None if nothing listens.
+
+    """
+    if not progress:
+        return sink
+    if sink is None:
+        return TqdmSink()
+    return MultiSink([TqdmSink(), sink])
@@ -0,0 +1,480 @@
+"""Queue crushes in SQLite, for workers to run across restarts."""
+
+from __future__ import annotations
+
+import contextlib
+import json
+import os
+import pathlib
+import socket
+import sqlite3
+import threading
+import time
+from typing import TYPE_CHECKING, Any, NamedTuple
+
+from .core import OVERWRITE_ALWAYS, load_options, run
+from .hooks import ProfileSink, percentile
+
+if TYPE_CHECKING:
+    from collections.abc import Generator, Iterable
+
+    from .batch import Job
+    from .cache import Cache
+
+QUEUE_PATH_DEFAULT = pathlib.Path("pycrusher-queue.sqlite3")
+LEASE_DEFAULT = 60.0
+MAX_ATTEMPTS_DEFAULT = 3
+BACKOFF_DEFAULT = 1.0
+POLL_INTERVAL = 1.0
+SQLITE_TIMEOUT = 60.0
+
+STATE_PENDING = "pending"
+STATE_LEASED = "leased"
+STATE_DONE = "done"
+STATE_FAILED = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    input_path TEXT NOT NULL,
+    output_path TEXT NOT NULL UNIQUE,
+    parameters TEXT NOT NULL,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    available_at REAL NOT NULL,
+    lease_expires REAL,
+    worker TEXT,
+    error TEXT,
+    seconds REAL,
+    timings TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, available_at);
+"""
+
+
+class Retries(NamedTuple):
+    """How often, and when, failed jobs are retried."""
+
+    # Attempts before a job fails for good.
+    max_attempts: int = MAX_ATTEMPTS_DEFAULT
+    # Seconds before the first retry, doubling after each attempt.
+    backoff: float = BACKOFF_DEFAULT
+
+
+class QueuedJob(NamedTuple):
+    """A crush leased to a worker."""
+
+    id: int
+    input_path: pathlib.Path
+    output_path: pathlib.Path
+    # Fields of core.Options, with targets as lists.
+    parameters: dict[str, Any]
+    attempts: int
+
+
+class QueueStats(NamedTuple):
+    """How many jobs are in each state, and how long done jobs took."""
+
+    pending: int
+    leased: int
+    done: int
+    failed: int
+    # Percentiles of the time taken by done jobs, in seconds.
+    seconds_p50: float | None
+    seconds_p95: float | None
+
+
+def get_worker_name() -> str:
+    """
+    Name this process, as the holder of its leases.
+
+    Returns:
+        Host name and process ID.
+
+    """
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class JobQueue:
+    """
+    Crushing jobs in a SQLite database, shared by any number of workers.
+
+    Workers lease one job at a time, and keep their lease alive while they
+    crush. A job whose lease expires, because its worker died, goes back to
+    the queue. Only the holder of a lease can complete or fail its job, so a
+    job is never recorded twice.
+    """
+
+    def __init__(self, path: pathlib.Path = QUEUE_PATH_DEFAULT) -> None:
+        """
+        Use the queue at path, creating it once it is first connected to.
+
+        Args:
+            path (pathlib.Path): SQLite database of the queue.
+
+        """
+        self.path = path
+
+    @contextlib.contextmanager
+    def connect(self) -> Generator[sqlite3.Connection, None, None]:
+        """
+        Open the database, creating it if needed.
+
+        Yields:
+            Connection in autocommit mode. Use 'BEGIN IMMEDIATE' to write.
+
+        """
+        connection = sqlite3.connect(
+            self.path, timeout=SQLITE_TIMEOUT, isolation_level=None
+        )
+        try:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(SCHEMA)
+            yield connection
+        finally:
+            connection.close()
+
+    def add(self, jobs: Iterable[Job], parameters: dict[str, Any]) -> int:
+        """
+        Enqueue jobs, skipping outputs that are already queued.
+
+        Args:
+            jobs (Iterable[Job]): Inputs and outputs.
+            parameters (dict[str, Any]): Fields of core.Options shared by
+                every job, which must be JSON serializable.
+
+        Returns:
+            Number of jobs added.
+
+        """
+        encoded = json.dumps(parameters, sort_keys=True)
+        now = time.time()
+        with self.connect() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            added = connection.executemany(
+                "INSERT OR IGNORE INTO jobs "
+                "(input_path, output_path, parameters, state, available_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [
+                    (
+                        str(job.input_path),
+                        str(job.output_path),
+                        encoded,
+                        STATE_PENDING,
+                        now,
+                    )
+                    for job in jobs
+                ],
+            ).rowcount
+            connection.execute("COMMIT")
+        return added
+
+    def lease(
+        self,
+        worker: str,
+        *,
+        lease: float = LEASE_DEFAULT,
+        max_attempts: int = MAX_ATTEMPTS_DEFAULT,
+    ) -> QueuedJob | None:
+        """
+        Take the oldest job that is ready, for lease seconds.
+
+        Jobs whose lease expired are ready again, unless their worker used
+        their last attempt, in which case they fail.
+
+        Args:
+            worker (str): Name of the leasing worker.
+            lease (float): Seconds before the job goes back to the queue,
+                unless renewed.
+            max_attempts (int): Attempts before a job fails for good.
+
+        Returns:
+            Leased job, or None if no job is ready.
+
+        """
+        now = time.time()
+        with self.connect() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.execute(
+                "UPDATE jobs SET state = ?, error = ? "
+                "WHERE state = ? AND lease_expires <= ? AND attempts >= ?",
+                (STATE_FAILED, "Lease expired", STATE_LEASED, now, max_attempts),
+            )
+            row = connection.execute(
+                "SELECT id, input_path, output_path, parameters, attempts "
+                "FROM jobs "
+                "WHERE (state = ? AND available_at <= ?) "
+                "OR (state = ? AND lease_expires <= ?) "
+                "ORDER BY id LIMIT 1",
+                (STATE_PENDING, now, STATE_LEASED, now),
+            ).fetchone()
+            if row is not None:
+                connection.execute(
+                    "UPDATE jobs SET state = ?, worker = ?, lease_expires = ?, "
+                    "attempts = attempts + 1 WHERE id = ?",
+                    (STATE_LEASED, worker, now + lease, row[0]),
+                )
+            connection.execute("COMMIT")
+
+        if row is None:
+            return None
+        job_id, input_path, output_path, parameters, attempts = row
+        return QueuedJob(
+            job_id,
+            pathlib.Path(input_path),
+            pathlib.Path(output_path),
+            json.loads(parameters),
+            attempts + 1,
+        )
+
+    def update_lease(self, job_id: int, worker: str, **columns: object) -> bool:
+        """
+        Update a job, if worker still holds its lease.
+
+        Args:
+            job_id (int): Leased job.
+            worker (str): Name of the worker holding the lease.
+            columns (object): New column values.
+
+        Returns:
+            Whether worker held the lease.
+
+        """
+        assignments = ", ".join(f"{name} = ?" for name in columns)
+        with self.connect() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            updated = connection.execute(
+                f"UPDATE jobs SET {assignments} "  # noqa: S608
+                "WHERE id = ? AND worker = ? AND state = ?",
+                (*columns.values(), job_id, worker, STATE_LEASED),
+            ).rowcount
+            connection.execute("COMMIT")
+        return bool(updated)
+
+    def renew(self, job_id: int, worker: str, lease: float = LEASE_DEFAULT) -> bool:
+        """
+        Extend a lease by lease seconds from now.
+
+        Args:
+            job_id (int): Leased job.
+            worker (str): Name of the worker holding the lease.
+            lease (float): Seconds before the job goes back to the queue.
+
+        Returns:
+            Whether worker still held the lease.
+
+        """
+        return self.update_lease(job_id, worker, lease_expires=time.time() + lease)
+
+    def complete(
+        self, job_id: int, worker: str, seconds: float, timings: dict[str, float]
+    ) -> bool:
+        """
+        Record a job as done.
+
+        Args:
+            job_id (int): Leased job.
+            worker (str): Name of the worker holding the lease.
+            seconds (float): Time taken by the last attempt.
+            timings (dict[str, float]): Seconds spent in each stage.
+
+        Returns:
+            Whether worker still held the lease.
+
+        """
+        return self.update_lease(
+            job_id,
+            worker,
+            state=STATE_DONE,
+            error=None,
+            seconds=seconds,
+            timings=json.dumps(timings),
+        )
+
+    def fail(
+        self,
+        job_id: int,
+        worker: str,
+        error: str,
+        *,
+        attempts: int,
+        retries: Retries | None = None,
+    ) -> bool:
+        """
+        Record a failed attempt, retrying the job later if attempts are left.
+
+        Args:
+            job_id (int): Leased job.
+            worker (str): Name of the worker holding the lease.
+            error (str): What went wrong.
+            attempts (int): Attempts so far, including this one.
+            retries (Retries | None): When to retry, or None for the defaults.
+
+        Returns:
+            Whether worker still held the lease.
+
+        """
+        retries = Retries() if retries is None else retries
+        if attempts >= retries.max_attempts:
+            return self.update_lease(job_id, worker, state=STATE_FAILED, error=error)
+        return self.update_lease(
+            job_id,
+            worker,
+            state=STATE_PENDING,
+            error=error,
+            available_at=time.time() + retries.backoff * 2 ** (attempts - 1),
+        )
+
+    def get_wait(self) -> float | None:
+        """
+        Find how long until a job may be ready.
+
+        Returns:
+            Seconds until the next retry or lease expiry, 0 if a job is ready,
+            or None if every job is done or failed.
+
+        """
+        with self.connect() as connection:
+            (ready_at,) = connection.execute(
+                "SELECT MIN(CASE WHEN state = ? THEN available_at "
+                "ELSE lease_expires END) FROM jobs WHERE state IN (?, ?)",
+                (STATE_PENDING, STATE_PENDING, STATE_LEASED),
+            ).fetchone()
+        if ready_at is None:
+            return None
+        return max(float(ready_at) - time.time(), 0.0)
+
+    def stats(self) -> QueueStats:
+        """
+        Count jobs in each state, and time done jobs.
+
+        Returns:
+            Queue statistics.
+
+        """
+        with self.connect() as connection:
+            counts = dict(
+                connection.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state")
+            )
+            seconds = [
+                row[0]
+                for row in connection.execute(
+                    "SELECT seconds FROM jobs WHERE state = ?", (STATE_DONE,)
+                )
+            ]
+        return QueueStats(
+            pending=counts.get(STATE_PENDING, 0),
+            leased=counts.get(STATE_LEASED, 0),
+            done=counts.get(STATE_DONE, 0),
+            failed=counts.get(STATE_FAILED, 0),
+            seconds_p50=percentile(seconds, 0.5),
+            seconds_p95=percentile(seconds, 0.95),
+        )
+
+    def failures(self) -> list[tuple[pathlib.Path, str]]:
+        """
+        List jobs that failed for good.
+
+        Returns:
+            Input path and last error of each failed job.
+
+        """
+        with self.connect() as connection:
+            rows = connection.execute(
+                "SELECT input_path, error FROM jobs WHERE state = ? ORDER BY id",
+                (STATE_FAILED,),
+            ).fetchall()
+        return [(pathlib.Path(input_path), error) for input_path, error in rows]
+
+
+def run_job(job: QueuedJob, *, cache: Cache | None = None) -> dict[str, float]:
+    """
+    Crush a queued job with core.run.
+
+    Args:
+        job (QueuedJob): Leased job.
+        cache (Cache | None): Reuse and store results in this cache, if given.
+
+    Returns:
+        Seconds spent in each stage.
+
+    """
+    options = load_options(job.parameters)
+    profile = ProfileSink()
+    run(
+        input_path=job.input_path,
+        output_path=job.output_path,
+        options=options._replace(overwrite=OVERWRITE_ALWAYS, cache=cache),
+        progress=False,
+        sink=profile,
+    )
+    return dict(profile.stages)
+
+
+def work(
+    queue: JobQueue,
+    *,
+    worker: str | None = None,
+    lease: float = LEASE_DEFAULT,
+    retries: Retries | None = None,
+    cache: Cache | None = None,
+) -> int:
+    """
+    Crush queued jobs until every job is done or failed.
+
+    While a job is crushed, a thread renews its lease every third of lease.
+
+    Args:
+        queue (JobQueue): Where jobs come from.
+        worker (str | None): Name of this worker, or None for
+            get_worker_name().
+        lease (float): Seconds before a job of a dead worker is retried.
+        retries (Retries | None): When to retry failed jobs, or None for the
+            defaults.
+        cache (Cache | None): Reuse and store results in this cache, if given.
+
+    Returns:
+        Number of jobs this worker completed.
+
+    """
+    if worker is None:
+        worker = get_worker_name()
+    retries = Retries() if retries is None else retries
+
+    completed = 0
+    while True:
+        job = queue.lease(worker, lease=lease, max_attempts=retries.max_attempts)
+        if job is None:
+            wait = queue.get_wait()
+            if wait is None:
+                return completed
+            time.sleep(min(max(wait, 0.01), POLL_INTERVAL))
+            continue
+
+        stop = threading.Event()
+
+        def renew_lease(job_id: int = job.id, stop: threading.Event = stop) -> None:
+            while not stop.wait(lease / 3):
+                queue.renew(job_id, worker, lease)
+
+        renewer = threading.Thread(target=renew_lease, daemon=True)
+        renewer.start()
+        started = time.perf_counter()
+        try:
+            timings = run_job(job, cache=cache)
+        except Exception as exc:  # noqa: BLE001
+            queue.fail(
+                job.id,
+                worker,
+                f"{type(exc).__name__}: {exc}",
+                attempts=job.attempts,
+                retries=retries,
+            )
+            continue
+        finally:
+            stop.set()
+            renewer.join()
+
+        seconds = time.perf_counter() - started
+        if queue.complete(job.id, worker, seconds, timings):
+            completed += 1
@@ -0,0 +1,244 @@
+"""Measure how much a crushed image differs from its source."""
+
+from __future__ import annotations
+
+import math
+from typing import TYPE_CHECKING, NamedTuple
+
+from .targets import (
+    SSIM_RADIUS,
+    blur,
+    get_ssim_factor,
+    get_ssim_map,
+    to_luma,
+    to_psnr,
+)
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+
+    import numpy as np
+    from PIL import Image
+
+# Pixels compared at a time, so large images never have more than a few
+# copies of a strip of this many pixels in memory.
+CHUNK_PIXELS = 2**20
+
+
+class ChannelError(NamedTuple):
+    """How far one band of an image is from the same band of another."""
+
+    # Band name, such as 'R' or 'L'.
+    channel: str
+    mean_absolute: float
+    root_mean_square: float
+    max_absolute: int
+
+
+class Report(NamedTuple):
+    """Every metric compare computes."""
+
+    # Decibels over every channel, or infinity if both images match.
+    psnr: float
+    # Mean SSIM of luma, or NaN if the images are too small.
+    ssim: float
+    channels: list[ChannelError]
+
+
+def get_strip_rows(width: int, chunk_pixels: int) -> int:
+    """
+    Find how many rows of an image make a chunk.
+
+    Args:
+        width (int): Image width.
+        chunk_pixels (int): Most pixels per chunk.
+
+    Returns:
+        At least one row.
+
+    """
+    return max(chunk_pixels // max(width, 1), 1)
+
+
+def are_identical(
+    img1: Image.Image, img2: Image.Image, *, chunk_pixels: int = CHUNK_PIXELS
+) -> bool:
+    """
+    Check whether two images have the same mode, size and pixels.
+
+    Strips of both images are compared as bytes, so this needs no numpy.
+
+    Args:
+        img1 (Image.Image): Image.
+        img2 (Image.Image): Image.
+        chunk_pixels (int): Most pixels compared at a time.
+
+    Returns:
+        Whether every pixel matches.
+
+    """
+    if img1.mode != img2.mode or img1.size != img2.size:
+        return False
+    width, height = img1.size
+    rows = get_strip_rows(width, chunk_pixels)
+    for top in range(0, height, rows):
+        box = (0, top, width, min(top + rows, height))
+        if img1.crop(box).tobytes() != img2.crop(box).tobytes():
+            return False
+    return True
+
+
+def iterate_strips(
+    reference: Image.Image, img: Image.Image, chunk_pixels: int
+) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+    """
+    Cut two images of the same size into strips of samples.
+
+    Strips are converted to grayscale if reference is grayscale, or else RGB.
+
+    Args:
+        reference (Image.Image): Reference image.
+        img (Image.Image): Image of the same size.
+        chunk_pixels (int): Most pixels per strip.
+
+    Yields:
+        Strips of both images, as uint8 arrays of rows, columns and bands.
+
+    Raises:
+        ValueError: If the images differ in size.
+
+    """
+    import numpy as np  # noqa: PLC0415
+
+    if reference.size != img.size:
+        msg = f"Cannot compare a {img.size} image against a {reference.size} one"
+        raise ValueError(msg)
+    mode = "L" if reference.mode == "L" else "RGB"
+    width, height = reference.size
+    rows = get_strip_rows(width, chunk_pixels)
+    for top in range(0, height, rows):
+        box = (0, top, width, min(top + rows, height))
+        yield (
+            np.atleast_3d(np.asarray(reference.crop(box).convert(mode))),
+            np.atleast_3d(np.asarray(img.crop(box).convert(mode))),
+        )
+
+
+def get_channel_errors(
+    reference: Image.Image, img: Image.Image, *, chunk_pixels: int = CHUNK_PIXELS
+) -> list[ChannelError]:
+    """
+    Measure how far the samples of img are from reference, per channel.
+
+    Args:
+        reference (Image.Image): Reference image.
+        img (Image.Image): Image of the same size.
+        chunk_pixels (int): Most pixels compared at a time.
+
+    Returns:
+        One entry per band of reference, as grayscale or RGB.
+
+    """
+    import numpy as np  # noqa: PLC0415
+
+    bands = ("L",) if reference.mode == "L" else ("R", "G", "B")
+    absolute = np.zeros(len(bands), dtype=np.int64)
+    squared = np.zeros(len(bands), dtype=np.int64)
+    maximum = np.zeros(len(bands), dtype=np.int64)
+    for x, y in iterate_strips(reference, img, chunk_pixels):
+        difference = np.abs(x.astype(np.int16) - y)
+        absolute += difference.sum(axis=(0, 1), dtype=np.int64)
+        squared += np.square(difference, dtype=np.int32).sum(
+            axis=(0, 1), dtype=np.int64
+        )
+        np.maximum(maximum, difference.max(axis=(0, 1)), out=maximum)
+
+    samples = max(reference.width * reference.height, 1)
+    return [
+        ChannelError(
+            band,
+            float(absolute[index]) / samples,
+            math.sqrt(float(squared[index]) / samples),
+            int(maximum[index]),
+        )
+        for index, band in enumerate(bands)
+    ]
+
+
+def get_ssim(
+    reference: Image.Image, img: Image.Image, *, chunk_pixels: int = CHUNK_PIXELS
+) -> float:
+    """
+    Compute the mean structural similarity of img against reference.
+
+    Like targets.get_ssim_function, both images are reduced, and compared on
+    luma with a Gaussian window, but strip by strip: strips overlap by the
+    window, so the result is the same as for whole images.
+
+    Args:
+        reference (Image.Image): Reference image.
+        img (Image.Image): Image of the same size.
+        chunk_pixels (int): Most pixels compared at a time.
+
+    Returns:
+        Mean SSIM.
+
+    Raises:
+        ValueError: If the images are too small once reduced.
+
+    """
+    import numpy as np  # noqa: PLC0415
+
+    factor = get_ssim_factor(reference)
+    x_luma = to_luma(reference, factor)
+    y_luma = to_luma(img, factor)
+    width, height = x_luma.size
+    if min(width, height) <= 2 * SSIM_RADIUS:
+        msg = f"SSIM needs images larger than {2 * SSIM_RADIUS + 1} pixels"
+        raise ValueError(msg)
+
+    rows = get_strip_rows(width, chunk_pixels)
+    total = 0.0
+    count = 0
+    for top in range(0, height - 2 * SSIM_RADIUS, rows):
+        box = (0, top, width, min(top + rows + 2 * SSIM_RADIUS, height))
+        x = np.asarray(x_luma.crop(box), dtype=np.float64)
+        y = np.asarray(y_luma.crop(box), dtype=np.float64)
+        mean_x = blur(x)
+        ssim = get_ssim_map(x, y, mean_x, blur(x * x) - mean_x**2)
+        total += float(ssim.sum())
+        count += ssim.size
+    return total / count
+
+
+def compare(
+    reference: Image.Image, img: Image.Image, *, chunk_pixels: int = CHUNK_PIXELS
+) -> Report:
+    """
+    Measure how crushed img is, against reference.
+
+    An img smaller than reference, such as a preview, is compared against
+    reference box reduced to its size.
+
+    Args:
+        reference (Image.Image): Input image.
+        img (Image.Image): Crushed image.
+        chunk_pixels (int): Most pixels compared at a time.
+
+    Returns:
+        PSNR, SSIM and errors per channel. PSNR is computed as in
+        targets.get_psnr, from the errors of every channel.
+
+    """
+    if img.size != reference.size:
+        from PIL import Image  # noqa: PLC0415
+
+        reference = reference.resize(img.size, Image.Resampling.BOX)
+    channels = get_channel_errors(reference, img, chunk_pixels=chunk_pixels)
+    try:
+        ssim = get_ssim(reference, img, chunk_pixels=chunk_pixels)
+    except ValueError:
+        ssim = math.nan
+    squared_errors = [channel.root_mean_square**2 for channel in channels]
+    psnr = to_psnr(sum(squared_errors) / len(squared_errors))
+    return Report(psnr, ssim, channels)
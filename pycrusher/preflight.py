@@ -0,0 +1,135 @@
+"""Read image headers to check inputs and estimate memory before crushing."""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, NamedTuple
+
+from PIL import Image
+
+from .core import ENGINE_NUMPY, ENGINE_PILLOW
+from .streaming import CODEC_OVERHEAD, JPEG_MODES, PIXEL_SIZE
+
+if TYPE_CHECKING:
+    import pathlib
+    from collections.abc import Iterable
+
+# Copies of an image alive at once while it is crushed: the input, the
+# decoded step and its color enhancement, plus one for the two JPEG buffers,
+# which are smaller than the image they hold.
+FRAME_COPIES = 4
+# Copies kept besides the DCT planes by the numpy engine: the input, and
+# the image encoded from the planes.
+NUMPY_FRAME_COPIES = 2
+
+
+class ImageHeader(NamedTuple):
+    """What an image file says about itself, before decoding."""
+
+    size: tuple[int, int]
+    mode: str
+    format: str | None
+
+
+def read_header(input_path: pathlib.Path) -> ImageHeader:
+    """
+    Read what crushing needs to know of input_path, without decoding it.
+
+    Args:
+        input_path (pathlib.Path): Image to crush.
+
+    Returns:
+        Size, mode and format.
+
+    Raises:
+        ValueError: If the image mode cannot be written as JPEG.
+
+    """
+    with Image.open(input_path) as img:
+        header = ImageHeader(img.size, img.mode, img.format)
+    if header.mode not in JPEG_MODES:
+        msg = (
+            f"Cannot crush a {header.mode} image: JPEG only takes "
+            f"{', '.join(JPEG_MODES)} images"
+        )
+        raise ValueError(msg)
+    return header
+
+
+def preflight(
+    input_paths: Iterable[pathlib.Path], max_workers: int | None = None
+) -> tuple[dict[pathlib.Path, ImageHeader], dict[pathlib.Path, BaseException]]:
+    """
+    Read the header of every input in threads, before anything is crushed.
+
+    Only headers are read, so this finds files Pillow cannot identify, modes
+    JPEG cannot take and images over Image.MAX_IMAGE_PIXELS, but not
+    truncated or corrupt image data.
+
+    Args:
+        input_paths (Iterable[pathlib.Path]): Images to crush.
+        max_workers (int | None): Number of threads, or None for the default
+            of concurrent.futures.ThreadPoolExecutor.
+
+    Returns:
+        Headers, and exceptions raised reading them, keyed by input path.
+
+    """
+    input_paths = list(input_paths)
+    headers: dict[pathlib.Path, ImageHeader] = {}
+    failures: dict[pathlib.Path, BaseException] = {}
+
+    def read(input_path: pathlib.Path) -> None:
+        try:
+            headers[input_path] = read_header(input_path)
+        except Exception as exc:  # noqa: BLE001
+            failures[input_path] = exc
+
+    if len(input_paths) <= 1:
+        for input_path in input_paths:
+            read(input_path)
+    else:
+        import concurrent.futures  # noqa: PLC0415
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+            list(executor.map(read, input_paths))
+    return (
+        {path: headers[path] for path in input_paths if path in headers},
+        {path: failures[path] for path in input_paths if path in failures},
+    )
+
+
+def estimate_memory(
+    header: ImageHeader,
+    *,
+    engine: str = ENGINE_PILLOW,
+    preview: int | None = None,
+    strip_memory: int | None = None,
+) -> int:
+    """
+    Estimate the peak memory crushing an image takes.
+
+    Args:
+        header (ImageHeader): Result of read_header.
+        engine (str): One of ENGINES.
+        preview (int | None): Preview width, if crushing a preview.
+        strip_memory (int | None): Strip crushing budget, if crushing in strips.
+
+    Returns:
+        Bytes.
+
+    """
+    if strip_memory is not None:
+        return strip_memory
+
+    width, height = header.size
+    if preview is not None and preview < width:
+        height = max(round(height * preview / width), 1)
+        width = preview
+    pixel_size = 1 if Image.getmodebands(header.mode) == 1 else PIXEL_SIZE
+    frame_bytes = width * height * pixel_size
+    if engine == ENGINE_NUMPY:
+        from .stack import estimate_memory as estimate_planes  # noqa: PLC0415
+
+        planes = estimate_planes((width, height), header.mode)
+        return planes + frame_bytes * NUMPY_FRAME_COPIES + CODEC_OVERHEAD
+    return frame_bytes * FRAME_COPIES + CODEC_OVERHEAD
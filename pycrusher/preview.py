@@ -0,0 +1,126 @@
+"""Crush a downscaled preview of an image."""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+from PIL import Image
+
+from .core import iterate_compressions, write_last_step
+
+if TYPE_CHECKING:
+    import io
+
+    from .core import Options
+    from .hooks import Sink
+
+
+def get_preview_scale(size: tuple[int, int], width: int) -> int:
+    """
+    Find how much to shrink an image for a preview at most width wide.
+
+    Scales are powers of two, so every 8x8 block of the preview covers
+    whole blocks of the full-resolution image, and the same size and width
+    always give the same scale.
+
+    Args:
+        size (tuple[int, int]): Full-resolution width and height.
+        width (int): Largest preview width.
+
+    Returns:
+        Smallest power of two shrinking size to width or less.
+
+    """
+    scale = 1
+    while -(-size[0] // scale) > width:
+        scale *= 2
+    return scale
+
+
+def open_preview(img: Image.Image, width: int, *, draft: bool = True) -> Image.Image:
+    """
+    Shrink img for a preview, decoding JPEG inputs at reduced size.
+
+    JPEG inputs are decoded with DCT scaling, so most of their samples are
+    never decoded at full resolution. What is left, and other formats, is
+    box averaged by the same power of two.
+
+    Args:
+        img (Image.Image): Opened image, not yet loaded to use DCT scaling.
+        width (int): Largest preview width.
+        draft (bool): Decode JPEG inputs at reduced size, which changes img.
+
+    Returns:
+        Loaded preview image, or img itself if it is already small enough.
+
+    """
+    scale = get_preview_scale(img.size, width)
+    if scale == 1:
+        img.load()
+        return img
+
+    full_size = img.size
+    if draft:
+        # Asking for the floor of the scaled size makes draft() pick scale,
+        # or the largest scale libjpeg has below it. Other formats ignore it.
+        img.draft(img.mode, (max(img.width // scale, 1), max(img.height // scale, 1)))
+    img.load()
+    draft_scale = get_preview_scale(full_size, img.width)
+    if draft_scale == scale:
+        return img
+    return img.reduce(scale // draft_scale)
+
+
+def crush_preview(
+    image_buffer: io.BytesIO,
+    qualities: list[int],
+    *,
+    options: Options,
+    progress: bool = True,
+    sink: Sink | None = None,
+) -> int:
+    """
+    Crush a preview of the image in image_buffer, at most options.preview wide.
+
+    The preview goes through the same steps as crush() would put the whole
+    image through.
+
+    Args:
+        image_buffer (io.BytesIO): Buffer containing image file, replaced by
+            the crushed preview.
+        qualities (list[int]): List of JPEG qualities.
+        options (Options): Parameters of the crush. Only preview, color,
+            preprocess, converge and fused_color are used.
+        progress (bool): Show a progress bar.
+        sink (Sink | None): Receives the timing of every step, if given.
+
+    Returns:
+        Number of skipped steps.
+
+    Raises:
+        ValueError: If options.preview is not given.
+
+    """
+    if options.preview is None:
+        msg = "options.preview must be given."
+        raise ValueError(msg)
+
+    with Image.open(image_buffer) as img:
+        preview_img = open_preview(img, options.preview)
+        try:
+            steps = iterate_compressions(
+                preview_img,
+                qualities,
+                color_index=0 if options.preprocess else len(qualities) - 1,
+                options=options,
+            )
+            return write_last_step(
+                image_buffer,
+                steps,
+                total=len(qualities),
+                progress=progress,
+                sink=sink,
+            )
+        finally:
+            if preview_img is not img:
+                preview_img.close()
@@ -0,0 +1,201 @@
+"""Checkpoint long crushes so that they can resume after an interruption."""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import time
+from typing import TYPE_CHECKING, NamedTuple
+
+from .cache import get_version_stamp
+from .core import Options, iterate_compressions, write_atomically, write_last_step
+
+if TYPE_CHECKING:
+    import io
+    import pathlib
+    from collections.abc import Generator, Iterable
+
+    from .core import Step
+    from .hooks import Sink
+
+RESUME_INTERVAL_DEFAULT = 60.0
+STATE_SUFFIX = ".state"
+
+
+class State(NamedTuple):
+    """Where a crush stopped, enough to carry on from there."""
+
+    # Position of the next step to compute.
+    position: int
+    # JPEG of the step before it.
+    data: bytes
+
+
+def get_state_path(output_path: pathlib.Path) -> pathlib.Path:
+    """
+    Get the sidecar file keeping the progress of output_path.
+
+    Args:
+        output_path (pathlib.Path): Output being crushed.
+
+    Returns:
+        output_path, with STATE_SUFFIX appended.
+
+    """
+    return output_path.with_name(output_path.name + STATE_SUFFIX)
+
+
+def make_state_key(data: bytes, **parameters: object) -> str:
+    """
+    Hash the input and every parameter a saved state depends on.
+
+    Args:
+        data (bytes): Input image file.
+        parameters (object): Parameters that change the crushed image.
+
+    Returns:
+        Hexadecimal key, stored with the state.
+
+    """
+    digest = hashlib.sha256()
+    digest.update(get_version_stamp().encode())
+    digest.update(json.dumps(parameters, sort_keys=True).encode())
+    digest.update(data)
+    return digest.hexdigest()
+
+
+def save_state(path: pathlib.Path, key: str, state: State) -> None:
+    """
+    Save state to path, as a JSON header line followed by the JPEG.
+
+    Args:
+        path (pathlib.Path): Sidecar file.
+        key (str): Result of make_state_key.
+        state (State): Progress to save.
+
+    """
+    header = json.dumps({"key": key, "position": state.position}).encode()
+    write_atomically(path, header + b"\n" + state.data)
+
+
+def load_state(path: pathlib.Path, key: str) -> State | None:
+    """
+    Load the state saved to path, if it was saved with key.
+
+    Args:
+        path (pathlib.Path): Sidecar file.
+        key (str): Result of make_state_key for this run.
+
+    Returns:
+        Saved state, or None if there is none, or it belongs to another input
+        or other parameters.
+
+    """
+    try:
+        contents = path.read_bytes()
+    except FileNotFoundError:
+        return None
+    header, _, data = contents.partition(b"\n")
+    try:
+        fields = json.loads(header)
+        if fields["key"] != key:
+            return None
+        return State(int(fields["position"]), data)
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def save_periodically(
+    steps: Iterable[Step], path: pathlib.Path, key: str, interval: float
+) -> Generator[Step, None, None]:
+    """
+    Pass steps through, saving the latest every interval seconds.
+
+    Args:
+        steps (Iterable[Step]): Result of iterate_compressions.
+        path (pathlib.Path): Sidecar file.
+        key (str): Result of make_state_key.
+        interval (float): Seconds between saves, or 0 to save every step.
+
+    Yields:
+        Every step, once it is saved if its turn came.
+
+    """
+    saved = time.monotonic()
+    for step in steps:
+        if time.monotonic() - saved >= interval:
+            with step.buffer.getbuffer() as view, view[: step.size] as data:
+                save_state(path, key, State(step.position + 1, bytes(data)))
+            saved = time.monotonic()
+        yield step
+
+
+def crush_resumable(
+    image_buffer: io.BytesIO,
+    qualities: list[int],
+    state_path: pathlib.Path,
+    *,
+    options: Options | None = None,
+    sink: Sink | None = None,
+) -> int:
+    """
+    Crush like crush(), saving progress to state_path, and resuming from it.
+
+    A saved state is only used if it was saved for the same input, qualities,
+    color parameters and versions. Since every step depends only on the JPEG
+    before it, the result is byte-identical to an uninterrupted crush.
+
+    Args:
+        image_buffer (io.BytesIO): Buffer containing image file.
+        qualities (list[int]): List of JPEG qualities.
+        state_path (pathlib.Path): Sidecar file, kept after crushing for the
+            caller to remove once the result is written.
+        options (Options | None): Parameters of the crush, or None for the
+            defaults. Only color, preprocess, converge, fused_color and
+            resume_interval are used. Progress is saved every resume_interval
+            seconds, or RESUME_INTERVAL_DEFAULT if not given, or every step
+            if 0.
+        sink (Sink | None): Receives the timing of every step, if given. Use
+            hooks.make_sink for a progress bar.
+
+    Returns:
+        Number of steps not computed by this call, including those computed
+        before resuming.
+
+    """
+    options = Options() if options is None else options
+    interval = (
+        RESUME_INTERVAL_DEFAULT
+        if options.resume_interval is None
+        else options.resume_interval
+    )
+    color_index = 0 if options.preprocess else len(qualities) - 1
+    key = make_state_key(
+        image_buffer.getvalue(),
+        qualities=qualities,
+        color=options.color,
+        color_index=color_index,
+        fused_color=options.fused_color,
+    )
+    state = load_state(state_path, key)
+    start = 0
+    if state is not None and 0 < state.position <= len(qualities):
+        start = state.position
+        image_buffer.seek(0)
+        image_buffer.truncate()
+        image_buffer.write(state.data)
+
+    steps = iterate_compressions(
+        image_buffer,
+        qualities,
+        color_index=color_index,
+        options=options,
+        start=start,
+    )
+    return write_last_step(
+        image_buffer,
+        save_periodically(steps, state_path, key, interval),
+        total=len(qualities),
+        progress=False,
+        sink=sink,
+    )
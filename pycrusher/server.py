@@ -0,0 +1,623 @@
+"""Crush images sent over HTTP."""
+
+from __future__ import annotations
+
+import asyncio
+import collections
+import concurrent.futures
+import contextlib
+import http
+import json
+import multiprocessing
+import os
+import signal
+import time
+import urllib.parse
+from concurrent.futures.process import BrokenProcessPool
+from typing import TYPE_CHECKING, Any, NamedTuple
+
+from .api import Crusher
+from .core import Options
+from .hooks import percentile
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+    from multiprocessing.queues import SimpleQueue
+
+HOST_DEFAULT = "127.0.0.1"
+PORT_DEFAULT = 8000
+QUEUE_SIZE_DEFAULT = 16
+TIMEOUT_DEFAULT = 60.0
+READ_TIMEOUT_DEFAULT = 10.0
+MAX_BODY_SIZE_DEFAULT = 64 * 2**20
+# Steps, iterations times extra, a request may ask for.
+MAX_STEPS_DEFAULT = 10_000
+# Stops a worker busy with an image that timed out. Windows has no SIGKILL.
+KILL_SIGNAL = getattr(signal, "SIGKILL", signal.SIGTERM)
+# Completed requests kept to compute latency percentiles.
+LATENCY_WINDOW = 1000
+PERCENTILES = (0.5, 0.9, 0.99)
+MAX_HEADER_SIZE = 64 * 2**10
+
+# Query parameters of POST /crush, and how to parse them.
+FLAG_VALUES = {"": True, "1": True, "true": True, "0": False, "false": False}
+QUERY_OPTIONS: dict[str, Callable[[str], Any]] = {
+    "iterations": int,
+    "extra": int,
+    "color": float,
+    "reverse": FLAG_VALUES.__getitem__,
+    "preprocess": FLAG_VALUES.__getitem__,
+    "converge": FLAG_VALUES.__getitem__,
+    "fused_color": FLAG_VALUES.__getitem__,
+    "preview": int,
+}
+
+
+class Limits(NamedTuple):
+    """How much a CrushServer accepts, and how long it waits."""
+
+    # Images that may wait for a worker.
+    queue_size: int = QUEUE_SIZE_DEFAULT
+    # Seconds an image may take to crush.
+    timeout: float = TIMEOUT_DEFAULT
+    # Seconds a client may take to send each part of its request, or to read
+    # the response.
+    read_timeout: float = READ_TIMEOUT_DEFAULT
+    # Bytes an uploaded image may take.
+    max_body_size: int = MAX_BODY_SIZE_DEFAULT
+    # Steps, iterations times extra, an image may take.
+    max_steps: int = MAX_STEPS_DEFAULT
+
+
+class HTTPError(Exception):
+    """Error to respond with, instead of a crushed image."""
+
+    def __init__(self, status: http.HTTPStatus, message: str = "") -> None:
+        """
+        Respond with status.
+
+        Args:
+            status (http.HTTPStatus): Status of the response.
+            message (str): Body of the response, or '' for the phrase of
+                status.
+
+        """
+        super().__init__(message or status.phrase)
+        self.status = status
+
+
+def crush_bytes(data: bytes, options: Options) -> bytes:
+    """
+    Crush an encoded image in a worker process.
+
+    Args:
+        data (bytes): Encoded image.
+        options (Options): Options of Crusher.
+
+    Returns:
+        Crushed JPEG.
+
+    """
+    return Crusher(options).crush(data)
+
+
+def register_worker(pids: SimpleQueue[int]) -> None:
+    """
+    Report the process ID of a new worker, so it can be killed.
+
+    Args:
+        pids (SimpleQueue[int]): Where the workers of a pool report.
+
+    """
+    pids.put(os.getpid())
+
+
+def warm_up() -> None:
+    """Load the JPEG codec, so the first request does not pay for it."""
+    Crusher(Options(iterations=1)).crush(b"P5 1 1 255 \x00")
+
+
+def parse_options(query: str, max_steps: int = MAX_STEPS_DEFAULT) -> Options:
+    """
+    Parse the query string of POST /crush.
+
+    Args:
+        query (str): Query string, such as 'iterations=20&reverse'.
+        max_steps (int): Steps, iterations times extra, a request may ask for.
+
+    Returns:
+        Options of Crusher.
+
+    Raises:
+        HTTPError: If an option is unknown, its value invalid, or the image
+            would take over max_steps steps.
+
+    """
+    parameters: dict[str, Any] = {}
+    for name, value in urllib.parse.parse_qsl(query, keep_blank_values=True):
+        if name not in QUERY_OPTIONS:
+            msg = f"Unknown option: {name}"
+            raise HTTPError(http.HTTPStatus.BAD_REQUEST, msg)
+        try:
+            parameters[name] = QUERY_OPTIONS[name](value.lower())
+        except (KeyError, ValueError):
+            msg = f"Invalid value for {name}: {value!r}"
+            raise HTTPError(http.HTTPStatus.BAD_REQUEST, msg) from None
+    options = Options(**parameters)
+    try:
+        Crusher(options)
+    except TypeError as exc:
+        raise HTTPError(http.HTTPStatus.BAD_REQUEST, str(exc)) from None
+    steps = options.iterations * options.extra
+    if steps > max_steps:
+        msg = f"Too many steps: {steps} (at most {max_steps})"
+        raise HTTPError(http.HTTPStatus.BAD_REQUEST, msg)
+    return options
+
+
+class CrushServer:
+    """
+    HTTP service crushing uploaded images in a pool of warm worker processes.
+
+    POST /crush takes an image as the request body and options as query
+    parameters, and answers with the crushed JPEG. At most max_workers
+    images are crushed at once, and at most limits.queue_size more wait for
+    a worker; further requests get 429. Requests asking for over
+    limits.max_steps steps get 400. Requests that take longer than limits.timeout
+    seconds get 503, as do those whose worker died, and the pool is then
+    replaced, killing the workers still busy with timed out images. Clients
+    that take longer than limits.read_timeout seconds to send the request
+    head, or its body, get 408, and those as slow to read the response are
+    dropped. GET /metrics reports queue depth, counters and latency
+    percentiles as JSON.
+    """
+
+    def __init__(
+        self,
+        *,
+        max_workers: int | None = None,
+        limits: Limits | None = None,
+    ) -> None:
+        """
+        Start the pool of workers, without listening yet.
+
+        Args:
+            max_workers (int | None): Worker processes, or None for one per
+                CPU.
+            limits (Limits | None): What requests may ask for, or None for
+                the defaults.
+
+        """
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.limits = limits or Limits()
+        self.context = multiprocessing.get_context(
+            "forkserver"
+            if "forkserver" in multiprocessing.get_all_start_methods()
+            else None
+        )
+        # Process IDs reported by the workers of the current pool.
+        self.worker_pids: SimpleQueue[int] = self.context.SimpleQueue()
+        self.executor = self.create_executor()
+        self.capacity = self.max_workers + self.limits.queue_size
+
+        # Images submitted to the pool and not finished yet, including those
+        # whose request timed out but that a worker is still crushing.
+        self.futures: set[concurrent.futures.Future[bytes]] = set()
+        # Requests admitted, whose body is still being read.
+        self.receiving = 0
+        self.counters: collections.Counter[str] = collections.Counter()
+        self.latencies: collections.deque[float] = collections.deque(
+            maxlen=LATENCY_WINDOW
+        )
+
+    async def start(
+        self,
+        host: str = HOST_DEFAULT,
+        port: int = PORT_DEFAULT,
+    ) -> asyncio.Server:
+        """
+        Start every worker process, then listen for requests.
+
+        Args:
+            host (str): Address to bind.
+            port (int): Port to bind, or 0 for any free port.
+
+        Returns:
+            Listening server.
+
+        """
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(
+            *(
+                loop.run_in_executor(self.executor, warm_up)
+                for _ in range(self.max_workers)
+            )
+        )
+        return await asyncio.start_server(
+            self.handle, host, port, limit=MAX_HEADER_SIZE
+        )
+
+    @property
+    def in_flight(self) -> int:
+        """Number of images in the pool, running or queued."""
+        return len(self.futures)
+
+    @property
+    def admitted(self) -> int:
+        """Number of images in the pool or being received, up to capacity."""
+        return self.in_flight + self.receiving
+
+    def create_executor(self) -> concurrent.futures.ProcessPoolExecutor:
+        """
+        Create a pool of max_workers processes, reporting to worker_pids.
+
+        Where possible, workers are forked from a server process holding no
+        client connections, so workers of a pool replaced while serving do
+        not keep those connections open.
+
+        Returns:
+            Pool, whose workers start with the first image.
+
+        """
+        return concurrent.futures.ProcessPoolExecutor(
+            self.max_workers,
+            mp_context=self.context,
+            initializer=register_worker,
+            initargs=(self.worker_pids,),
+        )
+
+    def replace_executor(self, broken: concurrent.futures.ProcessPoolExecutor) -> None:
+        """
+        Replace a pool broken by a dead worker with a new one.
+
+        Requests all run on the event loop, so the first one to find the pool
+        broken replaces it, and the others find it already replaced.
+
+        Args:
+            broken (concurrent.futures.ProcessPoolExecutor): Pool that raised
+                BrokenProcessPool.
+
+        """
+        if self.executor is not broken:
+            return
+        self.worker_pids = self.context.SimpleQueue()
+        self.executor = self.create_executor()
+        broken.shutdown(wait=False)
+        self.counters["restarts"] += 1
+
+    def kill_executor(self, executor: concurrent.futures.ProcessPoolExecutor) -> None:
+        """
+        Kill the workers of a pool, and replace it.
+
+        A running image cannot be cancelled, and would hold its slot until
+        done, so its worker is killed instead. Other images of the pool fail
+        with it, with BrokenProcessPool.
+
+        Args:
+            executor (concurrent.futures.ProcessPoolExecutor): Pool busy with
+                an image that timed out.
+
+        """
+        if self.executor is not executor:
+            # Already replaced, and its workers killed.
+            return
+        pids = self.worker_pids
+        while not pids.empty():
+            with contextlib.suppress(ProcessLookupError):
+                os.kill(pids.get(), KILL_SIGNAL)
+        self.replace_executor(executor)
+
+    def submit(self, data: bytes, options: Options) -> concurrent.futures.Future[bytes]:
+        """
+        Submit data to the pool, replacing the pool if a worker died.
+
+        Args:
+            data (bytes): Encoded image.
+            options (Options): Options of Crusher.
+
+        Returns:
+            Future of the crushed JPEG.
+
+        """
+        executor = self.executor
+        try:
+            return executor.submit(crush_bytes, data, options)
+        except BrokenProcessPool:
+            self.replace_executor(executor)
+            return self.executor.submit(crush_bytes, data, options)
+
+    def close(self) -> None:
+        """Stop the worker processes, cancelling queued images."""
+        for future in self.futures:
+            future.cancel()
+        self.executor.shutdown(wait=True)
+
+    def metrics(self) -> dict[str, Any]:
+        """
+        Report queue depth, counters and latency percentiles.
+
+        Returns:
+            Metrics, as sent by GET /metrics.
+
+        """
+        latencies = list(self.latencies)
+        return {
+            "in_flight": self.in_flight,
+            "receiving": self.receiving,
+            "queued": max(self.in_flight - self.max_workers, 0),
+            "workers": self.max_workers,
+            "capacity": self.capacity,
+            **{
+                name: self.counters[name]
+                for name in ("completed", "rejected", "timed_out", "failed", "restarts")
+            },
+            "latency_seconds": {
+                f"p{round(fraction * 100)}": percentile(latencies, fraction)
+                for fraction in PERCENTILES
+            },
+        }
+
+    async def crush(self, data: bytes, options: Options) -> bytes:
+        """
+        Crush data in the pool, within the capacity and timeout.
+
+        Args:
+            data (bytes): Encoded image.
+            options (Options): Options of Crusher.
+
+        Returns:
+            Crushed JPEG.
+
+        Raises:
+            HTTPError: If the pool is full, broken or too slow.
+
+        """
+        try:
+            future = self.submit(data, options)
+        except RuntimeError:
+            # Shutting down, or a worker died again.
+            raise HTTPError(http.HTTPStatus.SERVICE_UNAVAILABLE) from None
+        executor = self.executor
+        self.futures.add(future)
+        result = asyncio.wrap_future(future)
+        result.add_done_callback(lambda _: self.futures.discard(future))
+
+        try:
+            # Shielded, so a timeout leaves the image counted until its
+            # worker is killed.
+            return await asyncio.wait_for(asyncio.shield(result), self.limits.timeout)
+        except asyncio.TimeoutError:
+            if not future.cancel():
+                self.kill_executor(executor)
+            self.counters["timed_out"] += 1
+            msg = f"Timed out after {self.limits.timeout} seconds"
+            raise HTTPError(http.HTTPStatus.SERVICE_UNAVAILABLE, msg) from None
+        except BrokenProcessPool:
+            # This image may have killed its worker, so it is not retried.
+            self.replace_executor(executor)
+            raise HTTPError(http.HTTPStatus.SERVICE_UNAVAILABLE) from None
+        except Exception as exc:
+            self.counters["failed"] += 1
+            msg = f"Cannot crush image: {exc}"
+            raise HTTPError(http.HTTPStatus.UNPROCESSABLE_ENTITY, msg) from exc
+
+    def get_body_size(self, headers: dict[str, str]) -> int:
+        """
+        Get the size of the image a request uploads.
+
+        Args:
+            headers (dict[str, str]): Request headers, with lowercase names.
+
+        Returns:
+            Size of the body, in bytes.
+
+        Raises:
+            HTTPError: If the size is missing, zero or over
+                limits.max_body_size.
+
+        """
+        try:
+            length = int(headers["content-length"])
+        except (KeyError, ValueError):
+            raise HTTPError(http.HTTPStatus.LENGTH_REQUIRED) from None
+        if length > self.limits.max_body_size:
+            raise HTTPError(http.HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+        if length <= 0:
+            raise HTTPError(http.HTTPStatus.BAD_REQUEST, "Empty image")
+        return length
+
+    async def respond(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+    ) -> tuple[http.HTTPStatus, str, bytes]:
+        """
+        Read and route one request.
+
+        Args:
+            reader (asyncio.StreamReader): Stream from the client.
+            writer (asyncio.StreamWriter): Stream to the client.
+
+        Returns:
+            Status, content type and body of the response.
+
+        Raises:
+            HTTPError: If the request cannot be served.
+
+        """
+        method, target, headers = await self.read_head(reader)
+        url = urllib.parse.urlsplit(target)
+        if url.path == "/metrics":
+            if method != "GET":
+                raise HTTPError(http.HTTPStatus.METHOD_NOT_ALLOWED)
+            body = json.dumps(self.metrics()).encode()
+            return http.HTTPStatus.OK, "application/json", body
+
+        if url.path != "/crush":
+            raise HTTPError(http.HTTPStatus.NOT_FOUND)
+        if method != "POST":
+            raise HTTPError(http.HTTPStatus.METHOD_NOT_ALLOWED)
+
+        options = parse_options(url.query, self.limits.max_steps)
+        length = self.get_body_size(headers)
+        # Refuse before reading the body, so rejections stay cheap, and hold
+        # a slot while reading it, so concurrent uploads cannot all pass.
+        if self.admitted >= self.capacity:
+            self.counters["rejected"] += 1
+            raise HTTPError(http.HTTPStatus.TOO_MANY_REQUESTS)
+
+        self.receiving += 1
+        try:
+            if headers.get("expect", "").lower() == "100-continue":
+                writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+            data = await asyncio.wait_for(
+                reader.readexactly(length), self.limits.read_timeout
+            )
+        except asyncio.TimeoutError:
+            raise HTTPError(http.HTTPStatus.REQUEST_TIMEOUT) from None
+        finally:
+            # The image enters the pool without awaiting, so its slot passes
+            # from receiving to in_flight at once.
+            self.receiving -= 1
+
+        start = time.perf_counter()
+        crushed = await self.crush(data, options)
+        self.latencies.append(time.perf_counter() - start)
+        self.counters["completed"] += 1
+        return http.HTTPStatus.OK, "image/jpeg", crushed
+
+    async def read_head(
+        self, reader: asyncio.StreamReader
+    ) -> tuple[str, str, dict[str, str]]:
+        """
+        Read the request line and headers of a request.
+
+        Args:
+            reader (asyncio.StreamReader): Stream from the client.
+
+        Returns:
+            Method, target, and headers with lowercase names.
+
+        Raises:
+            HTTPError: If the client is too slow, or the head is malformed.
+
+        """
+        try:
+            head = await asyncio.wait_for(
+                reader.readuntil(b"\r\n\r\n"), self.limits.read_timeout
+            )
+        except asyncio.TimeoutError:
+            raise HTTPError(http.HTTPStatus.REQUEST_TIMEOUT) from None
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            raise HTTPError(http.HTTPStatus.BAD_REQUEST) from None
+        request_line, *header_lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, _ = request_line.split(" ")
+        except ValueError:
+            raise HTTPError(http.HTTPStatus.BAD_REQUEST) from None
+        headers = {}
+        for line in filter(None, header_lines):
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        return method, target, headers
+
+    async def send(
+        self,
+        writer: asyncio.StreamWriter,
+        status: http.HTTPStatus,
+        content_type: str,
+        body: bytes,
+    ) -> None:
+        """
+        Write a response, and wait until the client takes it.
+
+        Args:
+            writer (asyncio.StreamWriter): Stream to the client.
+            status (http.HTTPStatus): Status of the response.
+            content_type (str): Type of body.
+            body (bytes): Body of the response.
+
+        """
+        writer.write(
+            f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n"
+            "\r\n".encode("latin-1")
+        )
+        writer.write(body)
+        await asyncio.wait_for(writer.drain(), self.limits.read_timeout)
+
+    async def handle(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+    ) -> None:
+        """
+        Serve one request, then close the connection.
+
+        Args:
+            reader (asyncio.StreamReader): Stream from the client.
+            writer (asyncio.StreamWriter): Stream to the client.
+
+        """
+        try:
+            try:
+                response = await self.respond(reader, writer)
+            except HTTPError as exc:
+                response = (exc.status, "text/plain", f"{exc}\n".encode())
+            await self.send(writer, *response)
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            pass
+        finally:
+            writer.close()
+
+
+async def serve_forever(
+    crush_server: CrushServer,
+    host: str,
+    port: int,
+) -> None:
+    """
+    Serve requests until cancelled.
+
+    Args:
+        crush_server (CrushServer): Service to run.
+        host (str): Address to bind.
+        port (int): Port to bind.
+
+    """
+    server = await crush_server.start(host, port)
+    for sock in server.sockets:
+        address, bound_port = sock.getsockname()[:2]
+        print(f"Serving on http://{address}:{bound_port}")  # noqa: T201
+    async with server:
+        await server.serve_forever()
+
+
+def serve(
+    *,
+    host: str = HOST_DEFAULT,
+    port: int = PORT_DEFAULT,
+    max_workers: int | None = None,
+    limits: Limits | None = None,
+) -> None:
+    """
+    Run the HTTP service until interrupted.
+
+    Args:
+        host (str): Address to bind.
+        port (int): Port to bind.
+        max_workers (int | None): Number of worker processes, or None for one
+            per CPU.
+        limits (Limits | None): What requests may ask for, or None for the
+            defaults.
+
+    """
+    crush_server = CrushServer(max_workers=max_workers, limits=limits)
+    try:
+        asyncio.run(serve_forever(crush_server, host, port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        crush_server.close()
@@ -0,0 +1,302 @@
+"""Crush batches of images of the same size together with numpy."""
+
+from __future__ import annotations
+
+import time
+from typing import TYPE_CHECKING, Any, NamedTuple
+
+import numpy as np
+import tqdm
+from PIL import Image
+
+from .core import (
+    ENGINE_NUMPY,
+    OVERWRITE_ALWAYS,
+    OVERWRITE_ASK,
+    generate_quality_sequence,
+    get_keyed_options,
+    open_atomically,
+    should_write,
+)
+from .dct import BLOCK, load_planes, prepare_step, simulate, to_image
+from .hooks import StepTiming
+
+if TYPE_CHECKING:
+    import pathlib
+    from collections.abc import Callable, Hashable
+
+    from .batch import Job, Schedule
+    from .cache import Cache
+    from .core import Options
+    from .hooks import Sink
+
+STACK_SIZE_DEFAULT = 256
+# Float32 copies of every sample alive at once while a step runs: the planes,
+# their blocks, the coefficients and the decoded samples.
+MEMORY_FACTOR = 4
+
+
+class Stack(NamedTuple):
+    """Jobs whose inputs can be crushed together."""
+
+    size: tuple[int, int]
+    mode: str
+    jobs: list[Job]
+
+
+def get_stack_key(img: Image.Image) -> Hashable:
+    """
+    Group images that can be stacked together.
+
+    Args:
+        img (Image.Image): Opened, not yet decoded, input image.
+
+    Returns:
+        Image size and mode.
+
+    """
+    return img.size, img.mode
+
+
+def estimate_memory(size: tuple[int, int], mode: str) -> int:
+    """
+    Estimate the memory one image takes while its stack is crushed.
+
+    Args:
+        size (tuple[int, int]): Image width and height.
+        mode (str): Image mode.
+
+    Returns:
+        Bytes.
+
+    """
+    width, height = size
+    samples = -(-width // BLOCK) * BLOCK * -(-height // BLOCK) * BLOCK
+    if mode != "L":
+        # Two chroma planes, each a quarter of the size.
+        samples += samples // 2
+    return samples * np.dtype(np.float32).itemsize * MEMORY_FACTOR
+
+
+def plan_stacks(
+    jobs: list[Job],
+    *,
+    stack_size: int = STACK_SIZE_DEFAULT,
+    max_memory: int | None = None,
+    key: Callable[[Image.Image], Hashable] = get_stack_key,
+) -> tuple[list[Stack], dict[pathlib.Path, BaseException]]:
+    """
+    Group jobs into stacks of images with the same size and mode.
+
+    Only image headers are read. Groups keep the order of their first job,
+    and are split into stacks of at most stack_size images, fewer if their
+    image data would not fit in max_memory.
+
+    Args:
+        jobs (list[Job]): Inputs and outputs.
+        stack_size (int): Most images per stack.
+        max_memory (int | None): Most bytes of image data per stack, if
+            given. A single image over it still gets a stack of its own.
+        key (Callable[[Image.Image], Hashable]): Groups images further.
+            Images are always grouped by size and mode first.
+
+    Returns:
+        Stacks, and exceptions raised opening inputs, keyed by input path.
+
+    """
+    groups: dict[Any, Stack] = {}
+    failures: dict[pathlib.Path, BaseException] = {}
+    for job in jobs:
+        try:
+            with Image.open(job.input_path) as img:
+                group = (img.size, img.mode, key(img))
+        except Exception as exc:  # noqa: BLE001
+            failures[job.input_path] = exc
+            continue
+        groups.setdefault(group, Stack(img.size, img.mode, [])).jobs.append(job)
+
+    stacks: list[Stack] = []
+    for size, mode, group_jobs in groups.values():
+        count = stack_size
+        if max_memory is not None:
+            count = min(count, max(max_memory // estimate_memory(size, mode), 1))
+        stacks.extend(
+            Stack(size, mode, group_jobs[start : start + count])
+            for start in range(0, len(group_jobs), count)
+        )
+    return stacks, failures
+
+
+def crush_stack(
+    stack: Stack,
+    qualities: list[int],
+    *,
+    color: float,
+    preprocess: bool,
+    sink: Sink | None = None,
+) -> None:
+    """
+    Crush every image of stack at once, and write each output.
+
+    Images are stacked along a new first axis, so every step runs as one
+    array operation over the whole stack. Results match dct.crush, up to
+    float32 products summed in another order.
+
+    Args:
+        stack (Stack): Images of the same size and mode.
+        qualities (list[int]): List of JPEG qualities.
+        color (float): Color enhancement factor.
+        preprocess (bool): Enhance color at the first step instead of the last.
+        sink (Sink | None): Receives the timing of every step, if given.
+            The whole stack reports as one image, whose last step size
+            adds up every output.
+
+    Raises:
+        ValueError: If images in stack do not have the same size and mode.
+
+    """
+    if not qualities:
+        return
+    color_index = 0 if preprocess else len(qualities) - 1
+    if sink is not None:
+        sink.start(len(qualities))
+
+    started = time.perf_counter()
+    lumas = []
+    chromas = []
+    for job in stack.jobs:
+        with Image.open(job.input_path) as img:
+            if (img.size, img.mode) != (stack.size, stack.mode):
+                msg = f"{job.input_path} does not match the size and mode of its stack"
+                raise ValueError(msg)
+            luma, chroma = load_planes(img)
+        lumas.append(luma)
+        chromas.append(chroma)
+    planes = (np.stack(lumas), [np.stack(planes) for planes in zip(*chromas)])
+    del lumas, chromas
+    if sink is not None:
+        sink.stage("decode", time.perf_counter() - started)
+
+    luma, chroma = simulate(
+        planes, qualities, color=color, color_index=color_index, sink=sink
+    )
+
+    position, quality = len(qualities) - 1, qualities[-1]
+    started = time.perf_counter()
+    chroma = prepare_step(chroma, position, color=color, color_index=color_index)
+    colored = time.perf_counter()
+    size = 0
+    for index, job in enumerate(stack.jobs):
+        img = to_image(luma[index], [plane[index] for plane in chroma])
+        with open_atomically(job.output_path) as output_file:
+            img.save(output_file, format="JPEG", quality=quality)
+        size += job.output_path.stat().st_size
+    encoded = time.perf_counter()
+
+    if sink is not None:
+        sink.step(
+            StepTiming(
+                position, quality, size, 0.0, colored - started, encoded - colored
+            )
+        )
+        sink.finish(0)
+
+
+def fetch_cached(
+    jobs: list[Job], cache: Cache, **parameters: object
+) -> tuple[list[Job], dict[pathlib.Path, str]]:
+    """
+    Write the outputs of jobs found in cache.
+
+    Args:
+        jobs (list[Job]): Inputs and outputs.
+        cache (Cache): Cache to look jobs up in.
+        parameters (object): Parameters the outputs are crushed with.
+
+    Returns:
+        Jobs not found, and the key to store each of their outputs under,
+        keyed by output path.
+
+    """
+    pending = []
+    keys = {}
+    for job in jobs:
+        key = cache.make_key(job.input_path, **parameters)
+        if not cache.fetch(key, job.output_path):
+            keys[job.output_path] = key
+            pending.append(job)
+    return pending, keys
+
+
+def run_stacked(
+    jobs: list[Job],
+    *,
+    options: Options,
+    schedule: Schedule,
+    progress: bool = True,
+    sink: Sink | None = None,
+) -> dict[pathlib.Path, BaseException]:
+    """
+    Crush every job with the numpy engine, stacking same-sized images.
+
+    Overwrite questions are asked up front, like run_batch. Stacks run one
+    after another in this process, each as a single array.
+
+    Args:
+        jobs (list[Job]): Inputs and outputs.
+        options (Options): Parameters of the crush. Only iterations, extra,
+            color, reverse, preprocess, overwrite and cache are used.
+        schedule (Schedule): How to stack jobs. Only stack_size, or
+            STACK_SIZE_DEFAULT if not given, and max_memory are used.
+        progress (bool): Show a progress bar.
+        sink (Sink | None): Receives the timings of every stack, if given.
+
+    Returns:
+        Exceptions raised by failed jobs, keyed by input path. A failing
+        stack fails every job in it.
+
+    """
+    overwrite = options.overwrite
+    if overwrite == OVERWRITE_ASK:
+        jobs = [job for job in jobs if should_write(job.output_path, overwrite)]
+        overwrite = OVERWRITE_ALWAYS
+    jobs = [job for job in jobs if should_write(job.output_path, overwrite)]
+
+    for output_directory in {job.output_path.parent for job in jobs}:
+        output_directory.mkdir(parents=True, exist_ok=True)
+
+    cache = options.cache
+    keys: dict[pathlib.Path, str] = {}
+    if cache is not None:
+        jobs, keys = fetch_cached(
+            jobs, cache, **get_keyed_options(options._replace(engine=ENGINE_NUMPY))
+        )
+
+    qualities = options.extra * generate_quality_sequence(
+        options.iterations, options.reverse
+    )
+    stack_size = (
+        STACK_SIZE_DEFAULT if schedule.stack_size is None else schedule.stack_size
+    )
+    stacks, failures = plan_stacks(
+        jobs, stack_size=stack_size, max_memory=schedule.max_memory
+    )
+    with tqdm.tqdm(total=len(jobs), unit="image", disable=not progress) as bar:
+        for stack in stacks:
+            try:
+                crush_stack(
+                    stack,
+                    qualities,
+                    color=options.color,
+                    preprocess=options.preprocess,
+                    sink=sink,
+                )
+            except Exception as exc:  # noqa: BLE001
+                for job in stack.jobs:
+                    failures[job.input_path] = exc
+            else:
+                for job in stack.jobs:
+                    if cache is not None:
+                        cache.store(keys[job.output_path], job.output_path)
+            bar.update(len(stack.jobs))
+    return failures
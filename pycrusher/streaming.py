@@ -0,0 +1,201 @@
+"""Crush images in horizontal strips, bounding the memory each step takes."""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+import tqdm
+from PIL import Image, ImageEnhance
+
+from .core import open_atomically
+from .tiles import SUBSAMPLED_MODES, Tile, crush_tile, get_mcu_size, split_strips
+
+if TYPE_CHECKING:
+    import pathlib
+
+    from .core import Options
+
+# Modes Pillow writes as JPEG, and the modes they decode to.
+JPEG_MODES = {"1": "L", "L": "L", "RGB": "RGB", "RGBX": "RGB", "CMYK": "CMYK"}
+# Pillow keeps images with several bands at 4 bytes per pixel.
+PIXEL_SIZE = 4
+# Copies of a strip alive at once: the strip being crushed, its color
+# enhancement, its two JPEG buffers, its decoded JPEG, the part of it that
+# is kept and the previous strip, waiting to be pasted, plus some slack
+# for the allocator.
+STRIP_COPIES = 8
+# Decoder and encoder buffers, which do not depend on the strip size.
+CODEC_OVERHEAD = 4 * 2**20
+
+
+def get_strip_height(
+    size: tuple[int, int],
+    mode: str,
+    strip_memory: int,
+) -> int:
+    """
+    Find the tallest strip that keeps image data within strip_memory bytes.
+
+    Args:
+        size (tuple[int, int]): Image width and height.
+        mode (str): Mode of the decoded image.
+        strip_memory (int): Memory budget for image data, in bytes.
+
+    Returns:
+        Strip height, a multiple of the MCU size.
+
+    Raises:
+        ValueError: If not even the smallest strip fits in strip_memory.
+
+    """
+    width, height = size
+    pixel_size = 1 if Image.getmodebands(mode) == 1 else PIXEL_SIZE
+    frame_bytes = width * height * pixel_size + CODEC_OVERHEAD
+    row_bytes = width * pixel_size * STRIP_COPIES
+
+    mcu_size = get_mcu_size(mode)
+    halo = mcu_size if mode in SUBSAMPLED_MODES else 0
+    rows = (strip_memory - frame_bytes) // row_bytes - 2 * halo
+    strip_height = rows // mcu_size * mcu_size
+    if strip_height < mcu_size:
+        needed = frame_bytes + (mcu_size + 2 * halo) * row_bytes
+        msg = (
+            f"Memory budget of {strip_memory} bytes is too small for a "
+            f"{width}x{height} {mode} image: at least {needed} bytes are needed."
+        )
+        raise ValueError(msg)
+    return min(strip_height, -(-height // mcu_size) * mcu_size)
+
+
+def crush_strips(
+    frame: Image.Image,
+    strips: list[Tile],
+    *,
+    qualities: list[int],
+    color: float,
+    color_index: int | None,
+) -> None:
+    """
+    Crush every strip of frame, in place.
+
+    Each strip is pasted back only after the next one, whose halo overlaps
+    it, has been cropped.
+
+    Args:
+        frame (Image.Image): Whole image, overwritten strip by strip.
+        strips (list[Tile]): Result of split_strips.
+        qualities (list[int]): List of JPEG qualities.
+        color (float): Color enhancement factor.
+        color_index (int | None): Step at which color is enhanced, if any.
+
+    """
+    pending = None
+    for strip in strips:
+        strip_img = frame.crop(strip.halo_box)
+        if pending is not None:
+            frame.paste(*pending)
+        crushed_strip = crush_tile(
+            strip_img,
+            strip.inner_box,
+            qualities=qualities,
+            color=color,
+            color_index=color_index,
+        )
+        pending = (crushed_strip, strip.box[:2])
+    if pending is not None:
+        frame.paste(*pending)
+
+
+def crush_file(
+    input_path: pathlib.Path,
+    output_path: pathlib.Path,
+    qualities: list[int],
+    *,
+    options: Options,
+    progress: bool = True,
+) -> None:
+    """
+    Crush input_path into output_path within a memory budget.
+
+    The input is decoded straight from the file into the only full-size
+    image kept in memory. Every step crushes it in place, one horizontal
+    strip at a time, as in tiles.crush_tiled, so the result is the same as
+    crush(). The last step encodes that image straight into output_path.
+
+    Only the work of each step is bounded by strips: the decoded image is
+    kept whole, so options.strip_memory must hold it, as get_strip_height
+    checks.
+    Pillow decodes and encodes a JPEG in one go, so the input is decoded
+    into one image, and the output encoded from it.
+
+    Args:
+        input_path (pathlib.Path): Image to crush.
+        output_path (pathlib.Path): Where to write the JPEG.
+        qualities (list[int]): List of JPEG qualities.
+        options (Options): Parameters of the crush. Only strip_memory, the
+            memory budget for image data in bytes, color and preprocess are
+            used.
+        progress (bool): Show a progress bar.
+
+    Raises:
+        ValueError: If options.strip_memory is not given.
+        OSError: If the input mode cannot be written as JPEG.
+
+    """
+    strip_memory = options.strip_memory
+    if strip_memory is None:
+        msg = "options.strip_memory must be given."
+        raise ValueError(msg)
+    color, preprocess = options.color, options.preprocess
+
+    with input_path.open("rb") as input_file:
+        frame: Image.Image = Image.open(input_file)
+        if frame.mode not in JPEG_MODES:
+            msg = f"cannot write mode {frame.mode} as JPEG"
+            raise OSError(msg)
+        # Check the budget before decoding anything.
+        strip_height = get_strip_height(
+            frame.size, JPEG_MODES[frame.mode], strip_memory
+        )
+        frame.load()
+
+    if JPEG_MODES[frame.mode] != frame.mode:
+        frame = frame.convert(JPEG_MODES[frame.mode])
+
+    halo = get_mcu_size(frame.mode) if frame.mode in SUBSAMPLED_MODES else 0
+    strips = split_strips(frame.size, strip_height, halo)
+
+    *strip_qualities, last_quality = qualities
+    color_index = 0 if preprocess else None
+
+    with tqdm.tqdm(total=len(qualities), disable=not progress) as progress_bar:
+        if halo:
+            for index, quality in enumerate(strip_qualities):
+                crush_strips(
+                    frame,
+                    strips,
+                    qualities=[quality],
+                    color=color,
+                    color_index=0 if index == color_index else None,
+                )
+                progress_bar.update()
+        elif strip_qualities:
+            crush_strips(
+                frame,
+                strips,
+                qualities=strip_qualities,
+                color=color,
+                color_index=color_index,
+            )
+            progress_bar.update(len(strip_qualities))
+
+        if color != 1.0 and (not preprocess or not strip_qualities):
+            # Color enhancement works pixel by pixel, so strips will do.
+            for strip in split_strips(frame.size, strip_height, 0):
+                strip_img = frame.crop(strip.box)
+                enhanced_img = ImageEnhance.Color(strip_img).enhance(color)
+                frame.paste(enhanced_img, strip.box[:2])
+
+        with open_atomically(output_path) as output_file:
+            frame.save(output_file, format="JPEG", quality=last_quality)
+        progress_bar.update()
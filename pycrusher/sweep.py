@@ -0,0 +1,317 @@
+"""Crush one image with many parameters, sharing their common steps."""
+
+from __future__ import annotations
+
+import io
+import itertools
+from typing import TYPE_CHECKING, Any, NamedTuple
+
+from .core import (
+    Options,
+    generate_default_output_name,
+    generate_quality_sequence,
+    iterate_compressions,
+    write_atomically,
+)
+from .hooks import get_timing, make_sink
+
+if TYPE_CHECKING:
+    import pathlib
+    from collections.abc import Sequence
+
+    from .cache import Cache
+    from .hooks import Sink
+
+
+class Variant(NamedTuple):
+    """Parameters of one output of a sweep."""
+
+    iterations: int
+    extra: int
+    color: float
+    reverse: bool
+    preprocess: bool
+    steps: int | None = None
+
+
+class Operation(NamedTuple):
+    """Encoding at a quality, after enhancing color by a factor."""
+
+    quality: int
+    color: float
+
+
+class Node:
+    """One JPEG encoding, shared by every output whose operations start the same."""
+
+    def __init__(self) -> None:
+        """Start without children or outputs."""
+        self.children: dict[Operation, Node] = {}
+        self.output_paths: list[pathlib.Path] = []
+
+
+def plan_variants(
+    base: Variant,
+    sweep: Sequence[tuple[str, Sequence[float]]],
+    checkpoints: int | None,
+) -> list[Variant]:
+    """
+    Combine every swept value with the base parameters.
+
+    Args:
+        base (Variant): Parameters that are not swept.
+        sweep (Sequence[tuple[str, Sequence[float]]]): Parameter names and
+            their values. Several names sweep their product.
+        checkpoints (int | None): Also keep every this many steps, if given.
+
+    Returns:
+        Unique variants, in order.
+
+    """
+    swept = dict(sweep)
+    variants: list[Variant] = []
+    for values in itertools.product(*swept.values()):
+        parameters: dict[str, Any] = dict(zip(swept, values))
+        variant = base._replace(**parameters)
+        if checkpoints is not None:
+            length = variant.iterations * variant.extra
+            variants.extend(
+                variant._replace(steps=steps)
+                for steps in range(checkpoints, length, checkpoints)
+            )
+        variants.append(variant)
+    return list(dict.fromkeys(variants))
+
+
+def get_parameters(variant: Variant) -> dict[str, Any]:
+    """
+    Get the fields of core.Options that variant sets.
+
+    Args:
+        variant (Variant): Crushing parameters.
+
+    Returns:
+        Parameters, with steps only for checkpoints.
+
+    """
+    parameters = variant._asdict()
+    if variant.steps is None:
+        del parameters["steps"]
+    return parameters
+
+
+def get_output_name(input_path: pathlib.Path, variant: Variant) -> str:
+    """
+    Generate the default output name of variant.
+
+    Args:
+        input_path (pathlib.Path): Image to crush.
+        variant (Variant): Crushing parameters.
+
+    Returns:
+        Default output name, with the step count for checkpoints.
+
+    """
+    parameters = variant._asdict()
+    steps = parameters.pop("steps")
+    output_name = generate_default_output_name(input_path, Options(**parameters))
+    if steps is None:
+        return output_name
+    stem, _, suffix = output_name.rpartition(".")
+    return f"{stem}_s{steps}.{suffix}"
+
+
+def get_operations(variant: Variant) -> list[Operation]:
+    """
+    Spell out the encodings crush() would do for variant.
+
+    Args:
+        variant (Variant): Crushing parameters.
+
+    Returns:
+        One operation per step, with the color enhancement of that step.
+
+    """
+    qualities = variant.extra * generate_quality_sequence(
+        variant.iterations, variant.reverse
+    )
+    qualities = qualities[: variant.steps]
+    color_index = 0 if variant.preprocess else len(qualities) - 1
+    return [
+        Operation(quality, variant.color if index == color_index else 1.0)
+        for index, quality in enumerate(qualities)
+    ]
+
+
+def build_trie(requests: dict[pathlib.Path, list[Operation]]) -> Node:
+    """
+    Merge the operations of every output into a prefix tree.
+
+    Args:
+        requests (dict[pathlib.Path, list[Operation]]): Operations to run
+            for each output.
+
+    Returns:
+        Root of the tree, which does no encoding itself.
+
+    """
+    root = Node()
+    for output_path, operations in requests.items():
+        node = root
+        for operation in operations:
+            node = node.children.setdefault(operation, Node())
+        node.output_paths.append(output_path)
+    return root
+
+
+def count_nodes(root: Node) -> int:
+    """
+    Count the encodings under root.
+
+    Args:
+        root (Node): Result of build_trie.
+
+    Returns:
+        Number of nodes, root excluded.
+
+    """
+    count = 0
+    pending = [root]
+    while pending:
+        node = pending.pop()
+        count += len(node.children)
+        pending.extend(node.children.values())
+    return count
+
+
+def crush_sweep(
+    image_buffer: io.BytesIO,
+    requests: dict[pathlib.Path, list[Operation]],
+    *,
+    progress: bool = True,
+    sink: Sink | None = None,
+) -> int:
+    """
+    Write every requested output, encoding shared prefixes only once.
+
+    Runs of the tree without branches go through iterate_compressions.
+    At a branch, the last JPEG is decoded once and every child starts from
+    it, so outputs are byte-identical to crush().
+
+    Args:
+        image_buffer (io.BytesIO): Buffer containing image file.
+        requests (dict[pathlib.Path, list[Operation]]): Operations to run
+            for each output. See get_operations.
+        progress (bool): Show a progress bar.
+        sink (Sink | None): Receives the timing of every encoding, if given.
+            Positions count encodings across the whole tree.
+
+    Returns:
+        Number of JPEG encodings.
+
+    """
+    root = build_trie(requests)
+    total = count_nodes(root)
+    sink = make_sink(sink, progress=progress)
+    if sink is not None:
+        sink.start(total)
+    encoded = 0
+
+    from PIL import Image  # noqa: PLC0415
+
+    with Image.open(image_buffer) as input_img:
+        pending = [(input_img, *edge) for edge in root.children.items()]
+        while pending:
+            img, operation, node = pending.pop()
+            # Follow the tree until it branches.
+            operations = [operation]
+            chain = [node]
+            while len(node.children) == 1:
+                ((operation, node),) = node.children.items()
+                operations.append(operation)
+                chain.append(node)
+
+            # A variant enhances color once, so a chain does it at most once.
+            color_index = next(
+                (
+                    index
+                    for index, operation in enumerate(operations)
+                    if operation.color != 1.0
+                ),
+                None,
+            )
+            color = 1.0 if color_index is None else operations[color_index].color
+            steps = iterate_compressions(
+                img,
+                [operation.quality for operation in operations],
+                color_index=color_index,
+                options=Options(color=color),
+            )
+            for step in steps:
+                with step.buffer.getbuffer() as view, view[: step.size] as data:
+                    for output_path in chain[step.position].output_paths:
+                        write_atomically(output_path, data)
+                    if step.position == len(chain) - 1 and node.children:
+                        branch_img: Image.Image = Image.open(io.BytesIO(data))
+                        branch_img.load()
+                if sink is not None:
+                    sink.step(get_timing(step)._replace(position=encoded))
+                encoded += 1
+
+            # Children without descendants go last, so they are popped first
+            # and the branch image is dropped as soon as possible.
+            children = sorted(
+                node.children.items(), key=lambda edge: not edge[1].children
+            )
+            pending.extend((branch_img, *edge) for edge in children)
+            if img is not input_img and not any(
+                pending_img is img for pending_img, *_ in pending
+            ):
+                img.close()
+
+    if sink is not None:
+        sink.finish(0)
+    return total
+
+
+def run_sweep(
+    *,
+    input_path: pathlib.Path,
+    outputs: dict[pathlib.Path, Variant],
+    cache: Cache | None = None,
+    progress: bool = True,
+    sink: Sink | None = None,
+) -> list[pathlib.Path]:
+    """
+    Crush input_path once for several variants and write each result.
+
+    Args:
+        input_path (pathlib.Path): Image to crush.
+        outputs (dict[pathlib.Path, Variant]): Parameters of each output.
+        cache (Cache | None): Reuse and store results in this cache, if given.
+        progress (bool): Show a progress bar.
+        sink (Sink | None): Receives the timing of every encoding, if given.
+
+    Returns:
+        Paths written.
+
+    """
+    requests = {}
+    keys = {}
+    for output_path, variant in outputs.items():
+        if cache is not None:
+            key = cache.make_key(input_path, **get_parameters(variant))
+            if cache.fetch(key, output_path):
+                continue
+            keys[output_path] = key
+        requests[output_path] = get_operations(variant)
+
+    if requests:
+        with io.BytesIO(input_path.read_bytes()) as image_buffer:
+            crush_sweep(image_buffer, requests, progress=progress, sink=sink)
+
+    if cache is not None:
+        for output_path, key in keys.items():
+            cache.store(key, output_path)
+
+    return list(outputs)
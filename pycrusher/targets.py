@@ -0,0 +1,360 @@
+"""Stop crushing once an image reaches a target quality or size."""
+
+from __future__ import annotations
+
+import contextlib
+import functools
+import io
+import math
+import time
+from typing import TYPE_CHECKING, NamedTuple
+
+from .core import Options, iterate_compressions, write_last_step
+
+if TYPE_CHECKING:
+    from collections.abc import Callable, Generator, Iterable
+
+    import numpy as np
+    from PIL import Image
+
+    from .core import Step
+    from .hooks import Sink
+
+METRIC_PSNR = "psnr"
+METRIC_SSIM = "ssim"
+METRIC_BYTES = "bytes"
+METRICS = (METRIC_PSNR, METRIC_SSIM, METRIC_BYTES)
+
+# Gaussian window of Wang et al., "Image quality assessment: from error
+# visibility to structural similarity" (2004).
+SSIM_RADIUS = 5
+SSIM_SIGMA = 1.5
+SSIM_C1 = (0.01 * 255) ** 2
+SSIM_C2 = (0.03 * 255) ** 2
+# Their reference implementation first box averages images so their smaller
+# side is about this many pixels, which is also what makes SSIM affordable
+# on every step.
+SSIM_SIDE = 256
+
+
+class Target(NamedTuple):
+    """Value of a metric to crush an image down to."""
+
+    metric: str
+    value: float
+
+    def is_reached(self, measured: float) -> bool:
+        """
+        Check whether a step crushed the image enough.
+
+        Every metric drops as the image is crushed, so a target is reached
+        once the measured value is at or below it.
+
+        Args:
+            measured (float): Metric of a step.
+
+        Returns:
+            Whether crushing can stop.
+
+        """
+        return measured <= self.value
+
+
+class TargetResult(NamedTuple):
+    """How a crush towards a target went."""
+
+    target: Target
+    # Metric of the last computed step.
+    value: float
+    reached: bool
+    steps: int
+    total: int
+    quality: int
+
+
+def to_psnr(mean_squared_error: float) -> float:
+    """
+    Convert a mean squared error of 8-bit samples to decibels.
+
+    Args:
+        mean_squared_error (float): Mean squared error over every channel.
+
+    Returns:
+        PSNR in decibels, or infinity if there is no error.
+
+    """
+    if not mean_squared_error:
+        return math.inf
+    return 10 * math.log10(255**2 / mean_squared_error)
+
+
+def get_psnr(source: Image.Image, img: Image.Image) -> float:
+    """
+    Compute the peak signal-to-noise ratio of img against source.
+
+    Squared errors are summed from the histogram of their absolute values,
+    so every pixel is only touched by Pillow's C loops.
+
+    Args:
+        source (Image.Image): Loaded reference image.
+        img (Image.Image): Image of the same size.
+
+    Returns:
+        PSNR in decibels, over every channel, or infinity if both match.
+
+    """
+    from PIL import ImageChops  # noqa: PLC0415
+
+    difference = ImageChops.difference(source, img.convert(source.mode))
+    histogram = difference.histogram()
+    squared_error = sum(
+        count * (index % 256) ** 2 for index, count in enumerate(histogram)
+    )
+    # The histogram has 256 bins per channel.
+    samples = difference.width * difference.height * len(histogram) // 256
+    return to_psnr(squared_error / max(samples, 1))
+
+
+def blur(plane: np.ndarray) -> np.ndarray:
+    """
+    Average plane over the Gaussian window of SSIM.
+
+    Args:
+        plane (np.ndarray): 2D array.
+
+    Returns:
+        Averages centered on the pixels the window fully covers, so
+        2 * SSIM_RADIUS rows and columns smaller than plane.
+
+    """
+    import numpy as np  # noqa: PLC0415
+
+    offsets = np.arange(-SSIM_RADIUS, SSIM_RADIUS + 1)
+    window = np.exp(-(offsets**2) / (2 * SSIM_SIGMA**2))
+    window /= window.sum()
+
+    # Separable window.
+    rows = plane.shape[0] - 2 * SSIM_RADIUS
+    blurred = np.zeros((rows, plane.shape[1]))
+    for i, weight in enumerate(window):
+        blurred += weight * plane[i : i + rows]
+    columns = plane.shape[1] - 2 * SSIM_RADIUS
+    result = np.zeros((rows, columns))
+    for i, weight in enumerate(window):
+        result += weight * blurred[:, i : i + columns]
+    return result
+
+
+def get_ssim_factor(source: Image.Image) -> int:
+    """
+    Pick how much images are reduced before computing SSIM against source.
+
+    Args:
+        source (Image.Image): Reference image.
+
+    Returns:
+        Integer factor leaving the smaller side about SSIM_SIDE pixels.
+
+    """
+    return max(round(min(source.size) / SSIM_SIDE), 1)
+
+
+def to_luma(img: Image.Image, factor: int) -> Image.Image:
+    """
+    Convert img to luma, reduced by factor.
+
+    Args:
+        img (Image.Image): Image to measure.
+        factor (int): Result of get_ssim_factor.
+
+    Returns:
+        Grayscale image.
+
+    """
+    luma = img.convert("L")
+    if factor > 1:
+        luma = luma.reduce(factor)
+    return luma
+
+
+def get_ssim_map(
+    x: np.ndarray, y: np.ndarray, mean_x: np.ndarray, variance_x: np.ndarray
+) -> np.ndarray:
+    """
+    Compute the structural similarity of y against x, around every pixel.
+
+    Args:
+        x (np.ndarray): Reference luma, as floats.
+        y (np.ndarray): Luma of the same shape, as floats.
+        mean_x (np.ndarray): blur(x).
+        variance_x (np.ndarray): blur(x * x) - mean_x**2.
+
+    Returns:
+        SSIM of the pixels blur keeps.
+
+    """
+    mean_y = blur(y)
+    variance_y = blur(y * y) - mean_y**2
+    covariance = blur(x * y) - mean_x * mean_y
+    ssim: np.ndarray = (
+        (2 * mean_x * mean_y + SSIM_C1) * (2 * covariance + SSIM_C2)
+    ) / ((mean_x**2 + mean_y**2 + SSIM_C1) * (variance_x + variance_y + SSIM_C2))
+    return ssim
+
+
+def get_ssim_function(source: Image.Image) -> Callable[[Image.Image], float]:
+    """
+    Prepare to compute the structural similarity of images against source.
+
+    SSIM is computed on luma, with a Gaussian window, using numpy. Like the
+    reference implementation, images are first reduced by an integer factor
+    so their smaller side is about SSIM_SIDE pixels. Source statistics are
+    computed once.
+
+    Args:
+        source (Image.Image): Loaded reference image.
+
+    Returns:
+        Function giving the mean SSIM of an image of the same size.
+
+    Raises:
+        ValueError: If source is too small once reduced.
+
+    """
+    import numpy as np  # noqa: PLC0415
+
+    factor = get_ssim_factor(source)
+    x = np.asarray(to_luma(source, factor), dtype=np.float64)
+    if min(x.shape) <= 2 * SSIM_RADIUS:
+        msg = f"SSIM needs images larger than {2 * SSIM_RADIUS + 1} pixels"
+        raise ValueError(msg)
+    mean_x = blur(x)
+    variance_x = blur(x * x) - mean_x**2
+
+    def get_ssim(img: Image.Image) -> float:
+        y = np.asarray(to_luma(img, factor), dtype=np.float64)
+        return float(get_ssim_map(x, y, mean_x, variance_x).mean())
+
+    return get_ssim
+
+
+def get_measure(metric: str, source: Image.Image) -> Callable[[Step], float]:
+    """
+    Build the function measuring metric on every step.
+
+    Args:
+        metric (str): One of METRICS.
+        source (Image.Image): Loaded input image.
+
+    Returns:
+        Function of a step, decoding its JPEG unless metric is bytes.
+
+    """
+    if metric == METRIC_BYTES:
+        return lambda step: step.size
+
+    compare: Callable[[Image.Image], float]
+    if metric == METRIC_PSNR:
+        reference = source.convert("L" if source.mode == "L" else "RGB")
+        compare = functools.partial(get_psnr, reference)
+    else:
+        compare = get_ssim_function(source)
+
+    from PIL import Image  # noqa: PLC0415
+
+    def measure(step: Step) -> float:
+        with step.buffer.getbuffer() as view, view[: step.size] as data:
+            img = Image.open(io.BytesIO(data))
+        with img:
+            return compare(img)
+
+    return measure
+
+
+def crush_to_target(
+    image_buffer: io.BytesIO,
+    qualities: list[int],
+    *,
+    options: Options,
+    progress: bool = True,
+    sink: Sink | None = None,
+) -> TargetResult:
+    """
+    Compress image for each quality in qualities, until target is reached.
+
+    Steps are measured as they are computed, against the input, so crushing
+    stops at the first step reaching target, and no step is computed twice.
+
+    Args:
+        image_buffer (io.BytesIO): Buffer containing image file.
+        qualities (list[int]): Longest list of JPEG qualities to go through.
+        options (Options): Parameters of the crush. Only target, color and
+            preprocess are used. Without preprocess, color must be 1.0, since
+            where the last step is is not known up front.
+        progress (bool): Show a progress bar.
+        sink (Sink | None): Receives the timing of every step, and the time
+            spent measuring them as stage 'measure', if given.
+
+    Returns:
+        Where crushing stopped. If target was not reached, every step ran.
+
+    Raises:
+        ValueError: If options.target is not given, or if color is enhanced
+            without preprocess.
+
+    """
+    target = options.target
+    if target is None:
+        msg = "options.target must be given."
+        raise ValueError(msg)
+    if options.color != 1.0 and not options.preprocess:
+        msg = "Targets can only enhance color with preprocess"
+        raise ValueError(msg)
+
+    from PIL import Image  # noqa: PLC0415
+
+    with Image.open(image_buffer) as source:
+        source.load()
+        measure = get_measure(target.metric, source)
+
+        values: list[float] = []
+        positions: list[int] = []
+
+        def until_reached(steps: Iterable[Step]) -> Generator[Step, None, None]:
+            for step in steps:
+                yield step
+                started = time.perf_counter()
+                values.append(measure(step))
+                if sink is not None:
+                    sink.stage("measure", time.perf_counter() - started)
+                positions.append(step.position)
+                if target.is_reached(values[-1]):
+                    return
+
+        steps = iterate_compressions(
+            source,
+            qualities,
+            color_index=0 if options.preprocess else None,
+            options=Options(color=options.color),
+        )
+        with contextlib.closing(steps):
+            write_last_step(
+                image_buffer,
+                until_reached(steps),
+                total=len(qualities),
+                progress=progress,
+                sink=sink,
+            )
+
+    if not values:
+        return TargetResult(
+            target, math.nan, reached=False, steps=0, total=len(qualities), quality=0
+        )
+    return TargetResult(
+        target,
+        values[-1],
+        target.is_reached(values[-1]),
+        positions[-1] + 1,
+        len(qualities),
+        qualities[positions[-1]],
+    )
@@ -0,0 +1,308 @@
+"""Crush large images in tiles, in parallel."""
+
+from __future__ import annotations
+
+import concurrent.futures
+import contextlib
+import functools
+import io
+from typing import TYPE_CHECKING, NamedTuple
+
+import tqdm
+from PIL import Image
+
+from .core import Options, crush, iterate_compressions, write_last_step
+
+if TYPE_CHECKING:
+    from collections.abc import Callable, Iterator
+
+    Box = tuple[int, int, int, int]
+
+BLOCK_SIZE = 8
+# Pillow saves color images with 4:2:0 chroma subsampling,
+# so their MCUs span two blocks in each direction.
+SUBSAMPLED_MODES = frozenset({"RGB", "RGBX", "YCbCr"})
+TILE_SIZE_DEFAULT = 1024
+# Color tiles need a halo one MCU wider per step they go through. Halos are
+# crushed by both neighbors, so they are kept to this fraction of the tile
+# side, which still spares most of the round trips to the workers.
+HALO_FRACTION = 1 / 8
+
+
+class Tile(NamedTuple):
+    """Part of an image, and the margin crushed around it."""
+
+    box: Box
+    halo_box: Box
+
+    @property
+    def inner_box(self) -> Box:
+        """Tile box, relative to its halo box."""
+        x, y = self.halo_box[:2]
+        return (self.box[0] - x, self.box[1] - y, self.box[2] - x, self.box[3] - y)
+
+
+def get_mcu_size(mode: str) -> int:
+    """
+    Get the side of a JPEG MCU for images in mode.
+
+    Args:
+        mode (str): Image mode.
+
+    Returns:
+        MCU side, in pixels.
+
+    """
+    if mode in SUBSAMPLED_MODES:
+        return 2 * BLOCK_SIZE
+    return BLOCK_SIZE
+
+
+def split_tiles(
+    size: tuple[int, int],
+    tile_size: int,
+    halo: int,
+) -> list[Tile]:
+    """
+    Split an image into tiles, row by row.
+
+    Args:
+        size (tuple[int, int]): Image width and height.
+        tile_size (int): Tile side. Should be a multiple of the MCU size.
+        halo (int): Margin around each tile. Should be a multiple of the MCU size.
+
+    Returns:
+        Tiles covering the whole image.
+
+    """
+    width, height = size
+    tiles = []
+    for top in range(0, height, tile_size):
+        for left in range(0, width, tile_size):
+            box = (
+                left,
+                top,
+                min(left + tile_size, width),
+                min(top + tile_size, height),
+            )
+            halo_box = (
+                max(box[0] - halo, 0),
+                max(box[1] - halo, 0),
+                min(box[2] + halo, width),
+                min(box[3] + halo, height),
+            )
+            tiles.append(Tile(box, halo_box))
+    return tiles
+
+
+def split_strips(
+    size: tuple[int, int],
+    strip_height: int,
+    halo: int,
+) -> list[Tile]:
+    """
+    Split an image into full-width horizontal strips, top to bottom.
+
+    Args:
+        size (tuple[int, int]): Image width and height.
+        strip_height (int): Strip height. Should be a multiple of the MCU size.
+        halo (int): Margin above and below each strip. Should be a multiple of
+            the MCU size.
+
+    Returns:
+        Strips covering the whole image.
+
+    """
+    width, height = size
+    return [
+        Tile(
+            (0, top, width, min(top + strip_height, height)),
+            (0, max(top - halo, 0), width, min(top + strip_height + halo, height)),
+        )
+        for top in range(0, height, strip_height)
+    ]
+
+
+def get_steps_per_task(tile_size: int, mcu_size: int) -> int:
+    """
+    Get how many steps a color tile goes through before it is stitched back.
+
+    Args:
+        tile_size (int): Tile side, a multiple of mcu_size.
+        mcu_size (int): Side of a JPEG MCU.
+
+    Returns:
+        Steps per task, at least 1.
+
+    """
+    return max(int(tile_size * HALO_FRACTION) // mcu_size, 1)
+
+
+def crush_tile(
+    tile_img: Image.Image,
+    inner_box: Box,
+    *,
+    qualities: list[int],
+    color: float,
+    color_index: int | None,
+) -> Image.Image:
+    """
+    Compress one tile for each quality in qualities.
+
+    Args:
+        tile_img (Image.Image): Tile, including its halo.
+        inner_box (Box): Part of the tile to return.
+        qualities (list[int]): List of JPEG qualities.
+        color (float): Color enhancement factor.
+        color_index (int | None): Step at which color is enhanced, if any.
+
+    Returns:
+        Decoded tile, without its halo.
+
+    """
+    image_buffer = io.BytesIO()
+    steps = iterate_compressions(
+        tile_img,
+        qualities,
+        color_index=color_index,
+        options=Options(color=color),
+    )
+    write_last_step(image_buffer, steps, total=len(qualities), progress=False)
+    with Image.open(image_buffer) as img:
+        return img.crop(inner_box)
+
+
+def crush_tiles(
+    img: Image.Image,
+    tiles: list[Tile],
+    map_function: Callable[..., Iterator[Image.Image]],
+    crush_function: Callable[[Image.Image, Box], Image.Image],
+) -> Image.Image:
+    """
+    Crush every tile of img and stitch them back together.
+
+    Args:
+        img (Image.Image): Whole image.
+        tiles (list[Tile]): Result of split_tiles.
+        map_function (Callable): Either map or Executor.map.
+        crush_function (Callable): crush_tile, with every keyword argument
+            given.
+
+    Returns:
+        Stitched image.
+
+    """
+    tile_imgs = map_function(
+        crush_function,
+        [img.crop(tile.halo_box) for tile in tiles],
+        [tile.inner_box for tile in tiles],
+    )
+    # Tiles come back in the JPEG mode, which may differ from img's.
+    first_tile_img = next(tile_imgs)
+    stitched = Image.new(first_tile_img.mode, img.size)
+    stitched.paste(first_tile_img, tiles[0].box[:2])
+    for tile, tile_img in zip(tiles[1:], tile_imgs):
+        stitched.paste(tile_img, tile.box[:2])
+    return stitched
+
+
+def crush_tiled(
+    image_buffer: io.BytesIO,
+    qualities: list[int],
+    *,
+    options: Options | None = None,
+    progress: bool = True,
+) -> None:
+    """
+    Compress image tile by tile, in parallel worker processes.
+
+    Tiles are aligned to JPEG MCUs, so blocks are the same as in the whole
+    image. Grayscale and CMYK tiles are independent, and each one goes
+    through every quality in a single task. Decoding upsamples subsampled
+    chroma with its neighbors, so a difference at the edge of a color tile
+    reaches one MCU further in at every step. Color tiles go through several
+    steps per task, with a halo one MCU wider per step, and are stitched back
+    between tasks. Either way, the result is byte-identical
+    to crush(). The last step encodes the stitched image as a whole.
+
+    Args:
+        image_buffer (io.BytesIO): Buffer containing image file.
+        qualities (list[int]): List of JPEG qualities.
+        options (Options | None): Parameters of the crush, or None for the
+            defaults. Only color, preprocess, tile_size and tile_workers are
+            used. Tile sides are rounded up to a multiple of the MCU size,
+            from TILE_SIZE_DEFAULT if not given. With one tile worker, tiles
+            are crushed in this process.
+        progress (bool): Show a progress bar.
+
+    """
+    options = Options() if options is None else options
+    color, preprocess = options.color, options.preprocess
+    if len(qualities) <= 1:
+        crush(
+            image_buffer,
+            qualities,
+            options=Options(color=color, preprocess=preprocess),
+            progress=progress,
+        )
+        return
+
+    img: Image.Image = Image.open(image_buffer)
+    img.load()
+
+    mcu_size = get_mcu_size(img.mode)
+    tile_size = TILE_SIZE_DEFAULT if options.tile_size is None else options.tile_size
+    tile_size = -(-tile_size // mcu_size) * mcu_size
+
+    *tile_qualities, last_quality = qualities
+    color_index = 0 if preprocess else None
+
+    with contextlib.ExitStack() as stack:
+        progress_bar = stack.enter_context(
+            tqdm.tqdm(total=len(qualities), disable=not progress)
+        )
+        map_function: Callable[..., Iterator[Image.Image]] = map
+        if options.tile_workers != 1:
+            executor = stack.enter_context(
+                concurrent.futures.ProcessPoolExecutor(options.tile_workers)
+            )
+            map_function = executor.map
+
+        if img.mode in SUBSAMPLED_MODES:
+            steps_per_task = get_steps_per_task(tile_size, mcu_size)
+            for start in range(0, len(tile_qualities), steps_per_task):
+                task_qualities = tile_qualities[start : start + steps_per_task]
+                img = crush_tiles(
+                    img,
+                    split_tiles(img.size, tile_size, len(task_qualities) * mcu_size),
+                    map_function,
+                    functools.partial(
+                        crush_tile,
+                        qualities=task_qualities,
+                        color=color,
+                        color_index=color_index if start == 0 else None,
+                    ),
+                )
+                progress_bar.update(len(task_qualities))
+        else:
+            img = crush_tiles(
+                img,
+                split_tiles(img.size, tile_size, 0),
+                map_function,
+                functools.partial(
+                    crush_tile,
+                    qualities=tile_qualities,
+                    color=color,
+                    color_index=color_index,
+                ),
+            )
+            progress_bar.update(len(tile_qualities))
+
+        steps = iterate_compressions(
+            img,
+            [last_quality],
+            color_index=None if preprocess else 0,
+            options=Options(color=color),
+        )
+        write_last_step(image_buffer, steps, total=1, progress=False)
+        progress_bar.update()
@@ -0,0 +1,692 @@
+"""Watch directories and crush images as they appear."""
+
+from __future__ import annotations
+
+import contextlib
+import functools
+import hashlib
+import json
+import os
+import pathlib
+import select
+import struct
+import sys
+import time
+from typing import TYPE_CHECKING, Any, NamedTuple
+
+from .batch import plan_jobs
+from .cache import CHUNK_SIZE
+from .core import OVERWRITE_ALWAYS, load_options, run
+
+if TYPE_CHECKING:
+    import concurrent.futures
+    import sqlite3
+    from collections.abc import Generator, Iterable
+
+    from .cache import Cache
+    from .core import Options
+
+MANIFEST_PATH_DEFAULT = pathlib.Path("pycrusher-watch.sqlite3")
+INTERVAL_DEFAULT = 2.0
+SETTLE_DEFAULT = 2.0
+# Longest wait for crushes or changes before checking pending files again.
+TICK = 0.25
+SQLITE_TIMEOUT = 60.0
+# Parameters that change how an image is crushed, but not the output.
+UNRECORDED_PARAMETERS = ("tile_workers", "resume_interval")
+
+# struct inotify_event, followed by a name of its last field's length.
+INOTIFY_EVENT = struct.Struct("iIII")
+INOTIFY_READ_SIZE = 2**16
+IN_ATTRIB = 0x004
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+INOTIFY_MASK = (
+    IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    hash TEXT NOT NULL,
+    parameters TEXT NOT NULL,
+    output_path TEXT NOT NULL,
+    crushed_at REAL NOT NULL,
+    error TEXT
+);
+"""
+
+
+class FileState(NamedTuple):
+    """Size and modification time, to tell whether a file changed."""
+
+    size: int
+    mtime_ns: int
+
+
+class Entry(NamedTuple):
+    """A file a watcher crushed, as recorded in its manifest."""
+
+    state: FileState
+    # SHA-256 of the contents, or '' if crushing failed.
+    hash: str
+    # JSON of the parameters the output was crushed with.
+    parameters: str
+    output_path: pathlib.Path
+    error: str | None = None
+
+
+class Settings(NamedTuple):
+    """Where a Watcher writes, and how eagerly."""
+
+    # Where outputs go, or None for the 'compressions' directory.
+    output_directory: pathlib.Path | None = None
+    # Replace outputs the manifest does not know of. Otherwise, they are
+    # recorded as crushed.
+    overwrite: bool = False
+    # Seconds a file must stay unchanged to be crushed.
+    settle: float = SETTLE_DEFAULT
+    # Files crushed at a time.
+    max_workers: int = 1
+    # Reuse and store results in this cache, if given.
+    cache: Cache | None = None
+
+
+class Pending(NamedTuple):
+    """A file that changed, waiting to settle before it is crushed."""
+
+    state: FileState
+    # time.monotonic() when state was first seen.
+    since: float
+
+
+class Manifest:
+    """
+    Files a watcher has crushed, in a SQLite database.
+
+    Each file is recorded with the size, modification time and hash of the
+    contents it was crushed from, so a watcher that restarts only crushes
+    files that changed since.
+    """
+
+    def __init__(self, path: pathlib.Path = MANIFEST_PATH_DEFAULT) -> None:
+        """
+        Use the manifest at path, creating it once it is first connected to.
+
+        Args:
+            path (pathlib.Path): SQLite database of the manifest.
+
+        """
+        self.path = path
+
+    @contextlib.contextmanager
+    def connect(self) -> Generator[sqlite3.Connection, None, None]:
+        """
+        Open the database, creating it if needed.
+
+        Yields:
+            Connection in autocommit mode.
+
+        """
+        import sqlite3  # noqa: PLC0415
+
+        connection = sqlite3.connect(
+            self.path, timeout=SQLITE_TIMEOUT, isolation_level=None
+        )
+        try:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(SCHEMA)
+            yield connection
+        finally:
+            connection.close()
+
+    def load(self) -> dict[pathlib.Path, Entry]:
+        """
+        Read every recorded file.
+
+        Returns:
+            Entries keyed by input path.
+
+        """
+        with self.connect() as connection:
+            rows = connection.execute(
+                "SELECT path, size, mtime_ns, hash, parameters, output_path, error "
+                "FROM files"
+            ).fetchall()
+        return {
+            pathlib.Path(path): Entry(
+                FileState(size, mtime_ns),
+                digest,
+                parameters,
+                pathlib.Path(output_path),
+                error,
+            )
+            for path, size, mtime_ns, digest, parameters, output_path, error in rows
+        }
+
+    def record(self, input_path: pathlib.Path, entry: Entry) -> None:
+        """
+        Record that input_path was crushed, or failed to be.
+
+        Args:
+            input_path (pathlib.Path): Watched file.
+            entry (Entry): What it was crushed from and into.
+
+        """
+        with self.connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    str(input_path),
+                    entry.state.size,
+                    entry.state.mtime_ns,
+                    entry.hash,
+                    entry.parameters,
+                    str(entry.output_path),
+                    time.time(),
+                    entry.error,
+                ),
+            )
+
+    def forget(self, input_path: pathlib.Path) -> None:
+        """
+        Drop the record of a file that was deleted. Its output is kept.
+
+        Args:
+            input_path (pathlib.Path): Watched file.
+
+        """
+        with self.connect() as connection:
+            connection.execute("DELETE FROM files WHERE path = ?", (str(input_path),))
+
+
+def hash_file(path: pathlib.Path) -> str:
+    """
+    Hash the contents of path.
+
+    Args:
+        path (pathlib.Path): File to hash.
+
+    Returns:
+        Hexadecimal SHA-256.
+
+    """
+    digest = hashlib.sha256()
+    with path.open("rb") as file:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_state(path: pathlib.Path) -> FileState | None:
+    """
+    Stat path.
+
+    Args:
+        path (pathlib.Path): Watched file.
+
+    Returns:
+        Size and modification time, or None if path is not a file anymore.
+
+    """
+    try:
+        stat = path.stat()
+    except OSError:
+        return None
+    if not path.is_file():
+        return None
+    return FileState(stat.st_size, stat.st_mtime_ns)
+
+
+def crush_changed(
+    input_path: pathlib.Path,
+    output_path: pathlib.Path,
+    options: Options,
+    *,
+    known_hash: str | None,
+    keep_output: bool,
+) -> tuple[str, bool]:
+    """
+    Hash input_path, and crush it unless nothing changed.
+
+    Args:
+        input_path (pathlib.Path): Watched file.
+        output_path (pathlib.Path): Where it is crushed to.
+        options (Options): Parameters of the crush. Outputs are always
+            overwritten.
+        known_hash (str | None): Hash of the contents output_path was crushed
+            from with options, if known.
+        keep_output (bool): Keep output_path if it exists, whatever it was
+            crushed from.
+
+    Returns:
+        Hash of the contents, and whether input_path was crushed.
+
+    """
+    digest = hash_file(input_path)
+    if output_path.exists() and (keep_output or digest == known_hash):
+        return digest, False
+
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    run(
+        input_path=input_path,
+        output_path=output_path,
+        options=options._replace(overwrite=OVERWRITE_ALWAYS),
+        progress=False,
+    )
+    return digest, True
+
+
+def is_inotify_supported() -> bool:
+    """
+    Check whether this platform has inotify.
+
+    Returns:
+        Whether this runs on Linux.
+
+    """
+    return sys.platform.startswith("linux")
+
+
+class Inotify:
+    """
+    Changes to the files directly inside directories, reported by inotify.
+
+    inotify is called through ctypes, so this needs no dependency. close must
+    be called once done.
+    """
+
+    def __init__(self, directories: Iterable[pathlib.Path]) -> None:
+        """
+        Start watching directories.
+
+        Args:
+            directories (Iterable[pathlib.Path]): Directories to watch.
+
+        Raises:
+            OSError: If inotify cannot be started or cannot watch a
+                directory.
+
+        """
+        import ctypes  # noqa: PLC0415
+
+        libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self.directories: dict[int, pathlib.Path] = {}
+        for directory in directories:
+            wd = libc.inotify_add_watch(self.fd, os.fsencode(directory), INOTIFY_MASK)
+            if wd < 0:
+                errno = ctypes.get_errno()
+                os.close(self.fd)
+                raise OSError(errno, os.strerror(errno), str(directory))
+            self.directories[wd] = directory
+
+    def read(self, timeout: float) -> set[pathlib.Path] | None:
+        """
+        Wait up to timeout seconds for changes, and read every one that came.
+
+        Args:
+            timeout (float): Seconds to wait if nothing changed yet.
+
+        Returns:
+            Paths that changed, or None if the kernel dropped changes, and
+            the directories must be scanned again.
+
+        """
+        paths: set[pathlib.Path] = set()
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return paths
+        overflow = False
+        while True:
+            try:
+                data = os.read(self.fd, INOTIFY_READ_SIZE)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+                offset += INOTIFY_EVENT.size
+                name = data[offset : offset + length].rstrip(b"\0")
+                offset += length
+                if mask & IN_Q_OVERFLOW:
+                    overflow = True
+                elif name and wd in self.directories:
+                    paths.add(self.directories[wd].joinpath(os.fsdecode(name)))
+        return None if overflow else paths
+
+    def close(self) -> None:
+        """Stop watching."""
+        os.close(self.fd)
+
+
+class Watcher:
+    """
+    Crushes new and changed images in directories, as they settle.
+
+    Files are compared to the manifest by size and modification time, so
+    unchanged files are never read. Files that changed are crushed once their
+    size and modification time stayed the same for settle seconds, so
+    partially written files are left alone, and hashed first, so files
+    touched or copied over with the same contents are not crushed again.
+    Hidden files, such as the temporary files of rsync, are ignored.
+
+    At most max_workers files are crushed at a time. Files waiting for a
+    worker are only kept by path, and picked up in the state they are in
+    once a worker is free.
+    """
+
+    def __init__(
+        self,
+        directories: list[pathlib.Path],
+        manifest: Manifest,
+        *,
+        parameters: dict[str, Any],
+        settings: Settings | None = None,
+        executor: concurrent.futures.Executor | None = None,
+    ) -> None:
+        """
+        Load the manifest.
+
+        Args:
+            directories (list[pathlib.Path]): Watched directories.
+            manifest (Manifest): Where crushed files are recorded.
+            parameters (dict[str, Any]): Fields of core.Options, with targets
+                as lists, as recorded in the manifest.
+            settings (Settings | None): Where to write, and how eagerly, or
+                None for the defaults.
+            executor (concurrent.futures.Executor | None): Crushes files, or
+                None to crush them in this thread.
+
+        """
+        from PIL import Image  # noqa: PLC0415
+
+        settings = Settings() if settings is None else settings
+        self.directories = directories
+        self.manifest = manifest
+        self.options = load_options(parameters)._replace(cache=settings.cache)
+        self.recorded_parameters = json.dumps(
+            {
+                name: value
+                for name, value in parameters.items()
+                if name not in UNRECORDED_PARAMETERS
+            },
+            sort_keys=True,
+        )
+        self.output_directory = settings.output_directory
+        self.overwrite = settings.overwrite
+        self.settle = settings.settle
+        self.max_workers = settings.max_workers
+        self.executor = executor
+        self.extensions = frozenset(Image.registered_extensions())
+
+        self.entries = manifest.load()
+        # Last state of every file, crushed or not. Files crushed with other
+        # parameters are left out, so they are crushed again.
+        self.seen = {
+            path: entry.state
+            for path, entry in self.entries.items()
+            if self.is_current(entry, self.get_output_path(path))
+        }
+        # Input crushed, or being crushed, to each output, so two inputs never
+        # share one.
+        self.owners = {
+            entry.output_path: path
+            for path, entry in self.entries.items()
+            if entry.error is None
+        }
+        self.pending: dict[pathlib.Path, Pending] = {}
+        self.running: dict[
+            concurrent.futures.Future[tuple[str, bool]],
+            tuple[pathlib.Path, pathlib.Path, FileState],
+        ] = {}
+        self.crushed = 0
+        self.failures: dict[pathlib.Path, BaseException] = {}
+
+    def is_watched(self, path: pathlib.Path) -> bool:
+        """
+        Check whether path may be an image to crush, from its name.
+
+        Args:
+            path (pathlib.Path): File inside a watched directory.
+
+        Returns:
+            Whether path is not hidden, and has a registered image extension.
+
+        """
+        return not path.name.startswith(".") and path.suffix.lower() in self.extensions
+
+    def scan(self) -> None:
+        """Stat every file in the directories, noting those that changed."""
+        found = set()
+        for directory in self.directories:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    path = directory.joinpath(entry.name)
+                    if not self.is_watched(path) or not entry.is_file():
+                        continue
+                    found.add(path)
+                    stat = entry.stat()
+                    self.update(path, FileState(stat.st_size, stat.st_mtime_ns))
+        for path in set(self.seen).difference(found):
+            self.update(path, None)
+
+    def check(self, paths: Iterable[pathlib.Path]) -> None:
+        """
+        Stat paths, reported changed, noting those that did.
+
+        Args:
+            paths (Iterable[pathlib.Path]): Files inside the directories.
+
+        """
+        for path in paths:
+            if self.is_watched(path):
+                self.update(path, get_state(path))
+
+    def update(self, path: pathlib.Path, state: FileState | None) -> None:
+        """
+        Note the current state of path.
+
+        Args:
+            path (pathlib.Path): Watched file.
+            state (FileState | None): Its state, or None if it is gone.
+
+        """
+        if state is None:
+            self.pending.pop(path, None)
+            if self.seen.pop(path, None) is not None and path in self.entries:
+                entry = self.entries.pop(path)
+                if self.owners.get(entry.output_path) == path:
+                    del self.owners[entry.output_path]
+                self.manifest.forget(path)
+            return
+        pending = self.pending.get(path)
+        if pending is not None:
+            if pending.state != state:
+                self.pending[path] = Pending(state, time.monotonic())
+        elif self.seen.get(path) != state:
+            self.pending[path] = Pending(state, time.monotonic())
+        self.seen[path] = state
+
+    def get_output_path(self, input_path: pathlib.Path) -> pathlib.Path:
+        """
+        Name the output of input_path.
+
+        Args:
+            input_path (pathlib.Path): Watched file.
+
+        Returns:
+            Default output name, in output_directory.
+
+        """
+        (job,) = plan_jobs([input_path], self.output_directory, self.options)
+        return job.output_path.resolve()
+
+    def is_current(self, entry: Entry, output_path: pathlib.Path) -> bool:
+        """
+        Check whether entry was crushed like files are crushed now.
+
+        Args:
+            entry (Entry): Manifest entry.
+            output_path (pathlib.Path): Output of its file, from get_output_path.
+
+        Returns:
+            Whether entry has the same parameters and output path.
+
+        """
+        return (
+            entry.parameters == self.recorded_parameters
+            and entry.output_path == output_path
+        )
+
+    def submit(self) -> None:
+        """Crush settled files, while fewer than max_workers are crushed."""
+        import concurrent.futures  # noqa: PLC0415
+
+        now = time.monotonic()
+        running = {input_path for input_path, _, _ in self.running.values()}
+        for path, pending in list(self.pending.items()):
+            if len(self.running) >= self.max_workers:
+                return
+            if path in running:
+                continue
+            state = get_state(path)
+            if state != pending.state:
+                self.update(path, state)
+                continue
+            if now - pending.since < self.settle:
+                continue
+
+            del self.pending[path]
+            output_path = self.get_output_path(path)
+            entry = self.entries.get(path)
+            known = entry is not None and self.is_current(entry, output_path)
+            task = functools.partial(
+                crush_changed,
+                path,
+                output_path,
+                self.options,
+                known_hash=entry.hash if known and entry is not None else None,
+                keep_output=not self.overwrite
+                and (entry is None or entry.output_path != output_path),
+            )
+            future: concurrent.futures.Future[tuple[str, bool]]
+            owner = self.owners.setdefault(output_path, path)
+            if owner != path:
+                future = concurrent.futures.Future()
+                future.set_exception(
+                    ValueError(
+                        f"Inputs {owner} and {path} would both be written to "
+                        f"{output_path}"
+                    )
+                )
+            elif self.executor is None:
+                future = concurrent.futures.Future()
+                try:
+                    future.set_result(task())
+                except Exception as exc:  # noqa: BLE001
+                    future.set_exception(exc)
+            else:
+                future = self.executor.submit(task)
+            self.running[future] = (path, output_path, state)
+
+    def collect(self, timeout: float) -> None:
+        """
+        Record files crushed within timeout seconds.
+
+        Args:
+            timeout (float): Seconds to wait for a file to be crushed.
+
+        """
+        import concurrent.futures  # noqa: PLC0415
+
+        if not self.running:
+            return
+        done, _ = concurrent.futures.wait(
+            self.running,
+            timeout=timeout,
+            return_when=concurrent.futures.FIRST_COMPLETED,
+        )
+        for future in done:
+            input_path, output_path, state = self.running.pop(future)
+            error = future.exception()
+            if error is None:
+                digest, crushed = future.result()
+                entry = Entry(state, digest, self.recorded_parameters, output_path)
+                if crushed:
+                    self.crushed += 1
+                    print(f"Crushed {input_path} to {output_path}")  # noqa: T201
+            else:
+                self.failures[input_path] = error
+                print(  # noqa: T201
+                    f"Failed to crush {input_path}: {error}", file=sys.stderr
+                )
+                entry = Entry(
+                    state, "", self.recorded_parameters, output_path, str(error)
+                )
+            released = error is not None or input_path not in self.seen
+            if released and self.owners.get(output_path) == input_path:
+                del self.owners[output_path]
+            if input_path in self.seen:
+                self.entries[input_path] = entry
+                self.manifest.record(input_path, entry)
+
+    def is_idle(self) -> bool:
+        """
+        Check whether no file waits or is being crushed.
+
+        Returns:
+            Whether nothing is pending or running.
+
+        """
+        return not self.pending and not self.running
+
+    def run(
+        self,
+        *,
+        interval: float = INTERVAL_DEFAULT,
+        inotify: Inotify | None = None,
+        once: bool = False,
+    ) -> None:
+        """
+        Crush changes until interrupted.
+
+        The directories are scanned once, for changes made while nothing was
+        watching. Then, with inotify, only the files it reports are checked.
+        Otherwise, the directories are scanned every interval seconds.
+
+        Args:
+            interval (float): Seconds between scans, without inotify.
+            inotify (Inotify | None): Reports changes, if given.
+            once (bool): Return once every change found by the first scan
+                was crushed.
+
+        """
+        self.scan()
+        scanned = time.monotonic()
+        while not (once and self.is_idle()):
+            self.submit()
+            if self.running:
+                self.collect(TICK)
+            elif inotify is None or once:
+                time.sleep(TICK)
+            if once:
+                continue
+            if inotify is not None:
+                changed = inotify.read(0 if self.running else TICK)
+                if changed is None:
+                    self.scan()
+                else:
+                    self.check(changed)
+            elif time.monotonic() - scanned >= interval:
+                self.scan()
+                scanned = time.monotonic()
@@ -0,0 +1,9 @@
+from __future__ import annotations
+
+import importlib.util
+
+# Tests of the numpy engine import it, so they cannot even be collected
+# without numpy.
+collect_ignore: list[str] = []
+if importlib.util.find_spec("numpy") is None:
+    collect_ignore += ["test_dct.py", "test_stack.py"]
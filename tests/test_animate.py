@@ -0,0 +1,157 @@
+from __future__ import annotations
+
+import io
+from typing import TYPE_CHECKING
+
+import pytest
+from PIL import Image, features
+
+from pycrusher.animate import Animation, GIFWriter, crush_animated, write_frames
+from pycrusher.cache import Cache
+from pycrusher.core import (
+    Options,
+    crush,
+    generate_quality_sequence,
+    iterate_compressions,
+    run,
+)
+from tests.utils import SMALL_TEST_IMAGES_DIRECTORY
+
+if TYPE_CHECKING:
+    import pathlib
+
+QUALITIES = generate_quality_sequence(10, reverse=False)
+
+
+def read(name: str) -> bytes:
+    return SMALL_TEST_IMAGES_DIRECTORY.joinpath(name).read_bytes()
+
+
+def animate(name: str, animation: Animation) -> bytes:
+    buf = io.BytesIO(read(name))
+    crush_animated(
+        buf,
+        QUALITIES,
+        options=Options(color=1.0, preprocess=False, animation=animation),
+        progress=False,
+    )
+    return buf.getvalue()
+
+
+class TestCrushAnimated:
+    @pytest.mark.parametrize("name", ["gradient.png", "gradient.jpg", "gray.png"])
+    def test_output_matches_crush(self, tmp_path: pathlib.Path, name: str) -> None:
+        output = animate(name, Animation(tmp_path.joinpath("out.gif")))
+
+        expected = io.BytesIO(read(name))
+        crush(
+            expected,
+            QUALITIES,
+            options=Options(color=1.0, preprocess=False),
+            progress=False,
+        )
+        assert output == expected.getvalue()
+
+    @pytest.mark.parametrize(
+        ("every", "frames"), [(1, 10), (3, 4), (4, 4), (9, 2), (100, 2)]
+    )
+    def test_gif(self, tmp_path: pathlib.Path, every: int, frames: int) -> None:
+        path = tmp_path.joinpath("out.gif")
+        animate("gradient.png", Animation(path, every=every, duration=70))
+
+        with Image.open(path) as img:
+            assert img.n_frames == frames
+            assert img.info["loop"] == 0
+            for index in range(frames):
+                img.seek(index)
+                assert img.info["duration"] == 70
+                assert img.size == (64, 48)
+
+    @pytest.mark.skipif(
+        not features.check("webp"),  # type: ignore[no-untyped-call]
+        reason="WebP unsupported",
+    )
+    def test_webp(self, tmp_path: pathlib.Path) -> None:
+        path = tmp_path.joinpath("out.webp")
+        animate("gradient.png", Animation(path, every=3, width=32))
+
+        with Image.open(path) as img:
+            assert img.n_frames == 4
+            assert img.size == (32, 24)
+            for index in range(img.n_frames):
+                img.seek(index)
+                img.load()
+
+    def test_frames_are_steps(self, tmp_path: pathlib.Path) -> None:
+        directory = tmp_path.joinpath("frames")
+        animate("gradient.png", Animation(directory, every=4))
+
+        names = sorted(path.name for path in directory.iterdir())
+        positions = [0, 4, 8, 9]
+        assert names == [f"frame{index:05d}.jpg" for index in range(len(positions))]
+        for name, position in zip(names, positions):
+            expected = io.BytesIO(read("gradient.png"))
+            crush(
+                expected,
+                QUALITIES[: position + 1],
+                options=Options(color=1.0, preprocess=False),
+                progress=False,
+            )
+            assert directory.joinpath(name).read_bytes() == expected.getvalue()
+
+    def test_shrunk_frames(self, tmp_path: pathlib.Path) -> None:
+        directory = tmp_path.joinpath("frames")
+        animate("gradient.jpg", Animation(directory, width=16))
+
+        frames = sorted(directory.iterdir())
+        assert len(frames) == len(QUALITIES)
+        for frame in frames:
+            assert frame.suffix == ".png"
+            with Image.open(frame) as img:
+                assert img.size == (16, 12)
+
+
+class TestWriteFrames:
+    def test_frames_are_written_as_steps_come(self, tmp_path: pathlib.Path) -> None:
+        path = tmp_path.joinpath("out.gif")
+        with path.open("wb") as stream:
+            steps = iterate_compressions(io.BytesIO(read("gradient.png")), QUALITIES)
+            frames = write_frames(
+                steps, GIFWriter(stream, 100), total=len(QUALITIES), every=1, width=None
+            )
+            sizes = []
+            for _ in frames:
+                stream.flush()
+                sizes.append(path.stat().st_size)
+
+        assert sizes == sorted(sizes)
+        assert len(set(sizes)) == len(QUALITIES)
+
+
+def test_run_does_not_use_cache(tmp_path: pathlib.Path) -> None:
+    input_path = tmp_path.joinpath("input.png")
+    input_path.write_bytes(read("gradient.png"))
+    cache = Cache(directory=tmp_path.joinpath("cache"))
+
+    for index in range(2):
+        run(
+            input_path=input_path,
+            output_path=tmp_path.joinpath("output.jpg"),
+            options=Options(
+                iterations=10,
+                extra=1,
+                color=1.0,
+                reverse=False,
+                preprocess=False,
+                overwrite="always",
+                animation=Animation(tmp_path.joinpath(f"out{index}.gif")),
+                cache=cache,
+            ),
+            progress=False,
+        )
+
+    assert (
+        tmp_path.joinpath("out1.gif").read_bytes()
+        == tmp_path.joinpath("out0.gif").read_bytes()
+    )
+    assert cache.stats().entries == 0
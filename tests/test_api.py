@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+import io
+import itertools
+import pathlib
+import tempfile
+from typing import TYPE_CHECKING
+
+import hypothesis
+import pytest
+from hypothesis import strategies as st
+from PIL import Image
+
+from pycrusher import Crusher
+from pycrusher.core import OVERWRITE_ALWAYS, Options, run
+from tests.utils import SMALL_TEST_IMAGES_DIRECTORY
+
+if TYPE_CHECKING:
+    from tests.utils import Parameters
+
+
+@pytest.fixture
+def input_path() -> pathlib.Path:
+    return next(SMALL_TEST_IMAGES_DIRECTORY.glob("*.png"))
+
+
+class TestCrusher:
+    @hypothesis.settings(deadline=None, max_examples=10)
+    @hypothesis.given(
+        iterations=st.integers(min_value=1, max_value=10),
+        extra=st.integers(min_value=1, max_value=2),
+        color=st.sampled_from([1.0, 0.5, 2.0]),
+        reverse=st.booleans(),
+        preprocess=st.booleans(),
+    )
+    def test_crush_matches_run(
+        self,
+        iterations: int,
+        extra: int,
+        color: float,
+        *,
+        reverse: bool,
+        preprocess: bool,
+    ) -> None:
+        input_path = next(SMALL_TEST_IMAGES_DIRECTORY.glob("*.png"))
+        parameters: Parameters = {
+            "iterations": iterations,
+            "extra": extra,
+            "color": color,
+            "reverse": reverse,
+            "preprocess": preprocess,
+        }
+        with tempfile.TemporaryDirectory() as directory:
+            output_path = pathlib.Path(directory, "expected.jpg")
+            run(
+                input_path=input_path,
+                output_path=output_path,
+                options=Options(overwrite=OVERWRITE_ALWAYS, **parameters),
+                progress=False,
+            )
+            expected = output_path.read_bytes()
+
+        assert Crusher(Options(**parameters)).crush(input_path.read_bytes()) == expected
+
+    def test_accepted_inputs(self, input_path: pathlib.Path) -> None:
+        crusher = Crusher(Options(iterations=5))
+        expected = crusher.crush(input_path.read_bytes())
+
+        with input_path.open("rb") as input_file:
+            assert crusher.crush(input_file) == expected
+        assert crusher.crush(bytearray(input_path.read_bytes())) == expected
+        with Image.open(input_path) as img:
+            assert crusher.crush(img) == expected
+            # The caller's image is left open and unchanged.
+            assert img.tobytes() == Image.open(input_path).tobytes()
+
+    def test_crush_image(self, input_path: pathlib.Path) -> None:
+        crusher = Crusher(Options(iterations=5))
+        img = crusher.crush_image(input_path.read_bytes())
+        assert img.format == "JPEG"
+
+    def test_frames(self, input_path: pathlib.Path) -> None:
+        crusher = Crusher(Options(iterations=5, extra=2, color=2.0))
+
+        frames = list(crusher.frames(input_path.read_bytes()))
+
+        assert [frame.position for frame in frames] == list(range(10))
+        assert [frame.quality for frame in frames] == crusher.qualities
+        assert frames[-1].data == crusher.crush(input_path.read_bytes())
+        assert frames[0].to_image().size == Image.open(input_path).size
+
+    def test_frames_stop_early(self, input_path: pathlib.Path) -> None:
+        crusher = Crusher(Options(iterations=50))
+        data = input_path.read_bytes()
+
+        frames = crusher.frames(data)
+        first_frames = list(itertools.islice(frames, 3))
+        frames.close()
+
+        expected = Crusher(Options(iterations=50, extra=1)).frames(io.BytesIO(data))
+        assert first_frames == list(itertools.islice(expected, 3))
+
+    def test_frames_converge(self, input_path: pathlib.Path) -> None:
+        crusher = Crusher(Options(iterations=2, extra=50, converge=True))
+        data = input_path.read_bytes()
+
+        frames = list(crusher.frames(data))
+
+        assert len(frames) < len(crusher.qualities)
+        assert frames[-1].data == Crusher(Options(iterations=2, extra=50)).crush(data)
+
+    @pytest.mark.parametrize(
+        ("parameters", "match"),
+        [
+            ({"iterations": 0}, "Iterations must be greater or equal to 1: 0"),
+            ({"extra": 0}, "Extra must be greater or equal to 1: 0"),
+            ({"color": -1.0}, "Color enhancement must be greater or equal to 0.0"),
+        ],
+    )
+    def test_invalid_parameters(self, parameters: dict[str, float], match: str) -> None:
+        with pytest.raises(TypeError, match=match):
+            Crusher(Options(**parameters))  # type: ignore[arg-type]
+
+    @pytest.mark.parametrize(
+        ("options", "match"),
+        [
+            (Options(engine="numpy"), "Crusher cannot crush with the numpy engine"),
+            (Options(tile_size=32), "Crusher cannot crush with tile_size"),
+        ],
+    )
+    def test_other_modes(self, options: Options, match: str) -> None:
+        with pytest.raises(TypeError, match=match):
+            Crusher(options)
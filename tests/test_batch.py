@@ -0,0 +1,329 @@
+from __future__ import annotations
+
+import pathlib
+import shutil
+import threading
+import time
+from typing import TYPE_CHECKING
+
+import pytest
+
+from pycrusher.batch import (
+    EXECUTORS,
+    Job,
+    Schedule,
+    expand_input_paths,
+    plan_jobs,
+    plan_sweep_jobs,
+    run_batch,
+)
+from pycrusher.core import Options
+from pycrusher.hooks import SummarySink
+from pycrusher.sweep import Variant
+from tests.utils import SMALL_TEST_IMAGES_DIRECTORY
+
+if TYPE_CHECKING:
+    from tests.utils import Parameters
+
+PARAMETERS: Parameters = {
+    "iterations": 2,
+    "extra": 1,
+    "color": 1.0,
+    "reverse": False,
+    "preprocess": False,
+}
+
+
+@pytest.fixture
+def input_directory(tmp_path: pathlib.Path) -> pathlib.Path:
+    directory = tmp_path.joinpath("inputs")
+    shutil.copytree(SMALL_TEST_IMAGES_DIRECTORY, directory)
+    # gradient.jpg and gradient.png would share their default output name.
+    directory.joinpath("gradient.jpg").rename(directory.joinpath("photo.jpg"))
+    directory.joinpath("notes.txt").write_text("not an image")
+    return directory
+
+
+class TestExpandInputPaths:
+    def test_directory_expands_to_images(self, input_directory: pathlib.Path) -> None:
+        expanded = expand_input_paths([input_directory])
+        assert expanded == sorted(
+            path for path in input_directory.iterdir() if path.suffix != ".txt"
+        )
+
+    def test_glob(self, input_directory: pathlib.Path) -> None:
+        expanded = expand_input_paths([input_directory.joinpath("*.png")])
+        assert expanded
+        assert all(path.suffix == ".png" for path in expanded)
+
+    def test_duplicates_are_dropped(self, input_directory: pathlib.Path) -> None:
+        input_path = next(input_directory.glob("*.png"))
+        expanded = expand_input_paths([input_path, input_directory, input_path])
+        assert expanded[0] == input_path
+        assert len(expanded) == len(set(expanded))
+
+    def test_missing_path_is_kept(self) -> None:
+        missing = pathlib.Path("does/not/exist.png")
+        assert expand_input_paths([missing]) == [missing]
+
+
+class TestPlanJobs:
+    def test_default_output_names(self, tmp_path: pathlib.Path) -> None:
+        jobs = plan_jobs(
+            [pathlib.Path("a/one.png"), pathlib.Path("b/two.jpg")],
+            tmp_path,
+            Options(**PARAMETERS),
+        )
+        assert jobs == [
+            Job(pathlib.Path("a/one.png"), tmp_path.joinpath("one_i2_e1.jpg")),
+            Job(pathlib.Path("b/two.jpg"), tmp_path.joinpath("two_i2_e1.jpg")),
+        ]
+
+    def test_sweep_output_names(self, tmp_path: pathlib.Path) -> None:
+        variants = [
+            Variant(**PARAMETERS),
+            Variant(**PARAMETERS)._replace(extra=2),
+            Variant(**PARAMETERS, steps=1),
+        ]
+        jobs = plan_sweep_jobs([pathlib.Path("a/one.png")], tmp_path, variants)
+        assert [job.output_path.name for job in jobs] == [
+            "one_i2_e1.jpg",
+            "one_i2_e2.jpg",
+            "one_i2_e1_s1.jpg",
+        ]
+        assert [job.variant for job in jobs] == variants
+
+
+class TestRunBatch:
+    @pytest.mark.parametrize("executor", EXECUTORS)
+    @pytest.mark.parametrize("max_workers", [1, 2])
+    def test_run_batch_writes_every_output(
+        self,
+        input_directory: pathlib.Path,
+        tmp_path: pathlib.Path,
+        max_workers: int,
+        executor: str,
+    ) -> None:
+        output_directory = tmp_path.joinpath("outputs")
+        jobs = plan_jobs(
+            expand_input_paths([input_directory]),
+            output_directory,
+            Options(**PARAMETERS),
+        )
+
+        failures = run_batch(
+            jobs,
+            options=Options(overwrite="always", **PARAMETERS),
+            schedule=Schedule(max_workers=max_workers, executor=executor),
+        )
+
+        assert not failures
+        assert all(job.output_path.is_file() for job in jobs)
+
+    def test_run_batch_never_overwrites(
+        self,
+        input_directory: pathlib.Path,
+        tmp_path: pathlib.Path,
+    ) -> None:
+        jobs = plan_jobs(
+            expand_input_paths([input_directory]), tmp_path, Options(**PARAMETERS)
+        )
+        for job in jobs:
+            job.output_path.write_bytes(b"keep me")
+
+        failures = run_batch(
+            jobs,
+            options=Options(overwrite="never", **PARAMETERS),
+            schedule=Schedule(max_workers=2),
+        )
+
+        assert not failures
+        assert all(job.output_path.read_bytes() == b"keep me" for job in jobs)
+
+    def test_run_batch_rejects_shared_outputs(self, tmp_path: pathlib.Path) -> None:
+        jobs = plan_jobs(
+            [
+                SMALL_TEST_IMAGES_DIRECTORY.joinpath("gradient.png"),
+                SMALL_TEST_IMAGES_DIRECTORY.joinpath("gradient.jpg"),
+            ],
+            tmp_path,
+            Options(**PARAMETERS),
+        )
+
+        with pytest.raises(ValueError, match="would both be written to"):
+            run_batch(
+                jobs,
+                options=Options(overwrite="always", **PARAMETERS),
+                schedule=Schedule(max_workers=2),
+            )
+        assert not any(tmp_path.iterdir())
+
+    def test_run_batch_rejects_shared_inputs(self, tmp_path: pathlib.Path) -> None:
+        input_path = SMALL_TEST_IMAGES_DIRECTORY.joinpath("gradient.png")
+        jobs = [
+            Job(input_path, tmp_path.joinpath("a.jpg")),
+            Job(input_path, tmp_path.joinpath("b.jpg")),
+        ]
+
+        with pytest.raises(ValueError, match="would be crushed twice"):
+            run_batch(
+                jobs,
+                options=Options(overwrite="always", **PARAMETERS),
+                schedule=Schedule(max_workers=2),
+            )
+        assert not any(tmp_path.iterdir())
+
+    def test_run_batch_rejects_job_beside_sweep(self, tmp_path: pathlib.Path) -> None:
+        input_path = SMALL_TEST_IMAGES_DIRECTORY.joinpath("gradient.png")
+        jobs = [
+            Job(input_path, tmp_path.joinpath("a.jpg"), Variant(**PARAMETERS)),
+            Job(input_path, tmp_path.joinpath("b.jpg")),
+        ]
+
+        with pytest.raises(ValueError, match="would be crushed twice"):
+            run_batch(
+                jobs,
+                options=Options(overwrite="always", **PARAMETERS),
+                schedule=Schedule(max_workers=2),
+            )
+        assert not any(tmp_path.iterdir())
+
+    def test_run_batch_reports_failures(self, tmp_path: pathlib.Path) -> None:
+        broken = tmp_path.joinpath("broken.png")
+        broken.write_bytes(b"not an image")
+        jobs = plan_jobs([broken], tmp_path.joinpath("outputs"), Options(**PARAMETERS))
+
+        failures = run_batch(
+            jobs,
+            options=Options(overwrite="always", **PARAMETERS),
+            schedule=Schedule(max_workers=1),
+        )
+
+        assert list(failures) == [broken]
+
+    @pytest.mark.parametrize("max_workers", [1, 2])
+    def test_run_batch_sweep(
+        self,
+        input_directory: pathlib.Path,
+        tmp_path: pathlib.Path,
+        max_workers: int,
+    ) -> None:
+        variants = [Variant(**PARAMETERS)._replace(extra=extra) for extra in (1, 2)]
+        jobs = plan_sweep_jobs(
+            expand_input_paths([input_directory]), tmp_path, variants
+        )
+
+        failures = run_batch(
+            jobs,
+            options=Options(overwrite="always", **PARAMETERS),
+            schedule=Schedule(max_workers=max_workers),
+        )
+
+        assert not failures
+        assert all(job.output_path.is_file() for job in jobs)
+
+    @pytest.mark.parametrize("executor", EXECUTORS)
+    @pytest.mark.parametrize("max_workers", [1, 2])
+    def test_run_batch_reports_to_sink(
+        self,
+        input_directory: pathlib.Path,
+        tmp_path: pathlib.Path,
+        max_workers: int,
+        executor: str,
+    ) -> None:
+        jobs = plan_jobs(
+            expand_input_paths([input_directory]), tmp_path, Options(**PARAMETERS)
+        )
+        summary = SummarySink()
+
+        failures = run_batch(
+            jobs,
+            options=Options(overwrite="always", **PARAMETERS),
+            schedule=Schedule(max_workers=max_workers, executor=executor),
+            progress=False,
+            sink=summary,
+        )
+
+        assert not failures
+        assert summary.images == len(jobs)
+        assert len(summary.step_seconds) == len(jobs) * PARAMETERS["iterations"]
+
+    def test_executors_write_the_same_outputs(
+        self, input_directory: pathlib.Path, tmp_path: pathlib.Path
+    ) -> None:
+        input_paths = expand_input_paths([input_directory])
+        outputs = []
+        for executor in EXECUTORS:
+            jobs = plan_jobs(
+                input_paths, tmp_path.joinpath(executor), Options(**PARAMETERS)
+            )
+            failures = run_batch(
+                jobs,
+                options=Options(overwrite="always", **PARAMETERS),
+                schedule=Schedule(max_workers=2, executor=executor),
+                progress=False,
+            )
+            assert not failures
+            outputs.append([job.output_path.read_bytes() for job in jobs])
+
+        assert outputs[0] == outputs[1] == outputs[2]
+
+    @pytest.mark.parametrize(("memory_budget", "most_running"), [(1, 1), (2**30, 3)])
+    def test_run_batch_memory_budget(
+        self,
+        input_directory: pathlib.Path,
+        tmp_path: pathlib.Path,
+        monkeypatch: pytest.MonkeyPatch,
+        memory_budget: int,
+        most_running: int,
+    ) -> None:
+        lock = threading.Lock()
+        running = [0]
+        counts = []
+
+        def counting_run(**kwargs: object) -> None:
+            del kwargs
+            with lock:
+                running[0] += 1
+                counts.append(running[0])
+            time.sleep(0.1)
+            with lock:
+                running[0] -= 1
+
+        monkeypatch.setattr("pycrusher.batch.run", counting_run)
+        input_paths = expand_input_paths([input_directory])
+        jobs = [
+            Job(path, tmp_path.joinpath(f"{path.name}.jpg")) for path in input_paths
+        ]
+
+        failures = run_batch(
+            jobs,
+            options=Options(overwrite="always", **PARAMETERS),
+            schedule=Schedule(
+                max_workers=len(jobs), executor="thread", memory_budget=memory_budget
+            ),
+            progress=False,
+        )
+
+        assert not failures
+        assert max(counts) == most_running
+
+    def test_run_batch_memory_budget_reports_unreadable_inputs(
+        self, tmp_path: pathlib.Path
+    ) -> None:
+        broken = tmp_path.joinpath("broken.png")
+        broken.write_bytes(b"not an image")
+        input_path = SMALL_TEST_IMAGES_DIRECTORY.joinpath("gray.png")
+        jobs = plan_jobs(
+            [broken, input_path], tmp_path.joinpath("outputs"), Options(**PARAMETERS)
+        )
+
+        failures = run_batch(
+            jobs,
+            options=Options(overwrite="always", **PARAMETERS),
+            schedule=Schedule(max_workers=2, executor="thread", memory_budget=2**30),
+            progress=False,
+        )
+
+        assert list(failures) == [broken]
+        assert jobs[1].output_path.is_file()
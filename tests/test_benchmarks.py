@@ -0,0 +1,128 @@
+from __future__ import annotations
+
+import pytest
+
+from benchmarks.crushing import (
+    Case,
+    compare_results,
+    get_fastest_executors,
+    get_slow_previews,
+    get_speedups,
+    measure,
+    plan_cases,
+)
+from benchmarks.images import MODES, generate_image
+from benchmarks.startup import parse_import_times
+
+
+@pytest.mark.parametrize("mode", list(MODES))
+def test_generate_image_is_deterministic(mode: str) -> None:
+    img = generate_image((64, 48), mode)
+    assert img.mode == mode
+    assert img.tobytes() == generate_image((64, 48), mode).tobytes()
+
+
+def test_plan_cases_have_unique_keys() -> None:
+    cases = plan_cases([(64, 48), (128, 96)], list(MODES))
+    assert len({case.key for case in cases}) == len(cases)
+
+
+@pytest.mark.parametrize(
+    "case",
+    [
+        Case("compress", "RGBA", (64, 48), 2, 1),
+        Case("change_color", "L", (64, 48)),
+        Case("run", "CMYK", (64, 48), 2, 2),
+        Case("crush", "RGB", (64, 48), 2, 1),
+        Case("preview", "CMYK", (64, 48), 2, 1),
+        Case("batch_thread", "RGB", (64, 48), 2, 1),
+        Case("crush_tiled", "RGB", (64, 48), 2, 1),
+    ],
+)
+def test_measure(case: Case) -> None:
+    metrics = measure(case, repeat=1)
+    assert metrics["seconds"] > 0
+    assert ("decode_ms" in metrics) == (case.kind == "compress")
+    assert ("convert_seconds" in metrics) == (case.mode == "RGBA")
+
+
+def test_compare_results() -> None:
+    baseline = {
+        "fast": {"seconds": 1.0, "peak_rss": 100},
+        "slow": {"seconds": 1.0, "peak_rss": 100},
+        "big": {"seconds": 1.0, "peak_rss": 100},
+        "gone": {"seconds": 1.0, "peak_rss": 100},
+    }
+    current = {
+        "fast": {"seconds": 1.05, "peak_rss": 100},
+        "slow": {"seconds": 1.5, "peak_rss": 100},
+        "big": {"seconds": 1.0, "peak_rss": 200},
+        "new": {"seconds": 9.0, "peak_rss": 900},
+    }
+
+    regressions = compare_results(
+        baseline, current, threshold=0.1, memory_threshold=0.5
+    )
+
+    assert [(r.key, r.metric) for r in regressions] == [
+        ("big", "peak_rss"),
+        ("slow", "seconds"),
+    ]
+    assert regressions[1].ratio == pytest.approx(1.5)
+
+
+def test_get_speedups() -> None:
+    results = {
+        "crush/RGB/64x48/i10e1": {"seconds": 2.0},
+        "crush_numpy/RGB/64x48/i10e1": {"seconds": 1.0},
+        "crush/CMYK/64x48/i10e1": {"seconds": 2.0},
+        "crush_tiled/CMYK/64x48/i10e1": {"seconds": 4.0},
+    }
+
+    assert get_speedups(results) == {"crush/RGB/64x48/i10e1": 2.0}
+    assert get_speedups(results, "crush_tiled") == {"crush/CMYK/64x48/i10e1": 0.5}
+
+
+def test_get_fastest_executors() -> None:
+    results = {
+        "batch_process/RGB/64x48/i10e1": {"seconds": 0.3},
+        "batch_thread/RGB/64x48/i10e1": {"seconds": 0.1},
+        "batch_serial/RGB/64x48/i10e1": {"seconds": 0.2},
+        "batch_process/RGB/2048x1536/i10e1": {"seconds": 2.0},
+        "batch_thread/RGB/2048x1536/i10e1": {"seconds": 3.0},
+        "crush/RGB/64x48/i10e1": {"seconds": 0.01},
+    }
+
+    assert get_fastest_executors(results) == {
+        "RGB/64x48/i10e1": "thread",
+        "RGB/2048x1536/i10e1": "process",
+    }
+
+
+def test_get_slow_previews() -> None:
+    results = {
+        "preview/RGB/64x48/i50e1": {"seconds": 0.05},
+        "preview/RGB/2048x1536/i50e1": {"seconds": 0.2},
+        "crush/RGB/2048x1536/i50e1": {"seconds": 2.0},
+    }
+
+    assert get_slow_previews(results, 0.1) == {"preview/RGB/2048x1536/i50e1": 0.2}
+
+
+def test_parse_import_times() -> None:
+    report = """\
+import time: self [us] | cumulative | imported package
+import time:       100 |        100 | site
+import time:        10 |         10 |     json.decoder
+import time:        20 |         30 |   json
+import time:         5 |          5 |   struct
+import time:        40 |         75 | pycrusher.cli
+import time:        50 |         50 | os
+"""
+
+    assert parse_import_times(report, "pycrusher.cli") == {
+        "pycrusher.cli": 75,
+        "struct": 5,
+        "json": 30,
+        "json.decoder": 10,
+    }
@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+import concurrent.futures
+import pathlib
+from typing import TYPE_CHECKING
+
+import pytest
+
+from pycrusher import core
+from pycrusher.cache import Cache
+from pycrusher.core import OVERWRITE_ALWAYS, Options, run
+from tests.utils import SMALL_TEST_IMAGES_DIRECTORY
+
+if TYPE_CHECKING:
+    from tests.utils import Parameters
+
+PARAMETERS: Parameters = {
+    "iterations": 3,
+    "extra": 1,
+    "color": 1.0,
+    "reverse": False,
+    "preprocess": False,
+}
+
+
+def store_entry(directory: pathlib.Path, index: int, max_size: int = 2**20) -> None:
+    cache = Cache(directory, max_size)
+    source = directory.parent.joinpath(f"source{index}")
+    source.write_bytes(bytes([index]) * 1000)
+    cache.store(f"{index:064x}", source)
+
+
+@pytest.fixture
+def input_path() -> pathlib.Path:
+    return next(SMALL_TEST_IMAGES_DIRECTORY.glob("*.png"))
+
+
+class TestCache:
+    def test_key_depends_on_parameters(self, input_path: pathlib.Path) -> None:
+        cache = Cache(pathlib.Path("unused"))
+
+        key = cache.make_key(input_path, **PARAMETERS)
+        assert key == cache.make_key(input_path, **PARAMETERS)
+        assert key != cache.make_key(input_path, **{**PARAMETERS, "extra": 2})
+
+    def test_default_directory_follows_environment(
+        self, tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+
+        assert Cache().directory == tmp_path.joinpath("pycrusher")
+
+    def test_miss_then_hit(self, tmp_path: pathlib.Path) -> None:
+        cache = Cache(tmp_path.joinpath("cache"))
+        source = tmp_path.joinpath("source")
+        source.write_bytes(b"crushed")
+        output_path = tmp_path.joinpath("output")
+
+        assert not cache.fetch("ab" * 32, output_path)
+        cache.store("ab" * 32, source)
+        assert cache.fetch("ab" * 32, output_path)
+        assert output_path.read_bytes() == b"crushed"
+
+        stats = cache.stats()
+        assert stats.entries == 1
+        assert stats.size == len(b"crushed")
+        assert (stats.hits, stats.misses) == (1, 1)
+
+    def test_evicted_object_is_a_miss(self, tmp_path: pathlib.Path) -> None:
+        cache = Cache(tmp_path.joinpath("cache"))
+        source = tmp_path.joinpath("source")
+        source.write_bytes(b"crushed")
+        cache.store("ab" * 32, source)
+        cache.get_object_path("ab" * 32).unlink()
+
+        assert not cache.fetch("ab" * 32, tmp_path.joinpath("output"))
+        assert not tmp_path.joinpath("output").exists()
+
+        stats = cache.stats()
+        assert stats.entries == 0
+        assert (stats.hits, stats.misses) == (0, 1)
+
+    def test_prune_evicts_least_recently_used(self, tmp_path: pathlib.Path) -> None:
+        cache = Cache(tmp_path.joinpath("cache"), max_size=2500)
+        for index in range(3):
+            store_entry(cache.directory, index, cache.max_size)
+            cache.fetch(f"{0:064x}", tmp_path.joinpath("output"))
+
+        # Entry 0 is read after every store, so entry 1 goes first.
+        stats = cache.stats()
+        assert stats.entries == 2
+        assert stats.size <= cache.max_size
+        assert cache.fetch(f"{0:064x}", tmp_path.joinpath("output"))
+        assert not cache.fetch(f"{1:064x}", tmp_path.joinpath("output"))
+
+        assert cache.prune(0) == 2
+        assert cache.stats().entries == 0
+        objects = cache.directory.joinpath("objects").rglob("*")
+        assert not [path for path in objects if path.is_file()]
+
+    def test_concurrent_stores(self, tmp_path: pathlib.Path) -> None:
+        directory = tmp_path.joinpath("cache")
+        with concurrent.futures.ProcessPoolExecutor(4) as executor:
+            list(executor.map(store_entry, [directory] * 8, range(8)))
+
+        assert Cache(directory).stats().entries == 8
+
+
+class TestRunWithCache:
+    def test_hit_skips_crushing(
+        self,
+        tmp_path: pathlib.Path,
+        input_path: pathlib.Path,
+        monkeypatch: pytest.MonkeyPatch,
+    ) -> None:
+        cache = Cache(tmp_path.joinpath("cache"))
+        first_path = tmp_path.joinpath("first.jpg")
+        second_path = tmp_path.joinpath("second.jpg")
+
+        run(
+            input_path=input_path,
+            output_path=first_path,
+            options=Options(overwrite=OVERWRITE_ALWAYS, cache=cache, **PARAMETERS),
+            progress=False,
+        )
+
+        def fail(*args: object, **kwargs: object) -> None:
+            del args, kwargs
+            raise AssertionError
+
+        monkeypatch.setattr(core, "crush", fail)
+        run(
+            input_path=input_path,
+            output_path=second_path,
+            options=Options(overwrite=OVERWRITE_ALWAYS, cache=cache, **PARAMETERS),
+            progress=False,
+        )
+
+        assert second_path.read_bytes() == first_path.read_bytes()
+        stats = cache.stats()
+        assert (stats.hits, stats.misses) == (1, 1)
@@ -1,25 +1,68 @@
 from __future__ import annotations
 
 import argparse
+import json
 import pathlib
+import shutil
+import subprocess
+import sys
 
 import hypothesis
 import pytest
 from hypothesis import strategies as st
 from importlib_metadata import version
 
+from pycrusher.animate import FRAME_DURATION_DEFAULT
+from pycrusher.cache import CACHE_SIZE_DEFAULT
 from pycrusher.cli import (
-    COLOR_DEFAULT,
-    EXTRA_DEFAULT,
-    ITERATIONS_DEFAULT,
+    ANIMATE_DEFAULT,
+    ANIMATE_EVERY_DEFAULT,
+    ANIMATE_WIDTH_DEFAULT,
+    CACHE_DIR_DEFAULT,
+    CHECKPOINTS_DEFAULT,
+    ENGINE_DEFAULT,
+    EXECUTOR_DEFAULT,
+    JOBS_DEFAULT,
+    LOG_STEPS_DEFAULT,
+    MAX_MEMORY_DEFAULT,
+    MEMORY_BUDGET_DEFAULT,
     OUTPUT_DEFAULT,
+    OVERWRITE_DEFAULT,
+    PREVIEW_DEFAULT,
     PROGRAM,
+    STACK_SIZE_DEFAULT,
+    STRIP_MEMORY_DEFAULT,
+    SWEEP_DEFAULT,
+    TARGET_DEFAULT,
+    TILE_SIZE_DEFAULT,
     get_argparser,
+    get_cache,
+    get_cache_argparser,
+    get_queue_work_argparser,
+    main,
+    queue_main,
+    validate_animate,
+    validate_cache_size,
     validate_color,
+    validate_engine,
     validate_extra,
-    validate_input_path,
+    validate_fused_color,
+    validate_input_paths,
     validate_iterations,
+    validate_jobs,
+    validate_max_memory,
+    validate_memory_budget,
+    validate_preview,
+    validate_queue_work,
+    validate_resume,
+    validate_stack_size,
+    validate_strip_memory,
+    validate_sweep,
+    validate_target,
+    validate_tile_size,
 )
+from pycrusher.core import COLOR_DEFAULT, EXTRA_DEFAULT, ITERATIONS_DEFAULT
+from pycrusher.resume import RESUME_INTERVAL_DEFAULT
 from tests.utils import SMALL_TEST_IMAGES_DIRECTORY
 
 
@@ -29,11 +72,105 @@ class TestParseArgs:
         # Parsed as path
         parser = get_argparser()
         namespace = parser.parse_args(["placeholder_path"])
-        assert namespace.input_path == pathlib.Path("placeholder_path")
+        assert namespace.input_paths == [pathlib.Path("placeholder_path")]
         with pytest.raises(SystemExit):
             # Input_path is the only required argument
             parser.parse_args([])
 
+    def test_multiple_input_paths(self) -> None:
+        parser = get_argparser()
+        namespace = parser.parse_args(["a.png", "b.png", "c/", "-i", "3"])
+        assert namespace.input_paths == [
+            pathlib.Path("a.png"),
+            pathlib.Path("b.png"),
+            pathlib.Path("c/"),
+        ]
+
+    def test_converge(self) -> None:
+        parser = get_argparser()
+
+        namespace = parser.parse_args(["placeholder_path", "--converge"])
+        assert namespace.converge
+
+        namespace = parser.parse_args(["placeholder_path"])
+        assert not namespace.converge
+
+    @pytest.mark.parametrize(
+        ("value", "expected"),
+        [
+            ("1000", 1000),
+            ("64k", 64 * 2**10),
+            ("512M", 512 * 2**20),
+            ("1.5G", 3 * 2**29),
+        ],
+    )
+    @pytest.mark.parametrize("option", ["strip_memory", "max_memory"])
+    def test_memory(self, value: str, expected: int, option: str) -> None:
+        parser = get_argparser()
+        flag = "--" + option.replace("_", "-")
+
+        namespace = parser.parse_args(["placeholder_path", flag, value])
+        assert getattr(namespace, option) == expected
+
+        namespace = parser.parse_args(["placeholder_path"])
+        assert namespace.strip_memory == STRIP_MEMORY_DEFAULT
+        assert namespace.max_memory == MAX_MEMORY_DEFAULT
+
+    def test_invalid_memory(self) -> None:
+        parser = get_argparser()
+        with pytest.raises(SystemExit):
+            parser.parse_args(["placeholder_path", "--strip-memory", "lots"])
+
+    def test_sweep(self) -> None:
+        parser = get_argparser()
+
+        namespace = parser.parse_args([
+            "placeholder_path",
+            "--sweep",
+            "extra=1..3",
+            "--sweep",
+            "color=0.5,2",
+            "--checkpoints",
+            "5",
+        ])
+        assert namespace.sweep == [("extra", [1, 2, 3]), ("color", [0.5, 2.0])]
+        assert namespace.checkpoints == 5
+
+        namespace = parser.parse_args(["placeholder_path"])
+        assert namespace.sweep == SWEEP_DEFAULT
+        assert namespace.checkpoints == CHECKPOINTS_DEFAULT
+
+    @pytest.mark.parametrize(
+        "value", ["quality=1..3", "extra", "extra=", "extra=3..1", "color=1..2"]
+    )
+    def test_invalid_sweep(self, value: str) -> None:
+        parser = get_argparser()
+        with pytest.raises(SystemExit):
+            parser.parse_args(["placeholder_path", "--sweep", value])
+
+    @pytest.mark.parametrize("arg", ["-j", "--jobs"])
+    def test_jobs(self, arg: str) -> None:
+        parser = get_argparser()
+
+        namespace = parser.parse_args(["placeholder_path", arg, "4"])
+        assert namespace.jobs == 4
+
+        namespace = parser.parse_args(["placeholder_path"])
+        assert namespace.jobs == JOBS_DEFAULT
+
+    @pytest.mark.parametrize("policy", ["ask", "always", "never"])
+    def test_overwrite(self, policy: str) -> None:
+        parser = get_argparser()
+
+        namespace = parser.parse_args(["placeholder_path", "--overwrite", policy])
+        assert namespace.overwrite == policy
+
+        namespace = parser.parse_args(["placeholder_path"])
+        assert namespace.overwrite == OVERWRITE_DEFAULT
+
+        with pytest.raises(SystemExit):
+            parser.parse_args(["placeholder_path", "--overwrite", "maybe"])
+
     @pytest.mark.parametrize("arg", ["-i", "--iterations"])
     @hypothesis.given(iterations=st.integers())
     def test_iterations(self, arg: str, iterations: int) -> None:
@@ -79,6 +216,30 @@ class TestParseArgs:
         namespace = parser.parse_args(["placeholder_path"])
         assert namespace.color == COLOR_DEFAULT
 
+    @pytest.mark.parametrize("arg", ["-c", "--color"])
+    def test_colors(self, arg: str) -> None:
+        parser = get_argparser()
+
+        # Several colors sweep color, before or after --sweep.
+        namespace = parser.parse_args([arg, "0.5,2", "placeholder_path"])
+        assert namespace.color == COLOR_DEFAULT
+        assert namespace.sweep == [("color", [0.5, 2.0])]
+
+        namespace = parser.parse_args([
+            "placeholder_path",
+            "--sweep",
+            "extra=1..2",
+            arg,
+            "0,1",
+        ])
+        assert namespace.sweep == [("extra", [1, 2]), ("color", [0.0, 1.0])]
+
+    @pytest.mark.parametrize("value", ["", "2,", "a", "1,,2"])
+    def test_invalid_colors(self, value: str) -> None:
+        parser = get_argparser()
+        with pytest.raises(SystemExit):
+            parser.parse_args(["placeholder_path", "-c", value])
+
     @pytest.mark.parametrize("arg", ["-o", "--output"])
     def test_output_path(self, arg: str) -> None:
         # Output is optional
@@ -133,13 +294,43 @@ class TestParseArgs:
         namespace2 = parser.parse_args(joined_args2.split())
 
         expected_namespace = argparse.Namespace(
-            input_path=pathlib.Path("placeholder_path"),
+            input_paths=[pathlib.Path("placeholder_path")],
             iterations=1,
             extra=1,
             color=1.0,
             reverse=True,
             preprocess=True,
             output_path=pathlib.Path("out"),
+            jobs=JOBS_DEFAULT,
+            executor=EXECUTOR_DEFAULT,
+            overwrite=OVERWRITE_DEFAULT,
+            converge=False,
+            fused_color=False,
+            preview=PREVIEW_DEFAULT,
+            target_psnr=TARGET_DEFAULT,
+            target_ssim=TARGET_DEFAULT,
+            target_bytes=TARGET_DEFAULT,
+            resume=False,
+            resume_interval=RESUME_INTERVAL_DEFAULT,
+            animate=ANIMATE_DEFAULT,
+            animate_every=ANIMATE_EVERY_DEFAULT,
+            animate_width=ANIMATE_WIDTH_DEFAULT,
+            frame_duration=FRAME_DURATION_DEFAULT,
+            tile_size=TILE_SIZE_DEFAULT,
+            strip_memory=STRIP_MEMORY_DEFAULT,
+            max_memory=MAX_MEMORY_DEFAULT,
+            memory_budget=MEMORY_BUDGET_DEFAULT,
+            engine=ENGINE_DEFAULT,
+            stack_size=STACK_SIZE_DEFAULT,
+            sweep=SWEEP_DEFAULT,
+            checkpoints=CHECKPOINTS_DEFAULT,
+            cache=False,
+            cache_dir=CACHE_DIR_DEFAULT,
+            cache_size=CACHE_SIZE_DEFAULT,
+            quiet=False,
+            profile=False,
+            report=False,
+            log_steps=LOG_STEPS_DEFAULT,
         )
         assert namespace1 == expected_namespace
         assert namespace2 == expected_namespace
@@ -190,10 +381,209 @@ class TestParseArgs:
         assert capture1.out == f"{PROGRAM} {version(PROGRAM)}\n"
 
 
+class TestCommands:
+    def test_cache(self, tmp_path: pathlib.Path) -> None:
+        parser = get_argparser()
+
+        namespace = parser.parse_args(["placeholder_path"])
+        assert get_cache(namespace) is None
+
+        namespace = parser.parse_args(["placeholder_path", "--cache"])
+        cache = get_cache(namespace)
+        assert cache is not None
+        assert cache.max_size == CACHE_SIZE_DEFAULT
+
+        namespace = parser.parse_args([
+            "placeholder_path",
+            "--cache-dir",
+            str(tmp_path),
+            "--cache-size",
+            "1M",
+        ])
+        cache = get_cache(namespace)
+        assert cache is not None
+        assert cache.directory == tmp_path
+        assert cache.max_size == 2**20
+
+    def test_cache_command(self, tmp_path: pathlib.Path) -> None:
+        parser = get_cache_argparser()
+
+        namespace = parser.parse_args(["stats", "--cache-dir", str(tmp_path)])
+        assert namespace.action == "stats"
+        assert get_cache(namespace) is not None
+
+        with pytest.raises(SystemExit):
+            parser.parse_args(["clear"])
+
+    def test_queue_commands(
+        self, tmp_path: pathlib.Path, capsys: pytest.CaptureFixture[str]
+    ) -> None:
+        queue_path = str(tmp_path.joinpath("queue.sqlite3"))
+        input_path = str(SMALL_TEST_IMAGES_DIRECTORY.joinpath("gray.png"))
+        output_path = tmp_path.joinpath("out.jpg")
+
+        queue_main([
+            "add",
+            input_path,
+            "-i",
+            "3",
+            "-o",
+            str(output_path),
+            "--queue",
+            queue_path,
+        ])
+        queue_main(["work", "--queue", queue_path])
+        queue_main(["status", "--queue", queue_path])
+
+        lines = capsys.readouterr().out.splitlines()
+        assert lines[0] == "Queued 1 jobs (0 already queued)."
+        assert lines[1] == "Completed 1 jobs."
+        assert lines[-2].startswith("Pending: 0, leased: 0, done: 1, failed: 0")
+        assert output_path.exists()
+
+        with pytest.raises(SystemExit):
+            queue_main(["clear"])
+
+    def test_queue_add_rejects_sweeps(self) -> None:
+        input_path = str(SMALL_TEST_IMAGES_DIRECTORY.joinpath("gray.png"))
+        with pytest.raises(TypeError, match="cannot be queued"):
+            queue_main(["add", input_path, "--sweep", "extra=1..2"])
+
+    def test_preflight_rejects_unreadable_inputs(
+        self, tmp_path: pathlib.Path, capsys: pytest.CaptureFixture[str]
+    ) -> None:
+        broken = tmp_path.joinpath("broken.png")
+        broken.write_bytes(b"not an image")
+        input_path = SMALL_TEST_IMAGES_DIRECTORY.joinpath("gray.png")
+        output_directory = tmp_path.joinpath("out")
+
+        with pytest.raises(SystemExit) as exc_info:
+            main([
+                str(broken),
+                str(input_path),
+                "-i",
+                "2",
+                "-o",
+                str(output_directory),
+                "-j",
+                "2",
+                "--memory-budget",
+                "1G",
+                "-q",
+            ])
+
+        assert exc_info.value.code == 1
+        (error,) = capsys.readouterr().err.splitlines()
+        assert error.startswith(f"Failed to crush {broken}: cannot identify image")
+        assert output_directory.joinpath("gray_i2_e1.jpg").is_file()
+
+    def test_report(
+        self, tmp_path: pathlib.Path, capsys: pytest.CaptureFixture[str]
+    ) -> None:
+        pytest.importorskip("numpy")
+        input_path = SMALL_TEST_IMAGES_DIRECTORY.joinpath("gradient.png")
+        output_path = tmp_path.joinpath("out.jpg")
+
+        main([str(input_path), "-i", "2", "-o", str(output_path), "-q", "--report"])
+
+        lines = capsys.readouterr().out.splitlines()
+        assert lines[0].startswith(f"{output_path}: PSNR ")
+        assert [line.split(":")[0] for line in lines[1:4]] == ["  R", "  G", "  B"]
+        assert lines[-1] == "Done!"
+
+    def test_log_steps_to_stdout(
+        self, tmp_path: pathlib.Path, capsys: pytest.CaptureFixture[str]
+    ) -> None:
+        input_path = SMALL_TEST_IMAGES_DIRECTORY.joinpath("gradient.png")
+        output_path = tmp_path.joinpath("out.jpg")
+
+        main([
+            str(input_path),
+            "-i",
+            "2",
+            "-o",
+            str(output_path),
+            "-q",
+            "--target-bytes",
+            "1",
+            "--log-steps",
+            "-",
+        ])
+
+        captured = capsys.readouterr()
+        events = [json.loads(line) for line in captured.out.splitlines()]
+        assert {event["event"] for event in events} >= {"step", "target"}
+        lines = captured.err.splitlines()
+        assert lines[0].startswith(f"{input_path}: bytes 1 not reached")
+        assert lines[-1] == "Done!"
+
+    def test_watch_command(
+        self, tmp_path: pathlib.Path, capsys: pytest.CaptureFixture[str]
+    ) -> None:
+        directory = tmp_path.joinpath("in")
+        directory.mkdir()
+        shutil.copy(SMALL_TEST_IMAGES_DIRECTORY.joinpath("gray.png"), directory)
+        args = [
+            "watch",
+            str(directory),
+            "-i",
+            "3",
+            "-o",
+            str(tmp_path.joinpath("out")),
+            "--manifest",
+            str(tmp_path.joinpath("manifest.sqlite3")),
+            "--settle",
+            "0",
+            "--once",
+        ]
+
+        main(args)
+        main(args)
+
+        lines = capsys.readouterr().out.splitlines()
+        assert lines[0].startswith("Crushed ")
+        assert lines[1:] == ["Crushed 1 images.", "Crushed 0 images."]
+        assert tmp_path.joinpath("out", "gray_i3_e1.jpg").exists()
+
+    @pytest.mark.parametrize(
+        ("args", "match"),
+        [
+            (
+                ["-o", str(SMALL_TEST_IMAGES_DIRECTORY)],
+                "cannot go to a watched directory",
+            ),
+            (["--sweep", "extra=1..2"], "cannot be watched"),
+            (["--settle=-1"], "Settle must be greater or equal to 0"),
+            (["--interval", "0"], "Interval must be greater than 0"),
+            (["--strip-memory", "1M", "--converge"], "Strip memory cannot be"),
+        ],
+    )
+    def test_invalid_watch(self, args: list[str], match: str) -> None:
+        directory = str(SMALL_TEST_IMAGES_DIRECTORY)
+        with pytest.raises(TypeError, match=match):
+            main(["watch", directory, *args])
+
+    def test_watch_needs_directories(self) -> None:
+        input_path = str(SMALL_TEST_IMAGES_DIRECTORY.joinpath("gray.png"))
+        with pytest.raises(TypeError, match="should be a directory"):
+            main(["watch", input_path])
+
+
 class TestValidateNamespace:
     @pytest.mark.parametrize("input_path", SMALL_TEST_IMAGES_DIRECTORY.iterdir())
     def test_valid_input_path(self, input_path: pathlib.Path) -> None:
-        validate_input_path(argparse.Namespace(input_path=input_path))
+        validate_input_paths(argparse.Namespace(input_paths=[input_path]))
+
+    def test_valid_input_paths(self) -> None:
+        input_paths = sorted(SMALL_TEST_IMAGES_DIRECTORY.iterdir())
+        validate_input_paths(argparse.Namespace(input_paths=input_paths))
+
+    def test_invalid_input_paths_empty(self) -> None:
+        with pytest.raises(
+            TypeError,
+            match=r"No input images found\.",
+        ):
+            validate_input_paths(argparse.Namespace(input_paths=[]))
 
     @hypothesis.given(st.uuids().map(lambda u: pathlib.Path(str(u))))
     def test_invalid_input_path_does_not_exist(self, input_path: pathlib.Path) -> None:
@@ -201,14 +591,14 @@ class TestValidateNamespace:
             TypeError,
             match="Input path does not exist:",
         ):
-            validate_input_path(argparse.Namespace(input_path=input_path))
+            validate_input_paths(argparse.Namespace(input_paths=[input_path]))
 
     def test_invalid_input_path_is_not_directory(self, tmpdir: pathlib.Path) -> None:
         with pytest.raises(
             TypeError,
             match="Input path should be a file.",
         ):
-            validate_input_path(argparse.Namespace(input_path=pathlib.Path(tmpdir)))
+            validate_input_paths(argparse.Namespace(input_paths=[pathlib.Path(tmpdir)]))
 
     @hypothesis.given(iterations=st.integers(max_value=0))
     def test_invalid_iterations(self, iterations: int) -> None:
@@ -248,3 +638,330 @@ class TestValidateNamespace:
         color: float,
     ) -> None:
         validate_color(argparse.Namespace(color=color))
+
+    @hypothesis.given(jobs=st.integers(max_value=-1))
+    def test_invalid_jobs(self, jobs: int) -> None:
+        with pytest.raises(
+            TypeError,
+            match="Jobs must be greater or equal to 0:",
+        ):
+            validate_jobs(argparse.Namespace(jobs=jobs))
+
+    @hypothesis.given(jobs=st.integers(min_value=0))
+    def test_valid_jobs(self, jobs: int) -> None:
+        validate_jobs(argparse.Namespace(jobs=jobs))
+
+
+class TestValidateResourceLimits:
+    @hypothesis.given(tile_size=st.integers(max_value=0))
+    def test_invalid_tile_size(self, tile_size: int) -> None:
+        with pytest.raises(
+            TypeError,
+            match="Tile size must be greater or equal to 1:",
+        ):
+            validate_tile_size(argparse.Namespace(tile_size=tile_size, converge=False))
+
+    def test_tile_size_with_converge(self) -> None:
+        with pytest.raises(
+            TypeError,
+            match=r"Tile size cannot be combined with converge\.",
+        ):
+            validate_tile_size(argparse.Namespace(tile_size=64, converge=True))
+
+    @hypothesis.given(tile_size=st.one_of(st.none(), st.integers(min_value=1)))
+    def test_valid_tile_size(self, tile_size: int | None) -> None:
+        validate_tile_size(argparse.Namespace(tile_size=tile_size, converge=False))
+
+    @hypothesis.given(strip_memory=st.integers(max_value=0))
+    def test_invalid_strip_memory(self, strip_memory: int) -> None:
+        with pytest.raises(
+            TypeError,
+            match="Strip memory must be greater or equal to 1:",
+        ):
+            validate_strip_memory(
+                argparse.Namespace(
+                    strip_memory=strip_memory, converge=False, tile_size=None
+                )
+            )
+
+    def test_strip_memory_with_tile_size(self) -> None:
+        with pytest.raises(
+            TypeError,
+            match=r"Strip memory cannot be combined with converge or tile size\.",
+        ):
+            validate_strip_memory(
+                argparse.Namespace(strip_memory=2**20, converge=False, tile_size=64)
+            )
+
+    @hypothesis.given(max_memory=st.integers(max_value=0))
+    def test_invalid_max_memory(self, max_memory: int) -> None:
+        with pytest.raises(
+            TypeError,
+            match="Max memory must be greater or equal to 1:",
+        ):
+            validate_max_memory(
+                argparse.Namespace(max_memory=max_memory, stack_size=16)
+            )
+
+    def test_max_memory_without_stack_size(self) -> None:
+        with pytest.raises(TypeError, match="Max memory only bounds stacks"):
+            validate_max_memory(argparse.Namespace(max_memory=2**20, stack_size=None))
+
+    @pytest.mark.parametrize(
+        "args", [["--lease", "0"], ["--max-attempts", "0"], ["--backoff=-1"]]
+    )
+    def test_invalid_queue_work(self, args: list[str]) -> None:
+        namespace = get_queue_work_argparser().parse_args(args)
+        with pytest.raises(TypeError, match="must be greater"):
+            validate_queue_work(namespace)
+
+    @pytest.mark.parametrize(
+        ("memory_budget", "stack_size", "match"),
+        [
+            (0, None, "Memory budget must be greater or equal to 1: 0"),
+            (2**30, 8, "Memory budget cannot be combined with stack size"),
+        ],
+    )
+    def test_invalid_memory_budget(
+        self, memory_budget: int, stack_size: int | None, match: str
+    ) -> None:
+        with pytest.raises(TypeError, match=match):
+            validate_memory_budget(
+                argparse.Namespace(memory_budget=memory_budget, stack_size=stack_size)
+            )
+
+    def test_invalid_cache_size(self) -> None:
+        with pytest.raises(
+            TypeError,
+            match="Cache size must be greater or equal to 0: -1",
+        ):
+            validate_cache_size(argparse.Namespace(cache_size=-1))
+
+
+class TestValidateCrushModes:
+    @pytest.mark.parametrize(
+        ("sweep", "checkpoints", "match"),
+        [
+            (None, 0, "Checkpoints must be greater or equal to 1: 0"),
+            ([("extra", [1, 0])], None, "Extra must be greater or equal to 1: 0"),
+            ([("color", [-1.0])], None, "Color enhancement must be greater"),
+            (
+                [("color", [1.0, 2.0]), ("color", [3.0])],
+                None,
+                "Sweep sets color more than once.",
+            ),
+        ],
+    )
+    def test_invalid_sweep(
+        self,
+        sweep: list[tuple[str, list[float]]] | None,
+        checkpoints: int | None,
+        match: str,
+    ) -> None:
+        with pytest.raises(TypeError, match=match):
+            validate_sweep(
+                argparse.Namespace(
+                    sweep=sweep,
+                    checkpoints=checkpoints,
+                    converge=False,
+                    tile_size=None,
+                    strip_memory=None,
+                )
+            )
+
+    def test_sweep_with_tile_size(self) -> None:
+        with pytest.raises(
+            TypeError,
+            match=(
+                r"Sweep cannot be combined with converge, tile size or strip memory\."
+            ),
+        ):
+            validate_sweep(
+                argparse.Namespace(
+                    sweep=None,
+                    checkpoints=2,
+                    converge=False,
+                    tile_size=64,
+                    strip_memory=None,
+                )
+            )
+
+    def test_valid_engine(self) -> None:
+        pytest.importorskip("numpy")
+        parser = get_argparser()
+        namespace = parser.parse_args(["placeholder_path", "--engine", "numpy"])
+        validate_engine(namespace)
+
+    def test_numpy_engine_with_converge(self) -> None:
+        parser = get_argparser()
+        namespace = parser.parse_args([
+            "placeholder_path",
+            "--engine",
+            "numpy",
+            "--converge",
+        ])
+        with pytest.raises(
+            TypeError,
+            match="The numpy engine cannot be combined with converge",
+        ):
+            validate_engine(namespace)
+
+    def test_numpy_engine_with_stack_and_max_memory(self) -> None:
+        pytest.importorskip("numpy")
+        parser = get_argparser()
+        namespace = parser.parse_args([
+            "placeholder_path",
+            "--engine",
+            "numpy",
+            "--stack-size",
+            "16",
+            "--max-memory",
+            "64M",
+        ])
+        validate_stack_size(namespace)
+        validate_engine(namespace)
+
+    @hypothesis.given(stack_size=st.integers(max_value=0))
+    def test_invalid_stack_size(self, stack_size: int) -> None:
+        namespace = argparse.Namespace(stack_size=stack_size, engine="numpy")
+        with pytest.raises(TypeError, match="Stack size must be greater"):
+            validate_stack_size(namespace)
+
+    def test_stack_size_without_numpy_engine(self) -> None:
+        namespace = argparse.Namespace(stack_size=4, engine=ENGINE_DEFAULT)
+        with pytest.raises(TypeError, match="requires the numpy engine"):
+            validate_stack_size(namespace)
+
+    def test_fused_color_with_tile_size(self) -> None:
+        parser = get_argparser()
+        namespace = parser.parse_args([
+            "placeholder_path",
+            "--fused-color",
+            "--tile-size",
+            "32",
+        ])
+        with pytest.raises(TypeError, match="Fused color cannot be combined"):
+            validate_fused_color(namespace)
+
+    @hypothesis.given(preview=st.integers(max_value=0))
+    def test_invalid_preview(self, preview: int) -> None:
+        parser = get_argparser()
+        namespace = parser.parse_args(["placeholder_path", "--preview", str(preview)])
+        with pytest.raises(TypeError, match="Preview width must be greater"):
+            validate_preview(namespace)
+
+    def test_preview_with_numpy_engine(self) -> None:
+        parser = get_argparser()
+        namespace = parser.parse_args([
+            "placeholder_path",
+            "--preview",
+            "320",
+            "--engine",
+            "numpy",
+        ])
+        with pytest.raises(TypeError, match="Preview cannot be combined"):
+            validate_preview(namespace)
+
+    def test_target_bytes_units(self) -> None:
+        parser = get_argparser()
+        namespace = parser.parse_args(["placeholder_path", "--target-bytes", "20K"])
+        assert namespace.target_bytes == 20 * 2**10
+        validate_target(namespace)
+
+    def test_several_targets(self) -> None:
+        parser = get_argparser()
+        namespace = parser.parse_args([
+            "placeholder_path",
+            "--target-psnr",
+            "30",
+            "--target-bytes",
+            "20K",
+        ])
+        with pytest.raises(TypeError, match="Only one of target"):
+            validate_target(namespace)
+
+    def test_target_color_without_preprocess(self) -> None:
+        parser = get_argparser()
+        namespace = parser.parse_args([
+            "placeholder_path",
+            "--target-psnr",
+            "30",
+            "-c",
+            "2",
+        ])
+        with pytest.raises(TypeError, match="only enhance color with preprocess"):
+            validate_target(namespace)
+
+    def test_target_with_converge(self) -> None:
+        parser = get_argparser()
+        namespace = parser.parse_args([
+            "placeholder_path",
+            "--target-ssim",
+            "0.9",
+            "--converge",
+        ])
+        with pytest.raises(TypeError, match="Targets cannot be combined"):
+            validate_target(namespace)
+
+    @hypothesis.given(interval=st.floats(max_value=-0.001))
+    def test_invalid_resume_interval(self, interval: float) -> None:
+        parser = get_argparser()
+        namespace = parser.parse_args([
+            "placeholder_path",
+            "--resume",
+            f"--resume-interval={interval}",
+        ])
+        with pytest.raises(TypeError, match="Resume interval must be greater"):
+            validate_resume(namespace)
+
+    def test_resume_with_tile_size(self) -> None:
+        parser = get_argparser()
+        namespace = parser.parse_args([
+            "placeholder_path",
+            "--resume",
+            "--tile-size",
+            "32",
+        ])
+        with pytest.raises(TypeError, match="Resume cannot be combined"):
+            validate_resume(namespace)
+
+    @hypothesis.given(every=st.integers(max_value=0))
+    def test_invalid_animate_every(self, every: int) -> None:
+        parser = get_argparser()
+        namespace = parser.parse_args([
+            "placeholder_path",
+            "--animate",
+            "out.gif",
+            f"--animate-every={every}",
+        ])
+        with pytest.raises(TypeError, match="Animate every must be greater"):
+            validate_animate(namespace, [pathlib.Path("placeholder_path")])
+
+    def test_animate_several_inputs(self) -> None:
+        parser = get_argparser()
+        namespace = parser.parse_args(["a.png", "b.png", "--animate", "out.gif"])
+        with pytest.raises(TypeError, match="Animate requires a single input"):
+            validate_animate(namespace, namespace.input_paths)
+
+    def test_animate_with_converge(self) -> None:
+        parser = get_argparser()
+        namespace = parser.parse_args([
+            "placeholder_path",
+            "--animate",
+            "frames",
+            "--converge",
+        ])
+        with pytest.raises(TypeError, match="Animate cannot be combined"):
+            validate_animate(namespace, namespace.input_paths)
+
+
+def test_cli_starts_without_heavy_imports() -> None:
+    heavy = ["PIL", "importlib_metadata", "numpy", "sqlite3", "tqdm"]
+    code = (
+        "import sys, pycrusher.cli; "
+        f"print(*sorted(set({heavy!r}) & sys.modules.keys()))"
+    )
+    process = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    assert process.stdout.split() == []
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import io
+import os
 import pathlib
 from typing import TYPE_CHECKING, Generator, TypeVar
 
@@ -10,9 +11,26 @@ if TYPE_CHECKING:
 import hypothesis
 import pytest
 from hypothesis import strategies as st
+from PIL import Image, ImageChops, ImageEnhance, ImageStat
 
-from pycrusher.core import compress, generate_quality_sequence
-from tests.utils import SMALL_TEST_IMAGES_DIRECTORY, same_pixels_in_image_files
+from pycrusher.core import (
+    REUSED_BUFFERS,
+    Options,
+    compress,
+    crush,
+    enhance_color,
+    generate_quality_sequence,
+    iterate_compressions,
+    open_atomically,
+    reusing_buffers,
+    smallest_period,
+    write_atomically,
+)
+from tests.utils import (
+    SMALL_TEST_IMAGES_DIRECTORY,
+    quality_sequences,
+    same_pixels_in_image_files,
+)
 
 
 class TestGetQualities:
@@ -20,9 +38,12 @@ class TestGetQualities:
 
     # itertools.pairwise was added in python 3.10
     @staticmethod
-    def pairwise(iterable: Iterable[T]) -> Generator[tuple[T | None, T], T, None]:
+    def pairwise(iterable: Iterable[T]) -> Generator[tuple[T, T], None, None]:
         iterator = iter(iterable)
-        a = next(iterator, None)
+        try:
+            a = next(iterator)
+        except StopIteration:
+            return
         for b in iterator:
             yield a, b
             a = b
@@ -55,6 +76,28 @@ class TestGetQualities:
                 assert abs(a - b) == delta
 
 
+class TestSmallestPeriod:
+    @hypothesis.given(
+        iterations=st.integers(min_value=1, max_value=100),
+        extra=st.integers(min_value=1, max_value=5),
+        reverse=st.booleans(),
+    )
+    def test_quality_sequence_period(
+        self,
+        iterations: int,
+        extra: int,
+        *,
+        reverse: bool,
+    ) -> None:
+        qualities = extra * generate_quality_sequence(iterations, reverse)
+        assert smallest_period(qualities) == len(set(qualities))
+
+    def test_period_without_repetition(self) -> None:
+        assert smallest_period([3, 1, 2]) == 3
+        assert smallest_period([1, 2, 1]) == 2
+        assert smallest_period([]) == 0
+
+
 class TestGetDefaultOutputName:
     def test_get_default_output_name(self) -> None:
         pass
@@ -65,6 +108,81 @@ class TestChangeColors:
         pass
 
 
+# Mean absolute difference per pixel and channel, from 0 to 255.
+def mean_difference(a: Image.Image, b: Image.Image) -> float:
+    difference = ImageChops.difference(a.convert("RGB"), b.convert("RGB"))
+    return sum(ImageStat.Stat(difference).mean) / 3
+
+
+class TestEnhanceColor:
+    @pytest.mark.parametrize("input_path", SMALL_TEST_IMAGES_DIRECTORY.iterdir())
+    @pytest.mark.parametrize("color", [0.0, 0.5, 1.0, 2.5])
+    def test_matches_image_enhance(
+        self, input_path: pathlib.Path, color: float
+    ) -> None:
+        with Image.open(input_path) as img:
+            expected = ImageEnhance.Color(img).enhance(color)
+            actual = enhance_color(img, color)
+
+        # Pillow's RGB to YCbCr conversion truncates, and saturating colors
+        # clip in YCbCr rather than in RGB.
+        assert mean_difference(expected, actual) < (1.5 if color <= 1.0 else 3.0)
+
+    def test_keeps_grayscale(self) -> None:
+        with Image.open(SMALL_TEST_IMAGES_DIRECTORY.joinpath("gray.png")) as img:
+            assert enhance_color(img, 2.0) is img
+
+    @pytest.mark.parametrize("input_path", SMALL_TEST_IMAGES_DIRECTORY.iterdir())
+    @pytest.mark.parametrize("color", [0.0, 0.5])
+    @pytest.mark.parametrize("qualities", [[90, 75], [50, 30]])
+    def test_fused_crush_matches_image_enhance(
+        self, input_path: pathlib.Path, color: float, qualities: list[int]
+    ) -> None:
+        expected = io.BytesIO(input_path.read_bytes())
+        crush(
+            expected,
+            qualities,
+            options=Options(color=color, preprocess=False),
+            progress=False,
+        )
+
+        buf = io.BytesIO(input_path.read_bytes())
+        crush(
+            buf,
+            qualities,
+            options=Options(color=color, preprocess=False, fused_color=True),
+            progress=False,
+        )
+
+        # Only the last step differs, by a few levels at most on average.
+        with Image.open(expected) as a, Image.open(buf) as b:
+            assert mean_difference(a, b) < 3.5
+
+    @pytest.mark.parametrize("input_path", SMALL_TEST_IMAGES_DIRECTORY.iterdir())
+    @pytest.mark.parametrize(("color", "preprocess"), [(1.0, False), (2.0, True)])
+    def test_fused_crush_without_jpeg_color_step(
+        self, input_path: pathlib.Path, color: float, *, preprocess: bool
+    ) -> None:
+        qualities = generate_quality_sequence(3, reverse=False)
+        expected = io.BytesIO(input_path.read_bytes())
+        crush(
+            expected,
+            qualities,
+            options=Options(color=color, preprocess=preprocess),
+            progress=False,
+        )
+
+        buf = io.BytesIO(input_path.read_bytes())
+        crush(
+            buf,
+            qualities,
+            options=Options(color=color, preprocess=preprocess, fused_color=True),
+            progress=False,
+        )
+
+        assert buf.getvalue() == expected.getvalue()
+
+
 class TestCompress:
     @hypothesis.settings(deadline=None)
     @pytest.mark.parametrize("input_path", SMALL_TEST_IMAGES_DIRECTORY.iterdir())
@@ -113,3 +231,192 @@ class TestCompress:
         )
 
         assert not same_pixels_in_image_files(input_path, buf)
+
+
+def naive_crush(
+    image_buffer: io.BytesIO,
+    qualities: list[int],
+    *,
+    color: float,
+    preprocess: bool,
+) -> None:
+    """Reopen and re-encode the same buffer on every step."""
+
+    def save(quality: int, color: float | None = None) -> None:
+        with Image.open(image_buffer) as opened:
+            opened.load()
+            img = opened if color is None else ImageEnhance.Color(opened).enhance(color)
+            image_buffer.seek(0)
+            image_buffer.truncate()
+            img.save(image_buffer, format="JPEG", quality=quality)
+
+    if preprocess:
+        save(qualities[0], color)
+        for quality in qualities[1:]:
+            save(quality)
+    else:
+        for quality in qualities[:-1]:
+            save(quality)
+        save(qualities[-1], color)
+
+
+class TestCrush:
+    @hypothesis.settings(deadline=None, max_examples=20)
+    @pytest.mark.parametrize("input_path", SMALL_TEST_IMAGES_DIRECTORY.iterdir())
+    @hypothesis.given(
+        qualities=quality_sequences(5, 3, reversible=True),
+        color=st.sampled_from([0.0, 1.0, 2.5]),
+        preprocess=st.booleans(),
+    )
+    def test_crush_matches_naive_loop(
+        self,
+        input_path: pathlib.Path,
+        qualities: list[int],
+        color: float,
+        *,
+        preprocess: bool,
+    ) -> None:
+        expected = io.BytesIO(input_path.read_bytes())
+        naive_crush(expected, qualities, color=color, preprocess=preprocess)
+
+        buf = io.BytesIO(input_path.read_bytes())
+        crush(
+            buf,
+            qualities,
+            options=Options(color=color, preprocess=preprocess),
+            progress=False,
+        )
+
+        assert buf.getvalue() == expected.getvalue()
+
+    @hypothesis.settings(deadline=None, max_examples=10)
+    @pytest.mark.parametrize("input_path", SMALL_TEST_IMAGES_DIRECTORY.iterdir())
+    @hypothesis.given(
+        iterations=st.integers(min_value=1, max_value=4),
+        extra=st.integers(min_value=1, max_value=6),
+        reverse=st.booleans(),
+        preprocess=st.booleans(),
+    )
+    def test_converge_matches_naive_loop(
+        self,
+        input_path: pathlib.Path,
+        iterations: int,
+        extra: int,
+        *,
+        reverse: bool,
+        preprocess: bool,
+    ) -> None:
+        qualities = extra * generate_quality_sequence(iterations, reverse)
+
+        expected = io.BytesIO(input_path.read_bytes())
+        naive_crush(expected, qualities, color=2.0, preprocess=preprocess)
+
+        buf = io.BytesIO(input_path.read_bytes())
+        crush(
+            buf,
+            qualities,
+            options=Options(color=2.0, preprocess=preprocess, converge=True),
+            progress=False,
+        )
+
+        assert buf.getvalue() == expected.getvalue()
+
+    @pytest.mark.parametrize("input_path", SMALL_TEST_IMAGES_DIRECTORY.iterdir())
+    def test_converge_skips_repeated_cycles(self, input_path: pathlib.Path) -> None:
+        qualities = 20 * generate_quality_sequence(2, reverse=False)
+
+        buf = io.BytesIO(input_path.read_bytes())
+        skipped = crush(
+            buf,
+            qualities,
+            options=Options(color=1.0, preprocess=False, converge=True),
+            progress=False,
+        )
+
+        assert 0 < skipped < len(qualities)
+
+    def test_compress_without_qualities_keeps_buffer(self) -> None:
+        input_path = next(SMALL_TEST_IMAGES_DIRECTORY.iterdir())
+        buf = io.BytesIO(input_path.read_bytes())
+
+        compress(buf, [])
+
+        assert buf.getvalue() == input_path.read_bytes()
+
+
+class TestReusingBuffers:
+    def test_crushes_reuse_buffers(self) -> None:
+        qualities = generate_quality_sequence(5, reverse=False)
+        outputs = []
+        with reusing_buffers():
+            for input_path in sorted(SMALL_TEST_IMAGES_DIRECTORY.iterdir()):
+                buf = io.BytesIO(input_path.read_bytes())
+                crush(
+                    buf,
+                    qualities,
+                    options=Options(color=2.0, preprocess=False),
+                    progress=False,
+                )
+                outputs.append(buf.getvalue())
+            assert len(REUSED_BUFFERS.pool) == 1
+
+        for input_path, output in zip(
+            sorted(SMALL_TEST_IMAGES_DIRECTORY.iterdir()), outputs
+        ):
+            expected = io.BytesIO(input_path.read_bytes())
+            crush(
+                expected,
+                qualities,
+                options=Options(color=2.0, preprocess=False),
+                progress=False,
+            )
+            assert output == expected.getvalue()
+        assert not hasattr(REUSED_BUFFERS, "pool")
+
+    def test_concurrent_crushes_take_their_own_buffers(self) -> None:
+        input_path = SMALL_TEST_IMAGES_DIRECTORY.joinpath("gradient.png")
+        qualities = generate_quality_sequence(4, reverse=False)
+        with reusing_buffers():
+            first = iterate_compressions(io.BytesIO(input_path.read_bytes()), qualities)
+            second = iterate_compressions(
+                io.BytesIO(input_path.read_bytes()), qualities[::-1]
+            )
+            # Interleaved, as sweeps and targets run them.
+            first_buffers = set()
+            second_buffers = set()
+            for first_step, second_step in zip(first, second):
+                first_buffers.add(id(first_step.buffer))
+                second_buffers.add(id(second_step.buffer))
+
+            first.close()
+            second.close()
+
+            assert first_buffers.isdisjoint(second_buffers)
+            assert len(REUSED_BUFFERS.pool) == 2
+
+
+class TestWriteAtomically:
+    def test_creates_file(self, tmp_path: pathlib.Path) -> None:
+        path = tmp_path.joinpath("output.jpg")
+
+        write_atomically(path, b"crushed")
+
+        assert path.read_bytes() == b"crushed"
+        umask = os.umask(0)
+        os.umask(umask)
+        assert path.stat().st_mode & 0o777 == 0o666 & ~umask
+
+    def test_keeps_old_file_on_error(self, tmp_path: pathlib.Path) -> None:
+        path = tmp_path.joinpath("output.jpg")
+        path.write_bytes(b"old")
+
+        def write_partially() -> None:
+            with open_atomically(path) as file:
+                file.write(b"partial")
+                raise KeyboardInterrupt
+
+        with pytest.raises(KeyboardInterrupt):
+            write_partially()
+
+        assert path.read_bytes() == b"old"
+        assert list(tmp_path.iterdir()) == [path]
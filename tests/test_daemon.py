@@ -0,0 +1,361 @@
+from __future__ import annotations
+
+import json
+import os
+import pathlib
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from typing import TYPE_CHECKING, NoReturn
+
+import pytest
+
+from pycrusher import Crusher
+from pycrusher.core import Options
+from pycrusher.daemon import (
+    INTERRUPTED_STATUS,
+    LENGTH,
+    SOCKET_ENVIRONMENT_VARIABLE,
+    STATUS,
+    forward,
+    forward_command,
+    get_socket_path,
+    is_listening,
+    is_supported,
+    receive_exactly,
+    receive_fds,
+    run_forwarded,
+    send_fds,
+    serve_daemon,
+)
+from tests.utils import SMALL_TEST_IMAGES_DIRECTORY
+
+if TYPE_CHECKING:
+    from collections.abc import Callable, Generator
+
+pytestmark = pytest.mark.skipif(not is_supported(), reason="Daemon unsupported")
+
+INPUT_PATH = SMALL_TEST_IMAGES_DIRECTORY.joinpath("gradient.png")
+
+
+def start_daemon(socket_path: pathlib.Path) -> subprocess.Popen[bytes]:
+    process = subprocess.Popen(
+        [sys.executable, "-m", "pycrusher", "daemon", "--socket", str(socket_path)],
+        stdout=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 30
+    while not is_listening(socket_path):
+        assert process.poll() is None
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+    return process
+
+
+@pytest.fixture
+def socket_path(tmp_path: pathlib.Path) -> Generator[pathlib.Path, None, None]:
+    path = tmp_path.joinpath("daemon.sock")
+    process = start_daemon(path)
+    yield path
+    process.terminate()
+    process.wait()
+
+
+def wait_for_child(pid: int, timeout: float = 10) -> int:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        finished, status = os.waitpid(pid, os.WNOHANG)
+        if finished:
+            return os.waitstatus_to_exitcode(status)
+        time.sleep(0.05)
+    os.kill(pid, signal.SIGKILL)
+    os.waitpid(pid, 0)
+    pytest.fail(f"Child {pid} did not exit within {timeout} s")
+
+
+def fork_forwarded(handle: Callable[[list[str]], object]) -> tuple[socket.socket, int]:
+    caller, connection = socket.socketpair(socket.AF_UNIX)
+    pid = os.fork()
+    if pid == 0:
+        caller.close()
+        status = 1
+        try:
+            status = run_forwarded(connection, handle)
+        finally:
+            os._exit(status)
+    connection.close()
+    return caller, pid
+
+
+def send_request(
+    caller: socket.socket, args: list[str], cwd: pathlib.Path, fds: tuple[int, ...]
+) -> None:
+    request = json.dumps({
+        "args": args,
+        "cwd": str(cwd),
+        "environ": {"PYCRUSHER_TEST": "forwarded"},
+    }).encode()
+    send_fds(caller, LENGTH.pack(len(request)), fds)
+    caller.sendall(request)
+
+
+def listen(path: pathlib.Path) -> socket.socket:
+    server = socket.socket(socket.AF_UNIX)
+    server.bind(str(path))
+    server.listen()
+    server.setblocking(False)  # noqa: FBT003
+    return server
+
+
+def exit_with(args: list[str]) -> NoReturn:
+    sys.exit(int(args[0]))
+
+
+def run_pycrusher(
+    args: list[str], socket_path: pathlib.Path, cwd: pathlib.Path
+) -> subprocess.CompletedProcess[str]:
+    return subprocess.run(
+        [sys.executable, "-m", "pycrusher", *args],
+        cwd=cwd,
+        env=dict(os.environ, **{SOCKET_ENVIRONMENT_VARIABLE: str(socket_path)}),
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+
+
+class TestForward:
+    def test_crush(self, socket_path: pathlib.Path, tmp_path: pathlib.Path) -> None:
+        cwd = tmp_path.joinpath("cwd")
+        cwd.mkdir()
+        cwd.joinpath("input.png").write_bytes(INPUT_PATH.read_bytes())
+
+        process = run_pycrusher(["-i", "5", "input.png"], socket_path, cwd)
+
+        assert process.returncode == 0
+        assert "Done!" in process.stdout
+        output = cwd.joinpath("compressions", "input_i5_e1.jpg")
+        assert output.read_bytes() == Crusher(Options(iterations=5)).crush(
+            INPUT_PATH.read_bytes()
+        )
+
+    def test_errors(self, socket_path: pathlib.Path, tmp_path: pathlib.Path) -> None:
+        process = run_pycrusher(["missing.png"], socket_path, tmp_path)
+
+        assert process.returncode == 1
+        assert "Input path does not exist: missing.png" in process.stderr
+
+    def test_usage_errors(
+        self, socket_path: pathlib.Path, tmp_path: pathlib.Path
+    ) -> None:
+        process = run_pycrusher(["--iterations"], socket_path, tmp_path)
+
+        assert process.returncode == 2
+        assert "expected one argument" in process.stderr
+
+    def test_interrupt(self, socket_path: pathlib.Path, tmp_path: pathlib.Path) -> None:
+        process = subprocess.Popen(
+            [sys.executable, "-m", "pycrusher", "-i", "10000", str(INPUT_PATH)],
+            cwd=tmp_path,
+            env=dict(os.environ, **{SOCKET_ENVIRONMENT_VARIABLE: str(socket_path)}),
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        time.sleep(0.5)
+
+        process.send_signal(signal.SIGINT)
+
+        assert process.wait() == 128 + signal.SIGINT
+        # Uninterrupted, the crush would be written by then.
+        time.sleep(3)
+        assert not tmp_path.joinpath("compressions", "gradient_i10000_e1.jpg").exists()
+        assert forward(["--version"], socket_path) == 0
+
+    def test_streams(
+        self, socket_path: pathlib.Path, capfd: pytest.CaptureFixture[str]
+    ) -> None:
+        assert forward(["--version"], socket_path) == 0
+        assert capfd.readouterr().out.startswith("pycrusher ")
+
+    def test_without_daemon(self, tmp_path: pathlib.Path) -> None:
+        assert forward(["--version"], tmp_path.joinpath("missing.sock")) is None
+
+    def test_stale_socket(self, tmp_path: pathlib.Path) -> None:
+        path = tmp_path.joinpath("stale.sock")
+        with socket.socket(socket.AF_UNIX) as server:
+            server.bind(str(path))
+
+        assert forward(["--version"], path) is None
+
+    def test_socket_of_another_user(
+        self, tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        path = tmp_path.joinpath("other.sock")
+        uid = os.getuid()
+        monkeypatch.setattr(os, "getuid", lambda: uid + 1)
+
+        with listen(path) as server:
+            assert forward(["--version"], path) is None
+            with pytest.raises(BlockingIOError):
+                server.accept()
+
+    def test_daemon_dies_mid_call(self, tmp_path: pathlib.Path) -> None:
+        path = tmp_path.joinpath("dying.sock")
+
+        def accept_and_die(server: socket.socket) -> None:
+            server.setblocking(True)  # noqa: FBT003
+            connection, _ = server.accept()
+            with connection:
+                header, fds = receive_fds(connection, LENGTH.size, 3)
+                for fd in fds:
+                    os.close(fd)
+                receive_exactly(connection, *LENGTH.unpack(header))
+
+        with listen(path) as server:
+            thread = threading.Thread(target=accept_and_die, args=(server,))
+            thread.start()
+            assert forward(["--version"], path) == 1
+            thread.join()
+
+
+class TestForwardCommand:
+    def test_opt_in(
+        self, tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        monkeypatch.delenv(SOCKET_ENVIRONMENT_VARIABLE, raising=False)
+        monkeypatch.setenv("XDG_RUNTIME_DIR", str(tmp_path))
+
+        with listen(get_socket_path()) as server:
+            assert forward_command(["--version"]) is None
+            with pytest.raises(BlockingIOError):
+                server.accept()
+
+    def test_forwards_with_socket(
+        self, socket_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        monkeypatch.setenv(SOCKET_ENVIRONMENT_VARIABLE, str(socket_path))
+
+        assert forward_command(["--version"]) == 0
+        assert forward_command(["watch", "--help"]) is None
+
+
+class TestRunForwarded:
+    def test_runs_call(self, tmp_path: pathlib.Path) -> None:
+        def handle(args: list[str]) -> None:
+            print(*args, pathlib.Path.cwd(), os.environ["PYCRUSHER_TEST"])  # noqa: T201
+
+        output_path = tmp_path.joinpath("output.txt")
+        caller, pid = fork_forwarded(handle)
+        with caller, output_path.open("w") as output:
+            send_request(
+                caller, ["a", "b"], tmp_path, (0, output.fileno(), output.fileno())
+            )
+            reply = receive_exactly(caller, STATUS.size)
+
+        assert STATUS.unpack(reply) == (0,)
+        assert wait_for_child(pid) == 0
+        assert output_path.read_text() == f"a b {tmp_path} forwarded\n"
+
+    @pytest.mark.parametrize(
+        ("code", "status", "error"), [(3, 3, ""), ("boom", 1, "boom\n")]
+    )
+    def test_exit(
+        self, tmp_path: pathlib.Path, code: int | str, status: int, error: str
+    ) -> None:
+        def handle(args: list[str]) -> NoReturn:
+            del args
+            sys.exit(code)
+
+        error_path = tmp_path.joinpath("error.txt")
+        caller, pid = fork_forwarded(handle)
+        with caller, error_path.open("w") as error_file:
+            send_request(caller, [], tmp_path, (0, 1, error_file.fileno()))
+            reply = receive_exactly(caller, STATUS.size)
+
+        assert STATUS.unpack(reply) == (status,)
+        assert wait_for_child(pid) == status
+        assert error_path.read_text() == error
+
+    def test_caller_dies_mid_call(self, tmp_path: pathlib.Path) -> None:
+        started_path = tmp_path.joinpath("started")
+
+        def handle(args: list[str]) -> None:
+            del args
+            started_path.touch()
+            time.sleep(60)
+
+        caller, pid = fork_forwarded(handle)
+        with caller:
+            send_request(caller, [], tmp_path, (0, 1, 2))
+            deadline = time.monotonic() + 10
+            while not started_path.exists():
+                assert time.monotonic() < deadline
+                time.sleep(0.05)
+
+        assert wait_for_child(pid) == INTERRUPTED_STATUS
+
+    def test_caller_dies_mid_request(self, tmp_path: pathlib.Path) -> None:
+        called_path = tmp_path.joinpath("called")
+
+        def handle(args: list[str]) -> None:
+            del args
+            called_path.touch()
+
+        caller, pid = fork_forwarded(handle)
+        with caller:
+            send_fds(caller, LENGTH.pack(100), (0, 1, 2))
+            caller.sendall(b'{"args": ')
+
+        assert wait_for_child(pid) == 1
+        assert not called_path.exists()
+
+
+class TestServeDaemon:
+    def test_one_daemon_per_socket(self, socket_path: pathlib.Path) -> None:
+        with pytest.raises(RuntimeError, match="already listens"):
+            serve_daemon(socket_path, print)
+
+    def test_terminate_removes_socket(self, tmp_path: pathlib.Path) -> None:
+        path = tmp_path.joinpath("daemon.sock")
+        process = start_daemon(path)
+
+        process.terminate()
+
+        assert process.wait() == 0
+        assert not path.exists()
+
+    def test_forks_calls(self, tmp_path: pathlib.Path) -> None:
+        path = tmp_path.joinpath("daemon.sock")
+        pid = os.fork()
+        if pid == 0:
+            try:
+                serve_daemon(path, exit_with)
+            finally:
+                os._exit(0)
+        try:
+            deadline = time.monotonic() + 10
+            while not is_listening(path):
+                assert time.monotonic() < deadline
+                time.sleep(0.05)
+
+            assert forward(["3"], path) == 3
+            # A caller that goes away mid-request only takes its call with it.
+            with socket.socket(socket.AF_UNIX) as connection:
+                connection.connect(str(path))
+                send_fds(connection, LENGTH.pack(100), (0, 1, 2))
+            assert forward(["5"], path) == 5
+        finally:
+            os.kill(pid, signal.SIGTERM)
+            assert wait_for_child(pid) == 0
+        assert not path.exists()
+
+    def test_replaces_stale_socket(self, tmp_path: pathlib.Path) -> None:
+        path = tmp_path.joinpath("daemon.sock")
+        with socket.socket(socket.AF_UNIX) as server:
+            server.bind(str(path))
+
+        process = start_daemon(path)
+        process.terminate()
+        process.wait()
@@ -0,0 +1,185 @@
+from __future__ import annotations
+
+import io
+from typing import TYPE_CHECKING
+
+import hypothesis
+import numpy as np
+import pytest
+from hypothesis import strategies as st
+from PIL import Image
+
+from pycrusher import dct
+from pycrusher.core import Options, crush, generate_quality_sequence, run
+from pycrusher.hooks import SummarySink
+from tests.utils import SMALL_TEST_IMAGES_DIRECTORY
+
+if TYPE_CHECKING:
+    import pathlib
+
+
+# Mean absolute difference per pixel and channel, from 0 to 255.
+def deviation(expected: bytes, actual: bytes) -> float:
+    with Image.open(io.BytesIO(expected)) as a, Image.open(io.BytesIO(actual)) as b:
+        pixels_a = np.asarray(a.convert("RGB"), dtype=np.float64)
+        pixels_b = np.asarray(b.convert("RGB"), dtype=np.float64)
+    return float(np.abs(pixels_a - pixels_b).mean())
+
+
+def crush_both(
+    input_path: pathlib.Path,
+    qualities: list[int],
+    *,
+    color: float = 1.0,
+    preprocess: bool = False,
+) -> tuple[bytes, bytes]:
+    expected = io.BytesIO(input_path.read_bytes())
+    crush(
+        expected,
+        qualities,
+        options=Options(color=color, preprocess=preprocess),
+        progress=False,
+    )
+    actual = io.BytesIO(input_path.read_bytes())
+    dct.crush(
+        actual,
+        qualities,
+        options=Options(color=color, preprocess=preprocess),
+        progress=False,
+    )
+    return expected.getvalue(), actual.getvalue()
+
+
+class TestScaleTable:
+    @pytest.mark.parametrize("quality", [0, 1, 10, 34, 50, 75, 90, 100])
+    def test_matches_libjpeg(self, quality: int) -> None:
+        img = Image.new("RGB", (8, 8))
+        buf = io.BytesIO()
+        img.save(buf, format="JPEG", quality=quality)
+        with Image.open(buf) as jpeg:
+            tables = jpeg.quantization  # type: ignore[attr-defined]
+
+        luminance = dct.scale_table(dct.LUMINANCE_TABLE, quality)
+        chrominance = dct.scale_table(dct.CHROMINANCE_TABLE, quality)
+
+        assert luminance.flatten().tolist() == list(tables[0])
+        assert chrominance.flatten().tolist() == list(tables[1])
+
+
+class TestBlocks:
+    @hypothesis.given(
+        height=st.integers(min_value=1, max_value=40),
+        width=st.integers(min_value=1, max_value=40),
+    )
+    def test_round_trip(self, height: int, width: int) -> None:
+        plane = np.arange(height * width, dtype=np.float32).reshape(height, width)
+
+        blocks = dct.to_blocks(plane)
+
+        assert blocks.shape[2:] == (dct.BLOCK, dct.BLOCK)
+        np.testing.assert_array_equal(dct.from_blocks(blocks, plane.shape), plane)
+        padded = blocks.copy()
+        dct.repad(padded, plane.shape)
+        np.testing.assert_array_equal(padded, blocks)
+
+    def test_quantize_matches_one_jpeg_round_trip(self) -> None:
+        with Image.open(SMALL_TEST_IMAGES_DIRECTORY.joinpath("gray.png")) as img:
+            plane = np.asarray(img, dtype=np.float32)
+            buf = io.BytesIO()
+            img.save(buf, format="JPEG", quality=50)
+        with Image.open(buf) as jpeg:
+            expected = np.asarray(jpeg, dtype=np.float32)
+
+        blocks = dct.to_blocks(plane)
+        table = dct.scale_table(dct.LUMINANCE_TABLE, 50)
+        actual = dct.from_blocks(dct.quantize(blocks, table, plane.shape), plane.shape)
+
+        # libjpeg uses integer DCTs, so a few samples are off by some levels.
+        assert np.abs(actual - expected).mean() < 0.5
+
+
+class TestCrush:
+    @pytest.mark.parametrize("input_path", SMALL_TEST_IMAGES_DIRECTORY.iterdir())
+    def test_single_step_matches_pillow(self, input_path: pathlib.Path) -> None:
+        expected, actual = crush_both(input_path, [75])
+
+        # Only the conversion to YCbCr and 4:2:0 chroma differ.
+        assert deviation(expected, actual) < 1.0
+
+    @pytest.mark.parametrize("input_path", SMALL_TEST_IMAGES_DIRECTORY.iterdir())
+    @pytest.mark.parametrize(
+        ("iterations", "reverse", "color", "preprocess"),
+        [
+            (3, False, 1.0, False),
+            (5, True, 1.0, False),
+            (5, True, 0.5, False),
+            (10, True, 1.0, False),
+        ],
+    )
+    def test_deviation_from_pillow(
+        self,
+        input_path: pathlib.Path,
+        iterations: int,
+        *,
+        reverse: bool,
+        color: float,
+        preprocess: bool,
+    ) -> None:
+        qualities = generate_quality_sequence(iterations, reverse)
+
+        expected, actual = crush_both(
+            input_path, qualities, color=color, preprocess=preprocess
+        )
+
+        # Rounding differences compound over steps, but stay within a few
+        # levels per pixel. Grayscale has no chroma to approximate.
+        with Image.open(input_path) as img:
+            limit = 1.0 if img.mode == "L" else 5.0
+        assert deviation(expected, actual) < limit
+
+    def test_reports_steps(self) -> None:
+        input_path = SMALL_TEST_IMAGES_DIRECTORY.joinpath("gradient.png")
+        summary = SummarySink()
+        buf = io.BytesIO(input_path.read_bytes())
+
+        skipped = dct.crush(
+            buf,
+            [90, 50, 10],
+            options=Options(color=2.0, preprocess=True),
+            progress=False,
+            sink=summary,
+        )
+
+        assert skipped == 0
+        assert len(summary.step_seconds) == 3
+        # Only the last step is entropy coded.
+        assert summary.total_bytes == len(buf.getvalue())
+
+    def test_rejects_other_modes(self) -> None:
+        buf = io.BytesIO()
+        Image.new("RGBA", (8, 8)).save(buf, format="PNG")
+
+        with pytest.raises(OSError, match="cannot crush mode RGBA"):
+            dct.crush(
+                buf, [50], options=Options(color=1.0, preprocess=False), progress=False
+            )
+
+    def test_run(self, tmp_path: pathlib.Path) -> None:
+        output_path = tmp_path.joinpath("out.jpg")
+
+        run(
+            input_path=SMALL_TEST_IMAGES_DIRECTORY.joinpath("gradient.png"),
+            output_path=output_path,
+            options=Options(
+                iterations=10,
+                extra=2,
+                color=1.5,
+                reverse=False,
+                preprocess=False,
+                engine="numpy",
+            ),
+            progress=False,
+        )
+
+        with Image.open(output_path) as img:
+            assert img.format == "JPEG"
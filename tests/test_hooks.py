@@ -0,0 +1,161 @@
+from __future__ import annotations
+
+import io
+import json
+from typing import TYPE_CHECKING
+
+import pytest
+
+from pycrusher.core import Options, crush, generate_quality_sequence, run
+from pycrusher.hooks import (
+    JSONLinesSink,
+    MultiSink,
+    ProfileSink,
+    RecordingSink,
+    StepTiming,
+    SummarySink,
+    TqdmSink,
+    make_sink,
+    replay,
+)
+from tests.utils import SMALL_TEST_IMAGES_DIRECTORY
+
+if TYPE_CHECKING:
+    import pathlib
+
+INPUT_PATH = next(SMALL_TEST_IMAGES_DIRECTORY.glob("*.png"))
+TIMINGS = [
+    StepTiming(0, 100, 1000, 0.001, 0.0, 0.002),
+    StepTiming(1, 50, 500, 0.002, 0.001, 0.004),
+]
+
+
+def feed(sink: RecordingSink | SummarySink | ProfileSink | JSONLinesSink) -> None:
+    sink.start(len(TIMINGS) + 1)
+    for timing in TIMINGS:
+        sink.step(timing)
+    sink.stage("write", 0.5)
+    sink.finish(1)
+
+
+class TestSinks:
+    def test_summary(self) -> None:
+        summary = SummarySink()
+        feed(summary)
+
+        assert summary.summary() == {
+            "images": 1,
+            "steps": 2,
+            "skipped": 1,
+            "total_bytes": 1500,
+            "step_p50": pytest.approx(0.003),
+            "step_p95": pytest.approx(0.007),
+        }
+
+    def test_profile(self) -> None:
+        profile = ProfileSink()
+        feed(profile)
+
+        assert profile.stages == {
+            "decode": pytest.approx(0.003),
+            "color": pytest.approx(0.001),
+            "encode": pytest.approx(0.006),
+            "write": 0.5,
+        }
+        assert profile.report().splitlines()[1].startswith("write")
+
+    def test_json_lines(self) -> None:
+        stream = io.StringIO()
+        feed(JSONLinesSink(stream))
+
+        events = [json.loads(line) for line in stream.getvalue().splitlines()]
+        assert [event["event"] for event in events] == [
+            "start",
+            "step",
+            "step",
+            "stage",
+            "finish",
+        ]
+        assert events[2]["quality"] == 50
+        assert events[2]["size"] == 500
+
+    def test_replay(self) -> None:
+        recorder = RecordingSink()
+        feed(recorder)
+        summary = SummarySink()
+
+        replay(recorder.events, MultiSink([summary]))
+
+        expected = SummarySink()
+        feed(expected)
+        assert summary.summary() == expected.summary()
+
+    def test_make_sink(self) -> None:
+        summary = SummarySink()
+        assert make_sink(progress=False, sink=None) is None
+        assert make_sink(progress=False, sink=summary) is summary
+        assert isinstance(make_sink(progress=True, sink=None), TqdmSink)
+        assert isinstance(make_sink(progress=True, sink=summary), MultiSink)
+
+
+class TestInstrumentation:
+    @pytest.mark.parametrize("converge", [False, True])
+    def test_crush_reports_every_computed_step(self, *, converge: bool) -> None:
+        qualities = 10 * generate_quality_sequence(2, reverse=False)
+        recorder = RecordingSink()
+
+        buf = io.BytesIO(INPUT_PATH.read_bytes())
+        skipped = crush(
+            buf,
+            qualities,
+            options=Options(color=2.0, preprocess=False, converge=converge),
+            progress=False,
+            sink=recorder,
+        )
+
+        names = [name for name, _ in recorder.events]
+        assert names[0] == "start"
+        assert names[-1] == "finish"
+        assert recorder.events[-1][1] == (skipped,)
+        timings = [arguments[0] for name, arguments in recorder.events[1:-1]]
+        assert len(timings) == len(qualities) - skipped
+        assert [timing.quality for timing in timings[:2]] == qualities[:2]
+        assert all(timing.size > 0 for timing in timings)
+        assert all(timing.seconds > 0 for timing in timings)
+        assert timings[-1].color_seconds > 0
+
+    def test_sink_does_not_change_result(self) -> None:
+        qualities = generate_quality_sequence(5, reverse=False)
+        expected = io.BytesIO(INPUT_PATH.read_bytes())
+        crush(
+            expected,
+            qualities,
+            options=Options(color=1.0, preprocess=False),
+            progress=False,
+        )
+
+        buf = io.BytesIO(INPUT_PATH.read_bytes())
+        crush(
+            buf,
+            qualities,
+            options=Options(color=1.0, preprocess=False),
+            progress=True,
+            sink=SummarySink(),
+        )
+
+        assert buf.getvalue() == expected.getvalue()
+
+    def test_run_reports_stages(self, tmp_path: pathlib.Path) -> None:
+        profile = ProfileSink()
+
+        run(
+            input_path=INPUT_PATH,
+            output_path=tmp_path.joinpath("out.jpg"),
+            options=Options(
+                iterations=3, extra=1, color=1.0, reverse=False, preprocess=False
+            ),
+            progress=False,
+            sink=profile,
+        )
+
+        assert set(profile.stages) == {"read", "decode", "color", "encode", "write"}
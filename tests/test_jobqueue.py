@@ -0,0 +1,209 @@
+from __future__ import annotations
+
+import concurrent.futures
+import io
+import time
+from typing import TYPE_CHECKING, Any
+
+import pytest
+
+from pycrusher.batch import Job
+from pycrusher.core import Options, crush, generate_quality_sequence
+from pycrusher.jobqueue import (
+    STATE_DONE,
+    STATE_FAILED,
+    STATE_LEASED,
+    STATE_PENDING,
+    JobQueue,
+    QueuedJob,
+    Retries,
+    work,
+)
+from tests.utils import SMALL_TEST_IMAGES_DIRECTORY
+
+if TYPE_CHECKING:
+    import pathlib
+
+PARAMETERS: dict[str, Any] = {
+    "iterations": 3,
+    "extra": 1,
+    "color": 1.0,
+    "reverse": False,
+    "preprocess": False,
+}
+
+
+def make_jobs(directory: pathlib.Path, count: int) -> list[Job]:
+    input_path = SMALL_TEST_IMAGES_DIRECTORY.joinpath("gradient.png")
+    return [
+        Job(input_path, directory.joinpath(f"output{index}.jpg"))
+        for index in range(count)
+    ]
+
+
+def get_states(queue: JobQueue) -> list[tuple[str, int]]:
+    with queue.connect() as connection:
+        return connection.execute(
+            "SELECT state, attempts FROM jobs ORDER BY id"
+        ).fetchall()
+
+
+@pytest.fixture
+def queue(tmp_path: pathlib.Path) -> JobQueue:
+    return JobQueue(tmp_path.joinpath("queue.sqlite3"))
+
+
+class TestJobQueue:
+    def test_add_skips_queued_outputs(
+        self, queue: JobQueue, tmp_path: pathlib.Path
+    ) -> None:
+        assert queue.add(make_jobs(tmp_path, 2), PARAMETERS) == 2
+        assert queue.add(make_jobs(tmp_path, 3), PARAMETERS) == 1
+        assert queue.stats().pending == 3
+
+    def test_lease_takes_each_job_once(
+        self, queue: JobQueue, tmp_path: pathlib.Path
+    ) -> None:
+        queue.add(make_jobs(tmp_path, 2), PARAMETERS)
+
+        first = queue.lease("a")
+        second = queue.lease("b")
+
+        assert first is not None
+        assert second is not None
+        assert first.id != second.id
+        assert first.parameters == PARAMETERS
+        assert first.attempts == 1
+        assert queue.lease("c") is None
+
+    def test_only_holder_completes(
+        self, queue: JobQueue, tmp_path: pathlib.Path
+    ) -> None:
+        queue.add(make_jobs(tmp_path, 1), PARAMETERS)
+        job = queue.lease("a", lease=0.0)
+        assert job is not None
+
+        # The lease expired, so another worker takes the job over.
+        retried = queue.lease("b")
+        assert retried is not None
+        assert retried.id == job.id
+        assert retried.attempts == 2
+
+        assert not queue.complete(job.id, "a", 1.0, {})
+        assert queue.complete(job.id, "b", 1.0, {"write": 0.5})
+        assert get_states(queue) == [(STATE_DONE, 2)]
+
+    def test_expired_last_attempt_fails(
+        self, queue: JobQueue, tmp_path: pathlib.Path
+    ) -> None:
+        queue.add(make_jobs(tmp_path, 1), PARAMETERS)
+        assert queue.lease("a", lease=0.0, max_attempts=1) is not None
+
+        assert queue.lease("b", max_attempts=1) is None
+        assert queue.failures() == [
+            (SMALL_TEST_IMAGES_DIRECTORY.joinpath("gradient.png"), "Lease expired")
+        ]
+
+    def test_fail_backs_off(self, queue: JobQueue, tmp_path: pathlib.Path) -> None:
+        queue.add(make_jobs(tmp_path, 1), PARAMETERS)
+        job = queue.lease("a")
+        assert job is not None
+
+        assert queue.fail(
+            job.id, "a", "boom", attempts=1, retries=Retries(backoff=60.0)
+        )
+
+        assert get_states(queue) == [(STATE_PENDING, 1)]
+        assert queue.lease("a") is None
+        wait = queue.get_wait()
+        assert wait is not None
+        assert 0 < wait <= 60.0
+
+    def test_get_wait(self, queue: JobQueue, tmp_path: pathlib.Path) -> None:
+        assert queue.get_wait() is None
+        queue.add(make_jobs(tmp_path, 1), PARAMETERS)
+        assert queue.get_wait() == pytest.approx(0.0)
+
+
+class TestWork:
+    def test_crushes_every_job(self, queue: JobQueue, tmp_path: pathlib.Path) -> None:
+        jobs = make_jobs(tmp_path, 3)
+        queue.add(jobs, PARAMETERS)
+
+        assert work(queue) == 3
+
+        buf = io.BytesIO(jobs[0].input_path.read_bytes())
+        crush(
+            buf,
+            generate_quality_sequence(3, reverse=False),
+            options=Options(color=1.0, preprocess=False),
+            progress=False,
+        )
+        for job in jobs:
+            assert job.output_path.read_bytes() == buf.getvalue()
+        stats = queue.stats()
+        assert stats.done == 3
+        assert stats.seconds_p50 is not None
+        with queue.connect() as connection:
+            (timings,) = connection.execute("SELECT timings FROM jobs").fetchone()
+        assert "write" in timings
+
+    def test_retries_then_fails(self, queue: JobQueue, tmp_path: pathlib.Path) -> None:
+        bad_input = tmp_path.joinpath("bad.png")
+        bad_input.write_bytes(b"not an image")
+        queue.add([Job(bad_input, tmp_path.joinpath("bad.jpg"))], PARAMETERS)
+
+        assert work(queue, retries=Retries(max_attempts=3, backoff=0.01)) == 0
+
+        assert get_states(queue) == [(STATE_FAILED, 3)]
+        ((input_path, error),) = queue.failures()
+        assert input_path == bad_input
+        assert error.startswith("UnidentifiedImageError")
+
+    def test_takes_over_jobs_of_dead_workers(
+        self, queue: JobQueue, tmp_path: pathlib.Path
+    ) -> None:
+        queue.add(make_jobs(tmp_path, 2), PARAMETERS)
+        # Leased by a worker that died before finishing.
+        assert queue.lease("dead", lease=0.0) is not None
+
+        assert work(queue) == 2
+        assert get_states(queue) == [(STATE_DONE, 2), (STATE_DONE, 1)]
+
+    def test_concurrent_workers(self, queue: JobQueue, tmp_path: pathlib.Path) -> None:
+        jobs = make_jobs(tmp_path, 12)
+        queue.add(jobs, PARAMETERS)
+
+        with concurrent.futures.ProcessPoolExecutor(4) as executor:
+            futures = [executor.submit(work, queue) for _ in range(4)]
+            completed = [future.result() for future in futures]
+
+        # Every job was leased and completed exactly once.
+        assert sum(completed) == len(jobs)
+        assert get_states(queue) == [(STATE_DONE, 1)] * len(jobs)
+        assert all(job.output_path.exists() for job in jobs)
+
+    def test_lease_is_renewed_while_crushing(
+        self, queue: JobQueue, tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        queue.add(make_jobs(tmp_path, 1), PARAMETERS)
+        expiries = []
+
+        def slow_run_job(job: QueuedJob, **kwargs: object) -> dict[str, float]:
+            del kwargs
+            for _ in range(3):
+                with queue.connect() as connection:
+                    (expiry,) = connection.execute(
+                        "SELECT lease_expires FROM jobs WHERE id = ? AND state = ?",
+                        (job.id, STATE_LEASED),
+                    ).fetchone()
+                expiries.append(expiry)
+                time.sleep(0.2)
+            return {}
+
+        monkeypatch.setattr("pycrusher.jobqueue.run_job", slow_run_job)
+
+        # Crushing outlasts the lease, which never expires.
+        assert work(queue, lease=0.15) == 1
+        assert expiries == sorted(expiries)
+        assert expiries[-1] > expiries[0]
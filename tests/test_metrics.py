@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+import io
+import math
+
+import pytest
+from PIL import Image
+
+from pycrusher import Crusher
+from pycrusher.core import Options
+from pycrusher.metrics import (
+    ChannelError,
+    are_identical,
+    compare,
+    get_channel_errors,
+    get_ssim,
+)
+from pycrusher.targets import get_psnr, get_ssim_function
+from tests.utils import SMALL_TEST_IMAGES_DIRECTORY
+
+
+@pytest.fixture
+def source() -> Image.Image:
+    with Image.open(SMALL_TEST_IMAGES_DIRECTORY.joinpath("gradient.png")) as img:
+        return img.convert("RGB")
+
+
+@pytest.fixture
+def crushed() -> Image.Image:
+    data = SMALL_TEST_IMAGES_DIRECTORY.joinpath("gradient.png").read_bytes()
+    with Image.open(io.BytesIO(Crusher(Options(iterations=10)).crush(data))) as img:
+        img.load()
+        return img
+
+
+class TestAreIdentical:
+    @pytest.mark.parametrize("chunk_pixels", [1, 100, 2**20])
+    def test_same_image(self, source: Image.Image, chunk_pixels: int) -> None:
+        assert are_identical(source, source.copy(), chunk_pixels=chunk_pixels)
+
+    @pytest.mark.parametrize("chunk_pixels", [1, 100, 2**20])
+    def test_one_pixel_differs(self, source: Image.Image, chunk_pixels: int) -> None:
+        other = source.copy()
+        other.putpixel((source.width - 1, source.height - 1), (1, 2, 3))
+
+        assert not are_identical(source, other, chunk_pixels=chunk_pixels)
+
+    def test_mode_and_size_differ(self, source: Image.Image) -> None:
+        assert not are_identical(source, source.convert("L"))
+        assert not are_identical(source, source.crop((0, 0, 8, 8)))
+
+
+class TestCompare:
+    def test_same_image(self, source: Image.Image) -> None:
+        pytest.importorskip("numpy")
+
+        report = compare(source, source.copy())
+
+        assert report.psnr == math.inf
+        assert report.ssim == pytest.approx(1.0)
+        assert report.channels == [
+            ChannelError(band, 0.0, 0.0, 0) for band in ("R", "G", "B")
+        ]
+
+    def test_matches_targets(self, source: Image.Image, crushed: Image.Image) -> None:
+        pytest.importorskip("numpy")
+
+        report = compare(source, crushed, chunk_pixels=100)
+
+        assert report.psnr == pytest.approx(get_psnr(source, crushed))
+        assert report.ssim == pytest.approx(get_ssim_function(source)(crushed))
+
+    def test_channel_errors(self) -> None:
+        pytest.importorskip("numpy")
+        reference = Image.new("RGB", (4, 4), (10, 20, 30))
+        img = Image.new("RGB", (4, 4), (10, 24, 30))
+        img.putpixel((0, 0), (0, 20, 30))
+
+        red, green, blue = get_channel_errors(reference, img, chunk_pixels=3)
+
+        assert red == ChannelError("R", 10 / 16, math.sqrt(100 / 16), 10)
+        assert green == ChannelError("G", 60 / 16, math.sqrt(240 / 16), 4)
+        assert blue == ChannelError("B", 0.0, 0.0, 0)
+
+    def test_smaller_image(self, source: Image.Image) -> None:
+        pytest.importorskip("numpy")
+        preview = source.resize((32, 24), Image.Resampling.BOX)
+
+        report = compare(source, preview)
+
+        assert report.psnr == math.inf
+
+    def test_tiny_image_has_no_ssim(self) -> None:
+        pytest.importorskip("numpy")
+        img = Image.new("L", (64, 10))
+
+        with pytest.raises(ValueError, match="SSIM needs images larger"):
+            get_ssim(img, img)
+        assert math.isnan(compare(img, img).ssim)
@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+import pytest
+from PIL import Image
+
+from pycrusher.core import ENGINE_NUMPY
+from pycrusher.preflight import ImageHeader, estimate_memory, preflight, read_header
+from tests.utils import SMALL_TEST_IMAGES_DIRECTORY
+
+if TYPE_CHECKING:
+    import pathlib
+
+RGB_HEADER = ImageHeader((1000, 800), "RGB", "PNG")
+
+
+class TestReadHeader:
+    def test_header(self) -> None:
+        header = read_header(SMALL_TEST_IMAGES_DIRECTORY.joinpath("gradient.jpg"))
+
+        assert header == ImageHeader((64, 48), "RGB", "JPEG")
+
+    def test_rejects_modes_jpeg_cannot_take(self, tmp_path: pathlib.Path) -> None:
+        input_path = tmp_path.joinpath("alpha.png")
+        Image.new("RGBA", (8, 8)).save(input_path)
+
+        with pytest.raises(ValueError, match="Cannot crush a RGBA image"):
+            read_header(input_path)
+
+    def test_rejects_unidentified_files(self, tmp_path: pathlib.Path) -> None:
+        input_path = tmp_path.joinpath("broken.png")
+        input_path.write_bytes(b"not an image")
+
+        with pytest.raises(OSError, match="cannot identify image file"):
+            read_header(input_path)
+
+
+def test_preflight(tmp_path: pathlib.Path) -> None:
+    broken = tmp_path.joinpath("broken.png")
+    broken.write_bytes(b"not an image")
+    input_paths = [
+        SMALL_TEST_IMAGES_DIRECTORY.joinpath(name)
+        for name in ("gradient.png", "gray.png")
+    ]
+
+    headers, failures = preflight([input_paths[0], broken, input_paths[1]])
+
+    assert list(headers) == input_paths
+    assert headers[input_paths[1]].mode == "L"
+    assert list(failures) == [broken]
+
+
+class TestEstimateMemory:
+    def test_grayscale_takes_less(self) -> None:
+        gray_header = RGB_HEADER._replace(mode="L")
+
+        assert estimate_memory(gray_header) < estimate_memory(RGB_HEADER)
+
+    def test_preview_takes_less(self) -> None:
+        assert estimate_memory(RGB_HEADER, preview=100) < estimate_memory(RGB_HEADER)
+
+    def test_strips_take_strip_memory(self) -> None:
+        assert estimate_memory(RGB_HEADER, strip_memory=2**20) == 2**20
+
+    def test_numpy_engine(self) -> None:
+        pytest.importorskip("numpy")
+
+        assert estimate_memory(RGB_HEADER, engine=ENGINE_NUMPY) > estimate_memory(
+            RGB_HEADER
+        )
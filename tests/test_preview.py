@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+import io
+from typing import TYPE_CHECKING
+
+import hypothesis
+import pytest
+from hypothesis import strategies as st
+from PIL import Image
+
+from pycrusher.api import Crusher
+from pycrusher.core import Options, generate_quality_sequence, run
+from pycrusher.preview import crush_preview, get_preview_scale, open_preview
+
+if TYPE_CHECKING:
+    import pathlib
+
+SIZE = (200, 150)
+
+
+def encode(image_format: str) -> bytes:
+    gradient = Image.linear_gradient("L").resize(SIZE)
+    img = Image.merge(
+        "RGB", (gradient, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT), gradient)
+    )
+    buf = io.BytesIO()
+    img.save(buf, format=image_format)
+    return buf.getvalue()
+
+
+class TestGetPreviewScale:
+    @hypothesis.given(
+        image_width=st.integers(min_value=1, max_value=10000),
+        width=st.integers(min_value=1, max_value=2000),
+    )
+    def test_smallest_power_of_two(self, image_width: int, width: int) -> None:
+        scale = get_preview_scale((image_width, 1), width)
+
+        assert scale & (scale - 1) == 0
+        assert -(-image_width // scale) <= width
+        if scale > 1:
+            assert -(-image_width // (scale // 2)) > width
+
+
+class TestOpenPreview:
+    @pytest.mark.parametrize("image_format", ["JPEG", "PNG"])
+    @pytest.mark.parametrize("width", [200, 120, 50, 13, 1])
+    def test_size(self, image_format: str, width: int) -> None:
+        scale = get_preview_scale(SIZE, width)
+
+        with Image.open(io.BytesIO(encode(image_format))) as img:
+            preview_img = open_preview(img, width)
+
+        assert preview_img.size == (-(-SIZE[0] // scale), -(-SIZE[1] // scale))
+
+    def test_jpeg_is_decoded_at_reduced_size(self) -> None:
+        with Image.open(io.BytesIO(encode("JPEG"))) as img:
+            preview_img = open_preview(img, 50)
+
+            # libjpeg scaled it, so nothing was left to reduce.
+            assert preview_img is img
+            assert img.size == (50, 38)
+
+    def test_without_draft_keeps_image(self) -> None:
+        with Image.open(io.BytesIO(encode("JPEG"))) as img:
+            preview_img = open_preview(img, 50, draft=False)
+
+            assert img.size == SIZE
+            assert preview_img.size == (50, 38)
+
+
+class TestCrushPreview:
+    @pytest.mark.parametrize("image_format", ["JPEG", "PNG"])
+    def test_is_deterministic(self, image_format: str) -> None:
+        data = encode(image_format)
+        qualities = generate_quality_sequence(10, reverse=False)
+        results = []
+        for _ in range(2):
+            buf = io.BytesIO(data)
+            crush_preview(
+                buf,
+                qualities,
+                options=Options(preview=64, color=2.0, preprocess=False),
+                progress=False,
+            )
+            results.append(buf.getvalue())
+
+        assert results[0] == results[1]
+        with Image.open(io.BytesIO(results[0])) as img:
+            assert img.format == "JPEG"
+            assert img.size == (50, 38)
+
+    def test_matches_crusher(self) -> None:
+        data = encode("JPEG")
+        buf = io.BytesIO(data)
+        crush_preview(
+            buf,
+            generate_quality_sequence(5, reverse=True),
+            options=Options(preview=100, color=0.5, preprocess=True),
+            progress=False,
+        )
+
+        crusher = Crusher(
+            Options(iterations=5, reverse=True, color=0.5, preprocess=True, preview=100)
+        )
+
+        assert crusher.crush(data) == buf.getvalue()
+
+    def test_crusher_does_not_change_images(self) -> None:
+        with Image.open(io.BytesIO(encode("JPEG"))) as img:
+            crushed = Crusher(Options(iterations=2, preview=50)).crush_image(img)
+
+            assert img.size == SIZE
+        assert crushed.size == (50, 38)
+
+    def test_crusher_rejects_invalid_width(self) -> None:
+        with pytest.raises(TypeError, match="Preview width must be greater"):
+            Crusher(Options(preview=0))
+
+    def test_run_default_output_name(
+        self, tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        input_path = tmp_path.joinpath("input.jpg")
+        input_path.write_bytes(encode("JPEG"))
+        monkeypatch.chdir(tmp_path)
+
+        output_path = run(
+            input_path=input_path,
+            output_path=None,
+            options=Options(
+                iterations=3,
+                extra=1,
+                color=1.0,
+                reverse=False,
+                preprocess=False,
+                preview=100,
+            ),
+            progress=False,
+        )
+
+        assert output_path is not None
+        assert output_path.name == "input_i3_e1_w100.jpg"
+        with Image.open(output_path) as img:
+            assert img.size == (100, 75)
@@ -0,0 +1,215 @@
+from __future__ import annotations
+
+import io
+import pathlib
+from typing import Any
+
+import pytest
+
+from pycrusher.core import Options, crush, generate_quality_sequence, run
+from pycrusher.hooks import RecordingSink, Sink, StepTiming
+from pycrusher.resume import (
+    State,
+    crush_resumable,
+    get_state_path,
+    load_state,
+    save_state,
+)
+from pycrusher.targets import METRIC_PSNR, Target
+from tests.utils import SMALL_TEST_IMAGES_DIRECTORY
+
+QUALITIES = 2 * generate_quality_sequence(8, reverse=False)
+
+
+class InterruptedCrushError(Exception):
+    pass
+
+
+class InterruptingSink(Sink):
+    """Kills the crush after a given step, like a killed process."""
+
+    def __init__(self, position: int) -> None:
+        self.position = position
+
+    def step(self, timing: StepTiming) -> None:
+        if timing.position == self.position:
+            raise InterruptedCrushError
+
+
+def read(name: str) -> bytes:
+    return SMALL_TEST_IMAGES_DIRECTORY.joinpath(name).read_bytes()
+
+
+class TestState:
+    def test_round_trip(self, tmp_path: pathlib.Path) -> None:
+        path = tmp_path.joinpath("out.jpg.state")
+        save_state(path, "key", State(3, b"\n\xff\xd8 jpeg"))
+
+        assert load_state(path, "key") == State(3, b"\n\xff\xd8 jpeg")
+        assert [p.name for p in tmp_path.iterdir()] == ["out.jpg.state"]
+
+    def test_other_key(self, tmp_path: pathlib.Path) -> None:
+        path = tmp_path.joinpath("out.jpg.state")
+        save_state(path, "key", State(3, b"jpeg"))
+
+        assert load_state(path, "other") is None
+
+    @pytest.mark.parametrize("contents", [b"", b"not json\njpeg", b"[]\njpeg"])
+    def test_corrupt(self, tmp_path: pathlib.Path, contents: bytes) -> None:
+        path = tmp_path.joinpath("out.jpg.state")
+        path.write_bytes(contents)
+
+        assert load_state(path, "key") is None
+
+    def test_missing(self, tmp_path: pathlib.Path) -> None:
+        assert load_state(tmp_path.joinpath("out.jpg.state"), "key") is None
+
+    def test_state_path(self) -> None:
+        path = get_state_path(pathlib.Path("out", "image.jpg"))
+        assert path == pathlib.Path("out", "image.jpg.state")
+
+
+class TestCrushResumable:
+    @pytest.mark.parametrize(
+        ("name", "parameters"),
+        [
+            ("gradient.png", {"color": 1.0, "preprocess": False}),
+            ("gradient.jpg", {"color": 0.5, "preprocess": False, "fused_color": True}),
+            ("gradient.png", {"color": 2.0, "preprocess": True}),
+            ("gray.png", {"color": 1.0, "preprocess": False, "converge": True}),
+        ],
+    )
+    @pytest.mark.parametrize("position", [0, 7, len(QUALITIES) - 2])
+    def test_resumed_crush_is_identical(
+        self,
+        tmp_path: pathlib.Path,
+        name: str,
+        parameters: dict[str, Any],
+        position: int,
+    ) -> None:
+        data = read(name)
+        state_path = tmp_path.joinpath("out.jpg.state")
+        options = Options(resume_interval=0, **parameters)
+
+        with pytest.raises(InterruptedCrushError):
+            crush_resumable(
+                io.BytesIO(data),
+                QUALITIES,
+                state_path,
+                options=options,
+                sink=InterruptingSink(position),
+            )
+        assert state_path.exists()
+
+        buf = io.BytesIO(data)
+        recorder = RecordingSink()
+        crush_resumable(
+            buf,
+            QUALITIES,
+            state_path,
+            options=options,
+            sink=recorder,
+        )
+
+        expected = io.BytesIO(data)
+        crush(expected, QUALITIES, options=options, progress=False)
+        assert buf.getvalue() == expected.getvalue()
+        steps = [args[0] for name, args in recorder.events if name == "step"]
+        assert steps[0].position == position + 1
+
+    def test_ignores_state_of_other_parameters(self, tmp_path: pathlib.Path) -> None:
+        data = read("gradient.png")
+        state_path = tmp_path.joinpath("out.jpg.state")
+        with pytest.raises(InterruptedCrushError):
+            crush_resumable(
+                io.BytesIO(data),
+                QUALITIES,
+                state_path,
+                options=Options(color=1.0, preprocess=False, resume_interval=0),
+                sink=InterruptingSink(5),
+            )
+
+        buf = io.BytesIO(data)
+        crush_resumable(
+            buf,
+            QUALITIES,
+            state_path,
+            options=Options(color=0.5, preprocess=False, resume_interval=0),
+        )
+
+        expected = io.BytesIO(data)
+        crush(
+            expected,
+            QUALITIES,
+            options=Options(color=0.5, preprocess=False),
+            progress=False,
+        )
+        assert buf.getvalue() == expected.getvalue()
+
+    def test_run_removes_state(self, tmp_path: pathlib.Path) -> None:
+        input_path = tmp_path.joinpath("input.png")
+        input_path.write_bytes(read("gradient.png"))
+        output_path = tmp_path.joinpath("output.jpg")
+
+        def run_once(sink: Sink | None = None) -> None:
+            run(
+                input_path=input_path,
+                output_path=output_path,
+                options=Options(
+                    iterations=8,
+                    extra=2,
+                    color=1.0,
+                    reverse=False,
+                    preprocess=False,
+                    overwrite="always",
+                    resume_interval=0,
+                ),
+                progress=False,
+                sink=sink,
+            )
+
+        with pytest.raises(InterruptedCrushError):
+            run_once(InterruptingSink(9))
+        assert get_state_path(output_path).exists()
+        assert not output_path.exists()
+
+        run_once()
+
+        assert not get_state_path(output_path).exists()
+        buf = io.BytesIO(input_path.read_bytes())
+        crush(
+            buf, QUALITIES, options=Options(color=1.0, preprocess=False), progress=False
+        )
+        assert output_path.read_bytes() == buf.getvalue()
+
+    @pytest.mark.parametrize(
+        "options",
+        [
+            {"preview": 32},
+            {"target": Target(METRIC_PSNR, 30)},
+            {"engine": "numpy"},
+            {"tile_size": 32},
+        ],
+    )
+    def test_run_rejects_other_modes(
+        self, tmp_path: pathlib.Path, options: dict[str, Any]
+    ) -> None:
+        output_path = tmp_path.joinpath("output.jpg")
+
+        with pytest.raises(TypeError, match=r"Only one of .*resume_interval"):
+            run(
+                input_path=SMALL_TEST_IMAGES_DIRECTORY.joinpath("gradient.png"),
+                output_path=output_path,
+                options=Options(
+                    iterations=8,
+                    extra=2,
+                    color=1.0,
+                    reverse=False,
+                    preprocess=False,
+                    overwrite="always",
+                    resume_interval=0,
+                    **options,
+                ),
+                progress=False,
+            )
+        assert not output_path.exists()
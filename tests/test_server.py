@@ -0,0 +1,249 @@
+from __future__ import annotations
+
+import asyncio
+import concurrent.futures
+import json
+import os
+from concurrent.futures.process import BrokenProcessPool
+from typing import TYPE_CHECKING
+
+import pytest
+
+from pycrusher import Crusher
+from pycrusher.core import Options
+from pycrusher.hooks import percentile
+from pycrusher.server import CrushServer, HTTPError, Limits, parse_options
+from tests.utils import SMALL_TEST_IMAGES_DIRECTORY
+
+if TYPE_CHECKING:
+    from collections.abc import Awaitable, Callable
+
+INPUT_PATH = next(SMALL_TEST_IMAGES_DIRECTORY.glob("*.png"))
+
+
+async def request(
+    port: int,
+    method: str,
+    target: str,
+    body: bytes = b"",
+) -> tuple[int, bytes]:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(
+        f"{method} {target} HTTP/1.1\r\n"
+        "Host: localhost\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        "\r\n".encode()
+    )
+    writer.write(body)
+    response = await reader.read()
+    writer.close()
+    head, _, content = response.partition(b"\r\n\r\n")
+    return int(head.split()[1]), content
+
+
+def serve(
+    test: Callable[[CrushServer, int], Awaitable[None]],
+    crush_server: CrushServer | None = None,
+) -> CrushServer:
+    if crush_server is None:
+        crush_server = CrushServer(max_workers=1)
+
+    async def main() -> None:
+        server = await crush_server.start("127.0.0.1", 0)
+        async with server:
+            await test(crush_server, server.sockets[0].getsockname()[1])
+
+    try:
+        asyncio.run(main())
+    finally:
+        crush_server.close()
+    return crush_server
+
+
+class TestCrushServer:
+    def test_crush(self) -> None:
+        data = INPUT_PATH.read_bytes()
+
+        async def test(crush_server: CrushServer, port: int) -> None:
+            del crush_server
+            status, body = await request(
+                port, "POST", "/crush?iterations=5&reverse", data
+            )
+            assert status == 200
+            assert body == Crusher(Options(iterations=5, reverse=True)).crush(data)
+
+            status, body = await request(port, "GET", "/metrics")
+            assert status == 200
+            metrics = json.loads(body)
+            assert metrics["completed"] == 1
+            assert metrics["in_flight"] == 0
+            assert metrics["latency_seconds"]["p50"] > 0
+
+        serve(test)
+
+    @pytest.mark.parametrize(
+        ("method", "target", "body", "expected"),
+        [
+            ("POST", "/crush?quality=5", b"data", 400),
+            ("POST", "/crush?iterations=zero", b"data", 400),
+            ("POST", "/crush?extra=0", b"data", 400),
+            ("POST", "/crush", b"", 400),
+            ("POST", "/crush", bytes(2**10 + 1), 413),
+            ("POST", "/crush", b"not an image", 422),
+            ("GET", "/crush", b"", 405),
+            ("POST", "/metrics", b"", 405),
+            ("GET", "/", b"", 404),
+        ],
+    )
+    def test_errors(self, method: str, target: str, body: bytes, expected: int) -> None:
+        async def test(crush_server: CrushServer, port: int) -> None:
+            del crush_server
+            status, _ = await request(port, method, target, body)
+            assert status == expected
+
+        serve(test, CrushServer(max_workers=1, limits=Limits(max_body_size=2**10)))
+
+    def test_full_queue_is_rejected(self) -> None:
+        async def test(crush_server: CrushServer, port: int) -> None:
+            busy: list[concurrent.futures.Future[bytes]] = [
+                concurrent.futures.Future() for _ in range(2)
+            ]
+            crush_server.futures.update(busy)
+
+            status, _ = await request(port, "POST", "/crush", INPUT_PATH.read_bytes())
+            assert status == 429
+
+            crush_server.futures.difference_update(busy)
+            status, _ = await request(port, "POST", "/crush", INPUT_PATH.read_bytes())
+            assert status == 200
+
+        crush_server = serve(
+            test, CrushServer(max_workers=1, limits=Limits(queue_size=1))
+        )
+        assert crush_server.metrics()["rejected"] == 1
+
+    def test_uploads_hold_a_slot(self) -> None:
+        data = INPUT_PATH.read_bytes()
+
+        async def test(crush_server: CrushServer, port: int) -> None:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(
+                f"POST /crush HTTP/1.1\r\nContent-Length: {len(data)}\r\n\r\n".encode()
+            )
+            writer.write(data[:10])
+            await writer.drain()
+            for _ in range(1000):
+                if crush_server.receiving:
+                    break
+                await asyncio.sleep(0.01)
+
+            status, _ = await request(port, "POST", "/crush", data)
+            assert status == 429
+
+            writer.write(data[10:])
+            response = await reader.read()
+            writer.close()
+            assert response.startswith(b"HTTP/1.1 200 ")
+            assert crush_server.receiving == 0
+
+        crush_server = serve(
+            test, CrushServer(max_workers=1, limits=Limits(queue_size=0))
+        )
+        assert crush_server.metrics()["rejected"] == 1
+
+    @pytest.mark.parametrize(
+        "sent",
+        [
+            b"POST /crush HTTP/1.1\r\n",
+            b"POST /crush HTTP/1.1\r\nContent-Length: 9\r\n\r\n",
+        ],
+    )
+    def test_slow_clients_time_out(self, sent: bytes) -> None:
+        async def test(crush_server: CrushServer, port: int) -> None:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(sent)
+
+            response = await reader.read()
+            writer.close()
+            assert response.startswith(b"HTTP/1.1 408 ")
+            assert crush_server.receiving == 0
+
+        serve(test, CrushServer(max_workers=1, limits=Limits(read_timeout=0.1)))
+
+    def test_dead_worker_is_replaced(self) -> None:
+        data = INPUT_PATH.read_bytes()
+
+        async def test(crush_server: CrushServer, port: int) -> None:
+            executor = crush_server.executor
+            with pytest.raises(BrokenProcessPool):
+                await asyncio.wrap_future(executor.submit(os._exit, 1))
+
+            status, body = await request(port, "POST", "/crush", data)
+            assert status == 200
+            assert body == Crusher().crush(data)
+            assert crush_server.executor is not executor
+
+        crush_server = serve(test)
+        assert crush_server.metrics()["restarts"] == 1
+
+    def test_timeout_frees_capacity(self) -> None:
+        data = INPUT_PATH.read_bytes()
+
+        async def test(crush_server: CrushServer, port: int) -> None:
+            # Started, so the image is running rather than cancelled in the
+            # queue when it times out.
+            await asyncio.wrap_future(crush_server.executor.submit(int))
+            status, body = await request(
+                port, "POST", "/crush?iterations=100&extra=100", data
+            )
+            assert status == 503
+            assert b"Timed out" in body
+
+            # Its worker is killed, so the slot comes back long before the
+            # image would be done.
+            for _ in range(100):
+                if not crush_server.in_flight:
+                    break
+                await asyncio.sleep(0.05)
+            assert crush_server.in_flight == 0
+            crush_server.limits = crush_server.limits._replace(timeout=60.0)
+            status, body = await request(port, "POST", "/crush?iterations=5", data)
+            assert status == 200
+            assert body == Crusher(Options(iterations=5)).crush(data)
+
+        crush_server = serve(
+            test,
+            CrushServer(max_workers=1, limits=Limits(queue_size=0, timeout=0.5)),
+        )
+        assert crush_server.metrics()["timed_out"] == 1
+        assert crush_server.metrics()["restarts"] == 1
+
+    def test_too_many_steps(self) -> None:
+        async def test(crush_server: CrushServer, port: int) -> None:
+            status, body = await request(
+                port, "POST", "/crush?iterations=100&extra=11", INPUT_PATH.read_bytes()
+            )
+            assert status == 400
+            assert body == b"Too many steps: 1100 (at most 1000)\n"
+            assert crush_server.in_flight == 0
+
+        serve(test, CrushServer(max_workers=1, limits=Limits(max_steps=1000)))
+
+
+class TestParseOptions:
+    def test_options(self) -> None:
+        options = parse_options("iterations=20&color=1.5&reverse&preprocess=0")
+        assert options == Options(
+            iterations=20, color=1.5, reverse=True, preprocess=False
+        )
+
+    def test_invalid_flag(self) -> None:
+        with pytest.raises(HTTPError, match="Invalid value for reverse: 'maybe'"):
+            parse_options("reverse=maybe")
+
+
+def test_percentile() -> None:
+    assert percentile([], 0.5) is None
+    assert percentile([3.0, 1.0, 2.0], 0.5) == pytest.approx(2.0)
+    assert percentile(map(float, range(1, 101)), 0.99) == pytest.approx(99.0)
+    assert percentile([1.0], 0.01) == pytest.approx(1.0)
@@ -0,0 +1,177 @@
+from __future__ import annotations
+
+import io
+import shutil
+from typing import TYPE_CHECKING
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from pycrusher import dct
+from pycrusher.batch import Job, Schedule, run_batch
+from pycrusher.core import Options, generate_quality_sequence
+from pycrusher.hooks import SummarySink
+from pycrusher.stack import (
+    Stack,
+    crush_stack,
+    estimate_memory,
+    plan_stacks,
+    run_stacked,
+)
+from tests.utils import SMALL_TEST_IMAGES_DIRECTORY
+
+if TYPE_CHECKING:
+    import pathlib
+
+    from tests.utils import Parameters
+
+PARAMETERS: Parameters = {
+    "iterations": 5,
+    "extra": 1,
+    "color": 1.5,
+    "reverse": False,
+    "preprocess": False,
+}
+
+
+# Three RGB images of one size, one grayscale and one RGB of another.
+@pytest.fixture
+def jobs(tmp_path: pathlib.Path) -> list[Job]:
+    inputs = tmp_path.joinpath("inputs")
+    inputs.mkdir()
+    for copy in range(2):
+        shutil.copy(
+            SMALL_TEST_IMAGES_DIRECTORY.joinpath("gradient.png"),
+            inputs.joinpath(f"gradient{copy}.png"),
+        )
+    for name in ("gradient.jpg", "gray.png"):
+        shutil.copy(SMALL_TEST_IMAGES_DIRECTORY.joinpath(name), inputs)
+    with Image.open(SMALL_TEST_IMAGES_DIRECTORY.joinpath("gradient.png")) as img:
+        img.resize((40, 30)).save(inputs.joinpath("small.png"))
+    outputs = tmp_path.joinpath("outputs")
+    outputs.mkdir()
+    return [
+        Job(input_path, outputs.joinpath(f"{input_path.stem}.jpg"))
+        for input_path in sorted(inputs.iterdir())
+    ]
+
+
+class TestPlanStacks:
+    def test_groups_by_size_and_mode(self, jobs: list[Job]) -> None:
+        stacks, failures = plan_stacks(jobs)
+
+        assert not failures
+        assert [(stack.size, stack.mode, len(stack.jobs)) for stack in stacks] == [
+            ((64, 48), "RGB", 3),
+            ((64, 48), "L", 1),
+            ((40, 30), "RGB", 1),
+        ]
+
+    def test_stack_size(self, jobs: list[Job]) -> None:
+        stacks, _ = plan_stacks(jobs, stack_size=2)
+
+        assert [len(stack.jobs) for stack in stacks] == [2, 1, 1, 1]
+
+    def test_max_memory(self, jobs: list[Job]) -> None:
+        per_image = estimate_memory((64, 48), "RGB")
+
+        stacks, _ = plan_stacks(jobs, max_memory=2 * per_image + 1)
+        assert [len(stack.jobs) for stack in stacks] == [2, 1, 1, 1]
+
+        # An image over the ceiling still gets a stack.
+        stacks, _ = plan_stacks(jobs, max_memory=1)
+        assert [len(stack.jobs) for stack in stacks] == [1, 1, 1, 1, 1]
+
+    def test_key_splits_groups(self, jobs: list[Job]) -> None:
+        stacks, _ = plan_stacks(jobs, key=lambda img: img.format)
+
+        assert [len(stack.jobs) for stack in stacks] == [1, 2, 1, 1]
+
+    def test_unreadable_input(self, jobs: list[Job], tmp_path: pathlib.Path) -> None:
+        broken = tmp_path.joinpath("broken.png")
+        broken.write_text("not an image")
+
+        stacks, failures = plan_stacks([*jobs, Job(broken, tmp_path / "broken.jpg")])
+
+        assert sum(len(stack.jobs) for stack in stacks) == len(jobs)
+        assert list(failures) == [broken]
+
+
+class TestCrushStack:
+    def test_matches_numpy_engine(self, jobs: list[Job]) -> None:
+        qualities = generate_quality_sequence(5, reverse=False)
+        stacks, _ = plan_stacks(jobs)
+
+        for stack in stacks:
+            crush_stack(stack, qualities, color=1.5, preprocess=False)
+
+        for job in jobs:
+            expected = io.BytesIO(job.input_path.read_bytes())
+            dct.crush(
+                expected,
+                qualities,
+                options=Options(color=1.5, preprocess=False),
+                progress=False,
+            )
+            with Image.open(expected) as a, Image.open(job.output_path) as b:
+                pixels_a = np.asarray(a, dtype=np.float64)
+                pixels_b = np.asarray(b, dtype=np.float64)
+            # BLAS may sum stacked products in another order, which can flip
+            # a rounding, mostly at quality 100 where every step is exact.
+            assert np.abs(pixels_a - pixels_b).mean() < 0.5
+
+    def test_reports_one_image_per_stack(self, jobs: list[Job]) -> None:
+        stack = plan_stacks(jobs)[0][0]
+        summary = SummarySink()
+
+        crush_stack(stack, [90, 50, 10], color=1.0, preprocess=True, sink=summary)
+
+        assert summary.images == 1
+        assert len(summary.step_seconds) == 3
+        assert summary.total_bytes == sum(
+            job.output_path.stat().st_size for job in stack.jobs
+        )
+
+    def test_rejects_mismatched_images(self, jobs: list[Job]) -> None:
+        stack = Stack((64, 48), "RGB", jobs)
+
+        with pytest.raises(ValueError, match="does not match"):
+            crush_stack(stack, [50], color=1.0, preprocess=False)
+
+
+class TestRunStacked:
+    def test_run_batch(self, jobs: list[Job]) -> None:
+        failures = run_batch(
+            jobs,
+            options=Options(overwrite="always", engine="numpy", **PARAMETERS),
+            schedule=Schedule(max_workers=1, stack_size=2),
+            progress=False,
+        )
+
+        assert not failures
+        for job in jobs:
+            with Image.open(job.output_path) as img:
+                assert img.format == "JPEG"
+
+    def test_failing_stack_fails_its_jobs(
+        self, jobs: list[Job], tmp_path: pathlib.Path
+    ) -> None:
+        broken = tmp_path.joinpath("broken.png")
+        broken.write_text("not an image")
+        rgba = tmp_path.joinpath("rgba.png")
+        Image.new("RGBA", (8, 8)).save(rgba)
+        extra_jobs = [
+            Job(broken, tmp_path.joinpath("broken.jpg")),
+            Job(rgba, tmp_path.joinpath("rgba.jpg")),
+        ]
+
+        failures = run_stacked(
+            [*jobs, *extra_jobs],
+            options=Options(overwrite="always", **PARAMETERS),
+            schedule=Schedule(),
+            progress=False,
+        )
+
+        assert set(failures) == {broken, rgba}
+        assert all(job.output_path.is_file() for job in jobs)
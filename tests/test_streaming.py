@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+import io
+import subprocess
+import sys
+import textwrap
+from typing import TYPE_CHECKING
+
+import pytest
+from PIL import Image
+
+from pycrusher.core import Options, crush, generate_quality_sequence
+from pycrusher.streaming import crush_file, get_strip_height
+from tests.utils import SMALL_TEST_IMAGES_DIRECTORY
+
+if TYPE_CHECKING:
+    import pathlib
+
+PEAK_RSS_SCRIPT = textwrap.dedent(
+    """
+    import pathlib
+    import resource
+    import sys
+
+    from pycrusher.core import Options, generate_quality_sequence
+    from pycrusher.streaming import crush_file
+
+    input_path, output_path, strip_memory = sys.argv[1:]
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    crush_file(
+        pathlib.Path(input_path),
+        pathlib.Path(output_path),
+        generate_quality_sequence(5, reverse=False),
+        options=Options(color=1.5, strip_memory=int(strip_memory)),
+        progress=False,
+    )
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print((peak - baseline) * 1024)
+    """
+)
+
+
+class TestGetStripHeight:
+    @pytest.mark.parametrize("mode", ["RGB", "L", "CMYK"])
+    def test_strip_height_is_aligned(self, mode: str) -> None:
+        strip_height = get_strip_height((1000, 1000), mode, 2**24)
+        assert strip_height > 0
+        assert strip_height % 8 == 0
+
+    def test_budget_too_small(self) -> None:
+        with pytest.raises(ValueError, match="Memory budget of 1000 bytes"):
+            get_strip_height((1000, 1000), "RGB", 1000)
+
+
+class TestCrushFile:
+    @pytest.mark.parametrize("input_path", SMALL_TEST_IMAGES_DIRECTORY.iterdir())
+    @pytest.mark.parametrize("mode", ["RGB", "L", "CMYK"])
+    @pytest.mark.parametrize("preprocess", [False, True])
+    def test_crush_file_matches_crush(
+        self,
+        input_path: pathlib.Path,
+        mode: str,
+        *,
+        preprocess: bool,
+        tmp_path: pathlib.Path,
+    ) -> None:
+        source_path = tmp_path.joinpath("source.tiff")
+        with Image.open(input_path) as img:
+            img.convert(mode).save(source_path)
+        qualities = 2 * generate_quality_sequence(4, reverse=False)
+
+        expected = io.BytesIO(source_path.read_bytes())
+        crush(
+            expected,
+            qualities,
+            options=Options(color=1.5, preprocess=preprocess),
+            progress=False,
+        )
+
+        # Small enough for a strip per MCU row.
+        output_path = tmp_path.joinpath("output.jpg")
+        crush_file(
+            source_path,
+            output_path,
+            qualities,
+            options=Options(
+                color=1.5,
+                preprocess=preprocess,
+                strip_memory=2**22 + 64 * 48 * 4 + 64 * 4 * 8 * 48,
+            ),
+            progress=False,
+        )
+
+        assert output_path.read_bytes() == expected.getvalue()
+
+    @pytest.mark.skipif(sys.platform != "linux", reason="ru_maxrss is in KiB on Linux")
+    def test_peak_rss_stays_within_budget(self, tmp_path: pathlib.Path) -> None:
+        width, height = 3000, 2000
+        input_path = tmp_path.joinpath("large.png")
+        Image.merge(
+            "RGB",
+            [
+                Image.effect_noise((width, height), 30),
+                Image.linear_gradient("L").resize((width, height)),
+                Image.radial_gradient("L").resize((width, height)),
+            ],
+        ).save(input_path)
+        # Enough for the decoded image and a few strips only.
+        strip_memory = width * height * 4 + 12 * 2**20
+
+        result = subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                PEAK_RSS_SCRIPT,
+                str(input_path),
+                str(tmp_path.joinpath("output.jpg")),
+                str(strip_memory),
+            ],
+            capture_output=True,
+            check=True,
+            text=True,
+        )
+
+        assert int(result.stdout) < strip_memory
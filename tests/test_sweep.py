@@ -0,0 +1,187 @@
+from __future__ import annotations
+
+import io
+import pathlib
+import tempfile
+
+import hypothesis
+import pytest
+from hypothesis import strategies as st
+
+from pycrusher.cache import Cache
+from pycrusher.core import (
+    OVERWRITE_ALWAYS,
+    Options,
+    crush,
+    generate_quality_sequence,
+    run,
+)
+from pycrusher.sweep import (
+    Variant,
+    build_trie,
+    count_nodes,
+    crush_sweep,
+    get_operations,
+    get_output_name,
+    get_parameters,
+    plan_variants,
+    run_sweep,
+)
+from tests.utils import SMALL_TEST_IMAGES_DIRECTORY
+
+BASE = Variant(iterations=4, extra=1, color=1.0, reverse=False, preprocess=False)
+
+
+def crush_alone(input_path: pathlib.Path, variant: Variant) -> bytes:
+    qualities = variant.extra * generate_quality_sequence(
+        variant.iterations, variant.reverse
+    )
+    # A checkpoint is a run that stops early.
+    with io.BytesIO(input_path.read_bytes()) as image_buffer:
+        crush(
+            image_buffer,
+            qualities[: variant.steps],
+            options=Options(color=variant.color, preprocess=variant.preprocess),
+            progress=False,
+        )
+        return image_buffer.getvalue()
+
+
+class TestPlanVariants:
+    def test_sweep_product(self) -> None:
+        variants = plan_variants(BASE, [("extra", [1, 2]), ("color", [1.0, 2.0])], None)
+        assert [(variant.extra, variant.color) for variant in variants] == [
+            (1, 1.0),
+            (1, 2.0),
+            (2, 1.0),
+            (2, 2.0),
+        ]
+
+    def test_checkpoints(self) -> None:
+        variants = plan_variants(BASE, [("extra", [2])], 3)
+        assert [variant.steps for variant in variants] == [3, 6, None]
+
+    def test_duplicates_are_dropped(self) -> None:
+        variants = plan_variants(BASE, [("extra", [1, 1]), ("color", [1, 1.0])], None)
+        assert variants == [BASE]
+
+    def test_output_name(self) -> None:
+        input_path = pathlib.Path("one.png")
+        assert get_output_name(input_path, BASE) == "one_i4_e1.jpg"
+        assert get_output_name(input_path, BASE._replace(steps=2)) == "one_i4_e1_s2.jpg"
+        assert "steps" not in get_parameters(BASE)
+
+
+class TestBuildTrie:
+    def test_extra_sweep_shares_prefixes(self) -> None:
+        variants = plan_variants(BASE, [("extra", range(1, 11))], None)
+        requests = {
+            pathlib.Path(str(index)): get_operations(variant)
+            for index, variant in enumerate(variants)
+        }
+        # Without color, every run extends the previous one.
+        assert count_nodes(build_trie(requests)) == 10 * BASE.iterations
+
+    def test_color_branches_once_per_output(self) -> None:
+        variants = plan_variants(
+            BASE._replace(color=2.0), [("extra", range(1, 11))], None
+        )
+        requests = {
+            pathlib.Path(str(index)): get_operations(variant)
+            for index, variant in enumerate(variants)
+        }
+        assert count_nodes(build_trie(requests)) == 10 * BASE.iterations + 9
+
+    @pytest.mark.parametrize("preprocess", [False, True])
+    def test_color_sweep_shares_steps_before_color(self, *, preprocess: bool) -> None:
+        variants = plan_variants(
+            BASE._replace(preprocess=preprocess), [("color", [0.5, 1.0, 2.0])], None
+        )
+        requests = {
+            pathlib.Path(str(index)): get_operations(variant)
+            for index, variant in enumerate(variants)
+        }
+        # Color comes last, so only the last step is encoded once per color.
+        # Preprocessed, it comes first, and nothing is shared.
+        expected = 3 * BASE.iterations if preprocess else BASE.iterations + 2
+        assert count_nodes(build_trie(requests)) == expected
+
+
+class TestCrushSweep:
+    @hypothesis.settings(deadline=None, max_examples=10)
+    @pytest.mark.parametrize("input_path", SMALL_TEST_IMAGES_DIRECTORY.iterdir())
+    @hypothesis.given(
+        extras=st.lists(st.integers(min_value=1, max_value=3), min_size=1),
+        colors=st.lists(st.sampled_from([1.0, 0.5, 2.0]), min_size=1, max_size=2),
+        base=st.builds(BASE._replace, reverse=st.booleans(), preprocess=st.booleans()),
+        checkpoints=st.sampled_from([None, 3]),
+    )
+    def test_matches_separate_runs(
+        self,
+        input_path: pathlib.Path,
+        extras: list[int],
+        colors: list[float],
+        base: Variant,
+        checkpoints: int | None,
+    ) -> None:
+        variants = plan_variants(
+            base, [("extra", extras), ("color", colors)], checkpoints
+        )
+        with tempfile.TemporaryDirectory() as directory:
+            outputs = {
+                pathlib.Path(directory, str(index)): variant
+                for index, variant in enumerate(variants)
+            }
+            requests = {
+                output_path: get_operations(variant)
+                for output_path, variant in outputs.items()
+            }
+            with io.BytesIO(input_path.read_bytes()) as image_buffer:
+                crush_sweep(image_buffer, requests, progress=False)
+
+            for output_path, variant in outputs.items():
+                assert output_path.read_bytes() == crush_alone(input_path, variant)
+
+
+class TestRunSweep:
+    def test_matches_run(self, tmp_path: pathlib.Path) -> None:
+        input_path = next(SMALL_TEST_IMAGES_DIRECTORY.glob("*.png"))
+        variants = plan_variants(BASE._replace(color=2.0), [("extra", [1, 2, 3])], None)
+        outputs = {
+            tmp_path.joinpath(get_output_name(input_path, variant)): variant
+            for variant in variants
+        }
+
+        run_sweep(input_path=input_path, outputs=outputs, progress=False)
+
+        for output_path, variant in outputs.items():
+            expected_path = tmp_path.joinpath("expected.jpg")
+            run(
+                input_path=input_path,
+                output_path=expected_path,
+                options=Options(overwrite=OVERWRITE_ALWAYS, **get_parameters(variant)),
+                progress=False,
+            )
+            assert output_path.read_bytes() == expected_path.read_bytes()
+
+    def test_shares_cache_with_run(self, tmp_path: pathlib.Path) -> None:
+        input_path = next(SMALL_TEST_IMAGES_DIRECTORY.glob("*.png"))
+        cache = Cache(tmp_path.joinpath("cache"))
+        run(
+            input_path=input_path,
+            output_path=tmp_path.joinpath("first.jpg"),
+            options=Options(
+                overwrite=OVERWRITE_ALWAYS, cache=cache, **get_parameters(BASE)
+            ),
+            progress=False,
+        )
+
+        outputs = {
+            tmp_path.joinpath("e1.jpg"): BASE,
+            tmp_path.joinpath("e2.jpg"): BASE._replace(extra=2),
+        }
+        run_sweep(input_path=input_path, outputs=outputs, cache=cache, progress=False)
+
+        stats = cache.stats()
+        assert (stats.hits, stats.misses) == (1, 2)
+        assert stats.entries == 2
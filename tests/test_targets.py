@@ -0,0 +1,204 @@
+from __future__ import annotations
+
+import io
+import json
+import math
+from typing import TYPE_CHECKING
+
+import pytest
+from PIL import Image, ImageChops
+
+from pycrusher.core import (
+    Options,
+    crush,
+    generate_quality_sequence,
+    iterate_compressions,
+    run,
+)
+from pycrusher.hooks import JSONLinesSink, RecordingSink, TargetSink, replay
+from pycrusher.targets import (
+    METRIC_BYTES,
+    METRIC_PSNR,
+    METRIC_SSIM,
+    Target,
+    crush_to_target,
+    get_measure,
+    get_psnr,
+    get_ssim_function,
+)
+from tests.utils import SMALL_TEST_IMAGES_DIRECTORY
+
+if TYPE_CHECKING:
+    import pathlib
+
+QUALITIES = generate_quality_sequence(20, reverse=False)
+
+
+def read(name: str) -> bytes:
+    return SMALL_TEST_IMAGES_DIRECTORY.joinpath(name).read_bytes()
+
+
+def measure_every_step(data: bytes, metric: str) -> list[float]:
+    with Image.open(io.BytesIO(data)) as source:
+        source.load()
+        measure = get_measure(metric, source)
+        return [
+            measure(step)
+            for step in iterate_compressions(
+                source, QUALITIES, options=Options(color=1.0), color_index=None
+            )
+        ]
+
+
+class TestMetrics:
+    @pytest.mark.parametrize("name", ["gradient.png", "gray.png"])
+    def test_psnr_of_same_image(self, name: str) -> None:
+        with Image.open(SMALL_TEST_IMAGES_DIRECTORY.joinpath(name)) as img:
+            img.load()
+            assert get_psnr(img, img.copy()) == math.inf
+
+    def test_psnr_matches_definition(self) -> None:
+        with Image.open(SMALL_TEST_IMAGES_DIRECTORY.joinpath("gradient.png")) as img:
+            img.load()
+            other = img.point(lambda value: value // 2)
+
+            difference = ImageChops.difference(img, other)
+            samples = list(difference.tobytes())
+            mean_squared_error = sum(value**2 for value in samples) / len(samples)
+
+            assert get_psnr(img, other) == pytest.approx(
+                10 * math.log10(255**2 / mean_squared_error)
+            )
+
+    def test_ssim_of_same_image(self) -> None:
+        pytest.importorskip("numpy")
+        with Image.open(SMALL_TEST_IMAGES_DIRECTORY.joinpath("gradient.png")) as img:
+            img.load()
+            assert get_ssim_function(img)(img) == pytest.approx(1.0)
+
+    def test_ssim_rejects_tiny_images(self) -> None:
+        pytest.importorskip("numpy")
+        with pytest.raises(ValueError, match="SSIM needs images larger"):
+            get_ssim_function(Image.new("L", (64, 10)))
+
+
+class TestCrushToTarget:
+    @pytest.mark.parametrize("metric", [METRIC_PSNR, METRIC_BYTES, METRIC_SSIM])
+    def test_stops_at_first_step_reaching_target(self, metric: str) -> None:
+        if metric == METRIC_SSIM:
+            pytest.importorskip("numpy")
+        data = read("gradient.jpg")
+        values = measure_every_step(data, metric)
+        # Between the values of two steps halfway through.
+        position = len(values) // 2
+        target = Target(metric, (values[position - 1] + values[position]) / 2)
+        assert not target.is_reached(values[position - 1])
+
+        buf = io.BytesIO(data)
+        result = crush_to_target(
+            buf,
+            QUALITIES,
+            options=Options(target=target, color=1.0, preprocess=False),
+            progress=False,
+        )
+
+        expected = io.BytesIO(data)
+        crush(
+            expected,
+            QUALITIES[: position + 1],
+            options=Options(color=1.0, preprocess=False),
+            progress=False,
+        )
+        assert buf.getvalue() == expected.getvalue()
+        assert result.reached
+        assert result.steps == position + 1
+        assert result.total == len(QUALITIES)
+        assert result.quality == QUALITIES[position]
+        assert result.value == pytest.approx(values[position])
+
+    def test_unreached_target_runs_every_step(self) -> None:
+        data = read("gray.png")
+        buf = io.BytesIO(data)
+        result = crush_to_target(
+            buf,
+            QUALITIES,
+            options=Options(
+                target=Target(METRIC_BYTES, 1), color=1.0, preprocess=False
+            ),
+            progress=False,
+        )
+
+        expected = io.BytesIO(data)
+        crush(
+            expected,
+            QUALITIES,
+            options=Options(color=1.0, preprocess=False),
+            progress=False,
+        )
+        assert buf.getvalue() == expected.getvalue()
+        assert not result.reached
+        assert result.steps == len(QUALITIES)
+
+    def test_color_requires_preprocess(self) -> None:
+        with pytest.raises(ValueError, match="only enhance color with preprocess"):
+            crush_to_target(
+                io.BytesIO(read("gradient.png")),
+                QUALITIES,
+                options=Options(
+                    target=Target(METRIC_PSNR, 30.0), color=2.0, preprocess=False
+                ),
+                progress=False,
+            )
+
+    def test_reports_measuring(self) -> None:
+        recorder = RecordingSink()
+        crush_to_target(
+            io.BytesIO(read("gradient.png")),
+            QUALITIES,
+            options=Options(
+                target=Target(METRIC_PSNR, 0.0), color=1.0, preprocess=False
+            ),
+            progress=False,
+            sink=recorder,
+        )
+
+        stages = [args[0] for name, args in recorder.events if name == "stage"]
+        assert stages == ["measure"] * len(QUALITIES)
+
+
+class TestRunToTarget:
+    def test_reports_result(
+        self, tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        input_path = tmp_path.joinpath("input.png")
+        input_path.write_bytes(read("gradient.png"))
+        monkeypatch.chdir(tmp_path)
+        recorder = RecordingSink()
+        stream = io.StringIO()
+
+        output_path = run(
+            input_path=input_path,
+            output_path=None,
+            options=Options(
+                iterations=20,
+                extra=1,
+                color=1.0,
+                reverse=False,
+                preprocess=False,
+                target=Target(METRIC_BYTES, 2**11),
+            ),
+            progress=False,
+            sink=recorder,
+        )
+
+        assert output_path is not None
+        assert output_path.name == "input_i20_e1_bytes2048.jpg"
+        assert len(output_path.read_bytes()) <= 2**11
+        targets = TargetSink()
+        replay(recorder.events, targets)
+        replay(recorder.events, JSONLinesSink(stream))
+        result = targets.results[str(input_path)]
+        assert result.reached
+        events = [json.loads(line) for line in stream.getvalue().splitlines()]
+        (event,) = [event for event in events if event["event"] == "target"]
+        assert event["steps"] == result.steps
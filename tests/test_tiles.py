@@ -0,0 +1,168 @@
+from __future__ import annotations
+
+import io
+from typing import TYPE_CHECKING
+
+import hypothesis
+import pytest
+from hypothesis import strategies as st
+from PIL import Image
+
+from pycrusher import tiles
+from pycrusher.core import Options, crush, generate_quality_sequence
+from pycrusher.tiles import (
+    crush_tiled,
+    get_mcu_size,
+    get_steps_per_task,
+    split_tiles,
+)
+from tests.utils import SMALL_TEST_IMAGES_DIRECTORY, quality_sequences
+
+if TYPE_CHECKING:
+    import pathlib
+
+
+def image_bytes(input_path: pathlib.Path, mode: str) -> bytes:
+    with Image.open(input_path) as img:
+        buf = io.BytesIO()
+        img.convert(mode).save(buf, format="TIFF")
+        return buf.getvalue()
+
+
+class TestSplitTiles:
+    @hypothesis.given(
+        width=st.integers(min_value=1, max_value=200),
+        height=st.integers(min_value=1, max_value=200),
+        tile_size=st.sampled_from([8, 16, 64]),
+        halo=st.sampled_from([0, 16]),
+    )
+    def test_tiles_cover_image_once(
+        self,
+        width: int,
+        height: int,
+        tile_size: int,
+        halo: int,
+    ) -> None:
+        tiles = split_tiles((width, height), tile_size, halo)
+
+        area = 0
+        for tile in tiles:
+            left, top, right, bottom = tile.box
+            assert left % tile_size == 0
+            assert top % tile_size == 0
+            assert tile.halo_box[0] <= left
+            assert tile.halo_box[1] <= top
+            assert tile.halo_box[2] >= right
+            assert tile.halo_box[3] >= bottom
+            area += (right - left) * (bottom - top)
+        assert area == width * height
+
+    def test_mcu_size(self) -> None:
+        assert get_mcu_size("RGB") == 16
+        assert get_mcu_size("L") == 8
+        assert get_mcu_size("CMYK") == 8
+
+    def test_steps_per_task(self) -> None:
+        assert get_steps_per_task(1024, 16) == 8
+        assert get_steps_per_task(16, 16) == 1
+
+
+class TestCrushTiled:
+    @hypothesis.settings(deadline=None, max_examples=5)
+    @pytest.mark.parametrize("input_path", SMALL_TEST_IMAGES_DIRECTORY.iterdir())
+    @pytest.mark.parametrize("mode", ["RGB", "L", "CMYK"])
+    @hypothesis.given(
+        qualities=quality_sequences(5, 2, reversible=False),
+        preprocess=st.booleans(),
+        tile_size=st.sampled_from([1, 16, 24, 32]),
+    )
+    def test_crush_tiled_matches_crush(
+        self,
+        input_path: pathlib.Path,
+        mode: str,
+        qualities: list[int],
+        tile_size: int,
+        *,
+        preprocess: bool,
+    ) -> None:
+        data = image_bytes(input_path, mode)
+
+        expected = io.BytesIO(data)
+        crush(
+            expected,
+            qualities,
+            options=Options(color=1.5, preprocess=preprocess),
+            progress=False,
+        )
+
+        buf = io.BytesIO(data)
+        crush_tiled(
+            buf,
+            qualities,
+            options=Options(
+                color=1.5, preprocess=preprocess, tile_size=tile_size, tile_workers=1
+            ),
+            progress=False,
+        )
+
+        assert buf.getvalue() == expected.getvalue()
+
+    @pytest.mark.parametrize("tile_size", [32, 48])
+    @pytest.mark.parametrize("preprocess", [False, True])
+    def test_several_steps_per_task(
+        self,
+        monkeypatch: pytest.MonkeyPatch,
+        tile_size: int,
+        *,
+        preprocess: bool,
+    ) -> None:
+        # Tasks of 2 and 3 steps, with halos as wide as the tiles.
+        monkeypatch.setattr(tiles, "HALO_FRACTION", 1)
+        with Image.open(SMALL_TEST_IMAGES_DIRECTORY.joinpath("gradient.png")) as img:
+            buf = io.BytesIO()
+            img.convert("RGB").resize((256, 192)).save(buf, format="TIFF")
+        data = buf.getvalue()
+        qualities = 2 * generate_quality_sequence(5, reverse=False)
+
+        expected = io.BytesIO(data)
+        crush(
+            expected,
+            qualities,
+            options=Options(color=1.5, preprocess=preprocess),
+            progress=False,
+        )
+
+        buf = io.BytesIO(data)
+        crush_tiled(
+            buf,
+            qualities,
+            options=Options(
+                color=1.5, preprocess=preprocess, tile_size=tile_size, tile_workers=1
+            ),
+            progress=False,
+        )
+
+        assert buf.getvalue() == expected.getvalue()
+
+    def test_crush_tiled_in_worker_processes(self) -> None:
+        input_path = next(SMALL_TEST_IMAGES_DIRECTORY.glob("*.png"))
+        data = image_bytes(input_path, "RGB")
+        qualities = generate_quality_sequence(4, reverse=True)
+
+        expected = io.BytesIO(data)
+        crush(
+            expected,
+            qualities,
+            options=Options(color=1.0, preprocess=False),
+            progress=False,
+        )
+
+        buf = io.BytesIO(data)
+        crush_tiled(
+            buf,
+            qualities,
+            options=Options(color=1.0, preprocess=False, tile_size=16, tile_workers=2),
+            progress=False,
+        )
+
+        assert buf.getvalue() == expected.getvalue()
@@ -0,0 +1,256 @@
+from __future__ import annotations
+
+import concurrent.futures
+import os
+import shutil
+from typing import TYPE_CHECKING, Any
+
+import pytest
+
+from pycrusher import Crusher
+from pycrusher.core import Options
+from pycrusher.watch import (
+    Entry,
+    FileState,
+    Inotify,
+    Manifest,
+    Settings,
+    Watcher,
+    is_inotify_supported,
+)
+from tests.utils import SMALL_TEST_IMAGES_DIRECTORY
+
+if TYPE_CHECKING:
+    import pathlib
+
+PARAMETERS: dict[str, Any] = {
+    "iterations": 3,
+    "extra": 1,
+    "color": 1.0,
+    "reverse": False,
+    "preprocess": False,
+}
+
+
+@pytest.fixture
+def directory(tmp_path: pathlib.Path) -> pathlib.Path:
+    path = tmp_path.joinpath("in")
+    path.mkdir()
+    shutil.copy(SMALL_TEST_IMAGES_DIRECTORY.joinpath("gradient.png"), path)
+    return path
+
+
+@pytest.fixture
+def manifest(tmp_path: pathlib.Path) -> Manifest:
+    return Manifest(tmp_path.joinpath("manifest.sqlite3"))
+
+
+def watch_once(
+    directory: pathlib.Path,
+    manifest: Manifest,
+    *,
+    parameters: dict[str, Any] = PARAMETERS,
+    overwrite: bool = False,
+) -> Watcher:
+    watcher = Watcher(
+        [directory],
+        manifest,
+        parameters=parameters,
+        settings=Settings(
+            output_directory=directory.parent.joinpath("out"),
+            overwrite=overwrite,
+            settle=0,
+        ),
+    )
+    watcher.run(once=True)
+    return watcher
+
+
+def touch(path: pathlib.Path) -> None:
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+
+class TestManifest:
+    def test_record_and_forget(
+        self, manifest: Manifest, tmp_path: pathlib.Path
+    ) -> None:
+        input_path = tmp_path.joinpath("input.png")
+        entry = Entry(FileState(10, 20), "hash", "{}", tmp_path.joinpath("out.jpg"))
+
+        manifest.record(input_path, entry)
+        assert manifest.load() == {input_path: entry}
+
+        manifest.forget(input_path)
+        assert manifest.load() == {}
+
+
+class TestWatcher:
+    def test_crushes_new_files(
+        self, directory: pathlib.Path, manifest: Manifest, tmp_path: pathlib.Path
+    ) -> None:
+        watcher = watch_once(directory, manifest)
+
+        assert watcher.crushed == 1
+        output_path = tmp_path.joinpath("out", "gradient_i3_e1.jpg")
+        assert output_path.read_bytes() == Crusher(Options(iterations=3)).crush(
+            directory.joinpath("gradient.png").read_bytes()
+        )
+        (entry,) = manifest.load().values()
+        assert entry.output_path == output_path
+        assert entry.error is None
+
+    def test_skips_crushed_files(
+        self, directory: pathlib.Path, manifest: Manifest
+    ) -> None:
+        watch_once(directory, manifest)
+
+        assert watch_once(directory, manifest).crushed == 0
+
+    def test_skips_touched_files(
+        self, directory: pathlib.Path, manifest: Manifest
+    ) -> None:
+        watch_once(directory, manifest)
+        input_path = directory.joinpath("gradient.png")
+        touch(input_path)
+
+        assert watch_once(directory, manifest).crushed == 0
+        state = manifest.load()[input_path].state
+        assert state.mtime_ns == input_path.stat().st_mtime_ns
+
+    def test_crushes_changed_files(
+        self, directory: pathlib.Path, manifest: Manifest
+    ) -> None:
+        watch_once(directory, manifest)
+        input_path = directory.joinpath("gradient.png")
+        shutil.copy(SMALL_TEST_IMAGES_DIRECTORY.joinpath("gray.png"), input_path)
+        touch(input_path)
+
+        assert watch_once(directory, manifest).crushed == 1
+
+    def test_crushes_again_with_other_parameters(
+        self, directory: pathlib.Path, manifest: Manifest, tmp_path: pathlib.Path
+    ) -> None:
+        watch_once(directory, manifest)
+
+        watcher = watch_once(directory, manifest, parameters={**PARAMETERS, "extra": 2})
+
+        assert watcher.crushed == 1
+        assert tmp_path.joinpath("out", "gradient_i3_e2.jpg").exists()
+
+    def test_ignores_how_files_are_crushed(
+        self, directory: pathlib.Path, manifest: Manifest
+    ) -> None:
+        watch_once(directory, manifest)
+
+        parameters = {**PARAMETERS, "tile_workers": 4}
+        assert watch_once(directory, manifest, parameters=parameters).crushed == 0
+
+    def test_forgets_deleted_files(
+        self, directory: pathlib.Path, manifest: Manifest
+    ) -> None:
+        watch_once(directory, manifest)
+        directory.joinpath("gradient.png").unlink()
+
+        watch_once(directory, manifest)
+
+        assert manifest.load() == {}
+
+    def test_ignores_hidden_and_other_files(
+        self, directory: pathlib.Path, manifest: Manifest
+    ) -> None:
+        shutil.copy(
+            SMALL_TEST_IMAGES_DIRECTORY.joinpath("gray.png"),
+            directory.joinpath(".gray.png"),
+        )
+        directory.joinpath("notes.txt").write_text("notes")
+
+        assert watch_once(directory, manifest).crushed == 1
+
+    @pytest.mark.parametrize(("overwrite", "crushed"), [(False, 0), (True, 1)])
+    def test_existing_outputs(
+        self,
+        directory: pathlib.Path,
+        manifest: Manifest,
+        tmp_path: pathlib.Path,
+        crushed: int,
+        *,
+        overwrite: bool,
+    ) -> None:
+        output_path = tmp_path.joinpath("out", "gradient_i3_e1.jpg")
+        output_path.parent.mkdir()
+        output_path.write_bytes(b"crushed by cron")
+
+        watcher = watch_once(directory, manifest, overwrite=overwrite)
+
+        assert watcher.crushed == crushed
+        assert (output_path.read_bytes() == b"crushed by cron") != overwrite
+        assert directory.joinpath("gradient.png") in manifest.load()
+
+    def test_shared_output(self, directory: pathlib.Path, manifest: Manifest) -> None:
+        shutil.copy(SMALL_TEST_IMAGES_DIRECTORY.joinpath("gradient.jpg"), directory)
+
+        watcher = watch_once(directory, manifest)
+
+        assert watcher.crushed == 1
+        (failure,) = watcher.failures.values()
+        assert "would both be written to" in str(failure)
+
+    def test_waits_for_files_to_settle(
+        self, directory: pathlib.Path, manifest: Manifest, tmp_path: pathlib.Path
+    ) -> None:
+        watcher = Watcher(
+            [directory],
+            manifest,
+            parameters=PARAMETERS,
+            settings=Settings(output_directory=tmp_path.joinpath("out"), settle=60),
+        )
+
+        watcher.scan()
+        watcher.submit()
+
+        assert not watcher.running
+        assert list(watcher.pending) == [directory.joinpath("gradient.png")]
+
+    def test_thread_pool(
+        self, directory: pathlib.Path, manifest: Manifest, tmp_path: pathlib.Path
+    ) -> None:
+        for index in range(3):
+            shutil.copy(
+                SMALL_TEST_IMAGES_DIRECTORY.joinpath("gray.png"),
+                directory.joinpath(f"gray{index}.png"),
+            )
+
+        with concurrent.futures.ThreadPoolExecutor(2) as executor:
+            watcher = Watcher(
+                [directory],
+                manifest,
+                parameters=PARAMETERS,
+                settings=Settings(
+                    output_directory=tmp_path.joinpath("out"),
+                    settle=0,
+                    max_workers=2,
+                ),
+                executor=executor,
+            )
+            watcher.run(once=True)
+
+        assert watcher.crushed == 4
+        assert len(list(tmp_path.joinpath("out").iterdir())) == 4
+
+
+@pytest.mark.skipif(not is_inotify_supported(), reason="inotify unsupported")
+def test_inotify(tmp_path: pathlib.Path) -> None:
+    inotify = Inotify([tmp_path])
+    try:
+        assert inotify.read(0) == set()
+
+        tmp_path.joinpath("input.png").write_bytes(b"")
+        tmp_path.joinpath("other.png").write_bytes(b"")
+
+        assert inotify.read(1) == {
+            tmp_path.joinpath("input.png"),
+            tmp_path.joinpath("other.png"),
+        }
+    finally:
+        inotify.close()
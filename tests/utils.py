@@ -1,19 +1,47 @@
 from __future__ import annotations
 
 from pathlib import Path
-from typing import IO
+from typing import IO, TYPE_CHECKING
 
+from hypothesis import strategies as st
 from PIL import Image
 
+from pycrusher.core import generate_quality_sequence
+from pycrusher.metrics import are_identical
+
+if TYPE_CHECKING:
+    from typing import TypedDict
+
+    class Parameters(TypedDict):
+        iterations: int
+        extra: int
+        color: float
+        reverse: bool
+        preprocess: bool
+
+
 TEST_IMAGES_DIRECTORY = Path(__file__).parent.joinpath("images")
 SMALL_TEST_IMAGES_DIRECTORY = TEST_IMAGES_DIRECTORY.joinpath("small")
 
 
+def quality_sequences(
+    max_iterations: int, max_extra: int, *, reversible: bool
+) -> st.SearchStrategy[list[int]]:
+    return st.builds(
+        lambda iterations, extra, reverse: (
+            extra * generate_quality_sequence(iterations, reverse=reverse)
+        ),
+        st.integers(min_value=1, max_value=max_iterations),
+        st.integers(min_value=1, max_value=max_extra),
+        st.booleans() if reversible else st.sampled_from([False]),
+    )
+
+
 def same_pixels_in_image(
     i1: Image.Image,
     i2: Image.Image,
 ) -> bool:
-    return list(i1.getdata()) == list(i2.getdata())
+    return are_identical(i1, i2)
 
 
 def same_pixels_in_image_files(